@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""Compare compiling many files one interpreter at a time with mwx -o.
+
+   Copies the given files (by default the example files) into a directory
+   tree of COUNT files, then times:
+
+     one per file   running "mwx -x" once for each file, the way a shell
+                    loop over the files would
+     -j 1           a single "mwx -o" run in one process
+     -j N           a single "mwx -o" run with N worker processes
+
+   usage: bench_batch.py [-c COUNT] [-j N] [file.mw ...]
+"""
+
+import os
+import sys
+import glob
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+mwx = os.path.join(root, 'scripts', 'mwx')
+
+
+def run(args):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = root
+    with open(os.devnull, 'w') as devnull:
+        subprocess.call([sys.executable, mwx] + args, env=env,
+                        stdout=devnull, stderr=devnull)
+
+
+def timed(f):
+    tic = time.time()
+    f()
+    return time.time() - tic
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('files', nargs='*')
+    arg_parser.add_argument('-c', '--count', type=int, default=100)
+    arg_parser.add_argument('-j', '--jobs', type=int, default=4)
+    args = arg_parser.parse_args()
+
+    files = args.files
+    if not files:
+        files = sorted(glob.glob(os.path.join(root, 'examples', '*.mw')))
+
+    work = tempfile.mkdtemp()
+    try:
+        inputs = os.path.join(work, 'in')
+        inputs_list = []
+        for i in range(args.count):
+            directory = os.path.join(inputs, 'group%d' % (i % 10))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            path = os.path.join(directory, 'file%d.mw' % i)
+            shutil.copy(files[i % len(files)], path)
+            inputs_list.append(path)
+
+        def one_per_file():
+            for path in inputs_list:
+                run(['-x', path])
+
+        def batch(jobs):
+            out = os.path.join(work, 'out%d' % jobs)
+            return lambda: run(['-x', '-j', str(jobs), '-o', out, inputs])
+
+        timings = [("one per file", timed(one_per_file)),
+                   ("-j 1", timed(batch(1))),
+                   ("-j %d" % args.jobs, timed(batch(args.jobs)))]
+    finally:
+        shutil.rmtree(work)
+
+    print "%d files" % args.count
+    print "%-14s %10s %10s %8s" % ("", "total", "per file", "speedup")
+    for label, t in timings:
+        print "%-14s %9.2fs %8.1fms %7.1fx" % (label, t, 1000 * t / args.count,
+                                               timings[0][1] / t)
+
+
+if __name__ == '__main__':
+    main()
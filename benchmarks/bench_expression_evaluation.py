@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""Compare evaluating expressions at parse time by formatting them as
+   Python and handing them to eval, as MWExpression.eval did before
+   mwx.ast.evaluation, with the compiled evaluator.
+
+   Two measures:
+
+     conditions   EXPRESSIONS condition expressions on numbers (comparisons
+                  and arithmetic joined by and and or), each evaluated
+                  REPEAT times, as the same node
+     templates    resolve_templates over documents with CALLS calls of a
+                  template holding a conditional on its argument, with the
+                  expansion cache off, so each call evaluates a copy of the
+                  condition
+
+   in each of
+
+     eval       MWExpression.eval as it was before (rebuilt here): the
+                expression's infix string is passed to eval (and, for the
+                templates, TemplateIf's conditions are evaluated with it)
+     compiled   MWExpression.eval (and mwx.ast.evaluation.value_of)
+
+   Both must give the same values, and the same trees.  (The conditions are
+   ones eval could evaluate: no durations, strings or ^.)
+
+   usage: bench_expression_evaluation.py [-n REPEAT] [-e EXPRESSIONS]
+                                         [-c CALLS ...]
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mwx.ast import *
+from mwx.ast import evaluation
+from mwx.ast.templates import ExpansionCache, resolve_templates
+from mwx.parser import MWXParser
+
+
+COMPILED_EVAL = MWExpression.eval
+COMPILED_VALUE_OF = evaluation.value_of
+
+TEMPLATE = '''
+macro trial_template(name, n) {
+    trial[@name] {
+        @if ((@n * 2 > 3 and @n < 50) or @n == 0){
+            report("in range")
+        } else {
+            report("out of range")
+        }
+    }
+}
+'''
+
+
+def python_eval(self):
+    """MWExpression.eval, as it was before the compiled evaluator"""
+    eval_string = self.to_infix(quote_strings=False)
+    try:
+        return eval(eval_string)
+    except:
+        raise Exception("Unable to evaluate expression: %s" % eval_string)
+
+
+def python_value_of(x):
+    """The value of a TemplateIf's condition, as it was found before the
+       compiled evaluator
+    """
+    if getattr(x, 'eval', False):
+        return python_eval(x)
+    try:
+        return eval(x)
+    except:
+        return False
+
+
+def condition(r, depth=3):
+    if depth == 0:
+        return r.randint(0, 9)
+    if depth == 1:
+        return MWBinaryExpression(r.choice(['<', '<=', '>', '>=', '==']),
+                                  condition(r, 2), condition(r, 0))
+    if depth == 2:
+        return MWBinaryExpression(r.choice(['+', '-', '*']),
+                                  condition(r, 0), condition(r, 0))
+    return MWBinaryExpression(r.choice(['and', 'or']), condition(r, 1),
+                              condition(r, r.choice([1, 3])))
+
+
+def evaluate_all(expressions, repeat, eval_function):
+    MWExpression.eval = eval_function
+    try:
+        tic = time.time()
+        for i in range(repeat):
+            values = [e.eval() for e in expressions]
+        return time.time() - tic, values
+    finally:
+        MWExpression.eval = COMPILED_EVAL
+
+
+def document(calls):
+    return TEMPLATE + 'protocol P {\n%s}\n' % ''.join(
+        ['    @trial_template("T%d", %d)\n' % (i, i % 60)
+         for i in range(calls)])
+
+
+def expand(text, value_of):
+    evaluation.value_of = value_of
+    try:
+        nodes = MWXParser(engine='fast').parse_preprocessed(text)
+        tic = time.time()
+        nodes = resolve_templates(nodes,
+                                  expansion_cache=ExpansionCache(0))
+        return time.time() - tic, nodes
+    finally:
+        evaluation.value_of = COMPILED_VALUE_OF
+
+
+def best_time(text, value_of, repeat):
+    return min([expand(text, value_of)[0] for i in range(repeat)])
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('-n', '--repeat', type=int, default=3)
+    arg_parser.add_argument('-e', '--expressions', type=int, default=1000)
+    arg_parser.add_argument('-c', '--calls', type=int, nargs='+',
+                            default=[1000, 5000])
+    args = arg_parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    r = random.Random(0)
+    expressions = [condition(r) for i in range(args.expressions)]
+    (t_eval, eval_values) = evaluate_all(expressions, args.repeat,
+                                         python_eval)
+    (t_compiled, compiled_values) = evaluate_all(expressions, args.repeat,
+                                                 COMPILED_EVAL)
+    if [bool(v) for v in eval_values] != [bool(v) for v in compiled_values]:
+        print "different values for the conditions"
+        sys.exit(1)
+
+    evaluations = args.expressions * args.repeat
+    print "%-10s %12s %12s" % ("conditions", "eval", "compiled")
+    print "%-10d %10.1fus %10.1fus" % (args.expressions,
+                                       1e6 * t_eval / evaluations,
+                                       1e6 * t_compiled / evaluations)
+    print
+
+    print "%-10s %12s %12s" % ("calls", "eval", "compiled")
+    for calls in args.calls:
+        text = document(calls)
+        if (RootNode(expand(text, python_value_of)[1]).to_xml() !=
+            RootNode(expand(text, COMPILED_VALUE_OF)[1]).to_xml()):
+            print "different trees for %d calls" % calls
+            sys.exit(1)
+
+        t_eval = best_time(text, python_value_of, args.repeat)
+        t_compiled = best_time(text, COMPILED_VALUE_OF, args.repeat)
+        print "%-10d %10.0fms %10.0fms" % (calls, 1000 * t_eval,
+                                           1000 * t_compiled)
+
+
+if __name__ == '__main__':
+    main()
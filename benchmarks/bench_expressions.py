@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""Compare expression parsing with operatorPrecedence and precedence climbing.
+
+   Parses a corpus of transition guards and conditions (the guards found in
+   the example files, plus a list of typical ones below) with:
+
+     operatorPrecedence   the pyparsing expression grammar that MWXGrammar
+                          used before mwx.expression (rebuilt here)
+     pyparsing element    the precedence-climbing parser, wrapped as the
+                          pyparsing element the grammar now uses
+     parse_expression     the precedence-climbing parser on its own
+
+   All three must build the same trees.
+
+   usage: bench_expressions.py [-n REPEAT] [file.mw ...]
+"""
+
+import os
+import re
+import sys
+import glob
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pyparsing import *
+
+from mwx.ast import *
+from mwx.expression import parse_expression
+from mwx.grammar import (PrecedenceClimbingExpression, get_grammar,
+                         list_to_literals, quoted_string_fn)
+
+typical_guards = [
+    'always',
+    '(lick_sensor1 > 5)',
+    'timer_expired(wait_timer)',
+    'eye_in_window == 1 and fixation_timer_expired == 0',
+    'eye_in_window == 0 || saccade_started',
+    'n_trials >= max_trials',
+    'not correct',
+    '!correct && !ignore_errors',
+    'response == "left"',
+    "response != 'none' and rt < 800ms",
+    'saccade_latency > 250ms',
+    '-x < 3',
+    '(reward_count + 1) * 2 > total_trials',
+    'abs(eye_h - target_h) < window_size / 2',
+    'x[2] != y[idx + 1]',
+    'block_index == n_blocks - 1',
+    'contrast ^ 2 * gain >= threshold',
+    'timer_expired(iti_timer) and not paused',
+    '(stim_on == 1 and lever_pressed) or (stim_on == 0 and not lever_pressed)',
+    'reward_size * 1.5 <= max_reward',
+]
+
+# "guard -> target" lines in a transition block
+guard_line = re.compile(r"^\s*(.+?)\s*->", re.MULTILINE)
+
+
+def operator_precedence_expression():
+    """The expression grammar as MWXGrammar defined it before
+       mwx.expression
+    """
+    expression = Forward()
+    value = expression
+    identifier = Word(alphanums + '_' + '#')
+
+    integer_number = Word(nums)('str')
+    integer_number.setParseAction(lambda x: int(x.str))
+    float_number = Combine(Word(nums) + Optional(Literal(".") + Word(nums)))('str')
+    float_number.setParseAction(lambda x: float(x.str))
+    time_unit = Literal("ms") | Literal("us") | Literal("s") | Literal("min")
+    duration = Combine(integer_number + time_unit)
+
+    function_call = identifier("name") + Suppress("(") + Group(delimitedList(expression))("args") + Suppress(")")
+    function_call.setParseAction(lambda x: [MWFunctionCall(x.name, x.args.asList())])
+
+    array_reference = identifier('arr_var_ref_name') + Suppress("[") + expression('arr_var_ref_index') + Suppress("]")
+    array_reference.setParseAction(lambda x: MWVariableReference(identifier=x.arr_var_ref_name, index=x.arr_var_ref_index))
+
+    variable_reference = identifier("varname")
+    variable_reference.setParseAction(lambda x: MWVariableReference(identifier=x.varname))
+
+    template_reference = Suppress("@") + identifier("name") + Optional(NotAny(LineEnd()) + Suppress("(") + ZeroOrMore(value + Suppress(Optional(",")))("args") + Suppress(")"))
+    template_reference.setParseAction(lambda x: TemplateReference(x.name, x.args))
+
+    operand = (template_reference | duration | float_number | integer_number | quoted_string_fn(False) |
+               function_call | array_reference | variable_reference)
+
+    exp_op = Literal("^") | Literal("**")
+    sign_op = Literal("+") | Literal("-")
+    multiply_op = Literal("*") | Literal("/")
+    plus_op = Literal("+") | Literal("-")
+    not_op = (Literal("not") | Literal("!")).setParseAction(lambda x: ["not"])
+    and_op = (Literal("and") | Literal("&&")).setParseAction(lambda x: ["and"])
+    or_op = (Literal("or") | Literal("||")).setParseAction(lambda x: ["or"])
+    comp_op = list_to_literals([">=", "<=", ">", "<", "==", "!="])
+
+    def binary(pr):
+        expr = MWBinaryExpression(pr[1], pr[0], pr[2])
+        if len(pr) > 3:
+            return binary([expr] + pr[3:])
+        return expr
+
+    def unary(pr):
+        return MWUnaryExpression(pr[0], pr[1])
+
+    expression << operatorPrecedence(operand,
+                                     [(exp_op, 2, opAssoc.RIGHT, lambda x: binary(x[0])),
+                                      (sign_op, 1, opAssoc.RIGHT, lambda x: unary(x[0])),
+                                      (multiply_op, 2, opAssoc.LEFT, lambda x: binary(x[0])),
+                                      (plus_op, 2, opAssoc.LEFT, lambda x: binary(x[0])),
+                                      (not_op, 1, opAssoc.RIGHT, lambda x: unary(x[0])),
+                                      (or_op, 2, opAssoc.LEFT, lambda x: binary(x[0])),
+                                      (and_op, 2, opAssoc.LEFT, lambda x: binary(x[0])),
+                                      (comp_op, 2, opAssoc.LEFT, lambda x: binary(x[0]))])
+    return expression
+
+
+def tree_signature(node):
+    if isinstance(node, MWExpression):
+        return (node.__class__.__name__, node.op,
+                [tree_signature(c) for c in node.children])
+    if isinstance(node, MWASTNode):
+        return (node.__class__.__name__, node.tag, node.props.get('tag'),
+                [tree_signature(c) for c in node.children or []])
+    return node
+
+
+def best_time(f, repeat):
+    best = None
+    for i in range(repeat):
+        tic = time.time()
+        f()
+        elapsed = time.time() - tic
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('files', nargs='*')
+    arg_parser.add_argument('-n', '--repeat', type=int, default=5)
+    arg_parser.add_argument('-s', '--scale', type=int, default=50,
+                            help='number of passes over the corpus')
+    args = arg_parser.parse_args()
+
+    files = args.files
+    if not files:
+        examples = os.path.join(os.path.dirname(__file__), '..', 'examples')
+        files = sorted(glob.glob(os.path.join(examples, '*.mw')))
+
+    guards = list(typical_guards)
+    for filename in files:
+        for guard in guard_line.findall(open(filename).read()):
+            if guard not in guards:
+                guards.append(guard)
+
+    # the grammar is shared with MWXParser; make sure packrat is on, as it
+    # is when parsing documents
+    get_grammar()
+
+    reference = operator_precedence_expression() + StringEnd()
+    element = PrecedenceClimbingExpression() + StringEnd()
+
+    for guard in guards:
+        expected = tree_signature(reference.parseString(guard)[0])
+        for result in (element.parseString(guard)[0],
+                       parse_expression(guard)):
+            if tree_signature(result) != expected:
+                print "different trees for %r" % guard
+                sys.exit(1)
+
+    corpus = guards * args.scale
+
+    def run_pyparsing(e):
+        for guard in corpus:
+            ParserElement.resetCache()
+            e.parseString(guard)
+
+    def run_standalone():
+        for guard in corpus:
+            parse_expression(guard)
+
+    timings = [("operatorPrecedence", best_time(lambda: run_pyparsing(reference), args.repeat)),
+               ("pyparsing element", best_time(lambda: run_pyparsing(element), args.repeat)),
+               ("parse_expression", best_time(run_standalone, args.repeat))]
+
+    print "%d guards, %d parses per run" % (len(guards), len(corpus))
+    print "%-20s %12s %12s %8s" % ("", "total", "per guard", "speedup")
+    for label, t in timings:
+        print "%-20s %10.2fms %10.1fus %7.1fx" % (label, 1000 * t,
+                                                 1e6 * t / len(corpus),
+                                                 timings[0][1] / t)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""Compare the foreign-code scanners with the regular expressions they
+   replaced.
+
+   For blocks of python code of growing size, times:
+
+     regex     the {\\s*^(?P<padding>\\s*)(?P<code>.*?)^\\s*} expression (and
+               remove_python_padding over its groups)
+     scanner   mwx.foreign_code.scan_brace_block
+
+   on a well-formed block, and on the same block without its closing brace
+   (as seen while a file is being edited), where the expression backtracks
+   over the rest of the text for every padding it can try.  The scanner's
+   time per line should stay flat.  Both must return the same code for the
+   well-formed block.
+
+   usage: bench_foreign_code.py [-n REPEAT] [-l LINES ...]
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mwx.ast import remove_python_padding
+from mwx.foreign_code import scan_brace_block
+
+foreign_code_regex = re.compile(r"{\s*^(?P<padding>\s*)(?P<code>.*?)^\s*}",
+                                re.MULTILINE | re.DOTALL).match
+
+code_lines = ['s = {"a": [1, 2, 3], "b": \'{\'}',
+              'for i in range(0, 10, 2):',
+              '    s["a"].append(draw_selection(stimulus_randomizer))',
+              'if len(s["a"]) > 100:',
+              '    s = {}']
+
+
+def block(lines, closed=True):
+    padding = ' ' * 24
+    body = [padding + code_lines[i % len(code_lines)] for i in range(lines)]
+    text = "{\n" + "\n".join(body) + "\n"
+    if closed:
+        text += "}\n"
+    return text
+
+
+def regex_scan(text):
+    m = foreign_code_regex(text, 0)
+    if m is None:
+        return None
+    return (remove_python_padding(m.group('code'), m.group('padding')),
+            m.end())
+
+
+def best_time(f, repeat):
+    best = None
+    for i in range(repeat):
+        tic = time.time()
+        f()
+        elapsed = time.time() - tic
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('-n', '--repeat', type=int, default=5)
+    arg_parser.add_argument('-l', '--lines', type=int, nargs='+',
+                            default=[100, 1000, 10000])
+    args = arg_parser.parse_args()
+
+    print "%-10s %-10s %12s %12s %12s" % ("lines", "block", "regex",
+                                          "scanner", "us/line")
+    for lines in args.lines:
+        for closed in (True, False):
+            text = block(lines, closed)
+            if closed and regex_scan(text) != scan_brace_block(text, 0):
+                print "different code for %d lines" % lines
+                sys.exit(1)
+
+            t_regex = best_time(lambda: regex_scan(text), args.repeat)
+            t_scanner = best_time(lambda: scan_brace_block(text, 0),
+                                  args.repeat)
+            print "%-10d %-10s %10.2fms %10.2fms %12.2f" % (
+                lines, "closed" if closed else "unclosed", 1000 * t_regex,
+                1000 * t_scanner, 1e6 * t_scanner / lines)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""Check how long mwx takes to start, and fail if it has regressed.
+
+   Each measurement runs in a fresh interpreter, and the best of several
+   runs is compared with a threshold, as a multiple of the best time of
+   the bare interpreter (python -c pass), so that it holds on slower
+   machines too:
+
+     import mwx        python -c "import mwx"
+     mwx -x FILE       compiling an example file with the mwx script
+
+   Where no .pyc files can be written, every run compiles the modules it
+   imports, and takes longer; the thresholds leave room for that.  The
+   benchmark also
+   checks which of the expensive dependencies get imported: numpy should
+   only be imported when replicators are expanded, pyparsing only when
+   an MWX parser that uses the pyparsing grammar is created, and
+   mwx.ast.evaluation only when an expression is evaluated.
+
+   usage: bench_import.py [-n RUNS] [--max-import RATIO]
+                          [--max-compile RATIO]
+"""
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+mwx = os.path.join(root, 'scripts', 'mwx')
+example = os.path.join(root, 'examples', 'if_test.mw')
+
+# (what to run, modules that must not be imported after it)
+import_checks = [
+    ("import mwx", ['pyparsing', 'numpy', 'mwx.ast.evaluation']),
+    ("import mwx.parser", ['pyparsing', 'numpy']),
+    ("import mwx.parser; mwx.parser.MWXParser(engine='fast')",
+     ['pyparsing', 'numpy']),
+    ("import mwx.parser; mwx.parser.MWXMLParser()", ['pyparsing', 'numpy']),
+    ("import mwx.parser; mwx.parser.MWXParser()", ['numpy']),
+]
+
+check = r'''
+import sys
+%s
+print " ".join([m for m in %r if m in sys.modules])
+'''
+
+
+def environment():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = root
+    return env
+
+
+def best_time(args, runs):
+    best = None
+    with open(os.devnull, 'w') as devnull:
+        for i in range(runs):
+            tic = time.time()
+            subprocess.check_call(args, env=environment(), stdout=devnull,
+                                  stderr=devnull)
+            elapsed = time.time() - tic
+            if best is None or elapsed < best:
+                best = elapsed
+    return best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('-n', '--runs', type=int, default=10)
+    arg_parser.add_argument('--max-import', type=float, default=8,
+                            help='threshold for "import mwx", as a '
+                                 'multiple of the bare interpreter')
+    arg_parser.add_argument('--max-compile', type=float, default=25,
+                            help='threshold for "mwx -x", as a multiple '
+                                 'of the bare interpreter')
+    args = arg_parser.parse_args()
+
+    failed = False
+
+    for code, forbidden in import_checks:
+        output = subprocess.check_output([sys.executable, '-c',
+                                          check % (code, forbidden)],
+                                         env=environment())
+        if output.split():
+            print "%s imports %s" % (code, ", ".join(output.split()))
+            failed = True
+
+    python = best_time([sys.executable, '-c', 'pass'], args.runs)
+    timings = [("python", python, None),
+               ("import mwx", best_time([sys.executable, '-c', 'import mwx'],
+                                        args.runs), args.max_import),
+               ("mwx -x %s" % os.path.basename(example),
+                best_time([sys.executable, mwx, '-x', example], args.runs),
+                args.max_compile)]
+
+    print "%-24s %10s %10s %10s" % ("", "time", "ratio", "threshold")
+    for label, t, threshold in timings:
+        if threshold is None:
+            print "%-24s %8.1fms" % (label, 1000 * t)
+            continue
+        over = t > threshold * python
+        print "%-24s %8.1fms %9.1fx %9.1fx%s" % (label, 1000 * t, t / python,
+                                                 threshold,
+                                                 over and "  REGRESSION" or "")
+        failed = failed or over
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""Compare the peak memory of parse_string and iter_parse.
+
+   Generates a document with many stimuli and trials, then writes its XML
+   out once with parse_string + to_xml and once with iter_parse + the
+   streaming writer, each in a fresh interpreter.  Reports the peak
+   resident size of each process and the time taken.
+
+   usage: bench_iter_parse.py [-e ENGINE] [SIZE ...]
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+block = '''
+stimulus stim_%(i)d[type="image_file", path="images/%(i)d.png"]
+trial trial_%(i)d{
+    wait(100ms)
+    queue_stimulus(stim_%(i)d)
+    update_stimulus_display()
+}
+'''
+
+measure = r'''
+import sys, time, resource
+sys.path.insert(0, %(root)r)
+from mwx.parser import MWXParser
+from mwx.ast import write_xml_document
+
+out = open('/dev/null', 'w')
+p = MWXParser(engine=%(engine)r)
+
+tic = time.time()
+if %(streaming)r:
+    with open(%(filename)r) as f:
+        write_xml_document(p.iter_parse(f), out)
+else:
+    out.write(p.parse_string(open(%(filename)r).read()).to_xml())
+elapsed = time.time() - tic
+
+print elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+'''
+
+
+def run_once(filename, engine, streaming):
+    code = measure % {'root': root,
+                      'engine': engine,
+                      'filename': filename,
+                      'streaming': streaming}
+    output = subprocess.check_output([sys.executable, '-c', code])
+    elapsed, maxrss = output.split()
+    return float(elapsed), int(maxrss)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('sizes', nargs='*', type=int,
+                            default=[1000, 2000, 4000])
+    arg_parser.add_argument('-e', '--engine', default='fast')
+    args = arg_parser.parse_args()
+
+    print "%8s %12s %12s %12s %12s" % ("blocks", "parse time", "parse rss",
+                                       "iter time", "iter rss")
+
+    for n in args.sizes:
+        fd, filename = tempfile.mkstemp(suffix=".mw")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                for i in range(n):
+                    f.write(block % {'i': i})
+
+            t_parse, rss_parse = run_once(filename, args.engine, False)
+            t_iter, rss_iter = run_once(filename, args.engine, True)
+        finally:
+            os.remove(filename)
+
+        # ru_maxrss is in kilobytes on Linux
+        print "%8d %11.2fs %10.1fMB %11.2fs %10.1fMB" % (n, t_parse,
+                                                         rss_parse / 1024.0,
+                                                         t_iter,
+                                                         rss_iter / 1024.0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""Measure the memory taken by the nodes of a large AST.
+
+   Builds a synthetic experiment of about NODES nodes directly from the node
+   classes (protocols, blocks and trials holding wait, report and assignment
+   actions with expressions, and task systems of states with transitions),
+   and reports:
+
+     bytes/node (rss)      growth of the peak RSS while building the tree,
+                           per node
+     bytes/node (objects)  sys.getsizeof of each node and of the props,
+                           children and __dict__ it owns (shared objects,
+                           like empty_props, counted once)
+     peak RSS              resource.getrusage(RUSAGE_SELF).ru_maxrss
+
+   The RSS is also given after formatting every derived tag (as writing the
+   XML does), which the nodes only do when asked.
+
+   usage: bench_memory.py [-n NODES]
+"""
+
+import os
+import sys
+import time
+import resource
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mwx.ast import *
+
+
+def peak_rss():
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def trial(i):
+    condition = MWBinaryExpression('>', MWVariableReference('x'), i)
+    value = MWBinaryExpression('*', MWVariableReference('x'), 2)
+    return MWASTNode('trial', 'Trial %d' % i, props={'nsamples': 10},
+                     children=[Action('wait', '%dms' % (100 + i)),
+                               Action('report', 'x: $x'),
+                               AssignmentAction('x', value),
+                               AssignmentAction('y', i),
+                               MWASTNode('if', props={'condition': condition},
+                                         children=[Action('wait', '50ms')])])
+
+
+def state(i):
+    transitions = [Transition(MWFunctionCall('timer_expired',
+                                             [MWVariableReference('t')]),
+                              'State %d' % (i + 1)),
+                   Transition(MWKeyword('always'), MWKeyword('yield'))]
+    return State('State %d' % i,
+                 actions=[Action('report', 'state %d' % i),
+                          Action('wait', '100ms')],
+                 transitions=transitions)
+
+
+def protocol(i):
+    blocks = [MWASTNode('block', 'Block %d' % b, props={'nsamples': 2},
+                        children=[trial(t) for t in range(4)])
+              for b in range(4)]
+    system = MWASTNode('task_system', 'Task %d' % i,
+                       children=[state(s) for s in range(6)])
+    return MWASTNode('protocol', 'Protocol %d' % i,
+                     children=blocks + [system])
+
+
+def iter_nodes(tree):
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        yield node
+        for x in node.props.values():
+            if isinstance(x, MWASTNode):
+                stack.append(x)
+        for x in node.children or []:
+            if isinstance(x, MWASTNode):
+                stack.append(x)
+
+
+def object_bytes(nodes):
+    seen = set()
+    total = 0
+    for node in nodes:
+        for x in (node, node.props, node.children,
+                  getattr(node, '__dict__', None)):
+            if x is not None and id(x) not in seen:
+                seen.add(id(x))
+                total += sys.getsizeof(x)
+    return total
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('-n', '--nodes', type=int, default=500000)
+    args = arg_parser.parse_args()
+
+    # nodes in one protocol
+    per_protocol = sum(1 for n in iter_nodes(protocol(0)))
+
+    before = peak_rss()
+    tic = time.time()
+    tree = RootNode(children=[protocol(i) for i in
+                              range(max(1, args.nodes // per_protocol))])
+    elapsed = time.time() - tic
+    after = peak_rss()
+
+    # formatting the derived tags, as writing the XML does
+    nodes = list(iter_nodes(tree))
+    for node in nodes:
+        node.derive_tag()
+    with_tags = peak_rss()
+
+    n = len(nodes)
+    print "%d nodes, built in %.2fs" % (n, elapsed)
+    print "%-24s %12.1f" % ("bytes/node (rss)", float(after - before) / n)
+    print "%-24s %12.1f" % ("  with derived tags", float(with_tags - before) / n)
+    print "%-24s %12.1f" % ("bytes/node (objects)",
+                            float(object_bytes(nodes)) / n)
+    print "%-24s %10.1fMB" % ("peak RSS", peak_rss() / 1e6)
+
+
+if __name__ == '__main__':
+    main()
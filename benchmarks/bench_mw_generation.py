@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""Compare generate_mw_objects with its filtered passes walking the whole
+   tree and visiting just the nodes of their types from the RootNode's
+   index.
+
+   Builds experiments of about NODES nodes (variables and stimuli, and
+   protocols of blocks and trials holding actions, and task systems of
+   states with transitions), and times generate_mw_objects on each, against
+   a registry that does nothing, with the TypeFilteredTreeWalker passes:
+
+     walk      walking the whole tree each (indexed = False), as they did
+               before the index
+     indexed   visiting the nodes of their types only, from the index
+               (built once, for the first pass)
+
+   Both must make the same calls on the registry, in the same order.
+
+   usage: bench_mw_generation.py [-n REPEAT] [-s NODES ...]
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mwx.ast import *
+from mwx.mw_generation import generate_mw_objects, TypeFilteredTreeWalker
+
+
+class NullRegistry(object):
+
+    def __init__(self, log=False):
+        self.calls = [] if log else None
+
+    def create(self, mw_type, tag, params):
+        if self.calls is not None:
+            self.calls.append(('create', mw_type, tag))
+
+    def connect(self, parent, child):
+        if self.calls is not None:
+            self.calls.append(('connect', parent, child))
+
+    def finalize(self, tag):
+        if self.calls is not None:
+            self.calls.append(('finalize', tag))
+
+
+def trial(i):
+    return MWASTNode('trial', 'Trial %d' % i, props={'nsamples': 10},
+                     children=[Action('wait', '%dms' % (100 + i)),
+                               Action('report', 'x: $x'),
+                               AssignmentAction('y', i)])
+
+
+def state(i):
+    return State('State %d' % i,
+                 actions=[Action('report', 'state %d' % i),
+                          Action('wait', '100ms')],
+                 transitions=[Transition(MWKeyword('always'),
+                                         'State %d' % (i + 1))])
+
+
+def protocol(i):
+    blocks = [MWASTNode('block', 'Block %d.%d' % (i, b),
+                        props={'nsamples': 2},
+                        children=[trial(t) for t in range(4)])
+              for b in range(4)]
+    system = MWASTNode('task_system', 'Task %d' % i,
+                       children=[state(s) for s in range(6)])
+    return MWASTNode('protocol', 'Protocol %d' % i,
+                     children=blocks + [system])
+
+
+def experiment(nodes):
+    # a protocol is about 130 nodes
+    protocols = max(1, nodes // 130)
+    variables = [MWVariable('v%d' % v, default='0', var_type='integer')
+                 for v in range(protocols)]
+    stimuli = [MWASTNode('stimulus', 's%d' % s, props={'path': '%d.png' % s})
+               for s in range(protocols)]
+    return RootNode(children=variables + stimuli +
+                    [protocol(p) for p in range(protocols)])
+
+
+def generate(nodes, indexed, log=False):
+    TypeFilteredTreeWalker.indexed = indexed
+    registry = NullRegistry(log)
+    tree = experiment(nodes)
+    tic = time.time()
+    generate_mw_objects(tree, registry)
+    return time.time() - tic, registry.calls
+
+
+def numbered(calls):
+    """calls, with the generated tags numbered in order"""
+    ids = {}
+    uuid = re.compile(r'^[0-9a-f]{8}(-[0-9a-f]{4}){3}-[0-9a-f]{12}$')
+    return [tuple([ids.setdefault(x, len(ids)) if uuid.match(str(x)) else x
+                   for x in call]) for call in calls]
+
+
+def best_time(nodes, indexed, repeat):
+    return min([generate(nodes, indexed)[0] for i in range(repeat)])
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('-n', '--repeat', type=int, default=3)
+    arg_parser.add_argument('-s', '--nodes', type=int, nargs='+',
+                            default=[10000, 100000])
+    args = arg_parser.parse_args()
+
+    print "%-10s %12s %12s" % ("nodes", "walk", "indexed")
+    for nodes in args.nodes:
+        if (numbered(generate(nodes, False, log=True)[1]) !=
+            numbered(generate(nodes, True, log=True)[1])):
+            print "different calls for %d nodes" % nodes
+            sys.exit(1)
+
+        t_walk = best_time(nodes, False, args.repeat)
+        t_indexed = best_time(nodes, True, args.repeat)
+        print "%-10d %10.0fms %10.0fms" % (nodes, 1000 * t_walk,
+                                          1000 * t_indexed)
+
+
+if __name__ == '__main__':
+    main()
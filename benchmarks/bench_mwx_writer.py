@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+"""Compare writing the MWX of a document with MWXWriter and with string
+   concatenation.
+
+   Builds documents whose MWX grows to SIZE megabytes (the same protocol,
+   of blocks, trials, actions, variables and a task system, repeated, as
+   converted from a legacy XML protocol), and times each of:
+
+     concatenation   to_mwx as it was before MWXWriter, with each node's
+                     MWX built from its children's strings (rebuilt here),
+                     then written to a file
+     to_mwx          MWXWriter, collecting the pieces, then written to a
+                     file
+     write_mwx       RootNode.write_mwx, straight to the file
+
+   each in a process of its own, reporting the time per megabyte and how
+   much the peak RSS grew while writing.  The output goes to /dev/null; all
+   three must produce the same MWX.
+
+   usage: bench_mwx_writer.py [-n REPEAT] [-s SIZE ...]
+"""
+
+import os
+import sys
+import time
+import resource
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mwx.ast import *
+from mwx.ast.ast import mwx_declaration, PRIMARY_ARG_STRING
+from mwx.constants import shorthand_actions
+
+methods = ('concatenation', 'to_mwx', 'write_mwx')
+
+
+def trial(i):
+    value = MWBinaryExpression('*', MWVariableReference('x'), 2)
+    return MWASTNode('trial', 'Trial%d' % i,
+                     props={'nsamples': '10', 'sampling_method': 'cycles',
+                            'selection': 'random_without_replacement'},
+                     children=[Action('wait', '%dms' % (100 + i)),
+                               Action('report', 'x is $x'),
+                               Action('start_timer', props={'timer': 'T',
+                                                            'duration': '2s'}),
+                               AssignmentAction('x', value),
+                               MWASTNode('stimulus', 'Stimulus %d' % i,
+                                         props={'path': 'images/%d.png' % i,
+                                                'x_size': '10',
+                                                'y_size': '10'})])
+
+
+def state(i):
+    transitions = [Transition(MWFunctionCall('timer_expired',
+                                             [MWVariableReference('T')]),
+                              'State %d' % (i + 1)),
+                   Transition(MWKeyword('always'), MWKeyword('yield'))]
+    return State('State%d' % i,
+                 actions=[Action('report', 'state %d' % i),
+                          Action('wait', '100ms')],
+                 transitions=transitions)
+
+
+def protocol():
+    blocks = [MWASTNode('block', 'Block%d' % b,
+                        props={'nsamples': '2', 'sampling_method': 'cycles'},
+                        children=[trial(t) for t in range(10)])
+              for b in range(10)]
+    system = MWASTNode('task_system', 'Task',
+                       children=[state(s) for s in range(10)])
+    variables = [MWVariable('v%d' % v, default='0', var_type='integer')
+                 for v in range(5)]
+    return MWASTNode('protocol', 'Protocol',
+                     children=variables + blocks + [system])
+
+
+def document(megabytes):
+    # the same protocol, over and over: the tree stays small, however long
+    # its MWX
+    p = protocol()
+    n = max(1, int(megabytes * 1e6 / len(p.to_mwx())))
+    return RootNode(children=[p] * n)
+
+
+def child_block(children, tablevel):
+    if len(children) == 0:
+        return ''
+    return ('{\n' +
+            ''.join([concatenated_mwx(c, tablevel + 1) for c in children]) +
+            tab * tablevel + '}')
+
+
+def concatenated_mwx(obj, tablevel=0):
+    """to_mwx, as it was before MWXWriter"""
+    if isinstance(obj, RootNode):
+        return ''.join([concatenated_mwx(c) for c in obj.children])
+
+    if isinstance(obj, State):
+        return (tab * tablevel +
+                mwx_declaration(obj.obj_type, obj.props, True) +
+                child_block(obj.actions, tablevel) + ' transition ' +
+                child_block(obj.transitions, tablevel) + '\n')
+
+    if (isinstance(obj, Action) and 'type' in obj.props and
+        obj.__class__ is Action):
+        props = copy(obj.props)
+        args = []
+        if PRIMARY_ARG_STRING in props.keys():
+            args.append(to_mwx(obj.props[PRIMARY_ARG_STRING]))
+        primary_arg_property = shorthand_actions.get(props['type'], None)
+        if primary_arg_property is not None:
+            args.append(to_mwx(props.pop(primary_arg_property),
+                               mw_type=primary_arg_property))
+        for key in props.keys():
+            if key == PRIMARY_ARG_STRING or key == "tag" or key == "type":
+                continue
+            args.append("%s=%s" % (key, to_mwx(obj.props[key])))
+        return (tab * tablevel + obj.props['type'] +
+                "(" + ", ".join(args) + ")" +
+                child_block(obj.children, tablevel) + '\n')
+
+    if (isinstance(obj, MWASTNode) and
+        obj.__class__.to_mwx.im_func is MWASTNode.to_mwx.im_func):
+        obj.derive_tag()
+        return (tab * tablevel + mwx_declaration(obj.obj_type, obj.props) +
+                child_block(obj.children, tablevel) + '\n')
+
+    return to_mwx(obj, tablevel)
+
+
+def write(method, root, f):
+    if method == 'concatenation':
+        f.write(concatenated_mwx(root))
+    elif method == 'to_mwx':
+        f.write(root.to_mwx())
+    else:
+        root.write_mwx(f)
+
+
+def peak_rss():
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run(method, megabytes, repeat):
+    """Time one method, in this process; prints seconds and RSS growth"""
+    root = document(megabytes)
+    best = None
+    before = peak_rss()
+    for i in range(repeat):
+        with open(os.devnull, 'w') as f:
+            tic = time.time()
+            write(method, root, f)
+            elapsed = time.time() - tic
+        if best is None or elapsed < best:
+            best = elapsed
+    print best, peak_rss() - before
+
+
+def check():
+    root = document(0.5)
+
+    class Collect(object):
+        def __init__(self):
+            self.pieces = []
+
+        def write(self, s):
+            self.pieces.append(s)
+
+    outputs = []
+    for method in methods:
+        f = Collect()
+        write(method, root, f)
+        outputs.append(''.join(f.pieces))
+    if outputs.count(outputs[0]) != len(outputs):
+        print "different MWX from the methods"
+        sys.exit(1)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('-n', '--repeat', type=int, default=3)
+    arg_parser.add_argument('-s', '--size', type=float, nargs='+',
+                            default=[1, 10, 100],
+                            help='megabytes of MWX')
+    arg_parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.run:
+        run(args.run, args.size[0], args.repeat)
+        return
+
+    check()
+
+    print "%-8s %-14s %10s %10s %12s" % ("MB", "method", "time",
+                                         "ms/MB", "RSS growth")
+    for megabytes in args.size:
+        for method in methods:
+            out = subprocess.check_output([sys.executable, __file__,
+                                           '--run', method,
+                                           '-s', str(megabytes),
+                                           '-n', str(args.repeat)])
+            elapsed, growth = out.split()
+            elapsed = float(elapsed)
+            print "%-8g %-14s %9.2fs %10.1f %10.1fMB" % (
+                megabytes, method, elapsed, 1000 * elapsed / megabytes,
+                int(growth) / 1e6)
+
+
+if __name__ == '__main__':
+    main()
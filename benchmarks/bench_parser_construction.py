@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""Measure MWXParser construction and first-parse latency.
+
+   The grammar is built the first time an MWXParser is constructed in a
+   process and shared afterwards.  Each measurement runs in a fresh
+   interpreter, and reports:
+
+     cold construction   the first MWXParser() (builds the grammar; this is
+                         what every construction cost before the cache)
+     warm construction   a second MWXParser() in the same process
+     first parse         parse_string on the example file, after cold
+                         construction (brace syntax only)
+
+   usage: bench_parser_construction.py [-n RUNS] [file.mw]
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+measure = r'''
+import sys, time
+sys.path.insert(0, %(root)r)
+from mwx.parser import MWXParser
+
+tic = time.time()
+p = MWXParser(significant_whitespace=%(sigwhite)r)
+cold = time.time() - tic
+
+tic = time.time()
+MWXParser(significant_whitespace=%(sigwhite)r)
+warm = time.time() - tic
+
+first_parse = 0.0
+if not %(sigwhite)r:
+    s = open(%(filename)r).read()
+    tic = time.time()
+    p.parse_string(s, base_path=%(base_path)r)
+    first_parse = time.time() - tic
+
+print cold, warm, first_parse
+'''
+
+
+def run_once(filename, sigwhite):
+    code = measure % {'root': root,
+                      'sigwhite': sigwhite,
+                      'filename': filename,
+                      'base_path': os.path.dirname(filename)}
+    output = subprocess.check_output([sys.executable, '-c', code])
+    return [float(x) for x in output.split()]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('file', nargs='?',
+                            default=os.path.join(root, 'examples', 'if_test.mw'))
+    arg_parser.add_argument('-n', '--runs', type=int, default=5)
+    args = arg_parser.parse_args()
+
+    print "%-24s %12s %12s %12s" % ("", "cold ctor", "warm ctor", "first parse")
+
+    for sigwhite in (False, True):
+        runs = [run_once(args.file, sigwhite) for i in range(args.runs)]
+        best = [min(r[i] for r in runs) for i in range(3)]
+        label = "significant whitespace" if sigwhite else "braces"
+        print "%-24s %10.2fms %10.2fms %10.2fms" % tuple([label] + [1000 * t for t in best])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""Compare the "pyparsing" and "fast" MWX parser engines.
+
+   Checks that both engines produce identical trees for every .mw file
+   given on the command line (default: examples/), then times the parse
+   step of each engine on the same preprocessed text.  Files named
+   *sigwhite* are parsed with significant whitespace.  A file that both
+   engines reject is reported and not timed (examples/
+   mw_test_syntax_sigwhite.mw is written with "def" templates, which
+   neither engine accepts); one that only one of them rejects is a failure.
+
+   usage: bench_parser_engines.py [-n REPEAT] [file.mw ...]
+"""
+
+import os
+import sys
+import glob
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mwx.parser import MWXParser
+from mwx.expression import MWXSyntaxError
+
+
+def tree_fingerprint(tree):
+    # some trees cannot be written back out as MWX; the error itself is
+    # then part of the fingerprint
+    fingerprint = []
+    for output in (tree.to_xml, tree.to_mwx):
+        try:
+            fingerprint.append(output())
+        except Exception, e:
+            fingerprint.append(repr(e))
+    return fingerprint
+
+
+def best_time(f, repeat):
+    best = None
+    for i in range(repeat):
+        tic = time.time()
+        f()
+        elapsed = time.time() - tic
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('files', nargs='*')
+    arg_parser.add_argument('-n', '--repeat', type=int, default=5)
+    arg_parser.add_argument('-s', '--scale', type=int, default=10,
+                            help='number of copies of each file to parse')
+    args = arg_parser.parse_args()
+
+    files = args.files
+    if not files:
+        examples = os.path.join(os.path.dirname(__file__), '..', 'examples')
+        files = sorted(glob.glob(os.path.join(examples, '*.mw')))
+
+    failed = False
+    total_slow = total_fast = 0.0
+
+    print "%-40s %12s %12s %8s" % ("file", "pyparsing", "fast", "speedup")
+
+    for filename in files:
+        base_path = os.path.dirname(filename)
+        s = open(filename).read()
+
+        significant_whitespace = 'sigwhite' in os.path.basename(filename)
+        slow = MWXParser(engine="pyparsing",
+                         significant_whitespace=significant_whitespace)
+        fast = MWXParser(engine="fast",
+                         significant_whitespace=significant_whitespace)
+
+        trees = []
+        for parser in (slow, fast):
+            try:
+                trees.append(parser.parse_document(s, base_path=base_path))
+            except MWXSyntaxError, e:
+                trees.append(e)
+
+        rejected = [isinstance(t, MWXSyntaxError) for t in trees]
+        if all(rejected):
+            print "%-40s rejected by both engines: line %d: %s" % (
+                os.path.basename(filename), trees[0].lineno, trees[0].msg)
+            continue
+        if any(rejected):
+            print "%s: only one engine rejected the file" % filename
+            failed = True
+            continue
+        if tree_fingerprint(trees[0]) != tree_fingerprint(trees[1]):
+            print "%s: engines produced different trees" % filename
+            failed = True
+            continue
+
+        preprocessed = slow.preprocessor.preprocess(s, base_path).text
+        preprocessed = preprocessed * args.scale
+
+        t_slow = best_time(lambda: slow.parse_preprocessed(preprocessed),
+                           args.repeat)
+        t_fast = best_time(lambda: fast.parse_preprocessed(preprocessed),
+                           args.repeat)
+        total_slow += t_slow
+        total_fast += t_fast
+
+        print "%-40s %10.2fms %10.2fms %7.1fx" % (os.path.basename(filename),
+                                                  1000 * t_slow, 1000 * t_fast,
+                                                  t_slow / t_fast)
+
+    if total_fast > 0:
+        print "%-40s %10.2fms %10.2fms %7.1fx" % ("total", 1000 * total_slow,
+                                                  1000 * total_fast,
+                                                  total_slow / total_fast)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
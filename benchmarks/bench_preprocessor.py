@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Time the preprocessor (comments and includes) against the parse itself.
+
+   Builds documents of increasing size from commented stimulus/trial
+   blocks, each including a shared file of variable declarations, and
+   reports the time taken by Preprocessor.preprocess and by the fast
+   engine's parse of the result.  Preprocessing time should grow linearly
+   and stay a small fraction of the parse time.
+
+   usage: bench_preprocessor.py [-n REPEAT] [SIZE ...]
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mwx.parser import MWXParser
+
+included = '''// shared variables
+integer shared_count = 0  # a comment
+string shared_name = "not // a comment"
+'''
+
+block = '''
+// block %(i)d
+include "shared.mw"
+stimulus stim_%(i)d[type="image_file", path="images/%(i)d.png"]  # the image
+trial trial_%(i)d{
+    wait(100ms)  // a wait
+    queue_stimulus(stim_%(i)d)
+    update_stimulus_display()
+}
+'''
+
+
+def best_time(f, repeat):
+    best = None
+    for i in range(repeat):
+        tic = time.time()
+        f()
+        elapsed = time.time() - tic
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('sizes', nargs='*', type=int,
+                            default=[250, 500, 1000, 2000])
+    arg_parser.add_argument('-n', '--repeat', type=int, default=3)
+    args = arg_parser.parse_args()
+
+    parser = MWXParser(engine="fast")
+    base_path = tempfile.mkdtemp()
+
+    try:
+        with open(os.path.join(base_path, 'shared.mw'), 'w') as f:
+            f.write(included)
+
+        print "%8s %8s %14s %14s %8s" % ("blocks", "lines", "preprocess",
+                                         "parse", "ratio")
+
+        for n in args.sizes:
+            s = ''.join([block % {'i': i} for i in range(n)])
+            preprocessed = parser.preprocessor.preprocess(s, base_path).text
+
+            t_pre = best_time(
+                lambda: parser.preprocessor.preprocess(s, base_path),
+                args.repeat)
+            t_parse = best_time(lambda: parser.parse_preprocessed(preprocessed),
+                                args.repeat)
+
+            print "%8d %8d %12.2fms %12.2fms %7.1f%%" % (n, s.count("\n"),
+                                                        1000 * t_pre,
+                                                        1000 * t_parse,
+                                                        100 * t_pre / t_parse)
+    finally:
+        shutil.rmtree(base_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""Compare a full parse with MWXParser.reparse after a one-line edit.
+
+   Builds synthetic documents of increasing size (variables, stimuli and
+   one trial per block), changes a single wait() duration, and times the
+   edit-to-XML latency of parse_string and of reparse.  With reparse, the
+   time should stay roughly flat as the document grows.  With -t, each
+   trial is made by a call of a template defined at the top.
+
+   usage: bench_reparse.py [-e ENGINE] [-t] [SIZE ...]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mwx.parser import MWXParser
+
+block = '''
+integer var_%(i)d = 0
+stimulus stim_%(i)d[type="blank_screen"]
+trial trial_%(i)d{
+    wait(%(duration)dms)
+    queue_stimulus(stim_%(i)d)
+    update_stimulus_display()
+}
+'''
+
+template = '''
+macro make_trial(name, stim, duration) {
+    trial[@name]{
+        wait(@duration)
+        queue_stimulus(@stim)
+        update_stimulus_display()
+    }
+}
+'''
+
+templated_block = '''
+integer var_%(i)d = 0
+stimulus stim_%(i)d[type="blank_screen"]
+@make_trial("trial_%(i)d", stim_%(i)d, %(duration)dms)
+'''
+
+
+def document(n, edited=None, templated=False):
+    parts = []
+    if templated:
+        parts.append(template)
+    for i in range(n):
+        duration = 100
+        if i == edited:
+            duration = 200
+        parts.append((templated_block if templated else block) %
+                     {'i': i, 'duration': duration})
+    return ''.join(parts)
+
+
+def timed(f):
+    tic = time.time()
+    result = f()
+    return result, time.time() - tic
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('sizes', nargs='*', type=int,
+                            default=[100, 200, 400, 800])
+    arg_parser.add_argument('-e', '--engine', default='fast')
+    arg_parser.add_argument('-t', '--templates', action='store_true')
+    args = arg_parser.parse_args()
+
+    parser = MWXParser(engine=args.engine)
+
+    print "%8s %8s %14s %14s" % ("blocks", "lines", "parse+xml", "reparse+xml")
+
+    for n in args.sizes:
+        original = document(n, templated=args.templates)
+        edited = document(n, edited=n / 2, templated=args.templates)
+
+        old_result = parser.reparse(None, original)
+
+        full, t_full = timed(lambda: parser.parse_string(edited).to_xml())
+        incremental, t_incremental = timed(
+            lambda: parser.reparse(old_result, edited).to_xml())
+
+        if full != incremental:
+            print "reparse gave a different result for %d blocks" % n
+            sys.exit(1)
+
+        print "%8d %8d %12.1fms %12.1fms" % (n, edited.count("\n"),
+                                             1000 * t_full,
+                                             1000 * t_incremental)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""Measure the latency of "mwx client -x" against a running "mwx serve".
+
+   Starts a server on a private socket, and times (best of several runs):
+
+     in-process      "mwx -x FILE" (what the mwpp hook runs without a server)
+     client          "mwx client -x FILE", FILE unchanged since the last run
+     client, edited  the same, after FILE has been touched up (a reparse)
+     request         the client's round trip alone, inside one interpreter
+
+   The client's output must match the in-process output.
+
+   usage: bench_server.py [-n RUNS] [file.mw]
+"""
+
+import os
+import re
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+mwx = os.path.join(root, 'scripts', 'mwx')
+
+sys.path.insert(0, root)
+
+# reprs of template references include object addresses
+address = re.compile(r"0x[0-9a-f]+")
+
+
+def run(args, env):
+    tic = time.time()
+    output = subprocess.check_output([sys.executable, mwx] + args, env=env,
+                                     stderr=open(os.devnull, 'w'))
+    return time.time() - tic, address.sub('', output)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('file', nargs='?',
+                            default=os.path.join(root, 'examples',
+                                                 'mw_test_syntax_advanced.mw'))
+    arg_parser.add_argument('-n', '--runs', type=int, default=5)
+    args = arg_parser.parse_args()
+
+    work = tempfile.mkdtemp()
+    env = dict(os.environ)
+    env['PYTHONPATH'] = root
+    env['MWX_SOCKET'] = os.path.join(work, 'mwx.sock')
+
+    # a copy of the file's directory, for the file's includes
+    directory = os.path.join(work, 'files')
+    shutil.copytree(os.path.dirname(os.path.abspath(args.file)), directory)
+    filename = os.path.join(directory, os.path.basename(args.file))
+
+    server = subprocess.Popen([sys.executable, mwx, 'serve'], env=env,
+                              stdout=open(os.devnull, 'w'),
+                              stderr=open(os.devnull, 'w'))
+    try:
+        while not os.path.exists(env['MWX_SOCKET']):
+            time.sleep(0.05)
+
+        expected = run(['-x', filename], env)[1]
+
+        def best(edit=False):
+            times = []
+            for i in range(args.runs):
+                if edit:
+                    with open(filename, 'a') as f:
+                        f.write("\n// edit %d\n" % i)
+                elapsed, output = run(['client', '-x', filename], env)
+                if output != expected:
+                    print "client output differs from mwx -x"
+                    sys.exit(1)
+                times.append(elapsed)
+            return min(times)
+
+        # the first request fills the server's memo
+        run(['client', '-x', filename], env)
+
+        timings = [("in-process", min([run(['-x', filename], env)[0]
+                                       for i in range(args.runs)])),
+                   ("client", best()),
+                   ("client, edited", best(edit=True))]
+
+        from StringIO import StringIO
+        from mwx.server import run_client
+
+        def request():
+            tic = time.time()
+            run_client(['-x', filename], StringIO(), StringIO(),
+                       env['MWX_SOCKET'])
+            return time.time() - tic
+
+        timings.append(("request", min([request() for i in range(args.runs)])))
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(work)
+
+    for label, t in timings:
+        print "%-16s %9.1fms" % (label, 1000 * t)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""Compare parsing a significant-whitespace document with parsing the same
+   document written with braces.
+
+   Builds an experiment in both flavors of the syntax (protocols, blocks and
+   trials, a task system with states, if actions and python code), and
+   times, for each parser engine:
+
+     braces        MWXParser() on the brace version
+     indentation   MWXParser(significant_whitespace=True) on the indented
+                   version, which is rewritten into braces first (see
+                   mwx.indentation)
+
+   and the rewrite on its own.  Both versions must build the same tree.
+
+   usage: bench_sigwhite.py [-n REPEAT] [-s SCALE]
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mwx.parser import MWXParser
+from mwx.indentation import IndentedText
+
+
+def trial(i, indented):
+    if indented:
+        return ['trial["Trial %d", nsamples = 10]:' % i,
+                '    wait(%dms)' % (100 + i),
+                '    if x > %d:' % i,
+                '        report("x: $x")',
+                '        x = (x + 1) * 2',
+                '    wait(50ms)']
+    return ['trial["Trial %d", nsamples = 10] {' % i,
+            '    wait(%dms)' % (100 + i),
+            '    if x > %d {' % i,
+            '        report("x: $x")',
+            '        x = (x + 1) * 2',
+            '    }',
+            '    wait(50ms)',
+            '}']
+
+
+def state(i, indented):
+    if indented:
+        return ['state["State %d"]:' % i,
+                '    actions:',
+                '        report("state %d")' % i,
+                '        wait(100ms)',
+                '    transitions:',
+                '        timer_expired(t) -> "State %d"' % (i + 1),
+                '        always -> yield']
+    return ['state["State %d"] {' % i,
+            '    report("state %d")' % i,
+            '    wait(100ms)',
+            '} transition {',
+            '    timer_expired(t) -> "State %d"' % (i + 1),
+            '    always -> yield',
+            '}']
+
+
+def python_action(indented):
+    code = ['    s = []',
+            '    for i in range(0, 10, 2):',
+            '        s.append(i)']
+    if indented:
+        return ['python("""'] + code + ['""")']
+    return ['python {'] + code + ['}']
+
+
+def container(header, children, indented):
+    lines = [header + (':' if indented else ' {')]
+    for line in children:
+        lines.append('    ' + line)
+    if not indented:
+        lines.append('}')
+    return lines
+
+
+def document(scale, indented):
+    lines = []
+    for p in range(scale):
+        blocks = []
+        for b in range(4):
+            trials = []
+            for t in range(4):
+                trials.extend(trial(t, indented))
+            blocks.extend(container('block["Block %d", nsamples = 2]' % b,
+                                    trials, indented))
+            blocks.append('')
+
+        states = []
+        for s in range(6):
+            states.extend(state(s, indented))
+        system = container('task_system["Task %d"]' % p, states, indented)
+
+        body = blocks + python_action(indented) + system
+        lines.extend(container('protocol["Protocol %d"]' % p, body, indented))
+    return "\n".join(container('experiment["Benchmark"]', lines,
+                               indented)) + "\n"
+
+
+def best_time(f, repeat):
+    best = None
+    for i in range(repeat):
+        tic = time.time()
+        f()
+        elapsed = time.time() - tic
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+# foreign code keeps its final newline in brace blocks only
+normalize = re.compile(r"\n\n(?=</action>)")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('-n', '--repeat', type=int, default=5)
+    arg_parser.add_argument('-s', '--scale', type=int, default=10,
+                            help='number of protocols in the document')
+    args = arg_parser.parse_args()
+
+    braces = document(args.scale, False)
+    indented = document(args.scale, True)
+
+    print "%d lines (%d with braces)" % (indented.count("\n"),
+                                         braces.count("\n"))
+    print "%-24s %12s %8s" % ("", "time", "ratio")
+
+    rewrite = best_time(lambda: IndentedText(indented), args.repeat)
+    print "%-24s %10.2fms" % ("rewrite", 1000 * rewrite)
+
+    for engine in ("pyparsing", "fast"):
+        brace_parser = MWXParser(engine=engine)
+        indented_parser = MWXParser(engine=engine, significant_whitespace=True)
+
+        expected = brace_parser.parse_document(braces).to_xml()
+        result = indented_parser.parse_document(indented).to_xml()
+        if normalize.sub("\n", result) != normalize.sub("\n", expected):
+            print "different trees from the %s engine" % engine
+            sys.exit(1)
+
+        t_braces = best_time(lambda: brace_parser.parse_document(braces),
+                             args.repeat)
+        t_indented = best_time(lambda: indented_parser.parse_document(indented),
+                               args.repeat)
+
+        print "%-24s %10.2fms" % (engine + " braces", 1000 * t_braces)
+        print "%-24s %10.2fms %7.2fx" % (engine + " indentation",
+                                         1000 * t_indented,
+                                         t_indented / t_braces)
+
+
+if __name__ == '__main__':
+    main()
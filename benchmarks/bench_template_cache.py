@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""Compare expanding repeated template calls with and without the
+   expansion cache.
+
+   Builds documents of TRIALS trials, each calling a template with one of
+   a few durations (as numbers); the template holds a call of another template, a
+   template conditional on its argument, and an expression, so each
+   expansion has references to resolve and expressions to simplify.
+   Parses each with the fast engine and times resolve_templates over the
+   parsed nodes:
+
+     uncached   an ExpansionCache with max_entries = 0: every call is
+                expanded
+     cached     an ExpansionCache of the default size
+
+   Both must give the same tree.  The cache's stats are printed for the
+   cached run.
+
+   usage: bench_template_cache.py [-n REPEAT] [-t TRIALS ...]
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mwx.ast import *
+from mwx.ast.templates import (ExpansionCache, resolve_templates,
+                               default_expansion_cache_size)
+from mwx.parser import MWXParser
+
+
+TEMPLATES = '''
+macro reward() {
+    report("reward")
+    wait(5ms)
+}
+macro macro_for_nesting(dur) {
+    wait(@dur)
+    @reward
+    @if (@dur > 150){
+        report("long")
+    } else {
+        report("short")
+    }
+    stimulus["s", type="image", elevation=@dur * 2]
+}
+'''
+
+
+def document(trials):
+    return TEMPLATES + 'protocol P {\n%s}\n' % ''.join(
+        ['    trial["T%d"] {\n'
+         '        @macro_for_nesting(%d)\n'
+         '    }\n' % (i, 100 * (1 + i % 3))
+         for i in range(trials)])
+
+
+def expand(text, max_entries):
+    expansion_cache = ExpansionCache(max_entries)
+    nodes = MWXParser(engine='fast').parse_preprocessed(text)
+    tic = time.time()
+    nodes = resolve_templates(nodes, expansion_cache=expansion_cache)
+    return time.time() - tic, nodes, expansion_cache.stats()
+
+
+def best_time(text, max_entries, repeat):
+    runs = [expand(text, max_entries) for i in range(repeat)]
+    return min([run[0] for run in runs]), runs[-1][2]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('-n', '--repeat', type=int, default=3)
+    arg_parser.add_argument('-t', '--trials', type=int, nargs='+',
+                            default=[100, 1000, 5000])
+    args = arg_parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    max_entries = default_expansion_cache_size
+
+    print "%-8s %12s %12s   %s" % ("trials", "uncached", "cached", "stats")
+    for trials in args.trials:
+        text = document(trials)
+        if (RootNode(expand(text, 0)[1]).to_xml() !=
+            RootNode(expand(text, max_entries)[1]).to_xml()):
+            print "different trees for %d trials" % trials
+            sys.exit(1)
+
+        t_uncached = best_time(text, 0, args.repeat)[0]
+        (t_cached, stats) = best_time(text, max_entries, args.repeat)
+        print "%-8d %10.0fms %10.0fms   %d hits, %d misses, %d evictions" % (
+            trials, 1000 * t_uncached, 1000 * t_cached, stats['hits'],
+            stats['misses'], stats['evictions'])
+
+
+if __name__ == '__main__':
+    main()
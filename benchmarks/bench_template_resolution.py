@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""Compare resolving nested template calls with the TemplateResolver's
+   worklist, with the loop TemplateTreeRewriter ran before it, and from
+   template bodies prepared ahead of the calls.
+
+   Builds documents of chains of DEPTH templates, each holding an action,
+   a stimulus and a call of the next, and a protocol of TRIALS trials calling
+   the first.  Parses each with the fast engine and times resolve_templates
+   over the parsed nodes, with the expansion cache off:
+
+     rewalk     TemplateTreeRewriter.rewrite_tree as it was before the
+                resolver (rebuilt here): the tree is walked for references
+                until none are left, and then walked again to simplify
+                expressions, at every level of the chain, expansions of the
+                levels below included
+     worklist   TemplateTreeRewriter.rewrite_tree
+     prepared   TemplateTreeRewriter.rewrite_tree, with the templates
+                prepared (TemplateDefinition.prepare) as they're found, so
+                that each call of the first is a copy of the whole chain
+
+   The first two leave the templates unprepared.  All must give the same
+   tree.
+
+   usage: bench_template_resolution.py [-n REPEAT] [-t TRIALS]
+                                       [-d DEPTH ...]
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mwx.ast import *
+from mwx.ast.templates import (TemplateDefinition, TemplateTreeRewriter,
+                               TemplateReferenceRewriter,
+                               ExpressionSimplifier, ExpansionCache,
+                               resolve_templates,
+                               MaximumTreeRewritesExceededException,
+                               UnresolvedTemplateReferencesException)
+from mwx.parser import MWXParser
+
+
+PREPARE = TemplateDefinition.prepare
+
+
+def document(depth, trials):
+    levels = ''.join(['macro level%d(x) {\n'
+                      '    report("level %d: $x")\n'
+                      '    stimulus["s%d", type="image", elevation=@x * 2]\n'
+                      '    @level%d(%d)\n'
+                      '}\n' % (i, i, i, i + 1, i) for i in range(depth)])
+    last = 'macro level%d(x) {\n    wait(@x)\n}\n' % depth
+    return levels + last + 'protocol P {\n%s}\n' % ''.join(
+        ['    trial["T%d"] {\n'
+         '        @level0(%d)\n'
+         '    }\n' % (i, i) for i in range(trials)])
+
+
+def rewalk_rewrite_tree(self, maximum_rewrites=15):
+    """TemplateTreeRewriter.rewrite_tree, as it was before the resolver"""
+    self.find_templates()
+
+    rewriter = TemplateReferenceRewriter(self.tree, self.templates)
+
+    unresolved = rewriter.walk()
+    self.tree = rewriter.tree
+
+    count = 0
+    while(len(unresolved) > 0 and count < maximum_rewrites):
+        unresolved = rewriter.walk()
+        count += 1
+
+    if count == maximum_rewrites:
+        raise MaximumTreeRewritesExceededException(count)
+
+    if len(unresolved) > 0:
+        raise UnresolvedTemplateReferencesException(unresolved)
+
+    simplifier = ExpressionSimplifier(self.tree)
+    simplifier.walk()
+
+    self.tree = simplifier.tree
+
+    if self.has_tmp_root_node:
+        self.tree = self.tree.children
+
+    return self.tree
+
+
+def unprepared(self, templates):
+    return False
+
+
+def expand(text, rewrite_tree, prepare):
+    worklist_rewrite_tree = TemplateTreeRewriter.rewrite_tree
+    TemplateTreeRewriter.rewrite_tree = rewrite_tree
+    TemplateDefinition.prepare = prepare
+    try:
+        nodes = MWXParser(engine='fast').parse_preprocessed(text)
+        tic = time.time()
+        nodes = resolve_templates(nodes,
+                                  expansion_cache=ExpansionCache(0))
+        return time.time() - tic, nodes
+    finally:
+        TemplateTreeRewriter.rewrite_tree = worklist_rewrite_tree
+        TemplateDefinition.prepare = PREPARE
+
+
+def best_time(text, rewrite_tree, prepare, repeat):
+    return min([expand(text, rewrite_tree, prepare)[0]
+                for i in range(repeat)])
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('-n', '--repeat', type=int, default=3)
+    arg_parser.add_argument('-t', '--trials', type=int, default=20)
+    arg_parser.add_argument('-d', '--depth', type=int, nargs='+',
+                            default=[10, 40, 90])
+    args = arg_parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    worklist = TemplateTreeRewriter.rewrite_tree
+
+    runs = [(rewalk_rewrite_tree, unprepared), (worklist, unprepared),
+            (worklist, PREPARE)]
+
+    print "%-8s %12s %12s %12s" % ("depth", "rewalk", "worklist", "prepared")
+    for depth in args.depth:
+        text = document(depth, args.trials)
+        trees = [RootNode(expand(text, rewrite_tree, prepare)[1]).to_xml()
+                 for (rewrite_tree, prepare) in runs]
+        if trees.count(trees[0]) != len(trees):
+            print "different trees for depth %d" % depth
+            sys.exit(1)
+
+        times = [best_time(text, rewrite_tree, prepare, args.repeat)
+                 for (rewrite_tree, prepare) in runs]
+        print "%-8d %10.0fms %10.0fms %10.0fms" % tuple(
+            [depth] + [1000 * t for t in times])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""Compare resolving template calls with each nested resolver copying the
+   templates in scope, as it did before TemplateScope, and with chained
+   scopes.
+
+   Builds documents defining MACROS value templates, and a trial template
+   holding a conditional on its argument and a reference to one of them,
+   called from CALLS trials, so each call resolves its expansion (and the
+   conditional's) with a resolver of its own.  Parses each with the fast
+   engine and times resolve_templates over the parsed nodes, with the
+   expansion cache off:
+
+     copied   each TemplateResolver copies the templates in scope into a
+              dict of its own
+     scoped   each TemplateResolver looks templates up in the scope it's
+              given, nesting a TemplateScope in it if it defines any
+
+   Both must give the same tree.
+
+   usage: bench_template_scopes.py [-n REPEAT] [-c CALLS] [-m MACROS ...]
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mwx.ast import *
+from mwx.ast import templates
+from mwx.ast.templates import (ExpansionCache, TemplateResolver,
+                               resolve_templates)
+from mwx.parser import MWXParser
+
+
+def document(macros, calls):
+    values = ''.join(['macro k%d = %d\n' % (i, i) for i in range(macros)])
+    return values + '''
+macro trial_template(name, n) {
+    trial[@name] {
+        @if (@n > 1){
+            report("more")
+        } else {
+            report("one")
+        }
+        stimulus["s", type="image", elevation=@k1]
+    }
+}
+protocol P {
+%s}
+''' % ''.join(['    @trial_template("T%d", %d)\n' % (i, i % 3)
+               for i in range(calls)])
+
+
+NESTED = TemplateResolver.nested
+
+
+def copied_scope(parent=None):
+    """A TemplateScope, as it was before: a copy of the templates given"""
+    if parent is None:
+        return {}
+    return dict(parent)
+
+
+def copying_nested(self, templates):
+    """TemplateResolver.nested, as it was before: each resolver copies the
+       templates in scope
+    """
+    resolver = NESTED(self, templates)
+    resolver.templates = copied_scope(templates)
+    resolver.scoped = True
+    return resolver
+
+
+def expand(text, scope):
+    chained_scope = templates.TemplateScope
+    templates.TemplateScope = scope
+    if scope is copied_scope:
+        TemplateResolver.nested = copying_nested
+    try:
+        nodes = MWXParser(engine='fast').parse_preprocessed(text)
+        tic = time.time()
+        nodes = resolve_templates(nodes,
+                                  expansion_cache=ExpansionCache(0))
+        return time.time() - tic, nodes
+    finally:
+        templates.TemplateScope = chained_scope
+        TemplateResolver.nested = NESTED
+
+
+def best_time(text, scope, repeat):
+    return min([expand(text, scope)[0] for i in range(repeat)])
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('-n', '--repeat', type=int, default=3)
+    arg_parser.add_argument('-c', '--calls', type=int, default=2000)
+    arg_parser.add_argument('-m', '--macros', type=int, nargs='+',
+                            default=[10, 100, 1000])
+    args = arg_parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    scoped = templates.TemplateScope
+
+    print "%-8s %12s %12s" % ("macros", "copied", "scoped")
+    for macros in args.macros:
+        text = document(macros, args.calls)
+        if (RootNode(expand(text, copied_scope)[1]).to_xml() !=
+            RootNode(expand(text, scoped)[1]).to_xml()):
+            print "different trees for %d macros" % macros
+            sys.exit(1)
+
+        t_copied = best_time(text, copied_scope, args.repeat)
+        t_scoped = best_time(text, scoped, args.repeat)
+        print "%-8d %10.0fms %10.0fms" % (macros, 1000 * t_copied,
+                                          1000 * t_scoped)
+
+
+if __name__ == '__main__':
+    main()
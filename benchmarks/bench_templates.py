@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""Compare expanding template calls from a compiled ExpansionPlan with
+   expanding them by walking the template body, as TemplateDefinition did
+   before.
+
+   Builds documents with CALLS calls of a trial template (a trial named
+   after an argument, holding actions that use the others, in properties,
+   strings and expressions), parses each with the fast engine, and times
+   resolve_templates over the parsed nodes:
+
+     walk   TemplateDefinition.__call__ as it was before the plan (rebuilt
+            here): the body, wrapped in a RootNode, is walked by a
+            SimpleReplacementTreeWalker and then a TemplateTreeRewriter.
+            It rewrites the body in place, so every call after the first
+            gives the first call's nodes back
+     plan   TemplateDefinition.__call__
+
+   The plan must give the tree the walk would, were the walk given a fresh
+   copy of the body for each call.
+
+   usage: bench_templates.py [-n REPEAT] [-c CALLS ...]
+"""
+
+import os
+import sys
+import time
+import cPickle
+import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mwx.ast import *
+from mwx.ast.templates import (TemplateDefinition, TemplateTreeRewriter,
+                               SimpleReplacementTreeWalker, resolve_templates)
+from mwx.parser import MWXParser
+
+
+TEMPLATE = '''
+macro trial_template(name, dur, gain) {
+    trial[@name] {
+        wait(@dur)
+        report("@name: gain $x")
+        stimulus["@name stim", type="image", elevation=@gain * 2]
+    }
+}
+'''
+
+
+def document(calls):
+    return TEMPLATE + 'protocol P {\n%s}\n' % ''.join(
+        ['    @trial_template("T%d", %dms, %d)\n' % (i, 10 + i % 90, i % 7)
+         for i in range(calls)])
+
+
+def walk_call(self, args=[], templates={}, resolver=None):
+    """TemplateDefinition.__call__, as it was before the ExpansionPlan"""
+
+    body = self.body
+
+    if args is None or len(args) is not len(self.args):
+        raise Exception("Incorrect number of arguments to template")
+
+    replacement_table = dict(zip(self.args, args))
+
+    body_root = RootNode(children=body)
+
+    walker = SimpleReplacementTreeWalker(body_root, replacement_table)
+    walker.walk()
+
+    new_tree = walker.tree
+
+    template_rewriter = TemplateTreeRewriter(new_tree, templates=templates,
+                                             resolver=resolver)
+    template_rewriter.rewrite_tree()
+    new_tree = template_rewriter.tree.children
+
+    if len(new_tree) == 1:
+        new_tree = new_tree[0]
+
+    return new_tree
+
+
+def fresh_walk_call(self, args=[], templates={}, resolver=None):
+    """walk_call, on a fresh copy of the body each time"""
+    body = self.body
+    self.body = cPickle.loads(cPickle.dumps(body, 1))
+    try:
+        return walk_call(self, args, templates, resolver)
+    finally:
+        self.body = body
+
+
+def expand(text, call):
+    plan_call = TemplateDefinition.__call__
+    TemplateDefinition.__call__ = call
+    try:
+        nodes = MWXParser(engine='fast').parse_preprocessed(text)
+        tic = time.time()
+        nodes = resolve_templates(nodes)
+        return time.time() - tic, nodes
+    finally:
+        TemplateDefinition.__call__ = plan_call
+
+
+def best_time(text, call, repeat):
+    return min([expand(text, call)[0] for i in range(repeat)])
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('-n', '--repeat', type=int, default=3)
+    arg_parser.add_argument('-c', '--calls', type=int, nargs='+',
+                            default=[1000, 5000, 20000])
+    args = arg_parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    print "%-8s %12s %12s %12s" % ("calls", "walk", "plan", "us/call")
+    for calls in args.calls:
+        text = document(calls)
+        if (RootNode(expand(text, fresh_walk_call)[1]).to_xml() !=
+            RootNode(expand(text, TemplateDefinition.__call__)[1]).to_xml()):
+            print "different trees for %d calls" % calls
+            sys.exit(1)
+
+        t_walk = best_time(text, walk_call, args.repeat)
+        t_plan = best_time(text, TemplateDefinition.__call__, args.repeat)
+        print "%-8d %10.0fms %10.0fms %12.1f" % (calls, 1000 * t_walk,
+                                                1000 * t_plan,
+                                                1e6 * t_plan / calls)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""Compare the TreeWalker's explicit-stack walk with the recursive walk it
+   replaced.
+
+   Walks, with a walker triggered on every node (as the generation passes
+   are), each of:
+
+     wide   a node with WIDTH children, each holding a property and a
+            child of its own
+     deep   a chain of DEPTH nodes, each the only child of the one before
+
+   and times:
+
+     recursive   _walk_recursive, as it was before the explicit stack
+                 (rebuilt here), which looks each child's index up with
+                 children.index(child); it needs the recursion limit raised
+                 past DEPTH (as mwx.parser does) for the deep tree
+     stack       TreeWalker.walk
+
+   Both must visit the same nodes, with the same indices, in the same order.
+   The stack costs more per node than recursion on the deep tree (about 1.6
+   times as much), and much less on the wide one, where the recursive walk
+   takes time quadratic in WIDTH.
+
+   usage: bench_tree_walker.py [-n REPEAT] [-w WIDTH ...] [-d DEPTH ...]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mwx.ast import *
+from mwx.ast.ast import TreeWalker
+
+
+class Visits(TreeWalker):
+
+    def __init__(self, tree):
+        TreeWalker.__init__(self, tree)
+        self.visits = []
+
+    def trigger(self, node):
+        return isinstance(node, MWASTNode)
+
+    def action(self, node, parent, parent_ctx, index):
+        self.visits.append((node, index))
+        return None
+
+
+class RecursiveVisits(Visits):
+    """Visits, walked as TreeWalker walked before the explicit stack"""
+
+    def walk(self):
+        self.reset()
+        self._walk_recursive(self.tree)
+        return self.result
+
+    def _walk_recursive(self, node, parent=None, parent_context=None,
+                        index=None):
+
+        returned_node = None
+
+        if(self.trigger(node)):
+            returned_node = self.action(node, parent, parent_context, index)
+
+        if (not self.continue_after_rewrite and returned_node is not None):
+            return
+
+        if returned_node is not None:
+            node = returned_node
+
+        if not self.should_descend(node):
+            return
+
+        if getattr(node, 'props', False):
+            for k in node.props.keys():
+                p = node.props[k]
+                self._walk_recursive(p, node, MWASTNode.PROPERTY_CTX, k)
+
+        if getattr(node, 'children', False):
+            for child in node.children:
+                c = node.children.index(child)
+                self._walk_recursive(child, node, MWASTNode.CHILD_CTX, c)
+
+
+def wide(width):
+    return MWASTNode('block', 'Block',
+                     children=[MWASTNode('trial', 'Trial %d' % i,
+                                         props={'nsamples': i},
+                                         children=[Action('wait', '100ms')])
+                               for i in range(width)])
+
+
+def deep(depth):
+    node = Action('wait', '100ms')
+    for i in range(depth):
+        node = MWASTNode('block', children=[node])
+    return node
+
+
+def best_time(f, repeat):
+    best = None
+    for i in range(repeat):
+        tic = time.time()
+        f()
+        elapsed = time.time() - tic
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def compare(shape, size, tree, repeat):
+    recursive = RecursiveVisits(tree)
+    stack = Visits(tree)
+    recursive.walk()
+    stack.walk()
+    if recursive.visits != stack.visits:
+        print "different visits for %s %d" % (shape, size)
+        sys.exit(1)
+
+    t_recursive = best_time(lambda: RecursiveVisits(tree).walk(), repeat)
+    t_stack = best_time(lambda: Visits(tree).walk(), repeat)
+    print "%-6s %-8d %10d %10.2fms %10.2fms %10.2f" % (
+        shape, size, len(stack.visits), 1000 * t_recursive, 1000 * t_stack,
+        1e6 * t_stack / len(stack.visits))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('-n', '--repeat', type=int, default=3)
+    arg_parser.add_argument('-w', '--width', type=int, nargs='+',
+                            default=[1000, 10000])
+    arg_parser.add_argument('-d', '--depth', type=int, nargs='+',
+                            default=[1000, 10000])
+    args = arg_parser.parse_args()
+
+    sys.setrecursionlimit(10 ** 6)
+
+    print "%-6s %-8s %10s %12s %12s %10s" % ("tree", "size", "nodes",
+                                             "recursive", "stack",
+                                             "us/node")
+    for width in args.width:
+        compare("wide", width, wide(width), args.repeat)
+    for depth in args.depth:
+        compare("deep", depth, deep(depth), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""Compare running the MWXML import rewrites as fused passes with running
+   them one walk each.
+
+   Builds MWXML documents of growing size, laid out as the MWorks editor
+   saves them (folders of variables and stimuli, protocols of blocks and
+   trials holding generic actions between action markers, and task systems
+   of task_system_states holding actions and transitions between their
+   markers), parses each into a tree of MWASTNodes, and times the import
+   rewrites over it:
+
+     sequential   each registered pass walking the whole tree in turn, as
+                  do_registered_xml_import_rewrites did before the
+                  PassManager
+     fused        do_registered_xml_import_rewrites
+
+   along with the whole import (MWXMLParser.parse_string, without templates)
+   for scale.  Both must give the same tree.
+
+   usage: bench_xml_import.py [-n REPEAT] [-s STATES ...]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mwx.ast import *
+from mwx.ast.xml_import import registry, do_registered_xml_import_rewrites
+from mwx.ast.passes import PassManager
+from mwx.parser import MWXMLParser
+
+
+def action_xml(i):
+    kind = i % 4
+    if kind == 0:
+        return ('<action tag="Wait %d" type="wait" duration="%dms" '
+                'duration_units="ms" description=""/>' % (i, 100 + i))
+    if kind == 1:
+        return ('<action tag="Report %d" type="report" message="x is $x" '
+                'full_name="Report %d"/>' % (i, i))
+    if kind == 2:
+        return ('<action tag="Assign %d" type="assignment" variable="x" '
+                'value="x + %d" interruptible="YES"/>' % (i, i))
+    return ('<action tag="Start %d" type="start_timer" timer="T" '
+            'duration="2" duration_units="s"/>' % i)
+
+
+def state_xml(i, states):
+    target = 'State %d' % ((i + 1) % states)
+    return ('<task_system_state tag="State %d" interruptible="YES" '
+            'description="">'
+            '<action_marker _unmoveable="1" tag="Actions"/>'
+            '%s%s'
+            '<transition_marker _unmoveable="1" tag="Transitions"/>'
+            '<transition type="timer_expired" tag="If T expired" '
+            'target="%s" timer="T"/>'
+            '<transition type="conditional" tag="If x" condition="x #GT 3" '
+            'target="%s"/>'
+            '<transition type="yield" tag="Return"/>'
+            '</task_system_state>' % (i, action_xml(i), action_xml(i + 1),
+                                      target, target))
+
+
+def document(states):
+    variables = ''.join(['<variable tag="v%d" scope="global" logging="when_'
+                         'changed" default_value="0" type="integer"/>' % v
+                         for v in range(max(1, states // 10))])
+    stimuli = ''.join(['<stimulus type="image_file" tag="s%d" '
+                       'path="images/%d.png" x_size="10" y_size="10"/>'
+                       % (s, s) for s in range(max(1, states // 10))])
+    trials = ''.join(['<trial tag="Trial %d" nsamples="10" '
+                      'sampling_method="cycles" interruptible="YES">'
+                      '<action_marker _unmoveable="1" tag="Actions"/>'
+                      '%s%s</trial>' % (t, action_xml(t), action_xml(t + 2))
+                      for t in range(max(1, states // 4))])
+    system = ''.join([state_xml(s, states) for s in range(states)])
+    return ('<monkeyml version="1.0">'
+            '<folder tag="Variables"><variables tag="Vars">%s</variables>'
+            '</folder>'
+            '<stimuli tag="Stimuli">%s</stimuli>'
+            '<experiment tag="Experiment" full_name="" description="">'
+            '<protocol tag="Protocol" interruptible="YES">'
+            '<block tag="Block" nsamples="1" sampling_method="cycles">'
+            '%s</block>'
+            '<task_system tag="Task" interruptible="YES">%s</task_system>'
+            '</protocol></experiment></monkeyml>'
+            % (variables, stimuli, trials, system))
+
+
+def raw_tree(xml):
+    from xml.etree import ElementTree
+    parser = MWXMLParser()
+    return RootNode(children=[parser.xml_element_to_ast(e)
+                              for e in ElementTree.fromstring(xml)])
+
+
+def sequential(tree):
+    """do_registered_xml_import_rewrites, as it was before the PassManager"""
+    for rewriter_class in registry:
+        rewriter = rewriter_class(tree)
+        rewriter.walk()
+        tree = rewriter.tree
+    return tree
+
+
+def best_time(f, setup, repeat):
+    best = None
+    for i in range(repeat):
+        x = setup()
+        tic = time.time()
+        f(x)
+        elapsed = time.time() - tic
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('-n', '--repeat', type=int, default=3)
+    arg_parser.add_argument('-s', '--states', type=int, nargs='+',
+                            default=[1000, 10000, 50000])
+    args = arg_parser.parse_args()
+
+    print "walks: %d sequential, %d fused" % (
+        len(registry), len(PassManager(registry).stages))
+    print "%-8s %8s %12s %12s %12s" % ("states", "MB", "sequential",
+                                       "fused", "import")
+    for states in args.states:
+        xml = document(states)
+        if (sequential(raw_tree(xml)).to_mwx() !=
+            do_registered_xml_import_rewrites(raw_tree(xml)).to_mwx()):
+            print "different trees for %d states" % states
+            sys.exit(1)
+
+        t_sequential = best_time(sequential, lambda: raw_tree(xml),
+                                 args.repeat)
+        t_fused = best_time(do_registered_xml_import_rewrites,
+                            lambda: raw_tree(xml), args.repeat)
+        t_import = best_time(lambda x: MWXMLParser().parse_string(
+                                 x, process_templates=False),
+                             lambda: xml, args.repeat)
+        print "%-8d %8.1f %10.0fms %10.0fms %10.0fms" % (
+            states, len(xml) / 1e6, 1000 * t_sequential, 1000 * t_fused,
+            1000 * t_import)
+
+
+if __name__ == '__main__':
+    main()
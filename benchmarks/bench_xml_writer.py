@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""Compare writing the XML of a document with the streaming writer and with
+   string concatenation.
+
+   Builds documents whose XML grows to SIZE megabytes (the same protocol,
+   of trials, actions, expressions and a task system, repeated), and times
+   each of:
+
+     concatenation   the node-by-node `xml += ...` that to_xml used before
+                     the writer (rebuilt here), then written to a file
+     to_xml          ''.join(iter_xml()), then written to a file
+     write_xml       RootNode.write_xml, straight to the file
+
+   each in a process of its own, reporting the time per megabyte (which
+   should stay flat as the documents grow) and how much the peak RSS grew
+   while writing (which, for write_xml, should stay flat too).  The output
+   goes to /dev/null; all three must produce the same XML.
+
+   usage: bench_xml_writer.py [-n REPEAT] [-s SIZE ...]
+"""
+
+import os
+import sys
+import time
+import resource
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mwx.ast import *
+
+methods = ('concatenation', 'to_xml', 'write_xml')
+
+
+def trial(i):
+    condition = MWBinaryExpression('>', MWVariableReference('x'), i)
+    value = MWBinaryExpression('*', MWVariableReference('x'), 2)
+    return MWASTNode('trial', 'Trial %d' % i, props={'nsamples': 10},
+                     children=[Action('wait', '%dms' % (100 + i)),
+                               Action('report', 'x < $x & y > $y'),
+                               AssignmentAction('x', value),
+                               MWASTNode('if', props={'condition': condition},
+                                         children=[Action('wait', '50ms')]),
+                               ForeignCodeAction('python', 'x = [1, 2]\n')])
+
+
+def state(i):
+    return State('State %d' % i,
+                 actions=[Action('report', 'state %d' % i)],
+                 transitions=[Transition(MWFunctionCall('timer_expired',
+                                         [MWVariableReference('t')]),
+                                         'State %d' % (i + 1))])
+
+
+def protocol():
+    blocks = [MWASTNode('block', 'Block %d' % b, props={'nsamples': 2},
+                        children=[trial(t) for t in range(10)])
+              for b in range(10)]
+    system = MWASTNode('task_system', 'Task',
+                       children=[state(s) for s in range(10)])
+    return MWASTNode('protocol', 'Protocol', children=blocks + [system])
+
+
+def document(megabytes):
+    # the same protocol, over and over: the tree stays small, however long
+    # its XML
+    p = protocol()
+    n = max(1, int(megabytes * 1e6 / len(p.to_xml())))
+    return RootNode(children=[p] * n)
+
+
+def concatenated_xml(node):
+    """MWASTNode.to_xml, as it was before the writer"""
+    if not isinstance(node, MWASTNode):
+        return str(node)
+    if node.__class__.to_xml.im_func is not MWASTNode.to_xml.im_func:
+        return node.to_xml()
+
+    node.derive_tag()
+    xml = "<%s " % node.obj_type
+    for (key, val) in node.props.items():
+        xml += ' %s=%s' % (key, quote_once(escape(str(val))))
+    xml += ">\n"
+    for child in node.children or []:
+        xml += concatenated_xml(child) + "\n"
+    xml += "</%s>" % node.obj_type
+    return xml
+
+
+def write(method, root, f):
+    if method == 'concatenation':
+        xml = "<mwxml>"
+        for child in root.children:
+            xml += concatenated_xml(child) + "\n"
+        f.write(xml + "</mwxml>")
+    elif method == 'to_xml':
+        f.write(root.to_xml())
+    else:
+        root.write_xml(f)
+
+
+def peak_rss():
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run(method, megabytes, repeat):
+    """Time one method, in this process; prints seconds and RSS growth"""
+    root = document(megabytes)
+    best = None
+    before = peak_rss()
+    for i in range(repeat):
+        with open(os.devnull, 'w') as f:
+            tic = time.time()
+            write(method, root, f)
+            elapsed = time.time() - tic
+        if best is None or elapsed < best:
+            best = elapsed
+    print best, peak_rss() - before
+
+
+def check():
+    root = document(0.5)
+
+    class Collect(object):
+        def __init__(self):
+            self.pieces = []
+
+        def write(self, s):
+            self.pieces.append(s)
+
+    outputs = []
+    for method in methods:
+        f = Collect()
+        write(method, root, f)
+        outputs.append(''.join(f.pieces))
+    if outputs.count(outputs[0]) != len(outputs):
+        print "different XML from the methods"
+        sys.exit(1)
+    return len(outputs[0])
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('-n', '--repeat', type=int, default=3)
+    arg_parser.add_argument('-s', '--size', type=float, nargs='+',
+                            default=[1, 10, 100],
+                            help='megabytes of XML')
+    arg_parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.run:
+        run(args.run, args.size[0], args.repeat)
+        return
+
+    check()
+
+    print "%-8s %-14s %10s %10s %12s" % ("MB", "method", "time",
+                                         "ms/MB", "RSS growth")
+    for megabytes in args.size:
+        for method in methods:
+            out = subprocess.check_output([sys.executable, __file__,
+                                           '--run', method,
+                                           '-s', str(megabytes),
+                                           '-n', str(args.repeat)])
+            elapsed, growth = out.split()
+            elapsed = float(elapsed)
+            print "%-8g %-14s %9.2fs %10.1f %10.1fMB" % (
+                megabytes, method, elapsed, 1000 * elapsed / megabytes,
+                int(growth) / 1e6)
+
+
+if __name__ == '__main__':
+    main()
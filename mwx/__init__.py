@@ -1,4 +1,7 @@
+__version__ = 'dev'
+
+# mwx.parser is left to be imported when it is needed, to keep importing
+# mwx cheap
 import ast
-import parser
 
 from mw_generation import generate_mw_objects
@@ -1,5 +1,5 @@
-from xml.sax.saxutils import escape
 from copy import deepcopy, copy
+import heapq
 import re
 
 PRIMARY_ARG_STRING = "arg"
@@ -8,8 +8,116 @@ from mwx.constants import shorthand_actions
 isiterable = lambda x: getattr(x, "__iter__", False)
 
 tab = "    "
-use_declaration_style_syntax = True
-use_declaration_style_syntax_for_states = True
+
+
+def escape(data):
+    """Escape &, < and > in a string of data, like xml.sax.saxutils.escape
+       (which is slow to import: it pulls in urllib)
+    """
+    return data.replace("&", "&amp;").replace(">", "&gt;").replace("<", "&lt;")
+
+
+class EmptyProps(dict):
+    """The empty property dict shared by every node without properties.
+       It can't be added to: MWASTNode.set_prop replaces it with a dict of
+       the node's own.  A copy of it is an ordinary (empty) dict, to be
+       filled in; a deep copy, or an unpickled one, is the shared dict
+       itself.
+    """
+
+    __slots__ = ()
+
+    def __setitem__(self, key, value):
+        raise TypeError("the shared empty props can't be modified; "
+                        "use MWASTNode.set_prop")
+
+    def update(self, *args, **kwargs):
+        raise TypeError("the shared empty props can't be modified; "
+                        "use MWASTNode.set_prop")
+
+    def setdefault(self, key, default=None):
+        raise TypeError("the shared empty props can't be modified; "
+                        "use MWASTNode.set_prop")
+
+    def __copy__(self):
+        return {}
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return 'empty_props'
+
+
+# the props and children of nodes that have none
+empty_props = EmptyProps()
+empty_children = ()
+
+class EditLog(object):
+    """The nodes edited through the node methods, in order, by id, so that
+       the index of a tree can tell whether an edit since it was built
+       touched a node of its own (edits to other trees leave it be).  Only
+       the last max_edits are remembered: an index older than those is
+       rebuilt.
+    """
+
+    __slots__ = ('start', 'edits')
+
+    max_edits = 2 ** 16
+
+    def __init__(self):
+        # the version of the first edit in edits
+        self.start = 0
+        self.edits = []
+
+    def version(self):
+        return self.start + len(self.edits)
+
+    def note(self, node):
+        edits = self.edits
+        edits.append(id(node))
+        if len(edits) > self.max_edits:
+            half = len(edits) // 2
+            del edits[:half]
+            self.start += half
+
+    def forget(self):
+        """Forget the edits so far, so that every index is rebuilt"""
+        self.start += len(self.edits) + 1
+        self.edits = []
+
+    def edited_since(self, version, nodes):
+        """Whether a node in nodes (a dict by id) has been edited since
+           version (or the edits since then have been forgotten)
+        """
+        if version < self.start:
+            return True
+        edits = self.edits
+        for e in range(version - self.start, len(edits)):
+            if edits[e] in nodes:
+                return True
+        return False
+
+
+# the edits made to trees through the node methods: to the nodes in them
+# (structure_edits), and to their tags (tag_edits).  A RootNode rebuilds its
+# indexes when a node of its tree is among those edited since it built them.
+structure_edits = EditLog()
+tag_edits = EditLog()
+
+
+def tree_changed(node=None):
+    """Note an edit made to a node without the node methods (to its props
+       dict or children list directly), so that the index of a RootNode
+       with the node in its tree is rebuilt; with no node, every index is
+       rebuilt
+    """
+    if node is None:
+        structure_edits.forget()
+        tag_edits.forget()
+    else:
+        structure_edits.note(node)
+        tag_edits.note(node)
 
 
 def flatten(x):
@@ -48,6 +156,45 @@ def quote_once(x):
         return '"' + x + '"'
 
 
+# the XML of the property values written so far (see xml_attribute); it
+# starts over when it reaches xml_attribute_table_size entries
+xml_attribute_table = {}
+xml_attribute_table_size = 10000
+
+
+def xml_attribute(val):
+    """The XML of a property value: str(val), escaped and quoted.  Property
+       values repeat a lot within a document (types, durations, conditions),
+       so each is only escaped once, and looked up in xml_attribute_table
+       after that.
+    """
+    s = str(val)
+    xml = xml_attribute_table.get(s)
+    if xml is None:
+        xml = quote_once(escape(s))
+        if len(xml_attribute_table) >= xml_attribute_table_size:
+            xml_attribute_table.clear()
+        xml_attribute_table[s] = xml
+    return xml
+
+
+def write_chunks(chunks, f, buffer_size=65536):
+    """Write an iterable of strings to a file object, joined into writes of
+       about buffer_size characters
+    """
+    buf = []
+    size = 0
+    for chunk in chunks:
+        buf.append(chunk)
+        size += len(chunk)
+        if size >= buffer_size:
+            f.write(''.join(buf))
+            buf = []
+            size = 0
+    if buf:
+        f.write(''.join(buf))
+
+
 def mwx_properties_block(props):
 
     if len(props.keys()) == 0:
@@ -69,7 +216,7 @@ def mwx_properties_block(props):
     return output_string
 
 
-def mwx_declaration(obj_type, props, declaration_style_syntax=use_declaration_style_syntax):
+def mwx_declaration(obj_type, props, declaration_style_syntax=True):
 
     output_string = obj_type
 
@@ -87,22 +234,6 @@ def mwx_declaration(obj_type, props, declaration_style_syntax=use_declaration_st
     return output_string
 
 
-def mwx_child_block(children, tablevel=0):
-
-    if len(children) == 0:
-        return ''
-
-    output_string = '{\n'
-
-    tabs = tab * tablevel
-
-    output_string += ''.join([to_mwx(child, tablevel + 1) for child in children])
-
-    output_string += tabs + '}'
-
-    return output_string
-
-
 def to_mwx(obj, tablevel=0, quote_strings=True, mw_type=None):
     """Convert an object to a string in MWX format.  If the object supplies a
        to_mwx method, this is called.  Strings are simply quoted, and lists of
@@ -152,10 +283,131 @@ def to_infix(obj, quote_strings=False):
     return str(obj)
 
 
+class MWXStyle(object):
+    """Options for writing MWX (see MWXWriter):
+
+         declaration_style_syntax    write `type tag[...]` rather than
+                                     `type["tag", ...]`, for tags without
+                                     whitespace, $ or @ in them
+         declaration_style_syntax_for_states
+                                     the same, for states
+         tab                         the indentation of each level
+    """
+
+    def __init__(self, declaration_style_syntax=True,
+                 declaration_style_syntax_for_states=True, tab=tab):
+        self.declaration_style_syntax = declaration_style_syntax
+        self.declaration_style_syntax_for_states = declaration_style_syntax_for_states
+        self.tab = tab
+
+
+default_mwx_style = MWXStyle()
+
+
+class MWXWriter(object):
+    """Writes the MWX of a tree piece by piece: to a file object, in writes
+       of about buffer_size characters, or, without one, to a list of
+       pieces to be joined by getvalue.
+
+       Nodes write themselves with write_mwx_to(writer, tablevel), with
+       their children (and the rest of their blocks) written by the writer
+       as they go, rather than built into strings and concatenated on the
+       way back up.  Nodes that build their MWX as a string, in a to_mwx of
+       their own (variable references, expressions, transitions...), are
+       written with it.
+
+       A declaration (type, tag and property block) is only built once for
+       each type and set of string properties, and looked up in
+       declarations after that; it starts over when it reaches
+       declarations_size entries.
+    """
+
+    declarations_size = 10000
+
+    def __init__(self, f=None, style=None, buffer_size=65536):
+        self.f = f
+        self.style = style or default_mwx_style
+        self.buffer_size = buffer_size
+        self.pieces = []
+        self.size = 0
+        self.declarations = {}
+
+    def write(self, s):
+        self.pieces.append(s)
+        if self.f is not None:
+            self.size += len(s)
+            if self.size >= self.buffer_size:
+                self.flush()
+
+    def flush(self):
+        if self.f is not None and self.pieces:
+            self.f.write(''.join(self.pieces))
+            self.pieces = []
+            self.size = 0
+
+    def getvalue(self):
+        return ''.join(self.pieces)
+
+    def value(self, obj, tablevel=0):
+        """Write obj, as to_mwx(obj, tablevel) would"""
+        if isinstance(obj, MWASTNode) and writes_mwx_to(obj.__class__):
+            obj.write_mwx_to(self, tablevel)
+        else:
+            self.write(to_mwx(obj, tablevel))
+
+    def declaration(self, obj_type, props, declaration_style_syntax):
+        """mwx_declaration(obj_type, props, declaration_style_syntax)"""
+        for val in props.itervalues():
+            if type(val) is not str:
+                return mwx_declaration(obj_type, props,
+                                       declaration_style_syntax)
+
+        key = (obj_type, declaration_style_syntax, tuple(props.items()))
+        declaration = self.declarations.get(key)
+        if declaration is None:
+            declaration = mwx_declaration(obj_type, props,
+                                          declaration_style_syntax)
+            if len(self.declarations) >= self.declarations_size:
+                self.declarations.clear()
+            self.declarations[key] = declaration
+        return declaration
+
+    def child_block(self, children, tablevel=0):
+        """Write a block of children, { ... }, if there are any"""
+        if len(children) == 0:
+            return
+
+        self.write('{\n')
+        for child in children:
+            self.value(child, tablevel + 1)
+        self.write(self.style.tab * tablevel + '}')
+
+
+# whether the nodes of each class are written by their write_mwx_to (or by
+# their own to_mwx)
+class_writes_mwx_to = {}
+
+
+def writes_mwx_to(cls):
+    writes = class_writes_mwx_to.get(cls)
+    if writes is None:
+        writes = cls.to_mwx.im_func is MWASTNode.to_mwx.im_func
+        class_writes_mwx_to[cls] = writes
+    return writes
+
+
 class MWASTNode(object):
     """An abstract syntax tree node for MWorks.
+
+       Nodes are slotted, as a document can have hundreds of thousands of
+       them: subclasses declare their own attributes in __slots__ (RootNode,
+       of which there are few, keeps a __dict__).  A node without
+       properties or children shares empty_props or empty_children, which
+       can't be modified in place; set_prop and add_children replace them.
     """
 
+    __slots__ = ('obj_type', 'props', 'children', 'silent_syntax')
+
     # tokens for signaling whether an object is a child or a property
     # these are used to enable greater code reuse when recursively walking
     # an AST
@@ -165,23 +417,81 @@ class MWASTNode(object):
     def __init__(self, obj_type, tag=None, props={}, children=[]):
 
         self.obj_type = obj_type
-        self.props = copy(props)
 
-        if self.props == None or self.props == '':
-            self.props = {}
+        if not props:
+            self.props = empty_props
+        else:
+            self.props = copy(props)
 
         if tag is not None:
-            self.props['tag'] = to_mwx(tag, quote_strings=False)
+            self.set_prop('tag', to_mwx(tag, quote_strings=False))
 
         if isinstance(children, MWASTNode):
             children = [children]
 
-        self.children = flatten(children)
+        self.children = flatten(children) or empty_children
 
-        if self.children == None:
+        self.silent_syntax = False
+
+    def set_prop(self, key, value):
+        """Set a property, giving the node a props dict of its own first if
+           it shares empty_props
+        """
+        if self.props is empty_props:
+            self.props = {}
+        elif isinstance(self.props.get(key), MWASTNode):
+            structure_edits.note(self)
+        if isinstance(value, MWASTNode):
+            structure_edits.note(self)
+        elif key == 'tag':
+            tag_edits.note(self)
+        self.props[key] = value
+
+    def pop_prop(self, key, *default):
+        """Remove a property, and return its value (or default, as dict.pop
+           does)
+        """
+        value = self.props.pop(key, *default)
+        if isinstance(value, MWASTNode):
+            structure_edits.note(self)
+        elif key == 'tag':
+            tag_edits.note(self)
+        return value
+
+    def set_obj_type(self, obj_type):
+        """Change the obj_type of the node"""
+        structure_edits.note(self)
+        self.obj_type = obj_type
+
+    def add_children(self, nodes):
+        """Append nodes to the children (as `children += nodes`), giving the
+           node a children list of its own first if it shares empty_children
+        """
+        structure_edits.note(self)
+        if self.children is empty_children:
             self.children = []
+        self.children += nodes
+        if self.children == []:
+            self.children = empty_children
+
+    def derive_tag(self):
+        """Fill in a tag derived from the node's other properties, for nodes
+           that put off computing it (see Action); before reading
+           props['tag'] directly
+        """
+        pass
 
-        self.silent_syntax = False
+    def __getstate__(self):
+        state = {}
+        for name in slot_names(self.__class__):
+            if hasattr(self, name):
+                state[name] = getattr(self, name)
+        state.update(getattr(self, '__dict__', {}))
+        return state
+
+    def __setstate__(self, state):
+        for (name, value) in state.items():
+            setattr(self, name, value)
 
     @property
     def unresolved(self):
@@ -189,6 +499,7 @@ class MWASTNode(object):
 
     @property
     def tag(self):
+        self.derive_tag()
         if 'tag' in self.props:
             return self.props['tag']
         else:
@@ -200,8 +511,9 @@ class MWASTNode(object):
         """
 
         if ctx is self.PROPERTY_CTX:
-            self.props[index] = new_node
+            self.set_prop(index, new_node)
         elif ctx is self.CHILD_CTX:
+            structure_edits.note(self)
             if isiterable(new_node):
                 self.children[index] = new_node[0]
                 if len(new_node) > 1:
@@ -212,35 +524,35 @@ class MWASTNode(object):
 
     def remove_node(self, ctx, index):
         """Remove a sub-node (child or property)"""
+        structure_edits.note(self)
         if ctx is self.PROPERTY_CTX:
             self.props.pop(index)
         elif ctx is self.CHILD_CTX:
             self.children.pop(index)
 
     def to_xml(self):
-        xml = "<%s " % self.obj_type
-
-        for (key, val) in self.props.items():
-            val_xml = quote_once(escape(str(val)))
-            xml += ' %s=%s' % (key, val_xml)
-
-        xml += ">\n"
+        return ''.join(self.iter_xml())
+
+    def iter_xml(self, indent=None, depth=0):
+        """Generate the XML of the node, piece by piece.  If indent is given,
+           each element starts on a line of its own, indented by indent once
+           for each level of depth (the text of foreign code is left as it
+           is).  Subclasses that write their XML differently override
+           iter_xml (or just to_xml).
+        """
+        return iter_node_xml(self, indent, depth)
 
-        if self.children is not None:
-            # try:
-            for child in self.children:
-                if isinstance(child, MWASTNode):
-                    xml += child.to_xml() + "\n"
-                elif getattr(child, '__str__', False):
-                    xml += str(child) + "\n"
-                else:
-                    raise Exception("Can't stringify object: %s" + child)
-            # except Exception as e:
-            #     logging.debug(self.children)
-            #     logging.error(e)
+    def write_xml(self, f, indent=None):
+        """Write the XML of the node to a file object (or anything with a
+           write method, like a socket's makefile()), as it is generated
+        """
+        write_chunks(self.iter_xml(indent), f)
 
-        xml += "</%s>" % self.obj_type
-        return xml
+    def xml_start_tag(self):
+        self.derive_tag()
+        return "<%s %s>\n" % (self.obj_type,
+                               ''.join([' %s=%s' % (key, xml_attribute(val))
+                                        for (key, val) in self.props.items()]))
 
     def to_ast_string(self, tablevel=0):
 
@@ -259,28 +571,38 @@ class MWASTNode(object):
 
         return result
 
-    def to_mwx(self, tablevel=0):
+    def to_mwx(self, tablevel=0, style=None):
+        writer = MWXWriter(style=style)
+        writer.value(self, tablevel)
+        return writer.getvalue()
 
-        tabs = tab * tablevel
+    def write_mwx(self, f, style=None):
+        """Write the MWX of the node to a file object, as it is generated"""
+        writer = MWXWriter(f, style)
+        writer.value(self)
+        writer.flush()
 
-        output_string = tabs
+    def write_mwx_to(self, writer, tablevel=0):
+        """Write the MWX of the node with an MWXWriter"""
+        tabs = writer.style.tab * tablevel
 
         if self.silent_syntax:
-            output_string += '\n# ' + self.tag + '\n\n'
-            output_string += ''.join([to_mwx(c) for c in self.children])
-            return output_string
-
-        output_string += mwx_declaration(self.obj_type, self.props)
-
-        output_string += mwx_child_block(self.children, tablevel)
-
-        output_string += '\n'
+            writer.write(tabs + '\n# ' + self.tag + '\n\n')
+            for c in self.children:
+                writer.value(c)
+            return
 
-        return output_string
+        self.derive_tag()
+        writer.write(tabs + writer.declaration(self.obj_type, self.props,
+                                               writer.style.declaration_style_syntax))
+        writer.child_block(self.children, tablevel)
+        writer.write('\n')
 
 
 class MWKeyword (object):
 
+    __slots__ = ('name',)
+
     def __init__(self, name):
         self.name = name
 
@@ -288,30 +610,151 @@ class MWKeyword (object):
         return self.name
 
 
+class TreeIndex(object):
+    """The nodes of a tree by obj_type, by tag and by id, each with where it
+       sits in the tree, as of given versions of structure_edits and
+       tag_edits (see RootNode)
+    """
+
+    __slots__ = ('structure_version', 'tag_version', 'by_type', 'by_id',
+                 'by_tag')
+
+    def __init__(self, root):
+        self.structure_version = structure_edits.version()
+        self.tag_version = None
+
+        # obj_type -> [(position, node, parent, parent_ctx, index), ...],
+        # with a node that appears more than once listed each time, in the
+        # order a TreeWalker would visit them (properties, then children)
+        self.by_type = {}
+
+        # id(node) -> (position, node, parent, parent_ctx, index), where the
+        # node first appears
+        self.by_id = {}
+
+        # tag -> node, built when first needed
+        self.by_tag = None
+
+        position = 0
+        stack = [(root, None, None, None)]
+        while stack:
+            (node, parent, parent_ctx, index) = stack.pop()
+            if not isinstance(node, MWASTNode):
+                continue
+
+            entry = (position, node, parent, parent_ctx, index)
+            position += 1
+            self.by_type.setdefault(node.obj_type, []).append(entry)
+            self.by_id.setdefault(id(node), entry)
+
+            # pushed in reverse, to come off the stack in order
+            children = node.children
+            if children:
+                for c in range(len(children) - 1, -1, -1):
+                    stack.append((children[c], node, MWASTNode.CHILD_CTX, c))
+            keys = node.props.keys()
+            for k in reversed(keys):
+                stack.append((node.props[k], node, MWASTNode.PROPERTY_CTX, k))
+
+    def current(self):
+        """Whether no node of the tree has been edited since the index was
+           built (it is then brought up to the current version)
+        """
+        if structure_edits.edited_since(self.structure_version, self.by_id):
+            return False
+        self.structure_version = structure_edits.version()
+        return True
+
+    def tags_current(self):
+        """Whether the tags have been indexed, and no tag in the tree has
+           been set since
+        """
+        if (self.by_tag is None or
+            tag_edits.edited_since(self.tag_version, self.by_id)):
+            return False
+        self.tag_version = tag_edits.version()
+        return True
+
+    def build_tags(self):
+        self.tag_version = tag_edits.version()
+        self.by_tag = {}
+        for entry in sorted(self.by_id.values()):
+            node = entry[1]
+            node.derive_tag()
+            tag = node.props.get('tag')
+            if isinstance(tag, basestring):
+                self.by_tag.setdefault(tag, node)
+
+
 class RootNode (MWASTNode):
-    """A node representing the root of the document"""
+    """A node representing the root of the document.
+
+       The root keeps indexes of the nodes in the tree below it: by obj_type
+       (nodes_of_type, occurrences), by tag (by_tag), and of the parent of
+       each (parent_of).  They are built when first asked for, and rebuilt
+       when a node of the tree has been edited since: edits made through
+       the node methods (set_prop, pop_prop, set_obj_type, add_children,
+       rewrite, remove_node) are noticed; others should be followed by a
+       call to tree_changed(node).  Edits to other trees don't count.
+       Building the tag index fills in the derived tags of the nodes (see
+       Action).
+    """
 
     def __init__(self, children=[]):
         MWASTNode.__init__(self, 'root', children=children)
+        self.indexes = None
+
+    def __getstate__(self):
+        state = MWASTNode.__getstate__(self)
+        state['indexes'] = None
+        return state
+
+    def tree_index(self):
+        indexes = getattr(self, 'indexes', None)
+        if indexes is None or not indexes.current():
+            indexes = self.indexes = TreeIndex(self)
+        return indexes
+
+    def occurrences(self, obj_types):
+        """The nodes of the given obj_type (or list of obj_types), in the
+           order a TreeWalker would visit them, each as a
+           (node, parent, parent_ctx, index) tuple
+        """
+        if isinstance(obj_types, basestring):
+            obj_types = [obj_types]
+        by_type = self.tree_index().by_type
+        lists = [by_type[t] for t in set(obj_types) if t in by_type]
+        if len(lists) == 1:
+            entries = lists[0]
+        else:
+            entries = heapq.merge(*lists)
+        return [entry[1:] for entry in entries]
 
-    def to_xml(self):
-        xml = "<mwxml>"
+    def nodes_of_type(self, obj_types):
+        """The nodes of the given obj_type (or list of obj_types), in document
+           order, e.g. root.nodes_of_type('state')
+        """
+        return [o[0] for o in self.occurrences(obj_types)]
 
-        if self.children is not None:
-            # try:
-            for child in self.children:
-                if isinstance(child, MWASTNode):
-                    xml += child.to_xml() + "\n"
-                elif getattr(child, '__str__', False):
-                    xml += str(child) + "\n"
-                else:
-                    raise Exception("Can't stringify object: %s" % child)
-            # except Exception as e:
-            #     logging.debug(self.children)
-            #     logging.error(e)
+    def by_tag(self, tag):
+        """The node with the given tag (the first in document order, if there
+           are several), or None, e.g. root.by_tag('Init')
+        """
+        index = self.tree_index()
+        if not index.tags_current():
+            index.build_tags()
+        return index.by_tag.get(tag)
+
+    def parent_of(self, node):
+        """The parent of a node in the tree (where it first appears), or None
+        """
+        entry = self.tree_index().by_id.get(id(node))
+        if entry is None:
+            return None
+        return entry[2]
 
-        xml += "</mwxml>"
-        return xml
+    def iter_xml(self, indent=None, depth=0):
+        return iter_document_xml(self.children, indent)
 
     def to_ast_string(self):
         result = ""
@@ -325,12 +768,127 @@ class RootNode (MWASTNode):
 
         return result
 
-    def to_mwx(self):
-        return ''.join([to_mwx(c) for c in self.children])
+    def write_mwx_to(self, writer, tablevel=0):
+        for c in self.children:
+            writer.value(c)
+
+
+# the __slots__ of each node class and its bases, for pickling
+class_slot_names = {}
+
+
+def slot_names(cls):
+    names = class_slot_names.get(cls)
+    if names is None:
+        names = []
+        for c in cls.__mro__:
+            slots = c.__dict__.get('__slots__', ())
+            if isinstance(slots, str):
+                slots = (slots,)
+            names.extend(n for n in slots if n not in names)
+        class_slot_names[cls] = names
+    return names
+
+
+# how the nodes of each class write their XML: XML_STREAMED (by
+# iter_node_xml), XML_ITER (by their own iter_xml) or XML_STRING (by their
+# own to_xml)
+XML_STREAMED = 0
+XML_ITER = 1
+XML_STRING = 2
+class_xml_kinds = {}
+
+
+def xml_kind(cls):
+    kind = class_xml_kinds.get(cls)
+    if kind is None:
+        if cls.iter_xml.im_func is not MWASTNode.iter_xml.im_func:
+            kind = XML_ITER
+        elif cls.to_xml.im_func is not MWASTNode.to_xml.im_func:
+            kind = XML_STRING
+        else:
+            kind = XML_STREAMED
+        class_xml_kinds[cls] = kind
+    return kind
+
+
+def iter_node_xml(node, indent=None, depth=0):
+    """Generate the XML of a node, piece by piece (see MWASTNode.iter_xml).
+       The tree is walked with a stack of its own, rather than by recursion,
+       so each piece is handed straight out, however deep the node it
+       comes from.
+    """
+    # (node, depth) pairs still to write, and the text that goes between
+    # them, in reverse order
+    stack = [(node, depth)]
+    push = stack.append
+    pop = stack.pop
+
+    while stack:
+        item = pop()
+        if item.__class__ is not tuple:
+            yield item
+            continue
+
+        node, depth = item
+        if indent:
+            padding = indent * depth
+        else:
+            padding = ''
+
+        kind = xml_kind(node.__class__)
+        if kind is XML_ITER:
+            for xml in node.iter_xml(indent, depth):
+                yield xml
+            continue
+        if kind is XML_STRING:
+            yield padding + node.to_xml()
+            continue
+
+        yield padding + node.xml_start_tag()
+        push(padding + "</%s>" % node.obj_type)
+
+        if node.children:
+            for child in reversed(node.children):
+                if isinstance(child, MWASTNode):
+                    push("\n")
+                    push((child, depth + 1))
+                else:
+                    push(str(child) + "\n")
+
+
+def iter_document_xml(nodes, indent=None):
+    """Generate the XML of a document, piece by piece, from an iterable of
+       its top-level nodes
+    """
+    yield "<mwxml>"
+    if indent:
+        yield "\n"
+
+    if nodes is not None:
+        for child in nodes:
+            if isinstance(child, MWASTNode):
+                for xml in iter_node_xml(child, indent, 1):
+                    yield xml
+                yield "\n"
+            else:
+                yield str(child) + "\n"
+
+    yield "</mwxml>"
+
+
+def write_xml_document(nodes, f, indent=None):
+    """Write the XML of a document to a file object as its top-level nodes
+       come in, e.g. from MWXParser.iter_parse, without building the whole
+       tree or string in memory
+    """
+    write_chunks(iter_document_xml(nodes, indent), f)
 
 
 class MWVariable(MWASTNode):
 
+    __slots__ = ()
+
     def __init__(self, tag, default=None, scope='global', var_type=None, props={}, children=[]):
 
         try:
@@ -384,48 +942,86 @@ class MWVariable(MWASTNode):
         return s
 
 
+def is_fixed_value(x):
+    """True if x will format the same way for as long as the tree lives:
+       expressions are simplified in place, and strings holding template
+       references ('@') substituted
+    """
+    if x is None:
+        return True
+    t = type(x)
+    if t is str:
+        return '@' not in x
+    return t is int or t is float or t is long or t is bool
+
+
 class Action (MWASTNode):
     """A custom node for representing actions.  Provides infrastructure for
        handling a default arg, and automatically generating a convenience
-       tag from its type and arguments
+       tag from its type and arguments.
+
+       The tag is only formatted when something asks for it (see
+       derive_tag), if the argument it comes from can't change before then;
+       until then, tag_source holds the arguments to format_tag.
     """
 
+    __slots__ = ('tag_source',)
+
     def __init__(self, action_type=None, arg=None, props={}, children=[], alt_tag=None):
 
+        self.tag_source = None
+
         MWASTNode.__init__(self, "action", props=props, children=children)
 
         if action_type is not None:
-            self.props['type'] = action_type
+            self.set_prop('type', action_type)
 
         if arg is not None:
             if not action_type in shorthand_actions:
-                self.props[PRIMARY_ARG_STRING] = arg  # TODO: lookup what the real primary arg is
+                self.set_prop(PRIMARY_ARG_STRING, arg)  # TODO: lookup what the real primary arg is
             else:
-                self.props[shorthand_actions[action_type]] = arg
+                self.set_prop(shorthand_actions[action_type], arg)
 
-        tag = None
         if 'tag' not in self.props:
             if alt_tag is not None:
-                tag = alt_tag
+                self.set_prop('tag', alt_tag)
             # elif arg is not None and arg.__class__ == str:
             #     self.props['tag'] = action_type + " " + escape(arg.strip('" '))
-            elif getattr(arg, "__str__", False):
-                tag = action_type + " " + escape(to_mwx(arg, quote_strings=False))
+            elif not getattr(arg, "__str__", False):
+                self.set_prop('tag', action_type)
+            elif is_fixed_value(arg):
+                self.tag_source = (action_type, arg)
             else:
-                tag = action_type
+                self.set_prop('tag', self.format_tag(action_type, arg))
+        else:
+            self.set_prop('tag', None)
 
-        self.props['tag'] = tag
+    def format_tag(self, action_type, arg):
+        return action_type + " " + escape(to_mwx(arg, quote_strings=False))
 
-    def to_mwx(self, tablevel=0):
+    def derive_tag(self):
+        if self.tag_source is not None:
+            source = self.tag_source
+            self.tag_source = None
+            # the tag was there all along, as far as the indexes go
+            if self.props is empty_props:
+                self.props = {}
+            self.props['tag'] = self.format_tag(*source)
 
-        tabs = tab * tablevel
+    def set_prop(self, key, value):
+        # a new property goes in after the tag, as it always has
+        if self.tag_source is not None and key not in self.props:
+            self.derive_tag()
+        MWASTNode.set_prop(self, key, value)
 
-        output_string = tabs
+    def write_mwx_to(self, writer, tablevel=0):
 
         props = copy(self.props)
 
         if 'type' not in props.keys():
-            return MWASTNode.to_mwx(self, tablevel)
+            return MWASTNode.write_mwx_to(self, writer, tablevel)
+
+        output_string = writer.style.tab * tablevel
 
         output_string += self.props['type']
 
@@ -446,23 +1042,23 @@ class Action (MWASTNode):
 
         output_string += "(" + ", ".join(args) + ")"
 
-        output_string += mwx_child_block(self.children, tablevel)
-        output_string += '\n'
-
-        return output_string
+        writer.write(output_string)
+        writer.child_block(self.children, tablevel)
+        writer.write('\n')
 
 
 class ForeignCodeAction (Action):
 
+    __slots__ = ()
+
     def __init__(self, language=None, code=None, **kwargs):
 
         Action.__init__(self, "foreign_code", **kwargs)
 
         if language is not None:
-            self.props['language'] = language
+            self.set_prop('language', language)
 
         if code is not None:
-            from xml.sax.saxutils import escape
             self.children = [escape(code)]
 
     def to_mwx(self, tablevel=0):
@@ -486,18 +1082,32 @@ class ForeignCodeAction (Action):
 
 class AssignmentAction (Action):
 
-    def __init__(self, variable=None, value=None, **kwargs):
+    __slots__ = ()
 
-        alt_tag = "%s = %s" % (variable, to_mwx(value))
-        kwargs['alt_tag'] = alt_tag
+    def __init__(self, variable=None, value=None, **kwargs):
 
-        Action.__init__(self, 'assignment', **kwargs)
+        # the tag can wait if nothing else is in the props: type, tag,
+        # variable and value come out of a dict in the same order whichever
+        # of them goes in last
+        if (is_fixed_value(variable) and is_fixed_value(value) and
+            not kwargs.get('props')):
+            kwargs.pop('alt_tag', None)
+            Action.__init__(self, 'assignment', **kwargs)
+            self.tag_source = (variable, value)
+            set_prop = MWASTNode.set_prop
+        else:
+            kwargs['alt_tag'] = self.format_tag(variable, value)
+            Action.__init__(self, 'assignment', **kwargs)
+            set_prop = Action.set_prop
 
         if variable is not None:
-            self.props['variable'] = variable
+            set_prop(self, 'variable', variable)
 
         if value is not None:
-            self.props['value'] = value
+            set_prop(self, 'value', value)
+
+    def format_tag(self, variable, value):
+        return "%s = %s" % (variable, to_mwx(value))
 
     def to_mwx(self, tablevel=0):
         tabs = tab * tablevel
@@ -512,6 +1122,8 @@ class AssignmentAction (Action):
 class State (MWASTNode):
     """A custom node representing a state system state."""
 
+    __slots__ = ('actions', 'transitions')
+
     def __init__(self, tag=None, actions=[], transitions=[], props={}):
 
         if tag is None and 'tag' in props:
@@ -522,25 +1134,22 @@ class State (MWASTNode):
         children = actions + transitions
         MWASTNode.__init__(self, 'state', tag, children=children, props=props)
 
-    def to_mwx(self, tablevel=0):
+    def write_mwx_to(self, writer, tablevel=0):
 
-        tabs = tab * tablevel
-        output_string = tabs
+        tabs = writer.style.tab * tablevel
 
-        output_string += mwx_declaration(self.obj_type,
-                                         self.props,
-                                         use_declaration_style_syntax_for_states)
+        writer.write(tabs + writer.declaration(self.obj_type, self.props,
+                                               writer.style.declaration_style_syntax_for_states))
 
         # { action\n action\n ... }
-        output_string += mwx_child_block(self.actions, tablevel)
+        writer.child_block(self.actions, tablevel)
 
-        output_string += ' transition '
+        writer.write(' transition ')
 
         # { transition\n transition\n ... }
-        output_string += mwx_child_block(self.transitions, tablevel)
+        writer.child_block(self.transitions, tablevel)
 
-        output_string += '\n'
-        return output_string
+        writer.write('\n')
 
 
 class Transition (MWASTNode):
@@ -548,16 +1157,20 @@ class Transition (MWASTNode):
        tag from condition and target if one is not provided.
     """
 
+    __slots__ = ()
+
     def __init__(self, condition=None, target=None, **kwargs):
-        alt_tag = "%s -> %s" % (to_mwx(condition), to_mwx(target))
-        kwargs['alt_tag'] = alt_tag
-        kwargs['tag'] = alt_tag
         MWASTNode.__init__(self, 'transition')
 
         if condition is not None:
-            self.props['condition'] = condition
+            self.set_prop('condition', condition)
         if target is not None:
-            self.props['target'] = target
+            self.set_prop('target', target)
+
+    @property
+    def alt_tag(self):
+        return "%s -> %s" % (to_mwx(self.props.get('condition')),
+                             to_mwx(self.props.get('target')))
 
     def to_mwx(self, tablevel=0):
         tabs = tab * tablevel
@@ -586,6 +1199,9 @@ class MWVariableReference (MWASTNode):
     """A class that represents variable references, including those with
        indices supplied in a bracket operator (e.g. x[0])
     """
+
+    __slots__ = ('index',)
+
     def __init__(self, identifier=None, index=None, **kwargs):
 
         MWASTNode.__init__(self, 'variable_reference', tag=identifier)
@@ -600,9 +1216,9 @@ class MWVariableReference (MWASTNode):
         # so that recursive evaluation / discovery finds them
         if self.index is not None:
             if isiterable(index):
-                self.children += index
+                self.add_children(index)
             else:
-                self.children += [index]
+                self.add_children([index])
 
     def to_ast_string(self):
         if self.index is None:
@@ -628,21 +1244,23 @@ class MWVariableReference (MWASTNode):
 class MWFunctionCall (MWASTNode):
     """A node representing a function call, with optional arguments"""
 
+    __slots__ = ()
+
     def __init__(self, identifier, fargs=[], **kwargs):
 
         MWASTNode.__init__(self, 'function_call')
 
         if identifier is not None:
-            self.props['tag'] = identifier
+            self.set_prop('tag', identifier)
 
         if fargs is '':
             fargs = None
 
         if fargs is not None:
             if isiterable(fargs):
-                self.children += fargs
+                self.add_children(fargs)
             else:
-                self.children += [fargs]
+                self.add_children([fargs])
 
     def to_mwx(self, tablevel=0):
         return self.to_infix()
@@ -657,16 +1275,23 @@ class MWFunctionCall (MWASTNode):
 
 
 class MWExpression (MWASTNode):
-    """A node representing an arithmetic expression"""
+    """A node representing an arithmetic expression.  compiled holds the
+       closure that evaluates it (see mwx.ast.evaluation), once it has been
+       evaluated
+    """
+
+    __slots__ = ('op', 'compiled')
+
     def __init__(self, operator=None, operands=None, **kwargs):
 
         MWASTNode.__init__(self, "expression")
 
         self.op = operator
+        self.compiled = None
         #self.props['operator'] = operator
 
         if operands is not None:
-            self.children += operands
+            self.add_children(operands)
 
     @property
     def operands(self):
@@ -676,6 +1301,11 @@ class MWExpression (MWASTNode):
         "Check to see if the operands are variables; if not simplify the expression"
         return self
 
+    def __getstate__(self):
+        state = MWASTNode.__getstate__(self)
+        state['compiled'] = None
+        return state
+
     def __str__(self):
         return self.to_infix()
 
@@ -697,6 +1327,12 @@ class MWExpression (MWASTNode):
     def to_xml(self):
         return self.to_infix()
 
+    def iter_xml(self, indent=None, depth=0):
+        if indent:
+            yield indent * depth + self.to_infix()
+        else:
+            yield self.to_infix()
+
     def to_infix(self, quote_strings=False):
 
         if len(self.children) == 1:
@@ -707,25 +1343,27 @@ class MWExpression (MWASTNode):
             op2 = to_infix(self.children[1])
             return "(%s %s %s)" % (op1, self.op, op2)
 
-    # this is a bit of a hack for now
     # evaluate an expression at parse time (e.g. for macro control flow)
     def eval(self):
-        eval_string = self.to_infix(quote_strings=False)
+        from mwx.ast.evaluation import evaluate, ExpressionError
         try:
-            return eval(eval_string)
-        except:
-            raise Exception("Unable to evaluate expression: %s" % eval_string)
+            return evaluate(self)
+        except ExpressionError as e:
+            raise ExpressionError("Unable to evaluate expression: %s (%s)" %
+                                  (self.to_infix(), e))
 
 
 class MWBinaryExpression(MWExpression):
     """A node representing a sub-expression with two operands"""
 
+    __slots__ = ()
+
     def __init__(self, op, operand1, operand2):
         MWExpression.__init__(self, op, (operand1, operand2))
 
     def simplify(self):
+        from mwx.ast.evaluation import fold
 
-        new_value = self
         operands = self.children
         if getattr(operands[0], "simplify", False):
             operands[0] = operands[0].simplify()
@@ -733,80 +1371,47 @@ class MWBinaryExpression(MWExpression):
         if getattr(operands[1], "simplify", False):
             operands[1] = operands[1].simplify()
 
-        if (not isinstance(operands[0], MWVariableReference) and
-           not isinstance(operands[0], MWExpression) and
-           not isinstance(operands[1], MWVariableReference) and
-           not isinstance(operands[1], MWExpression)):
-
-            # TODO: this is terribly hacky for moment; care should be taken here
-            try:
-                o1 = eval(operands[0])
-            except:
-                o1 = operands[0]
-
-            try:
-                o2 = eval(operands[1])
-            except:
-                o2 = operands[1]
-
-            op = self.op
-            new_value = self
-
-            try:
-                if op is "+":
-                    if isinstance(o1, str) or isinstance(o2, str):  # a type cooercion not allowed in Python
-                        o1 = str(o1)
-                        o2 = str(o2)
-                    new_value = o1 + o2
-                elif op is "-":
-                    new_value = o1 - o2
-                elif op is "*":
-                    new_value = o1 * o2
-                elif op is "/":
-                    new_value = o1 / o2
-                elif op is "^":
-                    new_value = o1 ^ o2
-            except Exception:
-                pass
-
-        return new_value
+        return fold(self)
 
 
 class MWUnaryExpression(MWExpression):
     """A node representing a sub-expression with one operand"""
+
+    __slots__ = ()
+
     def __init__(self, op, operand):
         MWExpression.__init__(self, op, [operand])
 
     def simplify(self):
+        from mwx.ast.evaluation import fold
+
         operand = self.children[0]
-        op = self.op
         if getattr(operand, "simplify", False):
-            operand = operand.simplify()
-
-        new_value = self
-
-        if not isinstance(operand, MWVariableReference) and \
-           not isinstance(operand, MWExpression):
-
-            try:
-                operand = eval(operand)
-            except:
-                pass
+            self.rewrite(self.CHILD_CTX, 0, operand.simplify())
 
-            try:
-                if op is "+":
-                    new_value = +operand
-                elif op is "-":
-                    new_value = -operand
-            except:
-                pass
+        return fold(self)
 
-        return new_value
 
-
-def remove_python_padding(code, padding):
-    """A helper for normalizing python code in foreign_code actions"""
+def remove_python_padding(code, padding, line_starts=None):
+    """A helper for normalizing python code in foreign_code actions.
+       line_starts, if given, are the offsets in code of each line after
+       the first (as found by the scanners in mwx.foreign_code), which saves
+       splitting the code into lines.
+    """
     padding_len = len(padding)
+    if line_starts is not None:
+        pieces = []
+        p = 0
+        for i, line_start in enumerate(line_starts):
+            pieces.append(code[p:line_start])
+            if i + 1 < len(line_starts):
+                line_end = line_starts[i + 1] - 1
+            else:
+                line_end = len(code)
+            p = min(line_start + padding_len, line_end)
+        pieces.append(code[p:])
+        return "".join(pieces)
+
     lines = code.split("\n")
     for l in range(1, len(lines)):
         try:
@@ -816,18 +1421,112 @@ def remove_python_padding(code, padding):
     return "\n".join(lines)
 
 
+class WalkFrame(object):
+    """A node whose properties and children a TreeWalker is walking: how it
+       was reached, and how far the walk over it has got
+    """
+
+    __slots__ = ('node', 'parent', 'parent_context', 'index',
+                 'keys', 'key_position', 'children', 'child_position',
+                 'walking', 'following', 'children_before')
+
+    def __init__(self, node, parent, parent_context, index, keys, children):
+        self.node = node
+        self.parent = parent
+        self.parent_context = parent_context
+        self.index = index
+
+        # the property keys, as they were when the walk over them started
+        self.keys = keys
+        self.key_position = 0
+
+        # the children list, and the position of the child being walked
+        self.children = children
+        self.child_position = 0
+
+        # the child being walked, if any, and (set with it) the one after
+        # it and the length of the list, as they were when its walk started
+        # (see next_child)
+        self.walking = None
+
+
+def position_of(nodes, node):
+    """The position of node (itself, not an equal one) in nodes, or None"""
+    for i in xrange(len(nodes)):
+        if nodes[i] is node:
+            return i
+    return None
+
+
+def next_child(frame):
+    """The position of the child to walk after frame.walking, given what
+       was done to the children list while it was walked
+    """
+    children = frame.children
+    c = frame.child_position
+    walked = frame.walking
+
+    if c < len(children) and children[c] is walked:
+        return c + 1
+
+    # moved, by nodes put in or taken out before it
+    i = position_of(children, walked)
+    if i is not None:
+        return i + 1
+
+    # replaced or removed: carry on with the child that followed it
+    following = frame.following
+    if following is None:
+        return len(children)
+    i = position_of(children, following)
+    if i is not None:
+        return i
+
+    # (which is gone too)
+    return max(c, c + 1 + len(children) - frame.children_before)
+
+
 class TreeWalker:
     """A base class for walking an AST and performing actions on certain nodes.
        To be useful, `trigger` and `action` should be overridden.  `trigger`
        decides whether a node should be process, and `action` performs some
        action on the triggered node.
 
-       If the `continue_after_trigger` constructor kwarg is set to False, the
+       If the `continue_after_rewrite` constructor kwarg is set to False, the
        tree walking will not continue recursing after an action is performed.
        This is useful if the action rewrites the tree in a way that makes
        further traversal ill-defined.
+
+       Each node is walked in order: `pre_visit`, then `trigger` (and
+       `action`), then its properties and children (if `should_descend`
+       allows), then `post_visit`.  The walk keeps a stack of its own, so the
+       depth of the tree isn't limited by Python's recursion limit, and
+       children are visited by position, with the index handed to `action`
+       being where the child actually is.  When an action replaces its node
+       with several (see MWASTNode.rewrite), or removes it, the walk carries
+       on with the child that followed it; the nodes put in its place aren't
+       walked, as with a single replacement, unless the action returns one
+       of them.  Siblings put in before the node being walked aren't walked
+       either, and those put in after it are.
+
+       Keeping the stack costs a little: a chain of nodes, each the only
+       child of the one before, takes about 1.6 times as long to walk as it
+       did by recursion (wide trees take much less, as a child's index isn't
+       looked up any more; see benchmarks/bench_tree_walker.py).
+
+       Walkers run as passes by a PassManager (see mwx.ast.passes) can say
+       which nodes they work on with `obj_types`, and which passes must
+       have walked the whole tree before them with `requires`.
     """
 
+    # the obj_types of the nodes `trigger` can fire on, or None if it might
+    # fire on any node
+    obj_types = None
+
+    # the passes that must have finished with the whole tree before this one
+    # starts on it
+    requires = ()
+
     def __init__(self, tree, continue_after_rewrite=True):
         self.tree = tree
         self.continue_after_rewrite = continue_after_rewrite
@@ -846,44 +1545,137 @@ class TreeWalker:
     def should_descend(self, node):
         return True
 
+    def pre_visit(self, node, parent=None, parent_ctx=None, index=None):
+        """Called on reaching each node, before its trigger"""
+        pass
+
+    def post_visit(self, node, parent=None, parent_ctx=None, index=None):
+        """Called when done with each node (the one returned by its action,
+           if any), after its properties and children
+        """
+        pass
+
     def walk(self):
         self.reset()
 
         if isiterable(self.tree):
             for t in self.tree:
-                self._walk_recursive(t)
+                self._walk(t)
         else:
-            self._walk_recursive(self.tree)
+            self._walk(self.tree)
         return self.result
 
-    def _walk_recursive(self, node, parent=None, parent_context=None, index=None):
+    def _visit(self, node, parent, parent_context, index):
+        """Visit a node; returns a frame for walking its properties and
+           children, or None if they aren't to be walked
+        """
+        hooked = self.hooked
+        if hooked:
+            self.pre_visit(node, parent, parent_context, index)
 
         returned_node = None
 
         # test the trigger on this node
-        if(self.trigger(node)):
+        if self.trigger(node):
             returned_node = self.action(node, parent, parent_context, index)
 
-        # if we've been instructed to bail after a single trigger, bail
-        if (not self.continue_after_rewrite and returned_node is not None):
-            return
-
         if returned_node is not None:
+            # if we've been instructed to bail after a single trigger, bail
+            if not self.continue_after_rewrite:
+                if hooked:
+                    self.post_visit(returned_node, parent, parent_context,
+                                    index)
+                return None
             node = returned_node
 
-        # decide whether to recurse downward
-        if not self.should_descend(node):
+        # decide whether to descend (leaves, like the strings in props,
+        # have nothing to descend into)
+        props = getattr(node, 'props', None)
+        children = getattr(node, 'children', None)
+        if not (props or children) or (self.selective and
+                                       not self.should_descend(node)):
+            if hooked:
+                self.post_visit(node, parent, parent_context, index)
+            return None
+
+        return WalkFrame(node, parent, parent_context, index,
+                         props and props.keys() or (), children or ())
+
+    def _walk(self, node, parent=None, parent_context=None, index=None):
+
+        # (most walkers leave pre_visit, post_visit and should_descend be,
+        # and the calls cost as much as the rest of a visit to a leaf)
+        cls = self.__class__
+        self.hooked = hooked = (
+            cls.pre_visit.im_func is not TreeWalker.pre_visit.im_func or
+            cls.post_visit.im_func is not TreeWalker.post_visit.im_func)
+        self.selective = (cls.should_descend.im_func is not
+                          TreeWalker.should_descend.im_func)
+
+        visit = self._visit
+        post_visit = self.post_visit
+        property_ctx = MWASTNode.PROPERTY_CTX
+        child_ctx = MWASTNode.CHILD_CTX
+
+        frame = visit(node, parent, parent_context, index)
+        if frame is None:
             return
+        stack = [frame]
+        push = stack.append
+
+        while stack:
+            frame = stack[-1]
+            node = frame.node
+
+            # walk attributes
+            keys = frame.keys
+            k = frame.key_position
+            if k < len(keys):
+                frame.key_position = k + 1
+                key = keys[k]
+                child_frame = visit(node.props[key], node, property_ctx, key)
+                if child_frame is not None:
+                    push(child_frame)
+                continue
 
-        # walk attributes
-        if getattr(node, 'props', False):
-            for k in node.props.keys():
-                p = node.props[k]
-                self._walk_recursive(p, node, MWASTNode.PROPERTY_CTX, k)
+            # walk children, carrying on after the one whose walk just
+            # finished, if any
+            children = frame.children
+            n = len(children)
+            c = frame.child_position
+            walked = frame.walking
+            if walked is not None:
+                if c < n and children[c] is walked:
+                    c += 1
+                else:
+                    c = next_child(frame)
+                frame.walking = None
+
+            child_frame = None
+            while c < n:
+                child = children[c]
+                frame.walking = child
+                if c + 1 < n:
+                    frame.following = children[c + 1]
+                else:
+                    frame.following = None
+                frame.children_before = n
+                frame.child_position = c
+                child_frame = visit(child, node, child_ctx, c)
+                if child_frame is not None:
+                    break
+                n = len(children)
+                if c < n and children[c] is child:
+                    c += 1
+                else:
+                    c = next_child(frame)
+                frame.walking = None
 
-        # walk children
-        if getattr(node, 'children', False):
-            for child in node.children:
-                c = node.children.index(child)
-                self._walk_recursive(child, node, MWASTNode.CHILD_CTX, c)
+            if child_frame is not None:
+                push(child_frame)
+                continue
 
+            stack.pop()
+            if hooked:
+                post_visit(node, frame.parent, frame.parent_context,
+                           frame.index)
@@ -0,0 +1,246 @@
+'''
+Evaluating expressions at parse time (the conditions of template @ifs, say),
+and folding their constant parts, the way MWorks would evaluate them.
+
+An expression is compiled, once, into a closure over its operands: the
+constants in it converted up front (durations to microseconds, the unit
+MWorks keeps time in), and its operator looked up.  The closure is kept on
+the node (see MWExpression.compiled) for as long as the node keeps the same
+operands.  Nothing is formatted back into a string, or handed to Python's
+eval.
+
+The values are numbers, strings and booleans (true and false):
+
+  + - * /        on numbers (+ joins strings, and numbers to strings)
+  ^ **           raise a number to a power
+  == !=          compare any two values
+  < <= > >=      compare two numbers, or two strings (a number and a string
+                 are never in order)
+  and && or ||   short-circuit, giving a boolean
+  not !          a boolean
+  - +            (prefix) on numbers
+
+Variables (but for true and false), function calls and unresolved template
+references have no value before the experiment runs: evaluating them raises
+ExpressionError.
+'''
+
+import re
+import operator
+
+from mwx.ast.ast import MWExpression, MWVariableReference, to_infix
+
+
+# the length of each unit of duration, in microseconds
+duration_units = {'us': 1, 'ms': 1000, 's': 1000000, 'min': 60000000}
+
+duration_value = re.compile(r"^([0-9]+)(ms|us|s|min)$").match
+
+number_types = (int, long, float, bool)
+
+# the boolean literals (which parse as references to variables)
+boolean_literals = {'true': True, 'false': False}
+
+
+class ExpressionError(Exception):
+    pass
+
+
+def duration(s):
+    """The length (in microseconds) of a duration like '100ms', or None if s
+       isn't one
+    """
+    m = duration_value(s)
+    if m is None:
+        return None
+    return float(int(m.group(1)) * duration_units[m.group(2)])
+
+
+def check_numbers(op, a, b):
+    if not (isinstance(a, number_types) and isinstance(b, number_types)):
+        raise ExpressionError("%s needs numbers, got %r and %r" % (op, a, b))
+
+
+def arithmetic(op, f):
+    def apply(a, b):
+        check_numbers(op, a, b)
+        try:
+            return f(a, b)
+        except (ArithmeticError, ValueError) as e:
+            raise ExpressionError("%r %s %r: %s" % (a, op, b, e))
+    return apply
+
+
+def add(a, b):
+    # (joining a string and a number, as MWorks does)
+    if isinstance(a, basestring) or isinstance(b, basestring):
+        return str(a) + str(b)
+    check_numbers('+', a, b)
+    return a + b
+
+
+def ordering(f):
+    def apply(a, b):
+        # (a number and a string are never in order, rather than in the
+        # order Python 2 would give them)
+        if isinstance(a, basestring) != isinstance(b, basestring):
+            return False
+        return f(a, b)
+    return apply
+
+
+# the binary operators, by the op of an MWBinaryExpression (see
+# mwx.expression.binary_operators); and and or are compiled separately
+binary_operators = {'+': add,
+                    '-': arithmetic('-', operator.sub),
+                    '*': arithmetic('*', operator.mul),
+                    '/': arithmetic('/', operator.div),
+                    '^': arithmetic('^', operator.pow),
+                    '**': arithmetic('**', operator.pow),
+                    '==': operator.eq,
+                    '!=': operator.ne,
+                    '<': ordering(operator.lt),
+                    '<=': ordering(operator.le),
+                    '>': ordering(operator.gt),
+                    '>=': ordering(operator.ge)}
+
+
+def negative(a):
+    check_numbers('-', a, 0)
+    return -a
+
+
+def positive(a):
+    check_numbers('+', a, 0)
+    return +a
+
+
+unary_operators = {'-': negative,
+                   '+': positive,
+                   'not': operator.not_}
+
+# the operators simplify folds (the others are left for MWorks to evaluate)
+folded_operators = frozenset(['+', '-', '*', '/'])
+
+
+def constant(x):
+    """The value of a constant operand (a number, a string, true or false),
+       or None if it doesn't have one
+    """
+    if isinstance(x, number_types):
+        return x
+    elif isinstance(x, basestring):
+        value = duration(x)
+        if value is not None:
+            return value
+        return x
+    elif isinstance(x, MWVariableReference) and x.index is None:
+        return boolean_literals.get(x.props['tag'])
+    return None
+
+
+def describe(x):
+    """x, as it was written, for error messages"""
+    if getattr(x, 'obj_type', None) == 'template_reference':
+        # (template references have no infix form of their own)
+        return '@' + x.props['tag']
+    return to_infix(x)
+
+
+def compile_operand(x):
+    """A closure giving the value of an operand of an expression"""
+    if isinstance(x, MWExpression):
+        return lambda: evaluate(x)
+
+    value = constant(x)
+    if value is not None:
+        return lambda: value
+
+    def unknown():
+        raise ExpressionError("%s has no value at parse time" % describe(x))
+    return unknown
+
+
+def compile_expression(node):
+    """Compile an expression node into a closure that evaluates it"""
+    op = node.op
+    operands = [compile_operand(x) for x in node.children]
+
+    if len(operands) == 1:
+        f = unary_operators.get(op)
+        if f is None:
+            raise ExpressionError("unknown operator %s" % op)
+        a = operands[0]
+        return lambda: f(a())
+
+    (a, b) = operands
+    if op == 'and':
+        return lambda: bool(a()) and bool(b())
+    elif op == 'or':
+        return lambda: bool(a()) or bool(b())
+
+    f = binary_operators.get(op)
+    if f is None:
+        raise ExpressionError("unknown operator %s" % op)
+    return lambda: f(a(), b())
+
+
+def compiled(node):
+    """The closure that evaluates node, compiled the first time, and again
+       if its operands have changed since
+    """
+    children = node.children
+    entry = getattr(node, 'compiled', None)
+    if entry is not None:
+        (operands, f) = entry
+        if len(operands) == len(children):
+            for (x, y) in zip(operands, children):
+                if x is not y:
+                    break
+            else:
+                return f
+
+    f = compile_expression(node)
+    node.compiled = (tuple(children), f)
+    return f
+
+
+def evaluate(node):
+    """The value of an expression node; raises ExpressionError if it has
+       none
+    """
+    return compiled(node)()
+
+
+def value_of(x):
+    """The value of an expression, or of a constant (as an operand); raises
+       ExpressionError if it has none
+    """
+    if isinstance(x, MWExpression):
+        return evaluate(x)
+    value = constant(x)
+    if value is None:
+        raise ExpressionError("%s has no value at parse time" % describe(x))
+    return value
+
+
+def fold(node):
+    """The value of an expression node, if its operator is one that
+       simplify folds, and its operands are numbers (or strings, for +), or
+       else the node itself.  Durations aren't folded: they're left for
+       MWorks, in the units they were written in.
+    """
+    if node.op not in folded_operators:
+        return node
+
+    for x in node.children:
+        if isinstance(x, basestring):
+            if duration(x) is not None:
+                return node
+        elif not isinstance(x, number_types):
+            return node
+
+    try:
+        return evaluate(node)
+    except ExpressionError:
+        return node
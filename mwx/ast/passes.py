@@ -0,0 +1,175 @@
+'''
+Running a sequence of TreeWalker passes over a tree in as few walks as it
+allows.
+
+Each pass in a sequence would otherwise walk the whole tree, one after the
+other.  Most passes only look at the node they're given (rewriting it,
+replacing it, or removing it), and so give the same tree if, instead, every
+pass is run on each node as a single walk reaches it, in the order of the
+sequence.  A PassManager splits the sequence into stages that are walked
+like that, starting a new stage at a pass that `requires` one in the stage
+so far (one that looks at the children of its nodes, say, which it needs
+rewritten by the passes before it), or that walks the tree in a way of its
+own.
+
+In a stage, the passes are found by the obj_type of each node, from the
+`obj_types` they declare; those that don't declare any are tried on every
+node.
+'''
+
+from mwx.ast.ast import TreeWalker, MWASTNode, tree_changed
+
+
+def is_fusible(pass_class):
+    """Whether a pass can share its walk with others: it walks the tree as
+       a TreeWalker does, down through every node
+    """
+    for name in ('walk', '_walk', '_visit', 'should_descend',
+                 'pre_visit', 'post_visit'):
+        if getattr(pass_class, name).im_func is not \
+           getattr(TreeWalker, name).im_func:
+            return False
+    return True
+
+
+def in_place(node, parent, parent_ctx, index):
+    """Whether node is still where the walk found it"""
+    if parent is None:
+        return True
+    if parent_ctx is MWASTNode.PROPERTY_CTX:
+        return parent.props.get(index) is node
+    children = parent.children
+    return (children is not None and index < len(children) and
+            children[index] is node)
+
+
+class FusedPasses(TreeWalker):
+    """Runs a stage of passes in a single walk: each pass is run on each node
+       in turn, on whatever node the passes before it left in place
+    """
+
+    def __init__(self, tree, walkers):
+        TreeWalker.__init__(self, tree)
+        self.walkers = walkers
+        self.removed = None
+
+        # the position of each pass in the stage
+        self.positions = dict((id(w), i) for (i, w) in enumerate(walkers))
+
+        # the passes for each obj_type, in order
+        self.any_type = [w for w in walkers if w.obj_types is None]
+        self.by_type = {}
+        for w in walkers:
+            for t in w.obj_types or ():
+                self.by_type[t] = None
+        for t in self.by_type:
+            self.by_type[t] = [w for w in walkers
+                               if w.obj_types is None or t in w.obj_types]
+
+    def reset(self):
+        TreeWalker.reset(self)
+        for w in self.walkers:
+            w.reset()
+
+    def dispatch(self, node):
+        return self.by_type.get(getattr(node, 'obj_type', None),
+                                self.any_type)
+
+    def trigger(self, node):
+        return True
+
+    def action(self, node, parent=None, parent_ctx=None, index=None):
+        self.removed = None
+
+        walkers = self.dispatch(node)
+        i = 0
+        while i < len(walkers):
+            walker = walkers[i]
+            i += 1
+
+            if not walker.trigger(node):
+                continue
+
+            obj_type = getattr(node, 'obj_type', None)
+            returned_node = walker.action(node, parent, parent_ctx, index)
+
+            if returned_node is not None:
+                node = returned_node
+            elif not in_place(node, parent, parent_ctx, index):
+                # removed: the passes after this one never see it
+                self.removed = node
+                return node
+            elif getattr(node, 'obj_type', None) == obj_type:
+                continue
+
+            # a different node, or a different obj_type: find the passes
+            # after this one for it
+            position = self.positions[id(walker)]
+            walkers = [w for w in self.dispatch(node)
+                       if self.positions[id(w)] > position]
+            i = 0
+
+        return node
+
+    def should_descend(self, node):
+        return node is not self.removed
+
+
+class PassManager(object):
+    """Runs a sequence of TreeWalker passes over a tree, fusing them into as
+       few walks as their dependencies allow.  The tree comes out as it
+       would if each pass walked it in turn, provided each pass that doesn't
+       say it `requires` an earlier one only reads and rewrites the node it
+       is given (and returns the node it put in its place, if any).
+    """
+
+    def __init__(self, pass_classes):
+        self.pass_classes = list(pass_classes)
+
+        for (i, c) in enumerate(self.pass_classes):
+            for r in c.requires:
+                if r not in self.pass_classes[:i]:
+                    raise Exception("Pass %s requires %s, which doesn't run "
+                                    "before it" % (c.__name__, r.__name__))
+
+        # each stage is a list of pass classes run in one walk
+        self.stages = []
+        stage = []
+        for c in self.pass_classes:
+            if not is_fusible(c):
+                if stage:
+                    self.stages.append(stage)
+                self.stages.append([c])
+                stage = []
+            elif [r for r in c.requires if r in stage]:
+                self.stages.append(stage)
+                stage = [c]
+            else:
+                stage.append(c)
+        if stage:
+            self.stages.append(stage)
+
+    def run(self, tree):
+        """Run the passes over tree; returns the tree"""
+        for stage in self.stages:
+            walkers = [c(tree) for c in stage]
+
+            # a pass on its own, or passes built not to continue after a
+            # rewrite, walk as they always have
+            if (len(walkers) == 1 or
+                [w for w in walkers if not w.continue_after_rewrite]):
+                for (c, walker) in zip(stage, walkers):
+                    if walker.tree is not tree:
+                        walker = c(tree)
+                    walker.walk()
+                    tree = walker.tree
+                continue
+
+            fused = FusedPasses(tree, walkers)
+            fused.walk()
+            tree = fused.tree
+
+        # passes may edit the nodes directly (their props dicts, say)
+        tree_changed(tree)
+
+        return tree
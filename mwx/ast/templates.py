@@ -1,9 +1,10 @@
 """This module provides machinery for evaluating mwx templates."""
 
 from ast import *
-from copy import copy
+from collections import OrderedDict
 import logging
 import string
+import warnings
 
 
 # helper subclass of string.Template for finding '@macro' style substitution
@@ -15,6 +16,45 @@ def mw_template_string(s, subs):
     return MWStringTemplate(s).substitute(subs)
 
 
+class CompiledStringTemplate(object):
+    """An MWStringTemplate split up, once, into its text and the names
+       substituted into it, to be substituted again and again
+    """
+
+    __slots__ = ('template', 'pieces')
+
+    def __init__(self, s):
+        self.template = MWStringTemplate(s)
+
+        # (text, name) pairs, for the text before each substitution (or the
+        # end of the string) and the name substituted (or None)
+        self.pieces = []
+        start = 0
+        for m in self.template.pattern.finditer(s):
+            if m.group('invalid') is not None:
+                # substitute() reports it
+                self.pieces = None
+                return
+            if m.group('escaped') is not None:
+                self.pieces.append((s[start:m.end() - 1], None))
+            else:
+                self.pieces.append((s[start:m.start()],
+                                    m.group('named') or m.group('braced')))
+            start = m.end()
+        self.pieces.append((s[start:], None))
+
+    def substitute(self, values):
+        if self.pieces is None:
+            return self.template.substitute(values)
+
+        result = []
+        for (text, name) in self.pieces:
+            result.append(text)
+            if name is not None:
+                result.append('%s' % (values[name],))
+        return ''.join(result)
+
+
 class SimpleReplacementTreeWalker(TreeWalker):
     """ Walk the AST and replace all a recognized templated references according
         to the supplied replacement_table dictionary
@@ -57,12 +97,20 @@ class SimpleReplacementTreeWalker(TreeWalker):
 
 
 class ExpressionSimplifier(TreeWalker):
-    """TreeWalker that attempts to simplify arithmetic expression"""
-    def __init__(self, tree):
+    """TreeWalker that attempts to simplify arithmetic expression.  The
+       nodes in simplified (a set of ids), and those below them, have been
+       simplified already, and are skipped.
+    """
+    def __init__(self, tree, simplified=()):
         TreeWalker.__init__(self, tree)
+        self.simplified = simplified
 
     def trigger(self, node):
-        return isinstance(node, MWExpression)
+        return (isinstance(node, MWExpression) and
+                id(node) not in self.simplified)
+
+    def should_descend(self, node):
+        return id(node) not in self.simplified
 
     def action(self, node, parent=None, parent_ctx=None, index=None):
         new_node = node.simplify()
@@ -79,6 +127,360 @@ class MaximumTreeRewritesExceededException (Exception):
                "Is there an infinite loop in a template?"
 
 
+class MaximumTemplateNodesExceededException (Exception):
+    def __init__(self, n):
+        self.n = n
+
+    def __str__(self):
+        return "Template expansions made more than %d nodes. " % self.n +\
+               "Is there a runaway template?"
+
+
+class RecursiveTemplateException (MaximumTreeRewritesExceededException):
+    def __init__(self, path):
+        self.path = path
+        self.n = len(path) - 1
+
+    def __str__(self):
+        return "Template %s refers to itself: %s" % (self.path[0],
+                                                     " -> ".join(self.path))
+
+
+def is_unresolved(node):
+    return node.unresolved
+
+
+def is_expression(node):
+    return isinstance(node, MWExpression)
+
+
+def contains_node(x, test):
+    """Whether x (a node or value, or a list of them) holds a node, among
+       the properties and children of its nodes, for which test is true
+    """
+    stack = [x]
+    while stack:
+        x = stack.pop()
+        if isinstance(x, MWASTNode):
+            if test(x):
+                return True
+            stack.extend(x.props.values())
+            if x.children:
+                stack.extend(x.children)
+        elif isiterable(x) and not isinstance(x, dict):
+            stack.extend(x)
+    return False
+
+
+def count_nodes(x):
+    """The number of nodes in x (a node, or a list of them), counting those
+       among the properties and children of its nodes
+    """
+    n = 0
+    stack = [x]
+    while stack:
+        x = stack.pop()
+        if isinstance(x, MWASTNode):
+            n += 1
+            stack.extend(x.props.values())
+            if x.children:
+                stack.extend(x.children)
+        elif isiterable(x) and not isinstance(x, dict):
+            stack.extend(x)
+    return n
+
+
+def find_nodes(x, test, skip=()):
+    """The nodes in x (a node, or a list of them), among the properties and
+       children of its nodes, for which test is true, leaving out those in
+       (and below) nodes of the classes in skip
+    """
+    found = []
+    stack = [x]
+    while stack:
+        x = stack.pop()
+        if isinstance(x, MWASTNode):
+            if isinstance(x, skip):
+                continue
+            if test(x):
+                found.append(x)
+            stack.extend(x.props.values())
+            if x.children:
+                stack.extend(x.children)
+        elif isiterable(x) and not isinstance(x, dict):
+            stack.extend(x)
+    return found
+
+
+def is_reference(node):
+    return isinstance(node, TemplateReference)
+
+
+def is_definition(node):
+    return isinstance(node, TemplateDefinition)
+
+
+def template_names(x, test, skip=()):
+    """The names of the template references (or definitions, as test says)
+       in x, as find_nodes finds them
+    """
+    return set([node.name for node in find_nodes(x, test, skip)])
+
+
+def template_references(template):
+    """The names that the body of a template refers to at every call, and
+       those it might refer to (in conditionals too), as two sets.
+       References to the template's arguments, and to the templates defined
+       in its body, aren't counted.
+    """
+    skip = (set(template.args) |
+            template_names(template.body, is_definition))
+    refers = template_names(template.body, is_reference,
+                            (TemplateIf, TemplateDefinition))
+    may_refer = template_names(template.body, is_reference,
+                               TemplateDefinition)
+    return (refers - skip, may_refer - skip)
+
+
+def template_bindings(names, templates):
+    """The templates (a dict, or a TemplateScope) that names (of template
+       references) refer to, and those their bodies refer to, in turn: a
+       dict of them by name (None for a name that isn't there)
+    """
+    bindings = {}
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name in bindings:
+            continue
+        template = bindings[name] = templates.get(name)
+        if template is not None:
+            pending.extend(template.expansion_plan().references)
+    return bindings
+
+
+def value_key(x):
+    """A hashable key for x (an argument value) that equal keys share only
+       with values that expand a template the same way: its type, and its
+       value, or (for nodes and lists) what it holds, in order.  Raises
+       TypeError for a value that can't be keyed.
+    """
+    if isinstance(x, MWASTNode):
+        key = [x.__class__]
+        state = x.__getstate__()
+        for name in sorted(state):
+            value = state[name]
+            if name == 'props':
+                key.append(tuple([(k, value_key(value[k]))
+                                  for k in value.keys()]))
+            else:
+                key.append((name, value_key(value)))
+        return tuple(key)
+    elif isinstance(x, dict):
+        return (type(x), tuple([(k, value_key(x[k])) for k in x.keys()]))
+    elif isiterable(x):
+        return (type(x), tuple([value_key(v) for v in x]))
+
+    hash(x)
+    return (type(x), x)
+
+
+def clone_value(x, memo):
+    """Copy x, along with the nodes, lists, dicts and tuples in it (each
+       once, however many places it appears, by way of memo); anything else
+       (strings, numbers, ParseResults) is shared with the copy
+    """
+    new = memo.get(id(x))
+    if new is not None:
+        return new
+
+    if isinstance(x, MWASTNode):
+        new = x.__class__.__new__(x.__class__)
+        memo[id(x)] = new
+        state = x.__getstate__()
+        for name in state:
+            state[name] = clone_value(state[name], memo)
+        new.__setstate__(state)
+    elif type(x) is list:
+        new = memo[id(x)] = []
+        new.extend([clone_value(v, memo) for v in x])
+    elif type(x) is dict:
+        new = memo[id(x)] = {}
+        for k in x:
+            new[k] = clone_value(x[k], memo)
+    elif type(x) is tuple:
+        new = memo[id(x)] = tuple([clone_value(v, memo) for v in x])
+    else:
+        new = x
+
+    return new
+
+
+# how each value in an ExpansionPlan is filled in
+PLAN_CONSTANT = 0   # as it is (a string without substitutions, a number)
+PLAN_STRING = 1     # by substituting the arguments into a string template
+PLAN_ARGUMENT = 2   # by the value of an argument
+PLAN_NODE = 3       # by cloning a node, as its NodePlan says
+PLAN_COPY = 4       # by a copy, without substitutions (clone_value)
+
+
+class NodePlan(object):
+    """How to clone a node of a template body: its properties that aren't
+       constants, as (key, kind, value) tuples; its children, as
+       (kind, value) tuples (or None to copy them as they are); and its
+       other attributes, copied as they are (or, for those it doesn't
+       pickle, as (name, value) pairs to set)
+    """
+
+    __slots__ = ('node', 'props', 'children', 'attributes', 'fixed')
+
+    def __init__(self, node):
+        self.node = node
+        self.props = []
+        self.children = None
+        self.attributes = []
+        self.fixed = []
+
+        state = node.__getstate__()
+        for name in state:
+            if name == 'props' or name == 'children':
+                continue
+            if state[name] is getattr(node, name):
+                self.attributes.append(name)
+            else:
+                self.fixed.append((name, state[name]))
+
+
+class ExpansionPlan(object):
+    """A template body, compiled to be expanded again and again: the
+       positions in it that a call fills in (the references to the
+       template's arguments, and the strings with '@' substitutions in
+       them), and the nodes between them, to be cloned.
+
+       The positions are those SimpleReplacementTreeWalker rewrites: the
+       properties and children of the nodes of the body (and of its
+       expressions, and the template definitions and conditionals in it)
+       but not the lists in their properties.  Each expansion is a fresh
+       copy of the body, which is left as it is.
+    """
+
+    def __init__(self, body, args):
+        self.args = frozenset(args)
+        self.node_plans = {}
+
+        # whether the body holds anything for the TemplateTreeRewriter (or
+        # the ExpressionSimplifier) to do
+        self.has_unresolved = False
+        self.has_expressions = False
+
+        # the names of the templates the body refers to
+        self.references = set()
+
+        self.body = [self.plan_value(x) for x in flatten(body)]
+
+        # the number of nodes cloned for each expansion
+        self.size = len(self.node_plans)
+
+    def plan_value(self, x):
+        if isinstance(x, TemplateReference):
+            if getattr(x, 'name', False) and x.name in self.args:
+                return (PLAN_ARGUMENT, x.name)
+        elif isinstance(x, str):
+            if '@' in x:
+                return (PLAN_STRING, CompiledStringTemplate(x))
+            return (PLAN_CONSTANT, x)
+
+        if isinstance(x, MWASTNode):
+            return (PLAN_NODE, self.plan_node(x))
+        elif isiterable(x) or isinstance(x, dict):
+            return (PLAN_COPY, x)
+        return (PLAN_CONSTANT, x)
+
+    def plan_node(self, node):
+        plan = self.node_plans.get(id(node))
+        if plan is not None:
+            return plan
+        plan = self.node_plans[id(node)] = NodePlan(node)
+
+        if node.unresolved:
+            self.has_unresolved = True
+        if isinstance(node, TemplateReference):
+            self.references.add(node.name)
+        if isinstance(node, MWExpression):
+            self.has_expressions = True
+
+        for k in node.props.keys():
+            (kind, value) = self.plan_value(node.props[k])
+            if kind is not PLAN_CONSTANT:
+                plan.props.append((k, kind, value))
+
+        if isinstance(node.children, list):
+            plan.children = [self.plan_value(c) for c in node.children]
+
+        return plan
+
+    def expand(self, values):
+        """A fresh copy of the body (a list of nodes), with values (a dict
+           of the values of the template's arguments) filled in
+        """
+        new_body = []
+        self.fill_children(new_body, self.body, values, {})
+        return new_body
+
+    def fill_value(self, kind, x, values, memo):
+        if kind is PLAN_CONSTANT:
+            return x
+        elif kind is PLAN_NODE:
+            return self.clone_node(x, values, memo)
+        elif kind is PLAN_STRING:
+            return x.substitute(values)
+        elif kind is PLAN_ARGUMENT:
+            return values[x]
+        else:
+            return clone_value(x, memo)
+
+    def fill_children(self, children, plans, values, memo):
+        for (kind, x) in plans:
+            if kind is PLAN_ARGUMENT and isiterable(values[x]):
+                # spliced in, as MWASTNode.rewrite does
+                value = values[x]
+                children.append(value[0])
+                for c in range(1, len(value)):
+                    children.append(value[c])
+            else:
+                children.append(self.fill_value(kind, x, values, memo))
+
+    def clone_node(self, plan, values, memo):
+        node = plan.node
+        new = memo.get(id(node))
+        if new is not None:
+            return new
+
+        new = memo[id(node)] = node.__class__.__new__(node.__class__)
+
+        props = node.props
+        if props is not empty_props:
+            props = props.copy()
+            for (k, kind, x) in plan.props:
+                if k in props:
+                    props[k] = self.fill_value(kind, x, values, memo)
+        new.props = props
+
+        if plan.children is None:
+            new.children = clone_value(node.children, memo)
+        else:
+            # (remembered first: a TemplateDefinition's body is its children)
+            new.children = memo[id(node.children)] = []
+            self.fill_children(new.children, plan.children, values, memo)
+
+        for name in plan.attributes:
+            setattr(new, name, clone_value(getattr(node, name), memo))
+        for (name, value) in plan.fixed:
+            setattr(new, name, value)
+
+        return new
+
+
 def create_template_definition(name=None, args=[], **kwargs):
     t = TemplateDefinition(name, args, **kwargs)
     return t
@@ -86,6 +488,8 @@ def create_template_definition(name=None, args=[], **kwargs):
 
 class TemplateDefinition (MWASTNode):
 
+    __slots__ = ('name', 'args', 'body', 'plan', 'prepared')
+
     def __init__(self, name=None, args=[], **kwargs):
 
         MWASTNode.__init__(self, 'template_definition', **kwargs)
@@ -93,16 +497,18 @@ class TemplateDefinition (MWASTNode):
         # todo: the mapping of this onto the MWASTNode base class is squirrely
 
         self.body = self.children
+        self.plan = None
+        self.prepared = None
 
         if name is not None:
             self.name = name
-            self.props['tag'] = name
+            self.set_prop('tag', name)
         else:
             self.name = self.props['tag']
 
         if args is not None:
             self.args = args
-            self.props['args'] = args  # TODO
+            self.set_prop('args', args)  # TODO
         else:
             self.args = self.props['args']
 
@@ -117,52 +523,156 @@ class TemplateDefinition (MWASTNode):
     def to_xml(self):
         return ''
 
-    def to_mwx(self, tablevel=0):
+    def iter_xml(self, indent=None, depth=0):
+        return iter(())
 
-        output_string = '' + tab * tablevel
+    def write_mwx_to(self, writer, tablevel=0):
+
+        output_string = '' + writer.style.tab * tablevel
         output_string += "def %s" % self.name
 
         if len(self.args) > 0:
-            output_string += '('
-            to_mwx(self.args)
-            output_string += ')'
+            # (the args themselves have never been written)
+            output_string += '()'
 
         if isiterable(self.body):
             if len(self.body) > 1:
-                output_string += "{\n"
-                body_content = [to_mwx(x, tablevel + 1) for x in self.body]
-                output_string += "\n".join(body_content) + "\n"
-                output_string += "}\n"
+                writer.write(output_string + "{\n")
+                for i, x in enumerate(self.body):
+                    if i > 0:
+                        writer.write("\n")
+                    writer.value(x, tablevel + 1)
+                writer.write("\n}\n")
             else:
-                output_string += " = " + to_mwx(self.body[0])
+                writer.write(output_string + " = " + to_mwx(self.body[0]))
         else:
-            output_string += " = " + to_mwx(self.body)
+            writer.write(output_string + " = " + to_mwx(self.body))
+
+    def __getstate__(self):
+        state = MWASTNode.__getstate__(self)
+        state['plan'] = None
+        state['prepared'] = None
+        return state
+
+    def expansion_plan(self):
+        """The body, compiled for expanding (see ExpansionPlan); compiled at
+           the first call of the template
+        """
+        plan = getattr(self, 'plan', None)
+        if plan is None:
+            plan = self.plan = ExpansionPlan(self.body, self.args)
+        return plan
+
+    def prepare(self, templates):
+        """Resolve, in a copy of the body, the template references and
+           conditionals that are the same at every call (those that don't
+           use the arguments, or templates defined in the body), with the
+           templates given, and compile it for expanding.
+
+           Returns (and keeps) the plan, with the (name, template) pairs
+           the resolved references depend on, in turn; or False if there is
+           nothing to resolve, or if it can't be resolved ahead of a call
+           (calls then resolve it, and report what goes wrong).
+        """
+        prepared = getattr(self, 'prepared', None)
+        if prepared is not None:
+            return prepared
+
+        # (a template that refers to itself in a conditional is expanded
+        # from its body while it's being prepared)
+        self.prepared = False
+
+        args = set(self.args)
+        local = template_names(self.body, is_definition)
+
+        def is_fixed(node):
+            for name in template_names(node, is_reference):
+                if name in args or name in local or name not in templates:
+                    return False
+            return True
 
-        return output_string
+        body = clone_value(self.body, {})
+        root = RootNode()
+        root.children = body
 
-    def __call__(self, args=[], templates={}):
-        "Apply the template"
+        fixed = [node for (node, parent, parent_ctx, index) in
+                 UnresolvedTemplateFinder(root).walk() if is_fixed(node)]
+        if not fixed:
+            return False
 
-        body = self.body
+        definitions = len(find_nodes(body, is_definition))
+        resolver = TemplateResolver(
+            templates, maximum_nodes=default_maximum_prepared_nodes)
+        try:
+            resolver.resolve(root, is_fixed)
+        except Exception as e:
+            logging.debug(e)
+            return False
 
-        if args is None or len(args) is not len(self.args):
-            raise Exception("Incorrect number of arguments to template")
+        # definitions put in by the expansions would be found at each call,
+        # and so change what the other references there refer to
+        if len(find_nodes(body, is_definition)) != definitions:
+            return False
 
-        replacement_table = dict(zip(self.args, args))
+        bindings = template_bindings(template_names(fixed, is_reference),
+                                     templates)
+        self.prepared = (ExpansionPlan(body, self.args), bindings.items())
+        return self.prepared
+
+    def plan_for(self, templates):
+        """The plan to expand the template with, for the templates in
+           scope at a call: the prepared one (see prepare), if it was
+           prepared with the templates in scope, or else the plan of the
+           body as it is
+        """
+        prepared = getattr(self, 'prepared', None)
+        if prepared is None:
+            prepared = self.prepare(templates)
+
+        if prepared:
+            (plan, bindings) = prepared
+            for (name, template) in bindings:
+                if templates.get(name) is not template:
+                    break
+            else:
+                return plan
 
-        # attach the body to a temporary root node
-        body_root = RootNode(children=body)
+        return self.expansion_plan()
 
-        # apply simple macro-value replacement
-        walker = SimpleReplacementTreeWalker(body_root, replacement_table)
-        walker.walk()
+    def __call__(self, args=[], templates=None, resolver=None):
+        """Apply the template.  resolver is the TemplateResolver resolving
+           the reference to it, if any
+        """
 
-        new_tree = walker.tree
+        if templates is None:
+            templates = {}
 
-        # apply a full round of macro evaluation in this context
-        template_rewriter = TemplateTreeRewriter(new_tree, templates=templates)
-        template_rewriter.rewrite_tree()
-        new_tree = template_rewriter.tree.children
+        if args is None or len(args) is not len(self.args):
+            raise Exception("Incorrect number of arguments to template")
+
+        plan = self.plan_for(templates)
+
+        if resolver is None:
+            resolver = TemplateResolver(templates)
+        resolver.charge(plan.size)
+
+        # a fresh copy of the body, with the argument values filled in
+        new_tree = plan.expand(dict(zip(self.args, args)))
+
+        # apply a full round of macro evaluation in this context, if there
+        # are references (or expressions) to evaluate
+        if plan.has_unresolved or contains_node(args, is_unresolved):
+            new_root = RootNode()
+            new_root.children = new_tree
+            template_rewriter = TemplateTreeRewriter(new_root,
+                                                     templates=templates,
+                                                     resolver=resolver)
+            template_rewriter.rewrite_tree()
+            new_tree = template_rewriter.tree.children
+        elif plan.has_expressions or contains_node(args, is_expression):
+            new_root = RootNode()
+            new_root.children = new_tree
+            ExpressionSimplifier(new_root).walk()
 
         if len(new_tree) == 1:
             new_tree = new_tree[0]
@@ -170,28 +680,134 @@ class TemplateDefinition (MWASTNode):
         return new_tree
 
 
+# the number of expansions an ExpansionCache keeps, by default
+default_expansion_cache_size = 1024
+
+
+class ExpansionCache(object):
+    """A size-bounded LRU cache of template expansions, keyed by the
+       template (and the plan it's expanded from, see
+       TemplateDefinition.plan_for) and the values of its arguments (see
+       value_key), and, for templates whose expansions have references of
+       their own to resolve, the templates they might refer to (see
+       template_bindings).
+
+       Expansions that are a copy of the template body with the arguments
+       filled in, and nothing more, aren't kept: they would cost as much to
+       copy out of the cache.  The cache keeps its own copy of each
+       expansion, and hands out copies of it.
+
+       Each TemplateResolver tree (that is, each resolve_templates) has a
+       cache of its own, so that the templates it keeps go when it does.
+    """
+
+    def __init__(self, max_entries=default_expansion_cache_size):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, template, args, templates):
+        """The key for template applied to args, or None if the expansion
+           isn't to be kept
+        """
+        if (self.max_entries <= 0 or
+            not isinstance(template, TemplateDefinition) or
+            args is None or len(args) != len(template.args)):
+            return None
+
+        plan = template.plan_for(templates)
+        rewrites = plan.has_unresolved or contains_node(args, is_unresolved)
+        if not (rewrites or plan.has_expressions or
+                contains_node(args, is_expression)):
+            return None
+
+        try:
+            key = (template, plan, tuple([value_key(a) for a in args]))
+            if rewrites:
+                names = plan.references | template_names(args, is_reference)
+                key += (frozenset(template_bindings(names,
+                                                    templates).items()),)
+            hash(key)
+        except TypeError:
+            return None
+
+        return key
+
+    def expand(self, template, args, templates=None, resolver=None):
+        """Apply template to args, as template(args, templates, resolver)
+           does
+        """
+        if templates is None:
+            templates = {}
+        key = self.key(template, args, templates)
+        if key is None:
+            return template(args, templates=templates, resolver=resolver)
+
+        if key in self.entries:
+            self.hits += 1
+            (result, size) = self.entries.pop(key)
+
+            # (the copy handed out counts as nodes an expansion made; on a
+            # miss, the expansion has counted them already)
+            if resolver is not None:
+                resolver.charge(size)
+        else:
+            self.misses += 1
+            result = template(args, templates=templates, resolver=resolver)
+            size = count_nodes(result)
+        self.entries[key] = (result, size)
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+        return clone_value(result, {})
+
+    def stats(self):
+        """The hits, misses and evictions so far, and the number of
+           expansions kept (out of max_entries)
+        """
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'max_entries': self.max_entries}
+
+    def clear(self):
+        """Drop the kept expansions, and zero the stats"""
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
 class TemplateReference (MWASTNode):
     """A node representing a template reference, that is, a reference that
        should be expanded according to a previously defined template definition
     """
+
+    __slots__ = ('name', 'args', 'resolved')
+
     def __init__(self, name=None, args=None, **kwargs):
         MWASTNode.__init__(self, "template_reference", **kwargs)
 
         if name is not None:
             self.name = name
-            self.props['tag'] = name
+            self.set_prop('tag', name)
         else:
             self.name = self.props['tag']
 
         if args is not None:
             self.args = args
-            self.props['args'] = args
+            self.set_prop('args', args)
         else:
             self.args = self.props['args']
 
         # deposit the args in the "children" field
         # recursive descent can find them
-        self.children += self.args
+        self.add_children(self.args)
 
         self.resolved = False
 
@@ -199,7 +815,7 @@ class TemplateReference (MWASTNode):
     def unresolved(self):
         return not self.resolved
 
-    def resolve(self, templates):
+    def resolve(self, templates, resolver=None):
         name = self.name
         args = self.args
 
@@ -211,7 +827,7 @@ class TemplateReference (MWASTNode):
         # resolve the template arguments, if needed
         def attempt_resolve(arg):
             if getattr(arg, 'resolve', False):
-                return arg.resolve(templates)
+                return arg.resolve(templates, resolver)
             else:
                 return arg
         args = [attempt_resolve(a) for a in args]
@@ -221,9 +837,11 @@ class TemplateReference (MWASTNode):
         if len(template.args) != len(args):
             raise InvalidTemplateArgsException(template, self)
 
-        result = template(args, templates=templates)
+        if resolver is None:
+            return template(args, templates=templates)
 
-        return result
+        return resolver.expansion_cache.expand(template, args, templates,
+                                               resolver)
 
     def to_mwx(self, tablevel=0):
         result = tab * tablevel
@@ -236,6 +854,8 @@ class TemplateReference (MWASTNode):
 
 class TemplateIf(MWASTNode):
 
+    __slots__ = ('condition', 'body', 'else_body', 'resolved')
+
     def __init__(self, condition, body=[], else_body=[]):
 
         MWASTNode.__init__(self, 'template_if')
@@ -252,25 +872,39 @@ class TemplateIf(MWASTNode):
     def unresolved(self):
         return not self.resolved
 
-    def resolve(self, templates):
-
-        # TODO: error handling
-        if getattr(self.condition, 'eval', False):
-            try:
-                c = self.condition.eval()
-            except Exception as e:
-                logging.debug(e)
-                return None
-        else:
-            try:
-                c = eval(self.condition)
-            except:
-                c = False
+    def resolve(self, templates, resolver=None):
+        """The body or the else body, resolved, as the condition says.  A
+           condition that is a name (or anything else but an expression)
+           with no value at parse time is false; an expression that can't
+           be evaluated raises TemplateConditionException.
+        """
+        # (mwx.ast.evaluation is kept off the path of "import mwx")
+        from mwx.ast.evaluation import value_of, ExpressionError
+
+        # (the condition as the template's arguments were filled in: one
+        # that is just an argument is only replaced among the children)
+        condition = self.children[0]
+
+        # references to other templates (values, say) are filled in first
+        if find_nodes(condition, is_reference):
+            resolved = resolve_templates([condition], templates, resolver)
+            if len(resolved) != 1:
+                raise TemplateConditionException(
+                    self, "the condition expands to %d values" % len(resolved))
+            condition = resolved[0]
+
+        try:
+            c = value_of(condition)
+        except ExpressionError as e:
+            if isinstance(condition, MWExpression):
+                raise TemplateConditionException(self, e)
+            logging.debug(e)
+            c = False
 
         if c:
-            return resolve_templates(self.body, templates)
+            return resolve_templates(self.body, templates, resolver)
         else:
-            return resolve_templates(self.else_body, templates)
+            return resolve_templates(self.else_body, templates, resolver)
 
 
 class TemplateDefinitionFinder(TreeWalker):
@@ -293,6 +927,83 @@ class TemplateDefinitionFinder(TreeWalker):
         self.result[node.name] = node
 
 
+class TemplateGraph(object):
+    """The references between a set of template definitions (a dict of
+       them, by name), found in their bodies as the definitions are
+       collected: refers[name] is the set of the names (of the set) that
+       the body of a template refers to at every call, may_refer[name]
+       those it might refer to (in conditionals too), as
+       template_references finds them.
+
+       order lists the names so that each comes after those it might
+       refer to (but for the conditionals that lead back to it).  A
+       template that refers to itself at every call, directly or through
+       others, can never be expanded: RecursiveTemplateException is
+       raised straight away.
+    """
+
+    def __init__(self, templates):
+        self.templates = templates
+        self.refers = {}
+        self.may_refer = {}
+
+        for name in templates:
+            (refers, may_refer) = template_references(templates[name])
+            self.refers[name] = set([n for n in refers if n in templates])
+            self.may_refer[name] = set([n for n in may_refer
+                                        if n in templates])
+
+        cycle = self.depth_first(self.refers)[1]
+        if cycle is not None:
+            raise RecursiveTemplateException(cycle)
+
+        (self.order, cycle) = self.depth_first(self.may_refer)
+
+    @staticmethod
+    def depth_first(edges):
+        """Walk the graph of edges (a dict of the set of names each name
+           leads to) depth first, in name order: returns the names in the
+           order they were finished with (each after those it leads to),
+           and the first path found from a name back to itself (or None)
+        """
+        order = []
+        cycle = None
+
+        # the names on the path walked so far (True), and done with (False)
+        on_path = {}
+
+        for start in sorted(edges):
+            if start in on_path:
+                continue
+
+            on_path[start] = True
+            path = [start]
+            stack = [iter(sorted(edges[start]))]
+            while stack:
+                for name in stack[-1]:
+                    if name not in on_path:
+                        on_path[name] = True
+                        path.append(name)
+                        stack.append(iter(sorted(edges[name])))
+                        break
+                    elif on_path[name] and cycle is None:
+                        cycle = path[path.index(name):] + [name]
+                else:
+                    name = path.pop()
+                    on_path[name] = False
+                    order.append(name)
+                    stack.pop()
+
+        return (order, cycle)
+
+    def prepare(self, templates):
+        """Prepare each template (see TemplateDefinition.prepare), with the
+           templates in scope, after those it refers to
+        """
+        for name in self.order:
+            self.templates[name].prepare(templates)
+
+
 class InvalidTemplateArgsException(Exception):
 
     def __init__(self, template, reference):
@@ -315,6 +1026,19 @@ class UnresolvedTemplateReferencesException (Exception):
         return "Unresolved template references: %s" % (str(self.unresolved))
 
 
+class TemplateConditionException(UnresolvedTemplateReferencesException):
+    """The condition of a TemplateIf is an expression that can't be
+       evaluated at parse time
+    """
+
+    def __init__(self, node, error):
+        UnresolvedTemplateReferencesException.__init__(self, [node])
+        self.error = error
+
+    def __str__(self):
+        return "Unable to evaluate template condition: %s" % self.error
+
+
 class TemplateReferenceRewriter(TreeWalker):
     """An AST Walker object that finds unresolved template references and
        attempts to fill them in with appropriate content
@@ -355,12 +1079,214 @@ class TemplateReferenceRewriter(TreeWalker):
             self.unresolved_nodes.append(node)
 
 
+class UnresolvedTemplateFinder(TreeWalker):
+    """Find the unresolved template references and conditionals in a tree,
+       outside of template definitions, with where each is: a list of
+       (node, parent, parent_ctx, index) tuples, in the order a
+       TemplateReferenceRewriter would come to them
+    """
+
+    def reset(self):
+        self.result = []
+
+    def trigger(self, node):
+        return getattr(node, 'unresolved', False)
+
+    def action(self, node, parent=None, parent_ctx=None, index=None):
+        self.result.append((node, parent, parent_ctx, index))
+
+    def should_descend(self, node):
+        return not (isinstance(node, (TemplateDefinition, TemplateIf)) or
+                    getattr(node, 'unresolved', False))
+
+
+# how deeply template expansions may nest, and how many nodes the
+# expansions for a tree may make in all, by default
+default_maximum_template_depth = 100
+default_maximum_template_nodes = 10 ** 6
+
+# how many nodes the expansions put in a template body, as it's prepared,
+# may make (bodies that would grow bigger are resolved at each call)
+default_maximum_prepared_nodes = 10 ** 4
+
+
+class TemplateScope(object):
+    """The templates in scope in a tree being resolved: those defined in the
+       tree, by name, over those of the scope it's nested in (parent: a
+       TemplateScope, or a dict of templates, or None).  A nested scope
+       shares its parent's templates, rather than copying them, and a
+       template is looked up through the scopes, innermost first, as they
+       are at the time (templates defined in a scope after others were
+       nested in it are found from those too).
+    """
+
+    __slots__ = ('defined', 'parent')
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.defined = {}
+
+    def update(self, templates):
+        self.defined.update(templates)
+
+    def get(self, name, default=None):
+        scope = self
+        while isinstance(scope, TemplateScope):
+            template = scope.defined.get(name)
+            if template is not None:
+                return template
+            scope = scope.parent
+
+        if scope is None:
+            return default
+        return scope.get(name, default)
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __getitem__(self, name):
+        template = self.get(name)
+        if template is None:
+            raise KeyError(name)
+        return template
+
+
+class TemplateResolver(object):
+    """Resolves the template references and conditionals in a tree, in
+       place: they are found in a single walk, and each is replaced by its
+       expansion in turn.  An expansion comes back resolved already (by a
+       resolver nested in this one, for the templates it refers to in
+       turn), so nothing is walked twice.
+
+       Expansions may nest maximum_depth deep, counted along each chain of
+       expansions, and make maximum_nodes nodes in all (counted by the
+       resolver the others are nested in).
+
+       The expansions put in the tree have had their expressions
+       simplified already: their nodes are listed (by id) in simplified.
+       The templates in scope are a TemplateScope, nested in those given.
+       A nested resolver uses the scope it's given as it is, until the tree
+       defines templates of its own (see define): most expansions define
+       none, and a lookup then goes through no more scopes than it must.
+       Templates are expanded through expansion_cache, an ExpansionCache
+       shared by the resolvers nested in the same root (a new one, unless
+       one is given).
+    """
+
+    def __init__(self, templates=None,
+                 maximum_depth=default_maximum_template_depth,
+                 maximum_nodes=default_maximum_template_nodes, parent=None,
+                 expansion_cache=None):
+        if parent is None or templates is None:
+            self.templates = TemplateScope(templates)
+            self.scoped = True
+        else:
+            self.templates = templates
+            self.scoped = False
+
+        self.maximum_depth = maximum_depth
+        self.maximum_nodes = maximum_nodes
+
+        if parent is None:
+            self.depth = 0
+            self.root = self
+            if expansion_cache is None:
+                expansion_cache = ExpansionCache()
+            self.expansion_cache = expansion_cache
+        else:
+            self.depth = parent.depth + 1
+            self.root = parent.root
+            self.expansion_cache = parent.expansion_cache
+
+        if self.depth > self.maximum_depth:
+            raise MaximumTreeRewritesExceededException(self.depth)
+
+        # the number of nodes made by expansions (kept by the root)
+        self.nodes = 0
+
+        self.simplified = set()
+
+    def nested(self, templates):
+        """A resolver for an expansion made while resolving this tree"""
+        return TemplateResolver(templates, self.maximum_depth,
+                                self.maximum_nodes, parent=self)
+
+    def define(self, templates):
+        """Add templates (a dict, by name) defined in the tree to the scope,
+           giving the resolver a scope of its own first if it hasn't one
+        """
+        if not self.scoped:
+            self.templates = TemplateScope(self.templates)
+            self.scoped = True
+        self.templates.update(templates)
+
+    def charge(self, n):
+        """Count n nodes made by an expansion against maximum_nodes"""
+        root = self.root
+        root.nodes += n
+        if root.nodes > self.maximum_nodes:
+            raise MaximumTemplateNodesExceededException(self.maximum_nodes)
+
+    def resolve(self, tree, select=None):
+        """Resolve the references and conditionals in tree; returns the tree.
+           If select is given, only those it's true for are resolved (the
+           others are left as they are).
+        """
+
+        unresolved = []
+
+        # how far the children of each node have moved along, as the
+        # expansions before them were put in
+        moved = {}
+
+        for (node, parent, parent_ctx, index) in \
+                UnresolvedTemplateFinder(tree).walk():
+
+            if select is not None and not select(node):
+                continue
+
+            if parent_ctx is MWASTNode.CHILD_CTX:
+                index += moved.get(id(parent), 0)
+
+            result = node.resolve(self.templates, self)
+
+            if result is None:
+                unresolved.append(node)
+                continue
+
+            node.resolved = True
+            parent.rewrite(parent_ctx, index, result)
+
+            if isiterable(result):
+                if parent_ctx is MWASTNode.CHILD_CTX:
+                    moved[id(parent)] = (moved.get(id(parent), 0) +
+                                         len(result) - 1)
+                self.simplified.update([id(x) for x in result
+                                        if isinstance(x, MWASTNode)])
+            elif isinstance(result, MWASTNode):
+                self.simplified.add(id(result))
+
+        if len(unresolved) > 0:
+            # TODO come up with a list of what went wrong
+            raise UnresolvedTemplateReferencesException(unresolved)
+
+        return tree
+
+
 class TemplateTreeRewriter (object):
     """ An object that finds and coordinates the rewriting of templates
-        references in an AST.
+        references in an AST.  maximum_rewrites is the old name of
+        maximum_depth, and is deprecated.
     """
 
-    def __init__(self, tree, maximum_rewrites=15, templates={}):
+    def __init__(self, tree, maximum_depth=default_maximum_template_depth,
+                 templates=None, maximum_nodes=default_maximum_template_nodes,
+                 resolver=None, expansion_cache=None, maximum_rewrites=None):
+        if maximum_rewrites is not None:
+            warnings.warn("maximum_rewrites is deprecated, use maximum_depth",
+                          DeprecationWarning, stacklevel=2)
+            maximum_depth = maximum_rewrites
+
         if getattr(tree, '__iter__', False):
             self.tree = RootNode(children=tree)
             self.has_tmp_root_node = True
@@ -368,39 +1294,42 @@ class TemplateTreeRewriter (object):
             self.tree = tree
             self.has_tmp_root_node = False
 
-        self.templates = copy(templates)
-        self.maximum_rewrites = maximum_rewrites
+        # resolving an expansion for the resolver of an enclosing tree, or
+        # a tree of its own
+        if resolver is not None:
+            self.resolver = resolver.nested(templates)
+        else:
+            self.resolver = TemplateResolver(templates, maximum_depth,
+                                             maximum_nodes,
+                                             expansion_cache=expansion_cache)
+
+        self.templates = self.resolver.templates
 
     def find_templates(self):
         walker = TemplateDefinitionFinder(self.tree)
-        self.templates.update(walker.walk())
+        found = walker.walk()
+        if not found:
+            return
+
+        graph = TemplateGraph(found)
+        self.resolver.define(found)
+        self.templates = self.resolver.templates
+
+        # the templates of the tree itself are prepared now, those in
+        # expansions at their first call
+        if self.resolver.depth == 0:
+            graph.prepare(self.templates)
 
     def rewrite_tree(self):
         # build a dictionary of template declarations
         self.find_templates()
 
-        # build an tree-walker object that will rewrite the tree
-        # replacing references with their values
-        rewriter = TemplateReferenceRewriter(self.tree, self.templates)
-
-        unresolved = rewriter.walk()
-        self.tree = rewriter.tree
-
-        count = 0
-        while(len(unresolved) > 0 and count < self.maximum_rewrites):
-            unresolved = rewriter.walk()
-            logging.debug("Unresolved elements: %s" % unresolved)
-            count += 1
-
-        if count == self.maximum_rewrites:
-            raise MaximumTreeRewritesExceededException(count)
-
-        if len(unresolved) > 0:
-            # TODO come up with a list of what went wrong
-            raise UnresolvedTemplateReferencesException(unresolved)
+        # replace the references with their values
+        self.tree = self.resolver.resolve(self.tree)
 
         # Simplify expressions to the extent possible
-        simplifier = ExpressionSimplifier(self.tree)
+        simplifier = ExpressionSimplifier(self.tree,
+                                          self.resolver.simplified)
         simplifier.walk()
 
         self.tree = simplifier.tree
@@ -411,7 +1340,10 @@ class TemplateTreeRewriter (object):
         return self.tree
 
 
-def resolve_templates(tree, templates={}):
+def resolve_templates(tree, templates=None, resolver=None,
+                      expansion_cache=None):
 
-    tree_rewriter = TemplateTreeRewriter(tree, templates=templates)
+    tree_rewriter = TemplateTreeRewriter(tree, templates=templates,
+                                         resolver=resolver,
+                                         expansion_cache=expansion_cache)
     return tree_rewriter.rewrite_tree()
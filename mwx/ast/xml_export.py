@@ -4,6 +4,7 @@ old MWXML syntax.
 '''
 
 from mwx.ast.templates import *
+from mwx.ast.passes import PassManager
 from mwx.constants import *
 import re
 
@@ -13,6 +14,7 @@ registry = []
 class DrawsSyntaxRewriter(TreeWalker):
 
     triggered_types = container_types
+    obj_types = triggered_types
 
     def trigger(self, node):
         if (isinstance(node, MWASTNode) and
@@ -25,7 +27,7 @@ class DrawsSyntaxRewriter(TreeWalker):
     def action(self, node, parent=None, parent_ctx=None, index=None):
         # parse and rewrite the 'draws' property
         if 'draws' in node.props:
-            draws = node.props.pop('draws')
+            draws = node.pop_prop('draws')
 
             r = re.compile(r'\"?(\d+)\s*(cycles|samples)\"?')
             m = r.match(draws)
@@ -34,8 +36,8 @@ class DrawsSyntaxRewriter(TreeWalker):
                 nsamples = int(m.group(1))
                 method = m.group(2).upper()
 
-                node.props['nsamples'] = nsamples
-                node.props['sampling_method'] = method
+                node.set_prop('nsamples', nsamples)
+                node.set_prop('sampling_method', method)
             else:
                 raise Exception('Invalid "draws" specification: %s' % draws)
 
@@ -44,6 +46,8 @@ registry.append(DrawsSyntaxRewriter)
 
 class TypeAliasRewriter(TreeWalker):
 
+    obj_types = type_aliases.keys()
+
     def trigger(self, node):
         if (isinstance(node, MWASTNode) and
             node.obj_type in type_aliases.keys()):
@@ -52,7 +56,7 @@ class TypeAliasRewriter(TreeWalker):
         return False
 
     def action(self, node, parent=None, parent_ctx=None, index=None):
-        node.obj_type = type_aliases[node.obj_type]
+        node.set_obj_type(type_aliases[node.obj_type])
 
 registry.append(TypeAliasRewriter)
 
@@ -65,10 +69,7 @@ def do_registered_rewrites(tree):
     else:
         has_tmp_root = False
 
-    for rewriter_class in registry:
-        rewriter = rewriter_class(tree)
-        rewriter.walk()
-        tree = rewriter.tree
+    tree = PassManager(registry).run(tree)
 
     if has_tmp_root:
         tree = tree.children
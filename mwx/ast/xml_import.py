@@ -4,6 +4,7 @@ Smoothes over differences betweem MWXML syntax and mwx
 '''
 
 from mwx.ast import *
+from mwx.ast.passes import PassManager
 from mwx.constants import shorthand_actions, reverse_type_aliases
 
 registry = []
@@ -18,6 +19,7 @@ def registered(c):
 class PromoteGenericActions (TreeWalker):
 
     promoted_types = shorthand_actions.keys() + ['assignment']
+    obj_types = ['action']
 
     def trigger(self, node):
 
@@ -27,19 +29,19 @@ class PromoteGenericActions (TreeWalker):
                 node.props['type'].lower() in self.promoted_types)
 
     def action(self, node, parent=None, parent_ctx=None, index=None):
-        action_type = node.props.pop('type').lower()
+        action_type = node.pop_prop('type').lower()
 
         # generate a new, specialized version
         if action_type == 'assignment':
-            var = node.props.pop('variable', None)
-            val = node.props.pop('value', None)
+            var = node.pop_prop('variable', None)
+            val = node.pop_prop('value', None)
 
             if var is None or val is None:
                 raise Exception('Cannot promote invalid assignment action')
             replacement = AssignmentAction(variable=var, value=val, children=node.children)
         else:
             primary_arg_name = shorthand_actions[action_type]
-            primary_arg = node.props.pop(primary_arg_name, None)
+            primary_arg = node.pop_prop(primary_arg_name, None)
 
             replacement = Action(action_type, primary_arg, props=node.props, children=node.children)
 
@@ -51,6 +53,8 @@ class PromoteGenericActions (TreeWalker):
 @registered
 class PromoteVariables (TreeWalker):
 
+    obj_types = ['variable']
+
     def trigger(self, node):
         return (isinstance(node, MWASTNode) and
                 node.obj_type == 'variable')
@@ -66,6 +70,8 @@ class PromoteVariables (TreeWalker):
 @registered
 class DeleteMarkers (TreeWalker):
 
+    obj_types = ['action_marker', 'transition_marker']
+
     def trigger(self, node):
         return (isinstance(node, MWASTNode) and
                 (node.obj_type == 'action_marker' or
@@ -99,12 +105,14 @@ class DeleteJunkProperties (TreeWalker):
 @registered
 class ReverseTypeAliasRewriter(TreeWalker):
 
+    obj_types = reverse_type_aliases.keys()
+
     def trigger(self, node):
         return (isinstance(node, MWASTNode) and
                 node.obj_type in reverse_type_aliases.keys())
 
     def action(self, node, parent=None, parent_ctx=None, index=None):
-        node.obj_type = reverse_type_aliases[node.obj_type]
+        node.set_obj_type(reverse_type_aliases[node.obj_type])
 
         return None
 
@@ -112,6 +120,8 @@ class ReverseTypeAliasRewriter(TreeWalker):
 @registered
 class PromoteTransitions(TreeWalker):
 
+    obj_types = ['transition']
+
     def trigger(self, node):
         return  (isinstance(node, MWASTNode) and node.obj_type == 'transition')
 
@@ -145,6 +155,12 @@ class PromoteTransitions(TreeWalker):
 @registered
 class PromoteStateObjects (TreeWalker):
 
+    obj_types = ['state', 'task_system_state']
+
+    # the actions and transitions of a state are taken as they are, so they
+    # must have been promoted first
+    requires = (PromoteGenericActions, PromoteTransitions)
+
     def trigger(self, node):
         return  (isinstance(node, MWASTNode) and
                  (node.obj_type == 'state' or
@@ -172,6 +188,7 @@ class PromoteStateObjects (TreeWalker):
 class SilenceFolders(TreeWalker):
 
     folder_obj_types = ['folder', 'variables', 'io_devices', 'sounds', 'stimuli', 'filters', 'optimizers']
+    obj_types = folder_obj_types
 
     def trigger(self, node):
         return isinstance(node, MWASTNode) and node.obj_type in self.folder_obj_types
@@ -188,10 +205,7 @@ def do_registered_xml_import_rewrites(tree):
     else:
         has_tmp_root = False
 
-    for rewriter_class in registry:
-        rewriter = rewriter_class(tree)
-        rewriter.walk()
-        tree = rewriter.tree
+    tree = PassManager(registry).run(tree)
 
     if has_tmp_root:
         tree = tree.children
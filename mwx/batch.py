@@ -0,0 +1,259 @@
+"""Batch compilation of many MWX (or MW XML) files (see mwx -o / -j).
+
+   The inputs can be files, directories (searched recursively for .mw
+   files) and glob patterns.  Each file is compiled into a tree under an
+   output directory that mirrors the layout of the inputs: a file is placed
+   at its path relative to the directory it was found under (the directory
+   argument itself, or the part of a glob pattern before its first
+   wildcard).
+
+   The files are compiled by a pool of worker processes.  Each worker builds
+   its parsers (and so the grammar) once, and reuses them for every file it
+   is given.  A failure in one file is recorded in its BatchResult, and
+   doesn't stop the others.
+"""
+
+import os
+import glob
+import multiprocessing
+from timeit import default_timer as clock
+
+
+# output formats, and the extensions of the files they are written to
+output_extensions = {'xml': '.xml', 'mwx': '.mw'}
+
+input_extensions = ('.mw', '.xml')
+
+
+class BatchJob(object):
+    """One input file, and where its outputs go"""
+
+    def __init__(self, index, input_path, outputs):
+        self.index = index
+        self.input_path = input_path
+
+        # list of (format, output path)
+        self.outputs = outputs
+
+
+class BatchResult(object):
+    """The outcome of a BatchJob; error is None if it succeeded"""
+
+    def __init__(self, job, elapsed, error=None):
+        self.job = job
+        self.elapsed = elapsed
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def wildcard_root(pattern):
+    """The directory part of a glob pattern before its first wildcard"""
+    root = os.path.dirname(pattern)
+    while glob.has_magic(root):
+        root = os.path.dirname(root)
+    return root or '.'
+
+
+def find_input_files(arguments):
+    """Expand files, directories and glob patterns into a list of
+       (path, root) pairs, where root is the directory that the path's
+       place in the output tree is relative to.  Each file is only listed
+       once.
+    """
+    found = []
+    seen = set()
+
+    def add(path, root):
+        key = os.path.realpath(path)
+        if key not in seen:
+            seen.add(key)
+            found.append((path, root))
+
+    for argument in arguments:
+        if os.path.isdir(argument):
+            for directory, subdirectories, filenames in os.walk(argument):
+                subdirectories.sort()
+                for filename in sorted(filenames):
+                    if os.path.splitext(filename)[-1] == '.mw':
+                        add(os.path.join(directory, filename), argument)
+        elif glob.has_magic(argument):
+            matches = sorted(glob.glob(argument))
+            if not matches:
+                raise Exception("No files match %s" % argument)
+            root = wildcard_root(argument)
+            for path in matches:
+                if os.path.isfile(path):
+                    add(path, root)
+        elif os.path.isfile(argument):
+            add(argument, os.path.dirname(argument) or '.')
+        else:
+            raise Exception("No such file or directory: %s" % argument)
+
+    return found
+
+
+def make_jobs(input_files, output_dir, formats):
+    """Build a BatchJob for each (path, root) pair, with one output per
+       format under output_dir
+    """
+    jobs = []
+    sources = {}
+    for index, (path, root) in enumerate(input_files):
+        if os.path.splitext(path)[-1] not in input_extensions:
+            raise Exception("Unknown file extension: %s" % path)
+
+        relative_path = os.path.relpath(path, root)
+        stem = os.path.splitext(os.path.join(output_dir, relative_path))[0]
+        outputs = [(f, stem + output_extensions[f]) for f in formats]
+
+        targets = [p for f, p in outputs]
+        if os.path.realpath(path) in [os.path.realpath(p) for p in targets]:
+            raise Exception("%s would be overwritten by its own output" % path)
+
+        for target in targets:
+            if target in sources:
+                raise Exception("%s and %s would both be compiled to %s" %
+                                (sources[target], path, target))
+            sources[target] = path
+
+        jobs.append(BatchJob(index, path, outputs))
+    return jobs
+
+
+# ------------------------------
+# Workers
+# ------------------------------
+
+# the parsers of this (worker) process, built by init_worker
+worker_parsers = None
+worker_options = None
+
+
+def init_worker(options):
+    """Build the parsers that this process will use for all of its jobs.
+       options is a dict with the significant_whitespace, process_templates
+       and cache_dir settings.
+    """
+    global worker_parsers, worker_options
+    from mwx.parser import MWXParser, MWXMLParser
+
+    worker_options = options
+    worker_parsers = {
+        '.mw': MWXParser(significant_whitespace=options['significant_whitespace'],
+                         cache_dir=options['cache_dir']),
+        '.xml': MWXMLParser()}
+
+
+def compile_file(job):
+    """Compile one BatchJob in this process, and return its BatchResult"""
+    from mwx.parser import document_errors, format_document_error
+
+    tic = clock()
+    try:
+        extension = os.path.splitext(job.input_path)[-1]
+        parser = worker_parsers[extension]
+
+        with open(job.input_path, 'r') as f:
+            contents = f.read()
+
+        base_path = os.path.dirname(job.input_path)
+        process_templates = worker_options['process_templates']
+        if extension == '.mw':
+            results = parser.parse_document(contents, process_templates,
+                                            base_path)
+        else:
+            results = parser.parse_string(contents, process_templates,
+                                          base_path)
+
+        for output_format, output_path in job.outputs:
+            directory = os.path.dirname(output_path)
+            if directory and not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    # another worker got there first
+                    if not os.path.isdir(directory):
+                        raise
+
+            with open(output_path, 'w') as f:
+                if output_format == 'xml':
+                    results.write_xml(f)
+                else:
+                    results.write_mwx(f)
+                f.write("\n")
+
+    except document_errors, e:
+        return BatchResult(job, clock() - tic,
+                           format_document_error(e).rstrip())
+    except Exception, e:
+        return BatchResult(job, clock() - tic,
+                           "%s: %s" % (e.__class__.__name__, e))
+
+    return BatchResult(job, clock() - tic)
+
+
+def run_jobs(jobs, options, processes=1, callback=None):
+    """Compile every job, in a pool of processes (or in this process, if
+       processes is 1), and return their BatchResults in the order of the
+       jobs.  callback, if given, is called with each result as it comes in.
+    """
+    results = []
+
+    if processes == 1 or len(jobs) < 2:
+        init_worker(options)
+        for job in jobs:
+            result = compile_file(job)
+            if callback is not None:
+                callback(result)
+            results.append(result)
+    else:
+        pool = multiprocessing.Pool(processes, init_worker, (options,))
+        try:
+            for result in pool.imap_unordered(compile_file, jobs):
+                if callback is not None:
+                    callback(result)
+                results.append(result)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    results.sort(key=lambda r: r.job.index)
+    return results
+
+
+# ------------------------------
+# Reports
+# ------------------------------
+
+def format_result(result):
+    status = "ok" if result.ok else "FAILED"
+    line = "%10.1fms  %-6s  %s" % (1000 * result.elapsed, status,
+                                   result.job.input_path)
+    if result.ok:
+        return line
+    return line + "\n" + "\n".join(["        " + l
+                                    for l in result.error.split("\n")])
+
+
+def format_summary(results, wall_time, list_files=True):
+    """The report of a batch: a line per file (unless list_files is false,
+       as when they were reported as they came in), and the totals
+    """
+    failed = [r for r in results if not r.ok]
+    lines = []
+    if list_files:
+        lines = [format_result(r) for r in results]
+    lines.append("%d files compiled, %d failed, in %.2fs "
+                 "(%.2fs of compilation)" %
+                 (len(results) - len(failed), len(failed), wall_time,
+                  sum([r.elapsed for r in results])))
+    if failed:
+        lines.append("Failed:")
+        lines.extend(["    " + r.job.input_path for r in failed])
+    return "\n".join(lines)
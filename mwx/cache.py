@@ -0,0 +1,177 @@
+"""An on-disk, content-addressed cache of parsed MWX trees.
+
+   Entries are keyed by a hash of everything that determines the result of
+   MWXParser.parse_string: the source text, the contents of every file it
+   includes, the parser options, and the package itself (its version, and
+   the source of its modules, so that a change to the parser or the AST
+   never serves trees it would no longer build).  The stored value
+   is the final tree (after template resolution and the registered
+   rewrites), so a cache hit skips parsing entirely.
+
+   The cache directory is bounded in size; when it grows past its limit,
+   the least recently used entries are deleted.
+"""
+
+import os
+import zlib
+import hashlib
+import logging
+import tempfile
+import cPickle
+
+from mwx import __version__
+
+# bump this if the layout of the cached trees, or what a given source parses
+# to, changes (changes to the source of the package are picked up by
+# package_fingerprint anyway)
+cache_format = 3
+
+default_max_size = 64 * 1024 * 1024
+
+entry_extension = ".mwxc"
+
+# pickle protocol 2 can't be used: pyparsing's ParseResults (which end up
+# in some nodes) answer every missing attribute lookup, __getnewargs__
+# included
+pickle_protocol = 1
+
+
+package_dir = os.path.dirname(os.path.abspath(__file__))
+
+# package_fingerprint, once it has been computed
+fingerprint = None
+
+
+def package_fingerprint():
+    """A hash of the source of every module in the mwx package, computed
+       once per process
+    """
+    global fingerprint
+    if fingerprint is None:
+        h = hashlib.sha1()
+        for directory, subdirectories, filenames in os.walk(package_dir):
+            subdirectories.sort()
+            for filename in sorted(filenames):
+                if not filename.endswith(".py"):
+                    continue
+                path = os.path.join(directory, filename)
+                with open(path, 'rb') as f:
+                    contents = f.read()
+                h.update("%s:%d:" % (os.path.relpath(path, package_dir),
+                                     len(contents)))
+                h.update(contents)
+        fingerprint = h.hexdigest()
+    return fingerprint
+
+
+class ParseCache(object):
+    """A size-bounded LRU cache of parse trees, stored in a directory"""
+
+    def __init__(self, cache_dir, max_size=default_max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, source, included_files=[], options=()):
+        """Compute the key for a source string.  included_files is a list of
+           (path, contents) pairs, in the order in which they were included.
+        """
+        h = hashlib.sha1()
+
+        def add(s):
+            h.update("%d:" % len(s))
+            h.update(s)
+
+        add("%s/%d/%s" % (__version__, cache_format, package_fingerprint()))
+        add(repr(options))
+        add(source)
+        for path, contents in included_files:
+            add(path)
+            add(contents)
+
+        return h.hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, key + entry_extension)
+
+    def get(self, key):
+        """Return the cached tree for a key, or None"""
+        path = self.path_for(key)
+
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+
+        try:
+            tree = cPickle.loads(zlib.decompress(data))
+        except Exception, e:
+            logging.warning("Discarding unreadable cache entry %s (%s)" % (path, e))
+            self.remove(path)
+            return None
+
+        # mark the entry as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        return tree
+
+    def put(self, key, tree):
+        """Store a tree under a key, evicting old entries if needed"""
+        data = zlib.compress(cPickle.dumps(tree, pickle_protocol))
+
+        # write to a temporary file and rename it into place, so that
+        # concurrent readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmp_path, self.path_for(key))
+        except (IOError, OSError), e:
+            logging.warning("Could not write cache entry: %s" % e)
+            self.remove(tmp_path)
+            return
+
+        self.evict()
+
+    def entries(self):
+        """Return (mtime, size, path) for every entry, oldest first"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(entry_extension):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+
+        entries.sort()
+        return entries
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits"""
+        entries = self.entries()
+        total = sum([size for mtime, size, path in entries])
+
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            self.remove(path)
+            total -= size
+
+    def clear(self):
+        for mtime, size, path in self.entries():
+            self.remove(path)
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,375 @@
+"""A precedence-climbing parser for MWX expressions.
+
+   Expressions (conditions, transition guards, values, ...) are parsed by
+   climbing a table of operator precedence levels, instead of trying every
+   level in turn for each operand, as the operatorPrecedence grammar that
+   used to be part of the pyparsing grammar did.  The result is the same
+   tree of MWBinaryExpression, MWUnaryExpression, MWFunctionCall and
+   MWVariableReference nodes.
+
+   ExpressionParser is the base of the fast engine's parser (see
+   mwx.fast_parser), and the pyparsing grammar wraps it as a single element
+   (see mwx.parser).  parse_expression parses a string holding one
+   expression.
+"""
+
+import re
+
+from mwx.ast import *
+
+
+# ------------------------------
+# Tokens
+# ------------------------------
+
+whitespace = re.compile(r"[ \t\n\r]*").match
+line_whitespace = re.compile(r"[ \t\r]*").match
+
+identifier_token = re.compile(r"[A-Za-z0-9_#]+").match
+duration_token = re.compile(r"([0-9]+)(ms|us|s|min)").match
+number_token = re.compile(r"[0-9]+(?:\.[0-9]+)?").match
+string_tokens = {'"': re.compile(r'"(?:[^"\n\r\\]|(?:\\)|(?:\\.))*"').match,
+                 "'": re.compile(r"'(?:[^'\n\r\\]|(?:\\)|(?:\\.))*'").match}
+escaped_char = re.compile(r"\\(.)")
+
+# Binary operators, grouped by precedence level (lowest level binds
+# tightest).  Levels 1 (sign) and 4 (not) are the unary prefix levels.
+binary_operators = [(0, [("^", "^"), ("**", "**")]),
+                    (2, [("*", "*"), ("/", "/")]),
+                    (3, [("+", "+"), ("-", "-")]),
+                    (5, [("or", "or"), ("||", "or")]),
+                    (6, [("and", "and"), ("&&", "and")]),
+                    (7, [(">=", ">="), ("<=", "<="), (">", ">"),
+                         ("<", "<"), ("==", "=="), ("!=", "!=")])]
+
+binary_operator_chars = frozenset("^*/+-o|a&<>=!")
+
+SIGN_LEVEL = 1
+NOT_LEVEL = 4
+LOWEST_LEVEL = 7
+
+
+def unquote(token):
+    """Strip the quotes from a quoted string token and process its escapes"""
+    s = escaped_char.sub(r"\g<1>", token[1:-1])
+    return s.replace("\\", token[0])
+
+
+class MWXSyntaxError(Exception):
+    """A parse error.  Carries the same location attributes as a pyparsing
+       ParseBaseException, so that print_parser_error can report it.
+    """
+
+    def __init__(self, pstr, loc, msg):
+        Exception.__init__(self, msg)
+        self.pstr = pstr
+        self.loc = loc
+        self.msg = msg
+
+    @property
+    def lineno(self):
+        return self.pstr.count("\n", 0, self.loc) + 1
+
+    @property
+    def col(self):
+        if self.loc < len(self.pstr) and self.pstr[self.loc] == "\n":
+            return 1
+        return self.loc - self.pstr.rfind("\n", 0, self.loc)
+
+    @property
+    def line(self):
+        start = self.pstr.rfind("\n", 0, self.loc) + 1
+        end = self.pstr.find("\n", self.loc)
+        if end < 0:
+            end = len(self.pstr)
+        return self.pstr[start:end]
+
+    def __str__(self):
+        return "%s (at char %d), (line:%d, col:%d)" % (self.msg, self.loc,
+                                                       self.lineno, self.col)
+
+
+def parse_expression(s):
+    """Parse a string holding a single MWX expression, and return its node
+       (or the bare value, for a number or a string)
+    """
+    parser = ExpressionParser(s.expandtabs())
+    r = parser.expression(0)
+    if r is None:
+        raise parser.furthest_error()
+
+    value, p = r
+    p = whitespace(parser.text, p).end()
+    if p < parser.end:
+        if parser.fail_pos > p:
+            raise parser.furthest_error()
+        raise parser.error(p, "end of expression")
+
+    return value
+
+
+class ExpressionParser(object):
+    """The state of a parse of some text, and the rules for expressions.
+
+       Each rule takes a position in the text and returns a (result,
+       new position) tuple, or None if the rule does not match there.
+       Failures after a "commit point" in the grammar (e.g. after the
+       opening brace of a block) are fatal and raise MWXSyntaxError.
+    """
+
+    # the rule methods (see mwx.profiler)
+    rules = ('identifier', 'quoted_string', 'expression', 'primary',
+             'operand', 'template_reference')
+
+    def __init__(self, text):
+        self.text = text
+        self.end = len(text)
+
+        # the furthest position where a rule failed, for error reporting
+        self.fail_pos = 0
+        self.fail_msg = "Expected expression"
+
+    # ------------------------------
+    # Helpers
+    # ------------------------------
+
+    def expected(self, pos, what):
+        if pos >= self.fail_pos:
+            self.fail_pos = pos
+            self.fail_msg = "Expected " + what
+
+    def error(self, pos, what):
+        return MWXSyntaxError(self.text, min(pos, self.end), "Expected " + what)
+
+    def furthest_error(self):
+        return MWXSyntaxError(self.text, min(self.fail_pos, self.end),
+                              self.fail_msg)
+
+    def literal(self, pos, lit):
+        """Match a literal after any whitespace.  Returns the position after
+           it, or -1 if it isn't there.
+        """
+        pos = whitespace(self.text, pos).end()
+        if self.text.startswith(lit, pos):
+            return pos + len(lit)
+        self.expected(pos, '"%s"' % lit)
+        return -1
+
+    def expect(self, pos, lit):
+        """Match a literal that is required by the grammar"""
+        p = self.literal(pos, lit)
+        if p < 0:
+            raise self.error(whitespace(self.text, pos).end(), '"%s"' % lit)
+        return p
+
+    def required(self, result, pos, what):
+        if result is None:
+            raise self.error(whitespace(self.text, pos).end(), what)
+        return result
+
+    def token(self, match, pos, what):
+        """Match a regular expression token after any whitespace"""
+        pos = whitespace(self.text, pos).end()
+        m = match(self.text, pos)
+        if m is None:
+            self.expected(pos, what)
+        return m
+
+    def identifier(self, pos):
+        m = self.token(identifier_token, pos, "identifier")
+        if m is None:
+            return None
+        return m.group(), m.end()
+
+    # ------------------------------
+    # Values and expressions
+    # ------------------------------
+
+    def quoted_string(self, pos, drop_quotes=False):
+        pos = whitespace(self.text, pos).end()
+        match = string_tokens.get(self.text[pos:pos + 1])
+        m = match and match(self.text, pos)
+        if not m:
+            self.expected(pos, "quoted string")
+            return None
+
+        s = unquote(m.group())
+        if drop_quotes:
+            s = s.strip(m.group()[0])
+        return s, m.end()
+
+    def value(self, pos):
+        return self.expression(pos)
+
+    def expression(self, pos, max_level=LOWEST_LEVEL):
+        """Precedence climbing over the operator table above.  Mirrors the
+           grammar pyparsing's operatorPrecedence would build from the same
+           table, including its backtracking when an operator is not followed
+           by a valid operand.
+        """
+        text = self.text
+        pos = whitespace(text, pos).end()
+
+        lhs = None
+        level = -1
+
+        if max_level >= NOT_LEVEL:
+            if text.startswith("not", pos):
+                r = self.expression(pos + 3, NOT_LEVEL)
+            elif text.startswith("!", pos):
+                r = self.expression(pos + 1, NOT_LEVEL)
+            else:
+                r = None
+            if r is not None:
+                lhs, p = MWUnaryExpression("not", r[0]), r[1]
+                level = NOT_LEVEL
+
+        if lhs is None and max_level >= SIGN_LEVEL:
+            op = text[pos:pos + 1]
+            if op == "+" or op == "-":
+                r = self.expression(pos + 1, SIGN_LEVEL)
+                if r is not None:
+                    lhs, p = MWUnaryExpression(op, r[0]), r[1]
+                    level = SIGN_LEVEL
+
+        if lhs is None:
+            r = self.primary(pos)
+            if r is None:
+                return None
+            lhs, p = r
+
+        while True:
+            q = whitespace(text, p).end()
+            if text[q:q + 1] not in binary_operator_chars:
+                break
+
+            for op_level, ops in binary_operators:
+                if op_level < level or op_level > max_level:
+                    continue
+
+                for lit, op in ops:
+                    if text.startswith(lit, q):
+                        break
+                else:
+                    continue
+
+                # right-associative at level 0, left-associative otherwise
+                rhs_level = op_level - 1 if op_level else 0
+                r = self.expression(q + len(lit), rhs_level)
+                if r is None:
+                    continue
+
+                lhs, p = MWBinaryExpression(op, lhs, r[0]), r[1]
+                level = op_level
+                break
+            else:
+                break
+
+        return lhs, p
+
+    def primary(self, pos):
+        r = self.operand(pos)
+        if r is not None:
+            return r
+
+        if self.text.startswith("(", pos):
+            r = self.expression(pos + 1)
+            if r is not None:
+                p = self.literal(r[1], ")")
+                if p >= 0:
+                    return r[0], p
+
+        self.expected(pos, "expression")
+        return None
+
+    def operand(self, pos):
+        text = self.text
+        c = text[pos:pos + 1]
+
+        if c == "@":
+            r = self.template_reference(pos)
+            if r is not None:
+                return r
+
+        m = duration_token(text, pos)
+        if m is not None:
+            return str(int(m.group(1))) + m.group(2), m.end()
+
+        m = number_token(text, pos)
+        if m is not None:
+            return float(m.group()), m.end()
+
+        if c == '"' or c == "'":
+            r = self.quoted_string(pos)
+            if r is not None:
+                return r
+
+        m = identifier_token(text, pos)
+        if m is None:
+            return None
+        name = m.group()
+        p = m.end()
+
+        # function call
+        q = self.literal(p, "(")
+        if q >= 0:
+            args = []
+            r = self.expression(q)
+            while r is not None:
+                args.append(r[0])
+                q = r[1]
+                c = self.literal(q, ",")
+                r = c >= 0 and self.expression(c) or None
+            if args:
+                c = self.literal(q, ")")
+                if c >= 0:
+                    return MWFunctionCall(name, args), c
+
+        # array reference
+        q = self.literal(p, "[")
+        if q >= 0:
+            r = self.expression(q)
+            if r is not None:
+                c = self.literal(r[1], "]")
+                if c >= 0:
+                    return MWVariableReference(identifier=name, index=r[0]), c
+
+        return MWVariableReference(identifier=name), p
+
+    def template_reference(self, pos):
+        text = self.text
+        pos = self.literal(pos, "@")
+        if pos < 0:
+            return None
+        r = self.identifier(pos)
+        if r is None:
+            return None
+        name, p = r
+
+        # arguments must start on the same line as the reference
+        args = ''
+        q = line_whitespace(text, p).end()
+        if q < self.end and text[q] == "(":
+            values = []
+            q += 1
+            r = self.value(q)
+            while r is not None:
+                values.append(r[0])
+                q = r[1]
+                c = self.literal(q, ",")
+                if c >= 0:
+                    q = c
+                r = self.value(q)
+            c = self.literal(q, ")")
+            if c >= 0:
+                if values:
+                    args = values
+                p = c
+
+        reference = TemplateReference(name, args)
+        if args:
+            # with the pyparsing grammar the args arrive as a ParseResults,
+            # and adding that to the children list (via ParseResults.__radd__)
+            # leaves the children as None.  Keep the trees identical.
+            reference.children = None
+        return reference, p
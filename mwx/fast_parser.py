@@ -0,0 +1,544 @@
+"""A hand-written tokenizer and recursive-descent parser for the brace flavor
+   of the MWX syntax (significant-whitespace documents are rewritten into it
+   first, see mwx.indentation).
+
+   This engine builds exactly the same MWASTNode trees as the pyparsing
+   grammar in mwx.parser, but without the combinator graph and the packrat
+   memo.  It is selected with MWXParser(engine="fast").
+
+   The MWX grammar is context sensitive (keywords are matched as prefixes
+   rather than whole words, and newlines are only significant after blocks
+   and transitions), so the tokenizer is driven by the parser: each rule asks
+   for the token it expects at the current position, and the compiled
+   regular expressions below do the actual lexing.
+"""
+
+import re
+
+from mwx.ast import *
+from mwx.constants import *
+from mwx.expression import (ExpressionParser, MWXSyntaxError, whitespace,
+                            line_whitespace, identifier_token, unquote)
+from mwx.foreign_code import scan_brace_block, scan_string_block
+
+
+# ------------------------------
+# Tokens
+# ------------------------------
+
+def one_of(names):
+    """Build a matcher for a set of literal names that always prefers the
+       longest alternative, like pyparsing's oneOf
+    """
+    names = sorted(set(names), key=len, reverse=True)
+    return re.compile("|".join([re.escape(n) for n in names])).match
+
+property_name_token = re.compile(r"[A-Za-z0-9_]+").match
+object_name_token = one_of(container_types + noncontainer_types)
+action_name_token = one_of(shorthand_action_types)
+scope_token = re.compile(r"global|local").match
+variable_type_token = re.compile(r"integer|float|bool|string|struct|var").match
+language_token = re.compile(r"python|ruby").match
+
+
+def property_dict(props):
+    """The pyparsing grammar builds node properties with dict() over a
+       ParseResults, which only sees its named results, so bracketed property
+       lists are checked for syntax but never reach the tree.  Mirror that
+       here so that both engines build identical trees.
+    """
+    return {}
+
+
+class FastMWXParser(object):
+    """A recursive-descent parser for the brace flavor of MWX"""
+
+    def __init__(self, profiler=None, significant_whitespace=False):
+        # an optional mwx.profiler.ParserProfiler
+        self.profiler = profiler
+        self.significant_whitespace = significant_whitespace
+
+    def parse(self, s):
+        """Parse a preprocessed MWX string, and return a list of top-level
+           MWASTNode objects
+        """
+        parser = RecursiveDescent(s.expandtabs(), self.significant_whitespace)
+        if self.profiler is not None:
+            self.profiler.instrument_parser(parser)
+        return parser.document()
+
+
+class RecursiveDescent(ExpressionParser):
+    """The state of a single parse of a whole document.  The helpers and the
+       rules for expressions come from ExpressionParser.
+    """
+
+    rules = ExpressionParser.rules + (
+        'block', 'template_args', 'template_definition', 'macro_template_val',
+        'template_value', 'macro_if', 'object_declaration',
+        'ordinary_object_declaration', 'property_list', 'declaration',
+        'std_obj_decl', 'action', 'assignment_action', 'foreign_code_action',
+        'foreign_code',
+        'if_action', 'generic_action', 'state', 'transition',
+        'variable_declaration')
+
+    def __init__(self, text, significant_whitespace=False):
+        ExpressionParser.__init__(self, text)
+        self.fail_msg = "Expected object declaration"
+
+        # the rewritten significant-whitespace flavor differs in its state
+        # blocks and foreign code
+        self.significant_whitespace = significant_whitespace
+
+        # variable declarations must start a line, or the document
+        first = line_whitespace(text, 0).end()
+        if first < self.end and text[first] == "\n":
+            self.first_line_start = 1
+        else:
+            self.first_line_start = 0
+
+    # ------------------------------
+    # Helpers
+    # ------------------------------
+
+    def line_end(self, pos):
+        pos = line_whitespace(self.text, pos).end()
+        if pos >= self.end:
+            return self.end
+        if self.text[pos] == "\n":
+            return pos + 1
+        raise self.error(pos, "end of line")
+
+    def block(self, pos, item):
+        """{ item item ... }.  Everything after the opening brace is
+           required.
+        """
+        p = self.literal(pos, "{")
+        if p < 0:
+            return None
+
+        items = []
+        r = self.required(item(p), p, "block contents")
+        while r is not None:
+            items.append(r[0])
+            p = r[1]
+            r = item(p)
+
+        return items, self.expect(p, "}")
+
+    def required_block(self, pos, item):
+        return self.required(self.block(pos, item), pos, '"{"')
+
+    # ------------------------------
+    # Templates
+    # ------------------------------
+
+    def template_args(self, pos):
+        """An optional (name, name, ...) argument list for a macro"""
+        q = self.literal(pos, "(")
+        if q < 0:
+            return '', pos
+
+        args = []
+        r = self.identifier(q)
+        while r is not None:
+            args.append(r[0])
+            q = r[1]
+            c = self.literal(q, ",")
+            if c >= 0:
+                q = c
+            r = self.identifier(q)
+
+        c = self.literal(q, ")")
+        if c < 0:
+            return '', pos
+        return args, c
+
+    def template_definition(self, pos):
+        if not self.text.startswith("macro", pos):
+            self.expected(pos, '"macro"')
+            return None
+        r = self.identifier(pos + 5)
+        if r is None:
+            return None
+        name, p = r
+
+        # macro name = value
+        q = self.literal(p, "=")
+        if q >= 0:
+            r = self.value(q)
+            if r is not None:
+                return create_template_definition(name, [], children=[r[0]]), r[1]
+
+        # macro name(args) { body }
+        args, p = self.template_args(p)
+        q = self.literal(p, "=")
+        if q < 0:
+            q = p
+        r = self.block(q, self.object_declaration)
+        if r is not None:
+            return create_template_definition(name, args, children=r[0]), r[1]
+
+        # macro name(args) = value
+        return self.template_value(name, args, p)
+
+    def macro_template_val(self, pos):
+        if not self.text.startswith("macro", pos):
+            self.expected(pos, '"macro"')
+            return None
+        r = self.identifier(pos + 5)
+        if r is None:
+            return None
+        name, p = r
+        args, p = self.template_args(p)
+        return self.template_value(name, args, p)
+
+    def template_value(self, name, args, pos):
+        p = self.literal(pos, "=")
+        if p < 0:
+            return None
+        r = self.required(self.value(p), p, "expression")
+        return create_template_definition(name, args, children=r[0]), r[1]
+
+    def macro_if(self, pos):
+        text = self.text
+        p = self.literal(pos, "@")
+        if p < 0:
+            return None
+        p = whitespace(text, p).end()
+        if not text.startswith("if", p):
+            self.expected(p, '"if"')
+            return None
+
+        p = self.expect(p + 2, "(")
+        condition, p = self.required(self.expression(p), p, "expression")
+        p = self.expect(p, ")")
+        body, p = self.required_block(p, self.object_declaration)
+
+        else_body = ''
+        q = self.literal(p, "else")
+        if q >= 0:
+            r = self.block(q, self.object_declaration)
+            if r is not None:
+                else_body, p = r
+
+        return TemplateIf(condition, body, else_body), p
+
+    # ------------------------------
+    # Object declarations
+    # ------------------------------
+
+    def document(self):
+        results = []
+        pos = 0
+        r = self.object_declaration(pos)
+        while r is not None:
+            results.append(r[0])
+            pos = r[1]
+            r = self.object_declaration(pos)
+
+        if not results or whitespace(self.text, pos).end() < self.end:
+            raise self.furthest_error()
+
+        return results
+
+    def object_declaration(self, pos):
+        pos = whitespace(self.text, pos).end()
+        c = self.text[pos:pos + 1]
+
+        if c == "@":
+            r = self.macro_if(pos)
+            if r is None:
+                r = self.template_reference(pos)
+        elif c == "m":
+            r = self.template_definition(pos)
+        else:
+            r = None
+
+        if r is None:
+            r = self.ordinary_object_declaration(pos)
+        if r is None:
+            r = self.variable_declaration(pos)
+        return r
+
+    def ordinary_object_declaration(self, pos):
+        # an optional "alias = " prefix
+        alias = None
+        r = self.identifier(pos)
+        if r is not None:
+            p = self.literal(r[1], "=")
+            if p >= 0:
+                alias = r[0]
+                pos = p
+
+        r = self.std_obj_decl(pos)
+        if r is None:
+            r = self.action(pos, std_obj_decl=False)
+        if r is None:
+            r = self.state(pos)
+        if r is None:
+            return None
+
+        if alias is not None:
+            r[0].set_prop('alias', alias)
+        return r
+
+    def property_list(self, pos):
+        """name = value, name = value, ...  Returns a list of pairs"""
+        props = []
+        while True:
+            m = self.token(property_name_token, pos, "property name")
+            if m is None:
+                break
+            p = self.literal(m.end(), "=")
+            if p < 0:
+                break
+            value, pos = self.required(self.value(p), p, "expression")
+            props.append((m.group(), value))
+
+            p = self.literal(pos, ",")
+            if p >= 0:
+                pos = p
+
+        return props, pos
+
+    def declaration(self, pos):
+        """The tag and properties following an object's type name, in either
+           the "declaration-like" (name tag[props]) or the generic
+           (name["tag", props]) style
+        """
+        r = self.identifier(pos)
+        if r is not None:
+            tag, p = r
+            props = []
+            q = self.literal(p, "[")
+            if q >= 0:
+                props, q = self.property_list(q)
+                p = self.expect(q, "]")
+            return tag, props, p
+
+        p = self.literal(pos, "[")
+        if p < 0:
+            return None
+
+        tag = ''
+        r = self.quoted_string(p, drop_quotes=True)
+        if r is None:
+            r = self.template_reference(p)
+        if r is not None:
+            tag = [r[0]]
+            p = r[1]
+            q = self.literal(p, ",")
+            if q >= 0:
+                p = q
+
+        props, p = self.property_list(p)
+        p = self.expect(p, "]")
+        return tag, props, p
+
+    def std_obj_decl(self, pos):
+        m = self.token(object_name_token, pos, "object type")
+        if m is None:
+            return None
+        r = self.declaration(m.end())
+        if r is None:
+            return None
+        tag, props, p = r
+
+        children = ''
+        r = self.block(p, self.object_declaration)
+        if r is not None:
+            children, p = r
+            p = self.line_end(p)
+
+        return MWASTNode(m.group(), tag, props=property_dict(props), children=children), p
+
+    def action(self, pos, std_obj_decl=True):
+        text = self.text
+        pos = whitespace(text, pos).end()
+        c = text[pos:pos + 1]
+
+        # macro elements
+        r = None
+        if c == "@":
+            r = self.macro_if(pos)
+        elif c == "m":
+            r = self.macro_template_val(pos)
+        if r is not None:
+            return r
+
+        r = self.assignment_action(pos)
+        if r is None:
+            r = self.foreign_code_action(pos)
+        if r is None:
+            r = self.if_action(pos)
+        if r is None:
+            r = self.generic_action(pos)
+        if r is None and std_obj_decl:
+            r = self.std_obj_decl(pos)
+        return r
+
+    def assignment_action(self, pos):
+        if self.text.startswith("macro", pos):
+            return None
+        r = self.identifier(pos)
+        if r is None:
+            return None
+        variable, p = r
+        p = self.literal(p, "=")
+        if p < 0:
+            return None
+        value, p = self.required(self.value(p), p, "expression")
+        return AssignmentAction(variable, value), p
+
+    def foreign_code_action(self, pos):
+        m = language_token(self.text, pos)
+        if m is None:
+            return None
+        if self.significant_whitespace:
+            p = self.expect(m.end(), "(")
+            code, p = self.required(self.foreign_code(p, scan_string_block),
+                                    p, "foreign code block")
+            p = self.expect(p, ")")
+        else:
+            r = self.foreign_code(m.end(), scan_brace_block)
+            if r is None:
+                return None
+            code, p = r
+        return ForeignCodeAction(m.group(), code), p
+
+    def foreign_code(self, pos, scanner):
+        """Match the code of a foreign-code action after any whitespace (see
+           mwx.foreign_code)
+        """
+        pos = whitespace(self.text, pos).end()
+        r = scanner(self.text, pos)
+        if r is None:
+            self.expected(pos, "foreign code block")
+        return r
+
+    def if_action(self, pos):
+        if not self.text.startswith("if", pos):
+            return None
+        condition, p = self.required(self.expression(pos + 2), pos + 2,
+                                     "conditional expression")
+        children, p = self.required_block(p, self.action)
+        return MWASTNode("action", props={"type": "if", "condition": condition},
+                         children=children), p
+
+    def generic_action(self, pos):
+        m = action_name_token(self.text, pos)
+        if m is None:
+            self.expected(pos, "action")
+            return None
+        p = self.literal(m.end(), "(")
+        if p < 0:
+            return None
+
+        arg = ''
+        r = self.value(p)
+        if r is not None:
+            arg, p = r
+        props, p = self.property_list(p)
+        p = self.expect(p, ")")
+
+        return Action(m.group(), arg, props=property_dict(props)), p
+
+    def state(self, pos):
+        if not self.text.startswith("state", pos):
+            return None
+        r = self.declaration(pos + 5)
+        if r is None:
+            return None
+        tag, props, p = r
+
+        # { actions { ... } transitions { ... } } when significant
+        if self.significant_whitespace:
+            p = self.literal(p, "{")
+            if p >= 0:
+                p = self.literal(p, "actions")
+            if p < 0:
+                return None
+
+        r = self.block(p, self.action)
+        if r is None:
+            return None
+        actions, p = r
+        if self.significant_whitespace:
+            p = self.expect(p, "transitions")
+        else:
+            p = self.expect(p, "transition")
+        transitions, p = self.required_block(p, self.transition)
+        if self.significant_whitespace:
+            p = self.expect(p, "}")
+
+        return State(tag, props=property_dict(props), actions=actions,
+                     transitions=transitions), p
+
+    def transition(self, pos):
+        text = self.text
+        pos = whitespace(text, pos).end()
+        c = text[pos:pos + 1]
+
+        r = None
+        if c == "@":
+            r = self.macro_if(pos)
+        elif c == "m":
+            r = self.macro_template_val(pos)
+        if r is None:
+            if text.startswith("always", pos):
+                r = ("always", pos + 6)
+            else:
+                r = self.expression(pos)
+        if r is None:
+            return None
+        condition, p = r
+
+        p = self.expect(p, "->")
+
+        r = self.quoted_string(p, drop_quotes=True)
+        if r is None:
+            r = self.template_reference(p)
+        if r is None:
+            q = self.literal(p, "yield")
+            if q >= 0:
+                r = ("yield", q)
+        target, p = self.required(r, p, "transition target")
+
+        return Transition(condition, target), self.line_end(p)
+
+    def variable_declaration(self, pos):
+        text = self.text
+        pos = line_whitespace(text, pos).end()
+        if not (pos == 0 or pos == self.first_line_start or
+                text[pos - 1] == "\n"):
+            self.expected(pos, "start of line")
+            return None
+
+        p = pos
+        m = self.token(scope_token, p, "scope")
+        if m is not None:
+            p = m.end()
+
+        m = self.token(variable_type_token, p, "variable type")
+        if m is None:
+            return None
+        tag, p = self.required(self.identifier(m.end()), m.end(), "identifier")
+
+        props = []
+        q = self.literal(p, "[")
+        if q >= 0:
+            prop_list, q = self.property_list(q)
+            q = self.literal(q, "]")
+            if q >= 0:
+                props = prop_list
+                p = q
+
+        default = ''
+        q = self.literal(p, "=")
+        if q >= 0:
+            r = self.value(q)
+            if r is not None:
+                default, p = r
+
+        return MWVariable(tag, default=default, props=property_dict(props)), p
@@ -0,0 +1,146 @@
+"""Scanners for the code of foreign-code (python and ruby) actions.
+
+   A brace block
+
+     python {
+         s = {'a': 1}
+     }
+
+   runs from its opening brace to the brace that closes it, found by
+   counting the braces in the code and skipping over its string literals.
+   In significant-whitespace documents, the code in python(\"\"\" ... \"\"\")
+   runs to the first closing triple quote.  Either way, the code starts on
+   the line after the opening, and the indentation of its first line (the
+   padding) is removed from each of its lines (see remove_python_padding).
+
+   Each scanner makes a single forward pass over the block: the brace
+   scanner stops only at braces, with everything in between (string
+   literals included) taken by a regular expression that never backtracks,
+   and the triple-quote scanner only looks for the closing quotes.  The
+   whitespace before the end is stepped over once more, and the lines are
+   found once, to remove the padding.  The cost is linear in the size of
+   the block, whether it turns out to be well formed or not; the regular
+   expressions these replace retried the rest of the text for every
+   padding and line start they could backtrack to.
+"""
+
+import re
+
+from mwx.ast import remove_python_padding
+
+
+# \s, as in the regular expressions this replaces
+whitespace_chars = " \t\n\r\f\v"
+leading_whitespace = re.compile(r"[ \t\n\r\f\v]*").match
+
+# the code of a brace block up to its next brace: runs of other characters,
+# and whole string literals.  Single-quoted strings end at the end of the
+# line if they aren't closed before it, and triple-quoted ones at the end of
+# the text.  Each alternative starts with a different character, and the
+# last part of each always matches, so this never backtracks.
+brace_code_run = re.compile(r"""(?:[^{}"']+|"""
+                            r'"""(?:[^"\\]|\\[\s\S]?|"(?!""))*(?:"""|\Z)|'
+                            r"'''(?:[^'\\]|\\[\s\S]?|'(?!''))*(?:'''|\Z)|"
+                            r'"(?:[^"\\\n]|\\.?)*(?:"|(?=\n)|\Z)|'
+                            r"'(?:[^'\\\n]|\\.?)*(?:'|(?=\n)|\Z))*").match
+
+
+def code_start(text, pos):
+    """Find the start of the code after an opening delimiter that ends at
+       pos: the code starts on a later line, after its padding.  Returns
+       (start of the line, start of the code), or None if the code doesn't
+       start on a new line.
+    """
+    start = leading_whitespace(text, pos).end()
+    newline = text.rfind("\n", pos, start)
+    if newline < 0:
+        return None
+    return newline + 1, start
+
+
+def finish_code(text, first_line, start, end):
+    """Slice out the code between start and end, and remove its padding
+       (the text between first_line and start) from each of its lines
+    """
+    if end <= start:
+        return ""
+
+    code = text[start:end]
+    if start == first_line:
+        return code
+
+    line_starts = []
+    newline = code.find("\n")
+    while newline >= 0:
+        line_starts.append(newline + 1)
+        newline = code.find("\n", newline + 1)
+    return remove_python_padding(code, text[first_line:start], line_starts)
+
+
+def scan_brace_block(text, pos):
+    """Scan the brace block of foreign code whose opening brace is at pos.
+       Returns (code, position after the closing brace), or None if there is
+       no well-formed block there: the code must start on a new line, and
+       the closing brace must start its own line.
+    """
+    if not text.startswith("{", pos):
+        return None
+    r = code_start(text, pos + 1)
+    if r is None:
+        return None
+    first_line, start = r
+
+    depth = 1
+    p = start
+    while True:
+        p = brace_code_run(text, p).end()
+        if p == len(text):
+            return None
+        if text[p] == "{":
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                break
+        p += 1
+    close = p
+
+    # the code ends at the start of the line holding the closing brace,
+    # or of the blank lines before it
+    q = close
+    while q > first_line and text[q - 1] in whitespace_chars:
+        q -= 1
+
+    if q == first_line:
+        end = first_line
+    else:
+        newline = text.find("\n", q, close)
+        if newline < 0:
+            return None
+        end = newline + 1
+
+    return finish_code(text, first_line, start, end), close + 1
+
+
+def scan_string_block(text, pos):
+    """Scan the triple-quoted foreign code whose opening quotes are at pos
+       (the significant-whitespace form).  Returns (code, position after the
+       closing quotes), or None if there is no well-formed block there.
+    """
+    if not text.startswith('"""', pos):
+        return None
+    r = code_start(text, pos + 3)
+    if r is None:
+        return None
+    first_line, start = r
+
+    close = text.find('"""', start)
+    if close < 0:
+        return None
+
+    # trailing whitespace isn't part of the code
+    end = close
+    while end > start and text[end - 1] in whitespace_chars:
+        end -= 1
+
+    return finish_code(text, first_line, start, end), close + 3
@@ -0,0 +1,405 @@
+"""The pyparsing grammar for MWX (the "pyparsing" engine of MWXParser).
+
+   This module is only imported when a parser that uses the grammar is
+   created, since importing pyparsing and building the grammar are the most
+   expensive parts of starting up.
+"""
+
+from pyparsing import *
+
+from mwx.ast import *
+from mwx.constants import *
+from mwx.expression import ExpressionParser, MWXSyntaxError
+from mwx.foreign_code import scan_brace_block, scan_string_block
+
+
+# Helper functions
+
+def list_to_literals(list_of_names):
+    """Convert a list of strings to an OR'd sequence of pyparsing Literal
+       objects
+    """
+    p = Literal(list_of_names[0])
+    for l in list_of_names[1:]:
+        p = p | Literal(l)
+
+    return p
+
+
+def dummy_token(name):
+    """A pyparsing token allows for more sensible error reporting.  It does
+       not match any content, but its name will be used if an error occurs
+       is an OR'd sequences where the dummy_token is the first element.
+    """
+    exception_token = NoMatch()
+    exception_token.setName(name.upper())
+    return exception_token
+
+
+class PrecedenceClimbingExpression(Token):
+    """A pyparsing element that matches an expression, using the
+       precedence-climbing parser in mwx.expression
+    """
+
+    def __init__(self):
+        Token.__init__(self)
+        self.name = "expression"
+        self.errmsg = "Expected expression"
+        self.mayReturnEmpty = False
+        self.mayIndexError = False
+
+    def parseImpl(self, instring, loc, doActions=True):
+        r = ExpressionParser(instring).expression(loc)
+        if r is None:
+            raise ParseException(instring, loc, self.errmsg, self)
+        return r[1], [r[0]]
+
+
+class ForeignCodeBlock(Token):
+    """A pyparsing element that matches the code of a foreign-code action,
+       using one of the scanners in mwx.foreign_code, and returns it with
+       its padding removed
+    """
+
+    def __init__(self, scanner):
+        Token.__init__(self)
+        self.scanner = scanner
+        self.name = "foreign code block"
+        self.errmsg = "Expected foreign code block"
+        self.mayReturnEmpty = False
+        self.mayIndexError = False
+
+    def parseImpl(self, instring, loc, doActions=True):
+        r = self.scanner(instring, loc)
+        if r is None:
+            raise ParseException(instring, loc, self.errmsg, self)
+        return r[1], [r[0]]
+
+
+def quoted_string_fn(drop_quotes=True):
+    dq = QuotedString('"', "\\", "\\", False, True)
+    sq = QuotedString("'", "\\", "\\", False, True)
+
+    if drop_quotes:
+        dq.setParseAction(lambda s: str(s[0]).strip('"'))
+        sq.setParseAction(lambda s: str(s[0]).strip("'"))
+
+    qs = dq | sq
+
+    return qs
+
+
+class MWXGrammar(object):
+    """The compiled pyparsing grammar for MWX.
+
+       Building the grammar is expensive, and it holds no state between
+       parses, so one instance per significant_whitespace setting is built
+       and shared by every MWXParser (see get_grammar).  Both flavors parse
+       brace blocks: significant-whitespace documents are rewritten into
+       them before they get here (see mwx.indentation).
+    """
+
+    def __init__(self, use_significant_whitespace=False):
+
+        # ------------------------------
+        # Parser Combinator Definitions
+        # ------------------------------
+
+        # Parsers in pyparsing take the form of a large collection of
+        # parser object instantiations that handle snippets of syntax
+        # and assemblies thereof.
+        # At the end of the day, we're aiming towards a final parser
+        # object that will accept a full document
+
+        # ------------------------------
+        # Style and symbols
+        # ------------------------------
+        # Definition of block syntax.
+
+        block_open = Suppress("{")
+        block_close = Suppress("}")
+        block = lambda x, p: block_open - OneOrMore(x)(p) + block_close
+
+        # Some other stylistic variations
+        prop_list_open = Suppress("[")
+        prop_list_close = Suppress("]")
+
+        arg_list_open = Suppress("(")
+        arg_list_close = Suppress(")")
+
+        index_operator_open = Suppress("[")
+        index_operator_close = Suppress("]")
+
+        if use_significant_whitespace:
+            action_list_marker = Suppress("actions")
+            transition_list_marker = Suppress("transitions")
+        else:
+            action_list_marker = empty
+            transition_list_marker = Suppress("transition")
+
+        assign = Literal("=")
+        macro_symbol = Suppress("@")
+        def_keyword = Suppress("macro")
+
+        # triple_quote = Suppress("\"\"\"")
+
+        # ------------------------------
+        # Forward declarations
+        # ------------------------------
+
+        # Things that will be recursively embedded later
+        object_declaration = Forward()
+        expression = Forward()
+        value = Forward()
+
+        # ------------------------------
+        # Keywords
+        # ------------------------------
+
+        # Valid names of container object.  TODO: build from MWLibrary.xml
+        # container_name = oneOf(" ".join(container_types))
+
+        # Valid names of container object.  TODO: build from MWLibrary.xml
+        # noncontainer_name = oneOf(" ".join(noncontainer_types))
+
+        object_name = oneOf(" ".join(container_types + noncontainer_types))
+
+        # Valid names of action objects.  TODO: build from MWLibrary.xml
+        action_name = oneOf(" ".join(shorthand_action_types))
+
+        # Allowed foreign languages
+        language_name = Literal("python") | Literal("ruby")
+
+        # import and include
+        #import_kw = Keyword('import')
+
+        # ------------------------------
+        # Values and Expressions
+        # ------------------------------
+
+        identifier = Word(alphanums + '_' + '#')
+
+        # ------------------------------
+        # Templates
+        # ------------------------------
+
+        simple_value_template = def_keyword + identifier("name") + Suppress(assign) + value("value")
+        simple_value_template.setParseAction(lambda x: create_template_definition(x.name, [], children=[x.value]))
+        template_reference = macro_symbol + identifier("name") + Optional(NotAny(LineEnd()) + Suppress("(") + ZeroOrMore(value + Suppress(Optional(",")))("args") + Suppress(")"))
+        template_reference.setParseAction(lambda x: TemplateReference(x.name, x.args))
+
+        macro_template_decl = def_keyword + identifier("name") + \
+                              Optional(Suppress("(") + ZeroOrMore(identifier + Optional(Suppress(","))) + Suppress(")"))("args") + \
+                              Optional(Suppress(assign)) + \
+                              block(object_declaration, "body")
+
+        macro_template_val = def_keyword + identifier("name") + \
+                              Optional(Suppress("(") + ZeroOrMore(identifier + Optional(Suppress(","))) + Suppress(")"))("args") + \
+                              Suppress(assign) - value("body")
+
+        macro_template_decl.setParseAction(lambda x: create_template_definition(x.name, x.args, children=x.body))  # for now
+        macro_template_val.setParseAction(lambda x: create_template_definition(x.name, x.args, children=x.body))  # for now
+
+        template_definition = simple_value_template | macro_template_decl | macro_template_val
+
+        # ------------------------------
+        # Macro control flow
+        # ------------------------------
+
+        macro_if = macro_symbol + Suppress("if") - \
+                   Suppress("(") - expression("condition") + Suppress(")") -\
+                   block(object_declaration, "body") +\
+                   Optional(Suppress("else") + \
+                            block(object_declaration, "else_body"))
+
+        macro_if.setParseAction(lambda x: TemplateIf(x.condition,
+                                                     x.body,
+                                                     x.else_body))
+
+        macro_element = macro_if | macro_template_val
+
+        # ------------------------------
+        # Operators, infix notation, etc.
+        # ------------------------------
+
+        # operands, operators and their precedence are handled by a
+        # dedicated parser (see mwx.expression)
+        expression << PrecedenceClimbingExpression()
+
+        value << (dummy_token("expression") | expression)
+
+        # --------------------------------------------
+        # Conditionals
+        # --------------------------------------------
+
+        cond_expr = expression
+
+        conditional = (dummy_token("conditional expression") | cond_expr)
+
+        # --------------------------------------------
+        # Miscellaneous general reusable syntax parts
+        # --------------------------------------------
+
+        property_pair = Group(Word(alphanums + '_')("prop") + Suppress(assign) - value("value"))
+        property_list = OneOrMore(property_pair + Optional(Suppress(",")))
+
+        # ------------------------------
+        # Object Declarations
+        # ------------------------------
+
+        # Actions
+        std_obj_decl = Forward()
+        action = Forward()
+
+        generic_action = (action_name("type") + arg_list_open -
+                          Optional(value)("arg") + Optional(property_list)("props") +
+                          arg_list_close)
+        generic_action.setParseAction(lambda a: Action(a.type,  a.arg, props=dict(a.props)))
+
+        assignment_action = NotAny(def_keyword) + identifier("variable") + assign - value("value")
+        assignment_action.setParseAction(lambda a: AssignmentAction(a.variable, a.value))
+
+        if(use_significant_whitespace):
+            foreign_code_action = language_name("lang") - "(" + \
+                                  ForeignCodeBlock(scan_string_block)("code") + \
+                                  ")"
+        else:
+            foreign_code_action = language_name("lang") + ForeignCodeBlock(scan_brace_block)("code")
+
+        foreign_code_action.setParseAction(lambda a: ForeignCodeAction(a.lang, a.code))
+
+        if_action = Literal("if") - conditional("condition") + block(action, "children")
+        if_action.setParseAction(lambda a: MWASTNode("action", props={"type": "if", "condition": a.condition}, children=a.children))
+
+        action << (dummy_token("action") | macro_element | assignment_action | foreign_code_action | if_action | generic_action | std_obj_decl)
+
+        # "Ordinary" components
+
+        valid_tag = (quoted_string_fn(True) | template_reference)
+        unquoted_tag = identifier
+
+        def decl_and_properties(object_name_combinator):
+            return ((object_name_combinator +         # "alt" syntax
+                     unquoted_tag("tag") -
+                     Optional(prop_list_open -
+                              Optional(property_list)('props') +
+                              prop_list_close))
+
+                     |                                   # OR
+
+                     (object_name_combinator +          # "regular" syntax
+                           prop_list_open -
+                           Optional(valid_tag + Optional(Suppress(',')))("tag") +
+                           Optional(property_list)("props") +
+                           prop_list_close))
+
+        std_obj_decl << (decl_and_properties(object_name("obj_type")) +
+                          Optional(block(object_declaration, "children") +   # remaining syntax
+                                   LineEnd())
+                        )
+
+        std_obj_decl.setParseAction(lambda c: MWASTNode(c.obj_type, c.tag,
+                                                        props=dict(c.props),
+                                                        children=getattr(c, 'children', [])))
+
+        transition = ((dummy_token("transition") | macro_element |
+                        Literal("always") | conditional)("condition") -
+                        Suppress("->") -
+                        (dummy_token("transition target") |
+                            quoted_string_fn() | template_reference | Literal("yield"))("target") +
+                        LineEnd()
+                     )
+
+        transition.setParseAction(lambda t: Transition(t.condition, t.target))
+
+        state_payload = None
+        if use_significant_whitespace:
+            state_payload = block_open + action_list_marker + block(action, "actions") + \
+                            transition_list_marker + block(transition, "transitions") + block_close
+        else:
+            state_payload = block(action, "actions") + transition_list_marker + block(transition, "transitions")
+
+        state = decl_and_properties(Literal('state')) + state_payload
+
+        state.setParseAction(lambda s: State(s.tag, props=dict(s.props), actions=s.actions, transitions=s.transitions))
+
+        # ------------------------------
+        # Variable Declarations
+        # ------------------------------
+
+        scope_type = (Literal('global') | Literal('local'))
+        variable_type = (dummy_token('variabletype') |
+                         Literal('integer') |
+                         Literal('float') |
+                         Literal('bool') |
+                         Literal('string') |
+                         Literal('struct') |
+                         Literal('var'))
+
+        variable_declaration = (LineStart() +
+                                Optional(scope_type) +
+                                variable_type('type') -
+                                identifier("tag") +
+                                Optional(prop_list_open + Optional(property_list('props')) + prop_list_close) +  # property list
+                                Optional(assign + value("default")))  # default value assignment
+
+        variable_declaration.setParseAction(lambda x: MWVariable(x.tag, default=x.default, props=dict(x.props)))
+
+        # ----------------------------------------------------
+        # Top-level object declarations and aliases thereof
+        # ----------------------------------------------------
+
+         # an in-place quicky
+        def alias_parse_action(x):
+            if x.alias != '':
+                x.object.set_prop('alias', x.alias)
+            return x.object
+
+        ordinary_object_declaration = Optional(identifier("alias") + assign) + (std_obj_decl |
+                                                                                action | state)("object")
+        ordinary_object_declaration.setParseAction(alias_parse_action)
+
+        object_declaration << (macro_if |
+                               template_definition |
+                               template_reference |
+                               ordinary_object_declaration |
+                               variable_declaration)
+
+        # --------------------------------------
+        # Final assembly into a "master" parser
+        # --------------------------------------
+
+        self.parser = OneOrMore(object_declaration) + StringEnd()
+        self.parser.enablePackrat()
+
+        # the named rules, for the parser profiler (see mwx.profiler)
+        self.rules = dict([(name, element)
+                           for name, element in locals().items()
+                           if isinstance(element, ParserElement)])
+
+    def parse(self, s):
+        """Parse a preprocessed document, and return its top-level nodes.
+           Syntax errors are raised as MWXSyntaxError, as by the fast engine.
+        """
+        try:
+            return self.parser.parseString(s, parseAll=True)
+        except ParseBaseException, pe:
+            raise MWXSyntaxError(pe.pstr, pe.loc, pe.msg)
+
+    def clear_memo(self):
+        """Drop the packrat memo (which is shared by every grammar)"""
+        ParserElement.resetCache()
+
+
+# compiled grammars, keyed by significant_whitespace
+grammars = {}
+
+
+def get_grammar(significant_whitespace=False):
+    """Return the shared MWXGrammar for the given flavor of the syntax,
+       building it on first use
+    """
+    significant_whitespace = bool(significant_whitespace)
+    if significant_whitespace not in grammars:
+        grammars[significant_whitespace] = MWXGrammar(significant_whitespace)
+    return grammars[significant_whitespace]
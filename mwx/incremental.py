@@ -0,0 +1,291 @@
+"""Support for incremental reparsing of MWX documents (see MWXParser.reparse
+   and MWXParser.iter_parse).
+
+   A document is split into chunks at top-level declaration boundaries by a
+   cheap pre-scan that only tracks brackets, quoted strings and comments.
+   Each chunk is parsed on its own, and the result is kept alongside the
+   final tree, so that when the document is edited only the chunks whose
+   text changed need to be parsed again.
+
+   Chunks that neither define nor use templates can't be affected by edits
+   elsewhere in the document, so their finished subtrees are reused as is.
+   A chunk that uses templates is resolved again only when it has changed,
+   or when one of the definitions its expansions depend on (see
+   template_bindings) is no longer the one it was resolved with.
+"""
+
+import re
+import cPickle
+from copy import copy
+
+from mwx.ast import *
+from mwx.ast.xml_export import do_registered_rewrites
+from mwx.preprocessor import quoted_string, comment
+
+# brackets, plus the things that may contain brackets that don't count
+# (quoted strings and comments, as the preprocessor sees them)
+bracket_scanner = re.compile(quoted_string + "|" + comment + r"|[{}\[\]()]")
+
+# a line starting with one of these continues the previous declaration
+continuation_chars = frozenset("{}[]()=+-*/^<>!&|,.")
+continuation_word = re.compile(r"(else|and|or)\b")
+
+openers = frozenset("{[(")
+closers = frozenset("}])")
+
+pickle_protocol = 1
+
+
+def split_declarations(s, significant_whitespace=False):
+    """Split a document into chunks of whole top-level declarations (see
+       iter_declarations)
+    """
+    return list(iter_declarations(s.splitlines(True), significant_whitespace))
+
+
+def iter_declarations(lines, significant_whitespace=False):
+    """Group an iterable of lines into chunks of whole top-level
+       declarations, yielding each chunk as a string as soon as it is
+       complete.
+
+       A new chunk starts at a line that begins outside of any bracket,
+       with something that can't be the continuation of the line before.
+       Blank and comment-only lines stay with the preceding chunk.  In
+       significant-whitespace mode, the line must also be unindented.
+    """
+    chunk = []
+    chunk_has_content = False
+    depth = 0
+
+    for line in lines:
+        content = line.lstrip()
+        first = content[:1]
+        is_content = first and not content.startswith("//") and first != "#"
+
+        if (is_content and depth <= 0 and chunk_has_content and
+            first not in continuation_chars and
+            not continuation_word.match(content) and
+            not (significant_whitespace and line[:1] in " \t")):
+
+            yield ''.join(chunk)
+            chunk = []
+
+        if is_content:
+            chunk_has_content = True
+
+        for m in bracket_scanner.finditer(line):
+            c = m.group()
+            if c in openers:
+                depth += 1
+            elif c in closers:
+                depth -= 1
+
+        chunk.append(line)
+
+    if chunk:
+        yield ''.join(chunk)
+
+
+class TemplateNodeFinder(TreeWalker):
+    """Find out whether a tree defines, references or conditionally
+       expands any templates
+    """
+
+    def reset(self):
+        self.result = False
+
+    def trigger(self, node):
+        return isinstance(node, (TemplateDefinition, TemplateReference,
+                                 TemplateIf))
+
+    def action(self, node, parent=None, parent_ctx=None, index=None):
+        self.result = True
+
+
+class TemplateDependencies(object):
+    """The templates defined so far in a document that is being read
+       declaration by declaration (see MWXParser.iter_parse), and the
+       names their bodies refer to (see template_references): enough to
+       tell whether a declaration needs a template, directly or through the
+       bodies of others, that is yet to be defined.  As TemplateGraph does
+       for a whole document, a template that refers to itself at every
+       call raises RecursiveTemplateException as soon as the last
+       definition in the cycle has been read.
+    """
+
+    def __init__(self):
+        self.templates = {}
+        self.refers = {}
+        self.may_refer = {}
+
+        # the names whose templates, and all they might refer to, are
+        # defined
+        self.complete = set()
+
+    def update(self, found):
+        """Add the template definitions found (a dict of them, by name)"""
+        if not found:
+            return
+
+        if any([name in self.templates for name in found]):
+            # a template defined again may refer to others
+            self.complete = set()
+
+        self.templates.update(found)
+        for name in found:
+            (self.refers[name],
+             self.may_refer[name]) = template_references(found[name])
+
+        # only a cycle through the new definitions can be new
+        edges = {}
+        pending = list(found)
+        while pending:
+            name = pending.pop()
+            if name in edges:
+                continue
+            edges[name] = set([n for n in self.refers[name]
+                               if n in self.templates])
+            pending.extend(edges[name])
+
+        cycle = TemplateGraph.depth_first(edges)[1]
+        if cycle is not None:
+            raise RecursiveTemplateException(cycle)
+
+    def missing(self, nodes):
+        """Whether nodes refer to a template, or to one that a template
+           they refer to might refer to, in turn, that isn't defined yet
+        """
+        pending = [name for name in template_names(nodes, is_reference,
+                                                   TemplateDefinition)
+                   if name not in self.complete]
+        seen = set(pending)
+        while pending:
+            name = pending.pop()
+            if name not in self.templates:
+                return True
+            for other in self.may_refer[name]:
+                if other not in seen and other not in self.complete:
+                    seen.add(other)
+                    pending.append(other)
+
+        self.complete |= seen
+        return False
+
+
+class DeclarationChunk(object):
+    """The parse of one chunk of a document"""
+
+    def __init__(self, text, included_files, nodes):
+        self.text = text
+        self.included_files = included_files
+
+        # a pristine copy of the parsed nodes; template resolution rewrites
+        # trees in place
+        self.raw = cPickle.dumps(list(nodes), pickle_protocol)
+
+        self.uses_templates = TemplateNodeFinder(list(nodes)).walk()
+
+        # the templates the chunk defines, by name (from the parsed nodes,
+        # which are otherwise let go, so that they stay the same objects for
+        # as long as the chunk is reused)
+        self.templates = {}
+        if self.uses_templates:
+            self.templates = TemplateDefinitionFinder(list(nodes)).walk()
+
+        # the finished nodes, once they have been computed, and for a chunk
+        # that uses templates, the (name, template) pairs they were resolved
+        # with (see template_bindings)
+        self.final = None
+        self.bindings = None
+
+    def nodes(self):
+        """Return a fresh copy of the parsed nodes"""
+        return cPickle.loads(self.raw)
+
+    def duplicate(self):
+        """Return a chunk with the same parse, but no finished nodes, for
+           use at a second place in a document
+        """
+        d = copy(self)
+        d.final = None
+        d.bindings = None
+        return d
+
+    def resolved_with(self, templates):
+        """Whether the finished nodes were resolved with the templates that
+           are in templates now
+        """
+        if self.final is None or self.bindings is None:
+            return False
+        for (name, template) in self.bindings:
+            if templates.get(name) is not template:
+                return False
+        return True
+
+
+class IncrementalParseState(object):
+    """The chunks that made up a document, and the options they were parsed
+       with
+    """
+
+    def __init__(self, options, chunks):
+        self.options = options
+        self.chunks = chunks
+
+    def reusable_chunks(self, options):
+        """Index the chunks by text, for lookup during a reparse"""
+        index = {}
+        if options != self.options:
+            return index
+
+        for chunk in self.chunks:
+            index.setdefault(chunk.text, []).append(chunk)
+        return index
+
+
+def finish_chunks(chunks, process_templates=True):
+    """Run template resolution and the registered rewrites over a list of
+       chunks, and return the top-level nodes of the finished document.
+
+       Each chunk is finished on its own, with the templates defined by all
+       of them (as resolve_templates would find them in the whole
+       document), and its finished nodes are kept.  Template-free chunks
+       are reused thereafter; those that use templates are reused for as
+       long as the templates their expansions depend on are the same.
+    """
+
+    templates = {}
+    resolver = None
+    if process_templates:
+        for chunk in chunks:
+            templates.update(chunk.templates)
+        if templates:
+            # (raises RecursiveTemplateException, as for a whole document)
+            TemplateGraph(templates).prepare(templates)
+
+    results = []
+    for chunk in chunks:
+        if not (process_templates and chunk.uses_templates):
+            if chunk.final is None:
+                nodes = chunk.nodes()
+                if process_templates:
+                    nodes = resolve_templates(nodes)
+                chunk.final = do_registered_rewrites(nodes)
+
+        elif not chunk.resolved_with(templates):
+            nodes = chunk.nodes()
+            names = template_names(nodes, is_reference)
+
+            # one resolver for the document, as resolve_templates would
+            # have, minus the chunks reused
+            if resolver is None:
+                resolver = TemplateResolver(templates)
+            root = resolver.resolve(RootNode(children=nodes))
+            ExpressionSimplifier(root, resolver.simplified).walk()
+
+            chunk.final = do_registered_rewrites(root.children)
+            chunk.bindings = template_bindings(names, templates).items()
+
+        results += chunk.final
+
+    return results
@@ -0,0 +1,179 @@
+"""Significant-whitespace MWX, rewritten into the brace flavor of the syntax.
+
+   In significant-whitespace mode (MWXParser(significant_whitespace=True),
+   mwx -w), a block is opened by a colon at the end of a line, and holds the
+   lines indented under it:
+
+     trial["Trial 1"]:
+         wait(100ms)
+
+   Rather than have the grammar track indentation (pyparsing's indentedBlock
+   re-checks the indentation stack on every attempt, and backtracks heavily),
+   the document is rewritten into brace blocks in a single linear pass over
+   its tokens: the colon becomes an opening brace, and a closing brace is
+   inserted, on a line of its own, after the last line of the block.  The
+   result is parsed by the same rules as brace-mode documents.
+
+   Only logical lines count: a line that continues an open bracket (or a
+   triple-quoted string, as in python(\"\"\" ... \"\"\")) is part of the line
+   it continues, whatever its indentation.  Blank lines don't count either.
+   Brace blocks written out in full still work, as their contents are
+   inside a bracket.
+"""
+
+import re
+from bisect import bisect_right
+
+from mwx.expression import MWXSyntaxError
+
+
+token = re.compile(r'(?P<string>"""(?:.|\n)*?"""|'
+                   r'"(?:[^"\n\r\\]|\\.?)*"|'
+                   r"'(?:[^'\n\r\\]|\\.?)*')|"
+                   r'(?P<open>[\[({])|'
+                   r'(?P<close>[\])}])|'
+                   r'(?P<colon>:)|'
+                   r'(?P<newline>\n)|'
+                   r'(?P<space>[ \t\r]+)|'
+                   r'(?P<other>[^\s"\'\[\](){}:]+|.)')
+
+block_close = "\n}"
+
+
+class IndentedText(object):
+    """A significant-whitespace document, and its brace-block rewrite.
+       text is the rewrite, and original the document itself (with its tabs
+       expanded).  Raises MWXSyntaxError if the indentation is inconsistent.
+    """
+
+    def __init__(self, original):
+        self.original = original.expandtabs()
+        self.text, insertions = self.rewrite(self.original)
+
+        # where each inserted string starts in the rewrite, and how far the
+        # rewrite is ahead of the original after it
+        self.insertion_offsets = []
+        self.insertion_shifts = []
+        self.insertion_points = []
+        shift = 0
+        for offset, length in insertions:
+            self.insertion_offsets.append(offset + shift)
+            self.insertion_points.append(offset)
+            shift += length
+            self.insertion_shifts.append(shift)
+
+    def error(self, loc, msg):
+        return MWXSyntaxError(self.original, loc, msg)
+
+    def rewrite(self, s):
+        """Return the brace-block rewrite of s, and a list of the (offset,
+           length) of the strings inserted into it
+        """
+        # (offset, length replaced, replacement), in order of offset
+        edits = []
+
+        # the indentation of the open blocks
+        indents = []
+
+        depth = 0
+        line_start = 0
+        in_line = False
+
+        # the indentation of a line that opened a block, until the first
+        # line of the block is seen
+        opener = None
+
+        colon = None
+        indent = 0
+        line_end = 0
+
+        for m in token.finditer(s):
+            kind = m.lastgroup
+            if kind == 'space':
+                continue
+
+            if kind == 'newline':
+                if depth == 0:
+                    if in_line:
+                        opener = self.end_line(edits, colon, indent)
+                        line_end = m.start()
+                        in_line = False
+                    line_start = m.end()
+                continue
+
+            if not in_line:
+                in_line = True
+                colon = None
+                indent = m.start() - line_start
+
+                if opener is not None:
+                    if indent <= opener:
+                        raise self.error(m.start(),
+                                         "Expected an indented block")
+                    indents.append(indent)
+                    opener = None
+                elif indents:
+                    if indent > indents[-1]:
+                        raise self.error(m.start(), "Unexpected indent")
+                    while indents and indent < indents[-1]:
+                        indents.pop()
+                        edits.append((line_end, 0, block_close))
+                    if indents and indent != indents[-1]:
+                        raise self.error(m.start(), "Unindent does not "
+                                         "match any outer indentation level")
+
+            if kind == 'colon' and depth == 0:
+                colon = m.start()
+            else:
+                colon = None
+                if kind == 'open':
+                    depth += 1
+                elif kind == 'close' and depth:
+                    depth -= 1
+
+        if in_line:
+            opener = self.end_line(edits, colon, indent)
+            line_end = len(s)
+        if opener is not None:
+            raise self.error(len(s), "Expected an indented block")
+        for i in indents:
+            edits.append((line_end, 0, block_close))
+
+        pieces = []
+        insertions = []
+        p = 0
+        for offset, length, replacement in edits:
+            pieces.append(s[p:offset])
+            pieces.append(replacement)
+            if not length:
+                insertions.append((offset, len(replacement)))
+            p = offset + length
+        pieces.append(s[p:])
+
+        return ''.join(pieces), insertions
+
+    def end_line(self, edits, colon, indent):
+        """Finish a logical line.  If it ends with a colon, open a block, and
+           return the indentation of the line; otherwise return None.
+        """
+        if colon is None:
+            return None
+        edits.append((colon, 1, "{"))
+        return indent
+
+    def original_offset(self, offset):
+        """Map an offset in the rewrite back to the original document.  An
+           offset inside an inserted brace maps to where it was inserted.
+        """
+        i = bisect_right(self.insertion_offsets, offset) - 1
+        if i < 0:
+            return offset
+        if offset < self.insertion_offsets[i] + len(block_close):
+            return self.insertion_points[i]
+        return offset - self.insertion_shifts[i]
+
+    def original_error(self, e):
+        """Translate an MWXSyntaxError raised for the rewrite into one for
+           the original document
+        """
+        return self.error(self.original_offset(e.loc), e.msg)
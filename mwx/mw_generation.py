@@ -1,9 +1,8 @@
 from ast import *
-from numpy import arange
-import uuid
 
 
 def generate_unique_id():
+    import uuid
     return str(uuid.uuid1())
 
 
@@ -11,6 +10,11 @@ def generate_unique_id():
 
 class TypeFilteredTreeWalker(TreeWalker):
 
+    # whether the pass can visit just the nodes its filter lets through,
+    # found in the RootNode's index, rather than walking the whole tree; not
+    # for passes that rewrite the tree as they go
+    indexed = True
+
     def __init__(self, tree, filt=None):
         TreeWalker.__init__(self, tree)
 
@@ -21,6 +25,19 @@ class TypeFilteredTreeWalker(TreeWalker):
         else:
             self.filter = [filt]
 
+    def walk(self):
+        if (not self.indexed or self.filter is None or
+            not isinstance(self.tree, RootNode)):
+            return TreeWalker.walk(self)
+
+        self.reset()
+
+        for (node, parent, parent_ctx, index) in \
+                self.tree.occurrences(self.filter):
+            if self.trigger(node):
+                self.action(node, parent, parent_ctx, index)
+        return self.result
+
     # decide if this node requires action
     def trigger(self, node):
 
@@ -58,14 +75,16 @@ class CreateObjectPass(TypeFilteredTreeWalker):
         if parent_ctx is MWASTNode.PROPERTY_CTX:
             return
 
-        props = node.props
+        node.derive_tag()
 
         if 'tag' in node.props and not self.anonymous:
             # TODO: don't overwrite
             tag = node.props['tag']
         else:
             tag = generate_unique_id()
-            node.props['tag'] = tag
+            node.set_prop('tag', tag)
+
+        props = node.props
 
         if tag is '':
             raise Exception("Cannot create object with empty tag:\n %s" % node.to_ast_string())
@@ -82,6 +101,8 @@ class ExpandReplicatorPass(TypeFilteredTreeWalker):
         expanded
     """
 
+    indexed = False
+
     def __init__(self, tree, reg, filt=None):
         TypeFilteredTreeWalker.__init__(self, tree, ['range_replicator',
                                                      'list_replicator'])
@@ -97,6 +118,9 @@ class ExpandReplicatorPass(TypeFilteredTreeWalker):
             to_val = node.props['to']
             step_val = node.props['step']
 
+            # numpy is slow to import, and only needed here
+            from numpy import arange
+
             # TODO: check float versus integer
             replicator_value_list = arange(from_val, to_val, step_val)
         elif node.obj_type is 'list_replicator':
@@ -134,6 +158,9 @@ class ConnectPass(TypeFilteredTreeWalker):
         if parent.obj_type in ['root', 'template_definition']:
             return
 
+        parent.derive_tag()
+        node.derive_tag()
+
         if 'tag' not in parent.props:
             logging.error('No tag defined: %s' % parent.props)
             return
@@ -167,6 +194,8 @@ class FinalizePass(TypeFilteredTreeWalker):
         if parent.obj_type is 'template':
             return
 
+        node.derive_tag()
+
         if 'tag' not in node.props:
             raise Exception("Attempting to finalize an object that doesn't have a 'tag' attribute")
         tag = node.props['tag']
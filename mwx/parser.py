@@ -1,5 +1,4 @@
 
-from pyparsing import *
 import re
 from copy import deepcopy
 
@@ -7,486 +6,434 @@ from mwx.ast import *
 from mwx.constants import *
 from mwx.ast.xml_export import do_registered_rewrites
 from mwx.ast.xml_import import do_registered_xml_import_rewrites
+from mwx.fast_parser import FastMWXParser, MWXSyntaxError
+from mwx.indentation import IndentedText
+from mwx.preprocessor import Preprocessor, PreprocessorError
+from mwx.incremental import (split_declarations, iter_declarations,
+                             DeclarationChunk, IncrementalParseState,
+                             finish_chunks, TemplateDependencies)
 
 import os
 import sys
 
 # Increase max stack size from 8MB to 512MB
 #resource.setrlimit(resource.RLIMIT_STACK, (2 ** 29, -1))
+# (TreeWalker keeps its own stack, but pyparsing, the fast parser's recursive
+# descent, pickling a tree and to_ast_string still recurse once per level)
 sys.setrecursionlimit(10 ** 6)
 
 
 # Helper functions
 
-def list_to_literals(list_of_names):
-    """Convert a list of strings to an OR'd sequence of pyparsing Literal
-       objects
+def format_parser_error(pe, input_string=None, source_map=None):
+    """Describe a parser error, including a listing of the code that
+       generated the error.  With a source map (see mwx.preprocessor), the
+       error is reported at the file and line the code came from.
     """
-    p = Literal(list_of_names[0])
-    for l in list_of_names[1:]:
-        p = p | Literal(l)
-
-    return p
-
-
-def dummy_token(name):
-    """A pyparsing token allows for more sensible error reporting.  It does
-       not match any content, but its name will be used if an error occurs
-       is an OR'd sequences where the dummy_token is the first element.
-    """
-    exception_token = NoMatch()
-    exception_token.setName(name.upper())
-    return exception_token
-
-
-def print_parser_error(pe, input_string=None):
-    """Pretty-print a parser error, including a listing of the code that
-       generated the error
-    """
-    from sys import stderr
-
     if input_string == None:
         input_string = pe.pstr
 
-    stderr.write("On line %d, col %d\n" % (pe.lineno, pe.col))
-    stderr.write(pe.msg)
-    stderr.write("\n")
+    out = []
+
+    lineno = pe.lineno
+    if source_map is not None:
+        filename, lineno = source_map.origin(pe.loc)
+        if filename is not None:
+            out.append("In %s\n" % filename)
+
+    out.append("On line %d, col %d\n" % (lineno, pe.col))
+    out.append(pe.msg)
+    out.append("\n")
 
     col = pe.col
     lines = input_string.split("\n")
     preceding = lines[pe.lineno - 2]
     following = lines[pe.lineno]
-    stderr.write("%4d:    %s\n" % (pe.lineno - 1, preceding))
-    stderr.write("%4d: -->%s\n" % (pe.lineno, pe.line))
-    stderr.write(" " * (col + 8) + "^\n")
-    stderr.write("%4d:    %s\n" % (pe.lineno + 1, following))
-
-
-def quoted_string_fn(drop_quotes=True):
-    dq = QuotedString('"', "\\", "\\", False, True)
-    sq = QuotedString("'", "\\", "\\", False, True)
-
-    if drop_quotes:
-        dq.setParseAction(lambda s: str(s[0]).strip('"'))
-        sq.setParseAction(lambda s: str(s[0]).strip("'"))
-
-    qs = dq | sq
-
-    return qs
-
-
-class MWXParser:
-    """A parser object for the 'MWX' lightweight MWorks DSL."""
-
-    # for use with significant-whitespace grammars
-    indent_stack = [1]
-
-    def __init__(self, **kwargs):
-
-        use_significant_whitespace = kwargs.pop("significant_whitespace", False)
+    out.append("%4d:    %s\n" % (lineno - 1, preceding))
+    out.append("%4d: -->%s\n" % (lineno, pe.line))
+    out.append(" " * (col + 8) + "^\n")
+    out.append("%4d:    %s\n" % (lineno + 1, following))
 
-        # ------------------------------
-        # Parser Combinator Definitions
-        # ------------------------------
-
-        # Parsers in pyparsing take the form of a large collection of
-        # parser object instantiations that handle snippets of syntax
-        # and assemblies thereof.
-        # At the end of the day, we're aiming towards a final parser
-        # object that will accept a full document
+    return ''.join(out)
 
-        # ------------------------------
-        # Style and symbols
-        # ------------------------------
-        # Definition of block syntax.
-
-        block = None
-        if use_significant_whitespace:
-            block_open = Suppress(":")
-            block = lambda x, p: block_open - (indentedBlock(x, self.indent_stack, True))(p)
-        else:
-            block_open = Suppress("{")
-            block_close = Suppress("}")
-            block = lambda x, p: block_open - OneOrMore(x)(p) + block_close
-
-        # Some other stylistic variations
-        prop_list_open = Suppress("[")
-        prop_list_close = Suppress("]")
-
-        arg_list_open = Suppress("(")
-        arg_list_close = Suppress(")")
 
-        index_operator_open = Suppress("[")
-        index_operator_close = Suppress("]")
-
-        if use_significant_whitespace:
-            action_list_marker = Suppress("actions")
-            transition_list_marker = Suppress("transitions")
-        else:
-            action_list_marker = empty
-            transition_list_marker = Suppress("transition")
-
-        assign = Literal("=")
-        macro_symbol = Suppress("@")
-        def_keyword = Suppress("macro")
-
-        # triple_quote = Suppress("\"\"\"")
-
-        # ------------------------------
-        # Forward declarations
-        # ------------------------------
-
-        # Things that will be recursively embedded later
-        object_declaration = Forward()
-        expression = Forward()
-        value = Forward()
-
-        # ------------------------------
-        # Keywords
-        # ------------------------------
-
-        # Valid names of container object.  TODO: build from MWLibrary.xml
-        # container_name = oneOf(" ".join(container_types))
-
-        # Valid names of container object.  TODO: build from MWLibrary.xml
-        # noncontainer_name = oneOf(" ".join(noncontainer_types))
-
-        object_name = oneOf(" ".join(container_types + noncontainer_types))
-
-        # Valid names of action objects.  TODO: build from MWLibrary.xml
-        action_name = oneOf(" ".join(shorthand_action_types))
-
-        # Allowed foreign languages
-        language_name = Literal("python") | Literal("ruby")
-
-        # import and include
-        #import_kw = Keyword('import')
-
-        # ------------------------------
-        # Values and Expressions
-        # ------------------------------
-
-        integer_number = Word(nums)('str')
-        integer_number.setParseAction(lambda x: int(x.str))
-        float_number = Combine(Word(nums) + Optional(Literal(".") + Word(nums)))('str')
-        float_number.setParseAction(lambda x: float(x.str))
-        time_unit = Literal("ms") | Literal("us") | Literal("s") | Literal("min")
-        duration = Combine(integer_number + time_unit)
-        identifier = Word(alphanums + '_' + '#')
-        function_call = identifier("name") + arg_list_open + Group(delimitedList(expression))("args") + arg_list_close
-
-        def function_call_helper(n, a):
-            f_args = None
-            if a is not None:
-                f_args = a.asList()
-            r = [MWFunctionCall(n, f_args)]
-            return r
-
-        function_call.setParseAction(lambda x: function_call_helper(x.name, x.args))
-
-        array_reference = identifier('arr_var_ref_name') + index_operator_open + expression('arr_var_ref_index') + index_operator_close
-        array_reference.setParseAction(lambda x: MWVariableReference(identifier=x.arr_var_ref_name, index=x.arr_var_ref_index))
-
-        # for now, just support 1D array indexing.  Fancier slicing, etc. can come later
-        #variable_index_argument = Suppress(arg_list_open) + (integer_number | variable_reference) + Suppress(arg_list_close)
-
-        variable_reference = identifier("varname")
-        variable_reference.setParseAction(lambda x: MWVariableReference(identifier=x.varname))
-
-        # ------------------------------
-        # Templates
-        # ------------------------------
-
-        simple_value_template = def_keyword + identifier("name") + Suppress(assign) + value("value")
-        simple_value_template.setParseAction(lambda x: create_template_definition(x.name, [], children=[x.value]))
-        template_reference = macro_symbol + identifier("name") + Optional(NotAny(LineEnd()) + Suppress("(") + ZeroOrMore(value + Suppress(Optional(",")))("args") + Suppress(")"))
-        template_reference.setParseAction(lambda x: TemplateReference(x.name, x.args))
-
-        macro_template_decl = def_keyword + identifier("name") + \
-                              Optional(Suppress("(") + ZeroOrMore(identifier + Optional(Suppress(","))) + Suppress(")"))("args") + \
-                              Optional(Suppress(assign)) + \
-                              block(object_declaration, "body")
-
-        macro_template_val = def_keyword + identifier("name") + \
-                              Optional(Suppress("(") + ZeroOrMore(identifier + Optional(Suppress(","))) + Suppress(")"))("args") + \
-                              Suppress(assign) - value("body")
+def print_parser_error(pe, input_string=None, source_map=None):
+    """Pretty-print a parser error to stderr (see format_parser_error)"""
+    from sys import stderr
 
-        macro_template_decl.setParseAction(lambda x: create_template_definition(x.name, x.args, children=x.body))  # for now
-        macro_template_val.setParseAction(lambda x: create_template_definition(x.name, x.args, children=x.body))  # for now
+    stderr.write(format_parser_error(pe, input_string, source_map))
 
-        template_definition = simple_value_template | macro_template_decl | macro_template_val
 
-        # ------------------------------
-        # Macro control flow
-        # ------------------------------
+def print_preprocessor_error(e):
+    """Report a bad include statement"""
+    from sys import stderr
 
-        macro_if = macro_symbol + Suppress("if") - \
-                   Suppress("(") - expression("condition") + Suppress(")") -\
-                   block(object_declaration, "body") +\
-                   Optional(Suppress("else") + \
-                            block(object_declaration, "else_body"))
+    stderr.write("%s\n" % e)
 
-        macro_if.setParseAction(lambda x: TemplateIf(x.condition,
-                                                     x.body,
-                                                     x.else_body))
 
-        macro_element = macro_if | macro_template_val
+# the errors that parse_document and reparse_document raise for bad input
+document_errors = (PreprocessorError, MWXSyntaxError,
+                   TemplateConditionException)
 
-        # ------------------------------
-        # Operators, infix notation, etc.
-        # ------------------------------
 
-        # Basic expression handling
-        operand = (template_reference | duration | float_number | integer_number | quoted_string_fn(False) |
-                   function_call | array_reference | variable_reference)
+def format_document_error(e):
+    """Describe one of the document_errors, against the files that the code
+       came from
+    """
+    if not isinstance(e, MWXSyntaxError):
+        return "%s\n" % e
+    return format_parser_error(e, e.preprocessed.text,
+                               e.preprocessed.source_map)
 
-        exp_op = Literal("^") | Literal("**")
-        sign_op = Literal("+") | Literal("-")
-        multiply_op = Literal("*") | Literal("/")
-        plus_op = Literal("+") | Literal("-")
 
-        # operators + normalized optional syntax
-        not_op = (Literal("not") | Literal("!")).setParseAction(lambda x: ["not"])
-        and_op = (Literal("and") | Literal("&&")).setParseAction(lambda x: ["and"])
-        or_op = (Literal("or") | Literal("||")).setParseAction(lambda x: ["or"])
-        comp_op = list_to_literals([">=", "<=", ">", "<", "==", "!="])
+class MWXParser:
+    """A parser object for the 'MWX' lightweight MWorks DSL."""
 
-        def binary_expression_helper(pr):
+    # how far iter_parse will look ahead for the end of a declaration that
+    # doesn't parse on its own
+    max_declaration_lines = 1000
 
-            assert(len(pr) >= 3)
+    def __init__(self, **kwargs):
 
-            operator = pr[1]
-            operand1 = pr[0]
-            operand2 = pr[2]
-            expr = MWBinaryExpression(operator, operand1, operand2)
-
-            if len(pr) > 3:
-                # why the f does pyparsing do this?
-                return binary_expression_helper([expr] + pr[3:])
-            else:
-                return expr
+        use_significant_whitespace = kwargs.pop("significant_whitespace", False)
 
-        def unary_expression_helper(pr):
-            operator = ""
-            if len(pr) == 2:
-                operator = pr[0]
-                operand = pr[1]
+        # "pyparsing" uses the combinator grammar in MWXGrammar, "fast" uses the
+        # hand-written recursive-descent parser in mwx.fast_parser.  Both
+        # build the same trees.
+        self.engine = kwargs.pop("engine", "pyparsing")
+        if self.engine not in ("pyparsing", "fast"):
+            raise Exception("Unknown parser engine: %s" % self.engine)
+
+        # with profile=True, every grammar rule records how often it was
+        # tried and how long it took (see mwx.profiler)
+        self.profiler = None
+        if kwargs.pop("profile", False):
+            from mwx.profiler import ParserProfiler
+            self.profiler = ParserProfiler()
+
+        if self.engine == "fast":
+            self.fast_parser = FastMWXParser(self.profiler,
+                                             use_significant_whitespace)
+
+        # optional on-disk cache of finished trees (see mwx.cache)
+        self.cache = None
+        cache_dir = kwargs.pop("cache_dir", None)
+        if cache_dir is not None:
+            from mwx.cache import ParseCache, default_max_size
+            self.cache = ParseCache(cache_dir,
+                                    kwargs.pop("cache_size", default_max_size))
+
+        self.use_significant_whitespace = use_significant_whitespace
+
+        self.grammar = None
+        self.parser = None
+        if self.engine == "pyparsing":
+            # pyparsing is only imported once a parser needs it
+            from mwx.grammar import MWXGrammar, get_grammar
+
+            if self.profiler is not None:
+                # instrument a grammar of our own, rather than the shared one
+                self.grammar = MWXGrammar(use_significant_whitespace)
+                self.profiler.instrument_grammar(self.grammar.rules,
+                                                 self.grammar.parser)
             else:
-                raise Exception("Incorrect number of operands to unary op: %s" % pr)
-
-            return MWUnaryExpression(operator, operand)
-
-        expression << operatorPrecedence(operand,
-                                         [(exp_op, 2, opAssoc.RIGHT, lambda x: binary_expression_helper(x[0])),
-                                          (sign_op, 1, opAssoc.RIGHT, lambda x: unary_expression_helper(x[0])),
-                                          (multiply_op, 2, opAssoc.LEFT, lambda x: binary_expression_helper(x[0])),
-                                          (plus_op, 2, opAssoc.LEFT, lambda x: binary_expression_helper(x[0])),
-                                          (not_op, 1, opAssoc.RIGHT, lambda x: unary_expression_helper(x[0])),
-                                          (or_op,  2, opAssoc.LEFT,  lambda x: binary_expression_helper(x[0])),
-                                          (and_op, 2, opAssoc.LEFT,  lambda x: binary_expression_helper(x[0])),
-                                          (comp_op, 2, opAssoc.LEFT, lambda x: binary_expression_helper(x[0]))
-                                         ])
+                self.grammar = get_grammar(use_significant_whitespace)
+            self.parser = self.grammar.parser
 
-        value << (dummy_token("expression") | expression)
+        # comments and includes (see mwx.preprocessor)
+        self.preprocessor = Preprocessor()
 
-        # --------------------------------------------
-        # Conditionals
-        # --------------------------------------------
-
-        cond_expr = expression
-
-        conditional = (dummy_token("conditional expression") | cond_expr)
-
-        # --------------------------------------------
-        # Miscellaneous general reusable syntax parts
-        # --------------------------------------------
-
-        property_pair = Group(Word(alphanums + '_')("prop") + Suppress(assign) - value("value"))
-        property_list = OneOrMore(property_pair + Optional(Suppress(",")))
-
-        # ------------------------------
-        # Object Declarations
-        # ------------------------------
-
-        # Actions
-        std_obj_decl = Forward()
-        action = Forward()
-
-        generic_action = (action_name("type") + arg_list_open -
-                          Optional(value)("arg") + Optional(property_list)("props") +
-                          arg_list_close)
-        generic_action.setParseAction(lambda a: Action(a.type,  a.arg, props=dict(a.props)))
-
-        assignment_action = NotAny(def_keyword) + identifier("variable") + assign - value("value")
-        assignment_action.setParseAction(lambda a: AssignmentAction(a.variable, a.value))
-
-        if(use_significant_whitespace):
-            foreign_code_action = language_name("lang") - "(" + \
-                                  Regex(r"\s*\"\"\"\s*^(?P<padding>\s*)(?P<code>.*?)\s*\"\"\"", re.MULTILINE | re.DOTALL) + \
-                                  ")"
-        else:
-            foreign_code_action = language_name("lang") + Regex(r"{\s*^(?P<padding>\s*)(?P<code>.*?)^\s*}", re.MULTILINE | re.DOTALL)
-
-        foreign_code_action.setParseAction(lambda a: ForeignCodeAction(a.lang, remove_python_padding(a.code, a.padding)))
-
-        if_action = Literal("if") - conditional("condition") + block(action, "children")
-        if_action.setParseAction(lambda a: MWASTNode("action", props={"type": "if", "condition": a.condition}, children=a.children))
-
-        action << (dummy_token("action") | macro_element | assignment_action | foreign_code_action | if_action | generic_action | std_obj_decl)
-
-        # "Ordinary" components
-
-        valid_tag = (quoted_string_fn(True) | template_reference)
-        unquoted_tag = identifier
-
-        def decl_and_properties(object_name_combinator):
-            return ((object_name_combinator +         # "alt" syntax
-                     unquoted_tag("tag") -
-                     Optional(prop_list_open -
-                              Optional(property_list)('props') +
-                              prop_list_close))
-
-                     |                                   # OR
-
-                     (object_name_combinator +          # "regular" syntax
-                           prop_list_open -
-                           Optional(valid_tag + Optional(Suppress(',')))("tag") +
-                           Optional(property_list)("props") +
-                           prop_list_close))
-
-        std_obj_decl << (decl_and_properties(object_name("obj_type")) +
-                          Optional(block(object_declaration, "children") +   # remaining syntax
-                                   LineEnd())
-                        )
-
-        std_obj_decl.setParseAction(lambda c: MWASTNode(c.obj_type, c.tag,
-                                                        props=dict(c.props),
-                                                        children=getattr(c, 'children', [])))
+    def parse_preprocessed(self, preprocessed):
+        """Parse a string that has already been through the comment and
+           include preprocessors, and return a list of top-level nodes
+        """
+        if not self.use_significant_whitespace:
+            return self.parse_braces(preprocessed)
 
-        transition = ((dummy_token("transition") | macro_element |
-                        Literal("always") | conditional)("condition") -
-                        Suppress("->") -
-                        (dummy_token("transition target") |
-                            quoted_string_fn() | template_reference | Literal("yield"))("target") +
-                        LineEnd()
-                     )
+        # indented blocks become brace blocks (see mwx.indentation), and
+        # errors are reported against the text as it was written
+        indented = IndentedText(preprocessed)
+        try:
+            return self.parse_braces(indented.text)
+        except MWXSyntaxError, pe:
+            raise indented.original_error(pe)
 
-        transition.setParseAction(lambda t: Transition(t.condition, t.target))
+    def parse_braces(self, text):
+        if self.engine == "fast":
+            return self.fast_parser.parse(text)
 
-        state_payload = None
-        if use_significant_whitespace:
-            state_payload = block_open + indentedBlock(action_list_marker + block(action, "actions") + \
-                            transition_list_marker + block(transition, "transitions"), self.indent_stack, True)
-        else:
-            state_payload = block(action, "actions") + transition_list_marker + block(transition, "transitions")
+        return self.grammar.parse(text)
 
-        state = decl_and_properties(Literal('state')) + state_payload
+    def parse_string(self, s, process_templates=True, base_path='.'):
+        """Process a string containing valid MWX content, and return a tree of
+           MWASTNode objects.  Errors are reported on stderr, and end the
+           program.
+        """
 
-        state.setParseAction(lambda s: State(s.tag, props=dict(s.props), actions=s.actions, transitions=s.transitions))
+        try:
+            return self.parse_document(s, process_templates, base_path)
+        except document_errors, e:
+            sys.stderr.write(format_document_error(e))
+            exit()
 
-        # ------------------------------
-        # Variable Declarations
-        # ------------------------------
+    def parse_document(self, s, process_templates=True, base_path='.',
+                       included_files=None):
+        """Like parse_string, but errors are raised: a PreprocessorError for
+           a bad include, a TemplateConditionException for a template @if
+           whose condition can't be evaluated, or a parse exception carrying
+           the PreprocessedText it was raised for (as its preprocessed
+           attribute), so that it can be reported against the original
+           files.  The (path, contents) of the files the document includes
+           are added to included_files.
+        """
 
-        scope_type = (Literal('global') | Literal('local'))
-        variable_type = (dummy_token('variabletype') |
-                         Literal('integer') |
-                         Literal('float') |
-                         Literal('bool') |
-                         Literal('string') |
-                         Literal('struct') |
-                         Literal('var'))
+        preprocessed = self.preprocessor.preprocess(s, base_path)
+        if included_files is not None:
+            included_files.extend(preprocessed.included_files)
 
-        variable_declaration = (LineStart() +
-                                Optional(scope_type) +
-                                variable_type('type') -
-                                identifier("tag") +
-                                Optional(prop_list_open + Optional(property_list('props')) + prop_list_close) +  # property list
-                                Optional(assign + value("default")))  # default value assignment
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.key(s, preprocessed.included_files,
+                                       (self.use_significant_whitespace,
+                                        process_templates))
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
 
-        variable_declaration.setParseAction(lambda x: MWVariable(x.tag, default=x.default, props=dict(x.props)))
+        try:
+            results = self.parse_preprocessed(preprocessed.text)
 
-        # ----------------------------------------------------
-        # Top-level object declarations and aliases thereof
-        # ----------------------------------------------------
+        except MWXSyntaxError, pe:
+            pe.preprocessed = preprocessed
+            raise
 
-         # an in-place quicky
-        def alias_parse_action(x):
-            if x.alias != '':
-                x.object.props['alias'] = x.alias
-            return x.object
+        if process_templates:
+            results = resolve_templates(results)
 
-        ordinary_object_declaration = Optional(identifier("alias") + assign) + (std_obj_decl |
-                                                                                action | state)("object")
-        ordinary_object_declaration.setParseAction(alias_parse_action)
+        results = do_registered_rewrites(results)
 
-        object_declaration << (macro_if |
-                               template_definition |
-                               template_reference |
-                               ordinary_object_declaration |
-                               variable_declaration)
+        if getattr(results, '__iter__', False):
+            results = RootNode(children=results)
 
-        # --------------------------------------
-        # Final assembly into a "master" parser
-        # --------------------------------------
+        if cache_key is not None:
+            self.cache.put(cache_key, results)
 
-        self.parser = OneOrMore(object_declaration) + StringEnd()
-        self.parser.enablePackrat()
+        return results
 
-        # ------------------------------
-        # Comment preprocesser (used separately)
-        # ------------------------------
-
-        comment_regex = r"(//|#).*?$"  # accept either shell or c++ style comments
-        self.comment_parser = (QuotedString('"', unquoteResults=False) |
-                               QuotedString("'", unquoteResults=False) |
-                               Suppress(Regex(comment_regex, re.MULTILINE | re.DOTALL)))
-        #self.comment_parser.enablePackrat()
 
-    def include_parser(self, base_path):
-
-        # Include preprocessor
-        # File include
-        path = Word(alphas + '_./')
-        include_kw = Keyword('include')
+    def reparse(self, old_result, s, process_templates=True, base_path='.'):
+        """Parse a new version of a document, reusing as much as possible of
+           the work done for old_result.
 
+           The document is split into chunks at top-level declaration
+           boundaries, and only chunks that are new or changed are parsed.
+           The result is the same as that of parse_string(s), and carries
+           the information needed by the next call to reparse; old_result
+           may be None, or any earlier result (only results of reparse allow
+           work to be skipped).  The new tree shares subtrees with
+           old_result, so neither should be modified afterwards.  Errors
+           are reported on stderr, and end the program.
+        """
 
-        include_statement = LineStart() + include_kw - (quoted_string_fn(False) | path)('path') + LineEnd()
+        try:
+            return self.reparse_document(old_result, s, process_templates,
+                                         base_path)
+        except document_errors, e:
+            sys.stderr.write(format_document_error(e))
+            exit()
 
-        def include_file(p):
-            with open(os.path.join(base_path, p), 'r') as f:
-                return ''.join(f.readlines())
+    def reparse_document(self, old_result, s, process_templates=True,
+                         base_path='.', included_files=None):
+        """Like reparse, but errors are raised, and the files the document
+           includes are added to included_files, as by parse_document
+        """
 
-        include_statement.setParseAction(lambda x: include_file(x.path))
+        options = (self.use_significant_whitespace, process_templates,
+                   base_path)
+
+        old_state = getattr(old_result, 'declaration_chunks', None)
+        reusable = {}
+        if old_state is not None:
+            reusable = old_state.reusable_chunks(options)
+
+        chunks = []
+        parsed = {}
+        for text in split_declarations(s, self.use_significant_whitespace):
+            candidates = reusable.get(text, [])
+            chunk = None
+
+            while candidates:
+                chunk = candidates.pop()
+                if self.includes_unchanged(chunk, base_path):
+                    break
+                chunk = None
+
+            # the same text may appear more than once in a document
+            if chunk is None and text in parsed:
+                chunk = parsed[text].duplicate()
+
+            if chunk is None:
+                chunk_includes = []
+                try:
+                    nodes = self.parse_chunk(text, base_path, chunk_includes)
+                except (MWXSyntaxError, PreprocessorError):
+                    # either a real error, or the pre-scan split a
+                    # declaration; let a full parse sort it out
+                    return self.parse_document(s, process_templates, base_path,
+                                               included_files)
+
+                chunk = DeclarationChunk(text, chunk_includes, nodes)
+
+            parsed[text] = chunk
+            chunks.append(chunk)
+
+        # files are only included once per document, which chunks parsed
+        # on their own can't know about
+        if self.includes_repeated(chunks, base_path):
+            return self.parse_document(s, process_templates, base_path,
+                                       included_files)
+
+        if included_files is not None:
+            for chunk in chunks:
+                included_files.extend(chunk.included_files)
+
+        results = RootNode(children=finish_chunks(chunks, process_templates))
+        results.declaration_chunks = IncrementalParseState(options, chunks)
 
-        return include_statement
+        return results
 
-    def parse_string(self, s, process_templates=True, base_path='.'):
-        """Process a string containing valid MWX content, and return a tree of
-           MWASTNode objects
+    def iter_parse(self, f, process_templates=True, base_path='.'):
+        """Parse MWX from a file object, yielding each top-level node as soon
+           as the declaration it comes from is complete.
+
+           Only one top-level declaration (and whatever it includes) is held
+           in memory at a time, and the packrat memo is cleared between
+           declarations.  Template definitions are collected as they go by;
+           a declaration that uses a template defined further down (or a
+           template whose body uses one, in turn) is held back, along with
+           everything after it, until the definition turns up, so nodes
+           still come out in document order.  Unlike
+           parse_string, a template that is defined twice is used in its
+           first form until the second definition has been read.
         """
 
-        preprocessed = self.comment_parser.transformString(s)
-        preprocessed = self.include_parser(base_path).transformString(preprocessed)
-
-        #print 'Elapsed: %f' % (time.time() - tic)
+        dependencies = TemplateDependencies()
+        templates = dependencies.templates
+        pending = []
+
+        # the files included so far
+        included = set()
+
+        # a chunk that didn't parse on its own, e.g. because the pre-scan
+        # split a declaration, is retried together with the chunks after it
+        unparsed = ''
+        unparsed_line = 0
+        line = 0
+
+        for text in iter_declarations(f, self.use_significant_whitespace):
+            if not unparsed:
+                unparsed_line = line
+            unparsed += text
+            line += text.count("\n")
+
+            attempt_included = set(included)
+            try:
+                nodes = list(self.parse_chunk(unparsed, base_path,
+                                              included=attempt_included,
+                                              first_line=unparsed_line + 1))
+            except MWXSyntaxError:
+                if unparsed.count("\n") > self.max_declaration_lines:
+                    self.report_chunk_error(unparsed, unparsed_line, base_path,
+                                            included)
+                continue
+            except PreprocessorError, e:
+                print_preprocessor_error(e)
+                exit()
+            unparsed = ''
+            included = attempt_included
+
+            if process_templates:
+                dependencies.update(TemplateDefinitionFinder(nodes).walk())
+
+            pending.append(nodes)
+            while (pending and not
+                   (process_templates and dependencies.missing(pending[0]))):
+                for node in self.finish_nodes(pending.pop(0), process_templates,
+                                              templates):
+                    yield node
+
+        if unparsed:
+            self.report_chunk_error(unparsed, unparsed_line, base_path,
+                                    included)
+
+        for nodes in pending:
+            for node in self.finish_nodes(nodes, process_templates, templates):
+                yield node
+
+    def parse_chunk(self, text, base_path='.', included_files=None,
+                    included=None, first_line=1):
+        """Preprocess and parse part of a document.  The files it includes
+           are added to included_files and included (see
+           Preprocessor.preprocess).
+        """
+        preprocessed = self.preprocessor.preprocess(text, base_path, included,
+                                                    first_line)
+        if included_files is not None:
+            included_files.extend(preprocessed.included_files)
 
         try:
-            results = self.parser.parseString(preprocessed, parseAll=True)
-
-        except ParseBaseException, pe:
-            print_parser_error(pe, s)
-            exit()
+            return self.parse_preprocessed(preprocessed.text)
+        finally:
+            if self.grammar is not None:
+                # don't hold on to the packrat memo between chunks
+                self.grammar.clear_memo()
+
+    def report_chunk_error(self, text, first_line, base_path, included):
+        """Report a syntax error in a chunk of a document, with line numbers
+           relative to the whole document, and exit
+        """
+        preprocessed = self.preprocessor.preprocess(text, base_path,
+                                                    set(included),
+                                                    first_line + 1)
+        try:
+            self.parse_preprocessed(preprocessed.text)
+        except MWXSyntaxError, pe:
+            print_parser_error(pe, preprocessed.text, preprocessed.source_map)
+        exit()
 
+    def finish_nodes(self, nodes, process_templates, templates):
+        """Resolve templates in, and rewrite, the nodes from one chunk"""
         if process_templates:
-            results = resolve_templates(results)
-
-        results = do_registered_rewrites(results)
-
-        if getattr(results, '__iter__', False):
-            results = RootNode(children=results)
-
-        return results
+            try:
+                nodes = resolve_templates(nodes, templates)
+            except TemplateConditionException, e:
+                sys.stderr.write(format_document_error(e))
+                exit()
+        return do_registered_rewrites(nodes)
+
+    def includes_repeated(self, chunks, base_path):
+        """Check whether more than one chunk includes the same file"""
+        seen = set()
+        for chunk in chunks:
+            paths = set([os.path.realpath(os.path.join(base_path, path))
+                         for path, contents in chunk.included_files])
+            if paths & seen:
+                return True
+            seen |= paths
+        return False
+
+    def includes_unchanged(self, chunk, base_path):
+        """Check whether the files included by a chunk still have the
+           contents they had when it was parsed
+        """
+        for path, contents in chunk.included_files:
+            try:
+                with open(os.path.join(base_path, path), 'r') as f:
+                    if f.read() != contents:
+                        return False
+            except IOError:
+                return False
+        return True
 
 
 class MWXMLParser:
@@ -0,0 +1,240 @@
+"""The MWX preprocessor, which strips comments and expands include statements
+   in a single pass over each file.
+
+   Comments start with // or # and run to the end of the line, unless they
+   are inside a quoted string.  An include statement is a line starting with
+   the word include, followed by a file name (quoted or not); the line is
+   replaced with the preprocessed contents of that file.  Includes nest, with
+   paths taken relative to the including file.  A file is only included once
+   per document; later include statements for it are dropped, and a file
+   that ends up including itself is an error.
+
+   Each included file is scanned once per version of its contents, and the
+   scan is reused by later documents.  The preprocessed text comes with a
+   SourceMap, which tells which file and line any part of it came from.
+"""
+
+import os
+import re
+from bisect import bisect_right
+
+# quoted strings can't span lines; comment characters inside them don't count
+quoted_string = r'"[^"\n\r]*"|' + r"'[^'\n\r]*'"
+comment = r"(?://|#)[^\n]*"
+
+# "include" as a keyword (not followed by an identifier character), only at
+# the start of a line
+include_keyword = r"^include(?![A-Za-z0-9_$])"
+
+scanner = re.compile(r"(?P<string>%s)|" % quoted_string +
+                     r"(?P<comment>%s)|" % comment +
+                     include_keyword + r"[ \t]*" +
+                     r"(?:" + r'"(?P<dq>[^"\n\r]*)"|' +
+                     r"'(?P<sq>[^'\n\r]*)'|" +
+                     r"""(?P<bare>[^\s"']+?))""" +
+                     r"[ \t\r]*(?:%s)?(?P<newline>\n|$)|" % comment +
+                     r"(?P<bad>%s[^\n]*)" % include_keyword,
+                     re.MULTILINE)
+
+
+class PreprocessorError(Exception):
+    """An include statement that could not be expanded"""
+
+    def __init__(self, filename, lineno, msg):
+        Exception.__init__(self, filename, lineno, msg)
+        self.filename = filename
+        self.lineno = lineno
+        self.msg = msg
+
+    def __str__(self):
+        if self.filename is None:
+            return "On line %d: %s" % (self.lineno, self.msg)
+        return "In %s, on line %d: %s" % (self.filename, self.lineno,
+                                          self.msg)
+
+
+def scan(contents, filename=None, first_line=1):
+    """Strip the comments from a file and split it at its include statements.
+
+       Returns a list of (text, line, include) tuples: text starts on the
+       given line of the file, and include is None, or the (path, line,
+       newline) of the include statement that comes right after text
+       (newline says whether the statement ended with a line break).
+    """
+    pieces = []
+    text = []
+    line = first_line
+    piece_line = first_line
+    counted = 0
+    last = 0
+
+    for m in scanner.finditer(contents):
+        kind = m.lastgroup
+        if kind == 'string':
+            continue
+
+        text.append(contents[last:m.start()])
+        last = m.end()
+        if kind == 'comment':
+            continue
+
+        line += contents.count("\n", counted, m.start())
+        counted = m.start()
+
+        if kind == 'bad':
+            raise PreprocessorError(filename, line,
+                                    "Invalid include statement: %s" %
+                                    m.group().strip())
+
+        path = m.group('dq')
+        if path is None:
+            path = m.group('sq')
+        if path is None:
+            path = m.group('bare')
+
+        newline = m.group('newline') == "\n"
+        pieces.append((''.join(text), piece_line, (path, line, newline)))
+        text = []
+        piece_line = line + 1
+
+    text.append(contents[last:])
+    pieces.append((''.join(text), piece_line, None))
+
+    return pieces
+
+
+class SourceMap(object):
+    """Maps offsets in preprocessed text back to the file and line they came
+       from.  The file is None for the document itself.
+    """
+
+    def __init__(self):
+        self.text = ''
+        self.offsets = []
+        self.origins = []
+
+    def add(self, offset, filename, line):
+        self.offsets.append(offset)
+        self.origins.append((filename, line))
+
+    def origin(self, offset):
+        """Return the (file, line) that an offset came from"""
+        i = bisect_right(self.offsets, offset) - 1
+        if i < 0:
+            return (None, 1)
+
+        start = self.offsets[i]
+        filename, line = self.origins[i]
+        return (filename, line + self.text.count("\n", start, offset))
+
+
+class PreprocessedText(object):
+    """The result of preprocessing a document.
+
+       included_files lists the (path, contents) of every file that was
+       included, in order, with paths relative to the document's base path;
+       included is the set of their real paths.
+    """
+
+    def __init__(self, included=None):
+        if included is None:
+            included = set()
+        self.included = included
+        self.included_files = []
+        self.source_map = SourceMap()
+        self.parts = []
+        self.length = 0
+        self.text = None
+
+    def append(self, text, filename, line):
+        if not text:
+            return
+        self.source_map.add(self.length, filename, line)
+        self.parts.append(text)
+        self.length += len(text)
+
+    def end_line(self):
+        """Make sure that whatever comes next starts on a new line"""
+        if self.parts and not self.parts[-1].endswith("\n"):
+            self.parts.append("\n")
+            self.length += 1
+
+    def finish(self):
+        self.text = ''.join(self.parts)
+        self.source_map.text = self.text
+        self.parts = None
+
+
+class Preprocessor(object):
+    """Strips comments and expands includes, remembering the scans of the
+       files it has included
+    """
+
+    def __init__(self):
+        # real path -> (contents, pieces)
+        self.files = {}
+
+    def preprocess(self, s, base_path='.', included=None, first_line=1):
+        """Preprocess a document, and return a PreprocessedText.
+
+           included is a set of the real paths of files that have already
+           been included (e.g. by an earlier part of the same document),
+           which is updated in place.  first_line is the line number of the
+           start of s, for the source map.
+        """
+        result = PreprocessedText(included)
+        self.expand(result, scan(s, None, first_line), None, base_path, '',
+                    [])
+        result.finish()
+        return result
+
+    def expand(self, result, pieces, filename, directory, relative_directory,
+               stack):
+        for text, line, include in pieces:
+            result.append(text, filename, line)
+            if include is None:
+                continue
+
+            path, include_line, newline = include
+            full_path = os.path.join(directory, path)
+            key = os.path.realpath(full_path)
+            relative_path = os.path.join(relative_directory, path)
+
+            keys = [k for p, k in stack]
+            if key in keys:
+                chain = [p for p, k in stack[keys.index(key):]]
+                raise PreprocessorError(filename, include_line,
+                                        "Circular include: %s" %
+                                        " -> ".join(chain + [relative_path]))
+
+            if key in result.included:
+                continue
+
+            try:
+                with open(full_path, 'r') as f:
+                    contents = f.read()
+            except IOError, e:
+                raise PreprocessorError(filename, include_line,
+                                        "Cannot include %s: %s" %
+                                        (path, e.strerror))
+
+            result.included.add(key)
+            result.included_files.append((relative_path, contents))
+
+            self.expand(result, self.scan_file(key, contents, relative_path),
+                        relative_path, os.path.dirname(full_path),
+                        os.path.dirname(relative_path),
+                        stack + [(relative_path, key)])
+
+            if newline:
+                result.end_line()
+
+    def scan_file(self, key, contents, filename):
+        """Scan a file, or reuse the scan of the same contents"""
+        entry = self.files.get(key)
+        if entry is not None and entry[0] == contents:
+            return entry[1]
+
+        pieces = scan(contents, filename)
+        self.files[key] = (contents, pieces)
+        return pieces
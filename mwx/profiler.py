@@ -0,0 +1,209 @@
+"""Per-rule profiling of the MWX parsers (see MWXParser(profile=True) and
+   mwx --profile-parser).
+
+   Every named rule of the grammar is wrapped so that it counts its match
+   attempts, successes and failures, the attempts that were answered from
+   the packrat memo, and the time spent in the rule (including the rules it
+   calls; recursive calls are only timed once).  For the pyparsing engine,
+   the rules are the named elements of the MWXGrammar; for the fast engine,
+   they are the rule methods of its parser.
+
+   The wrappers are only installed on grammars and parsers that are being
+   profiled, so parsing is not slowed down otherwise.
+"""
+
+import json
+from collections import OrderedDict
+from timeit import default_timer as clock
+
+
+class RuleStats(object):
+    """The counters for one grammar rule"""
+
+    fields = ('name', 'attempts', 'successes', 'failures', 'packrat_hits',
+              'time')
+
+    def __init__(self, name):
+        self.name = name
+        self.attempts = 0
+        self.successes = 0
+        self.failures = 0
+        self.packrat_hits = 0
+        self.time = 0.0
+
+        # how many calls of the rule are in progress
+        self.depth = 0
+
+    def as_dict(self):
+        return OrderedDict([(f, getattr(self, f)) for f in self.fields])
+
+
+def grammar_elements(root):
+    """Return every pyparsing element reachable from root"""
+    elements = {}
+    stack = [root]
+    while stack:
+        element = stack.pop()
+        if id(element) in elements:
+            continue
+        elements[id(element)] = element
+
+        stack.extend(getattr(element, 'exprs', None) or [])
+        sub = getattr(element, 'expr', None)
+        if sub is not None:
+            stack.append(sub)
+
+    return elements.values()
+
+
+# attributes that differ between a pyparsing element and a copy of it made
+# by setResultsName
+copy_attributes = frozenset(['resultsName', 'modalResults', 'saveAsList'])
+
+
+def element_identity(element):
+    """Something that a pyparsing element shares with the copies that
+       setResultsName makes of it (which are shallow)
+    """
+    if hasattr(element, 'exprs'):
+        return (type(element), id(element.exprs))
+    if getattr(element, 'expr', None) is not None:
+        return (type(element), id(element.expr))
+
+    return (type(element), dict([(k, v) for k, v in element.__dict__.items()
+                                 if k not in copy_attributes]))
+
+
+class ParserProfiler(object):
+    """Collects RuleStats for the rules of a grammar or parser"""
+
+    sort_keys = ('time', 'attempts', 'successes', 'failures', 'packrat_hits',
+                 'name')
+
+    def __init__(self):
+        self.stats = {}
+
+    def rule(self, name):
+        if name not in self.stats:
+            self.stats[name] = RuleStats(name)
+        return self.stats[name]
+
+    def reset(self):
+        self.stats = {}
+
+    # ------------------------------
+    # Instrumentation
+    # ------------------------------
+
+    def instrument_grammar(self, rules, root):
+        """Wrap the named elements of a pyparsing grammar.  rules maps names
+           to elements; copies of those elements found under root (made by
+           giving them results names) are counted under the same name.
+        """
+        names = {}
+        for name, element in rules.items():
+            names.setdefault(id(element), []).append(name)
+
+        named = [(element_identity(rules[n[0]]), "/".join(sorted(n)))
+                 for n in names.values()]
+
+        for element in grammar_elements(root):
+            identity = element_identity(element)
+            for other, name in named:
+                if identity == other:
+                    self.profile_element(name, element)
+                    break
+
+    def profile_element(self, name, element):
+        from pyparsing import ParserElement, ParseBaseException
+
+        stats = self.rule(name)
+        parse = element._parse
+
+        def profiled_parse(instring, loc, doActions=True, callPreParse=True):
+            stats.attempts += 1
+            if (element, instring, loc, callPreParse, doActions) in \
+                    ParserElement._exprArgCache:
+                stats.packrat_hits += 1
+
+            stats.depth += 1
+            tic = clock()
+            try:
+                result = parse(instring, loc, doActions, callPreParse)
+            except ParseBaseException:
+                stats.failures += 1
+                raise
+            finally:
+                stats.depth -= 1
+                if stats.depth == 0:
+                    stats.time += clock() - tic
+
+            stats.successes += 1
+            return result
+
+        element._parse = profiled_parse
+
+    def instrument_parser(self, parser):
+        """Wrap the rule methods of a fast engine parser (see
+           mwx.fast_parser), as listed in its rules attribute
+        """
+        for name in parser.rules:
+            setattr(parser, name, self.profiled_method(name,
+                                                       getattr(parser, name)))
+
+    def profiled_method(self, name, method):
+        from mwx.expression import MWXSyntaxError
+
+        stats = self.rule(name)
+
+        def profiled(*args, **kwargs):
+            stats.attempts += 1
+            stats.depth += 1
+            tic = clock()
+            try:
+                result = method(*args, **kwargs)
+            except MWXSyntaxError:
+                stats.failures += 1
+                raise
+            finally:
+                stats.depth -= 1
+                if stats.depth == 0:
+                    stats.time += clock() - tic
+
+            if result is None:
+                stats.failures += 1
+            else:
+                stats.successes += 1
+            return result
+
+        return profiled
+
+    # ------------------------------
+    # Reports
+    # ------------------------------
+
+    def report(self, sort='time'):
+        """Return the RuleStats of the rules that were tried, sorted by one
+           of sort_keys (largest first, or by name)
+        """
+        if sort not in self.sort_keys:
+            raise Exception("Unknown sort key: %s" % sort)
+
+        stats = [s for s in self.stats.values() if s.attempts]
+        stats.sort(key=lambda s: s.name)
+        if sort != 'name':
+            stats.sort(key=lambda s: getattr(s, sort), reverse=True)
+        return stats
+
+    def format_table(self, sort='time'):
+        lines = ["%-36s %10s %10s %10s %10s %12s" % ("rule", "attempts",
+                                                     "successes", "failures",
+                                                     "packrat", "time")]
+        for s in self.report(sort):
+            lines.append("%-36s %10d %10d %10d %10d %10.2fms" %
+                         (s.name, s.attempts, s.successes, s.failures,
+                          s.packrat_hits, 1000 * s.time))
+        return "\n".join(lines)
+
+    def to_json(self, sort='time'):
+        return json.dumps([s.as_dict() for s in self.report(sort)], indent=2)
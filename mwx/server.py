@@ -0,0 +1,373 @@
+"""A compile server for MWX files (mwx serve), and its client (mwx client).
+
+   Each MWorks load of an MWX file runs mwx through its mwpp hook, and pays
+   for starting an interpreter, importing mwx, building the grammar and
+   parsing the file.  The server is a long-running process that keeps its
+   parsers (and so their grammars) warm, and remembers the files it has
+   compiled: an unchanged file (with unchanged includes) is answered from
+   memory, and a changed one is reparsed incrementally (see
+   MWXParser.reparse).
+
+   The server listens on a Unix socket, by default one per user in a
+   directory that only that user can get into: $XDG_RUNTIME_DIR, or else
+   mwx-<uid> in the temporary directory, made with mode 0700 ($MWX_SOCKET
+   overrides it).  The client only talks to a socket that the user owns.
+   A request is a line of JSON; the response is a sequence of frames, each
+   a channel letter and a length on a line, followed by that many bytes:
+
+     o<length>\\n<data>    output, for stdout
+     e<length>\\n<data>    messages, for stderr
+     x<status>\\n          the end of the response, with the exit status
+
+   run_client only needs the standard library, so that the client starts
+   quickly.  It returns None when there is no server to talk to, and the
+   caller then compiles the file itself.
+"""
+
+import os
+import json
+import stat
+import errno
+import socket
+import tempfile
+
+# the options that a client can forward, and the request fields they set
+client_flags = {'-x': 'xml', '--xml': 'xml',
+                '-m': 'mwx', '--mwx': 'mwx',
+                '-a': 'ast', '--ast': 'ast',
+                '-T': 'no_templates', '--no-templates': 'no_templates',
+                '-w': 'significant_whitespace',
+                '--significant-whitespace': 'significant_whitespace'}
+
+frame_size = 64 * 1024
+
+
+def private_socket_directory():
+    return os.path.join(tempfile.gettempdir(), "mwx-%d" % os.getuid())
+
+
+def default_socket_path():
+    path = os.environ.get("MWX_SOCKET")
+    if path:
+        return path
+    directory = (os.environ.get("XDG_RUNTIME_DIR") or
+                 private_socket_directory())
+    return os.path.join(directory, "mwx.sock")
+
+
+def make_private_directory(path):
+    """Make a directory that only this user can get into, or check that the
+       one there already is: owned by this user, with mode 0700.  Raises an
+       Exception if it isn't.
+    """
+    try:
+        os.mkdir(path, 0700)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    st = os.lstat(path)
+    if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or
+        stat.S_IMODE(st.st_mode) & 077):
+        raise Exception("%s is not a directory that only you can use" % path)
+
+
+def owned_socket(path):
+    """Whether path is a socket that this user owns (a server that anyone
+       else put there could answer with anything)
+    """
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid()
+
+
+def read_frame(f):
+    """Read a frame from a file object, and return its (channel, data);
+       data is the exit status for the "x" channel
+    """
+    header = f.readline()
+    if not header.endswith("\n"):
+        raise IOError("mwx server closed the connection")
+
+    channel, value = header[0], int(header[1:])
+    if channel == "x":
+        return channel, value
+
+    data = f.read(value)
+    if len(data) != value:
+        raise IOError("mwx server closed the connection")
+    return channel, data
+
+
+def write_frames(f, channel, data):
+    for start in range(0, len(data), frame_size):
+        chunk = data[start:start + frame_size]
+        f.write("%s%d\n" % (channel, len(chunk)))
+        f.write(chunk)
+
+
+# ------------------------------
+# Client
+# ------------------------------
+
+def client_request(args):
+    """Turn mwx command line arguments into a request, or return None if
+       they include something the server doesn't handle
+    """
+    request = {}
+    input_file = None
+    for arg in args:
+        if arg in client_flags:
+            request[client_flags[arg]] = True
+        elif arg.startswith("-") or input_file is not None:
+            return None
+        else:
+            input_file = arg
+
+    if input_file is None:
+        return None
+
+    request['file'] = os.path.abspath(input_file)
+    return request
+
+
+def run_client(args, stdout=None, stderr=None, socket_path=None):
+    """Have the server compile a file, given the arguments that mwx would
+       take for it, and copy its output to stdout and stderr.  Returns the
+       exit status, or None if the server isn't running (or can't handle
+       the arguments).
+    """
+    import sys
+
+    if stdout is None:
+        stdout = sys.stdout
+    if stderr is None:
+        stderr = sys.stderr
+
+    request = client_request(args)
+    if request is None:
+        return None
+
+    socket_path = socket_path or default_socket_path()
+    if not owned_socket(socket_path):
+        return None
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except socket.error:
+        connection.close()
+        return None
+
+    try:
+        connection.sendall(json.dumps(request) + "\n")
+        f = connection.makefile('rb')
+        while True:
+            channel, data = read_frame(f)
+            if channel == "x":
+                return data
+            if channel == "o":
+                stdout.write(data)
+            else:
+                stderr.write(data)
+    finally:
+        connection.close()
+
+
+# ------------------------------
+# Server
+# ------------------------------
+
+def read_file(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except IOError:
+        return None
+
+
+class CompiledFile(object):
+    """What the server remembers about a file it has compiled"""
+
+    def __init__(self, contents, included_files, result):
+        self.contents = contents
+
+        # (absolute path, contents) of every included file
+        self.included_files = included_files
+        self.result = result
+
+        # format -> output text
+        self.outputs = {}
+
+    def unchanged(self, contents):
+        if contents != self.contents:
+            return False
+        for path, included in self.included_files:
+            if read_file(path) != included:
+                return False
+        return True
+
+    def output(self, output_format):
+        if output_format not in self.outputs:
+            if output_format == 'mwx':
+                text = self.result.to_mwx()
+            elif output_format == 'ast':
+                text = self.result.to_ast_string()
+            else:
+                text = self.result.to_xml()
+            self.outputs[output_format] = text + "\n"
+        return self.outputs[output_format]
+
+
+class Compiler(object):
+    """Compiles files for the server, with warm parsers and a memo of the
+       files compiled so far
+    """
+
+    def __init__(self):
+        from mwx.parser import MWXParser, MWXMLParser
+
+        self.parser_class = MWXParser
+        self.xml_parser = MWXMLParser()
+
+        # significant_whitespace -> MWXParser, built on first use (the
+        # usual one is built right away, so that its grammar is warm)
+        self.parsers = {}
+        self.parser(False)
+
+        # (path, significant_whitespace, process_templates) -> CompiledFile
+        self.files = {}
+
+    def parser(self, significant_whitespace):
+        if significant_whitespace not in self.parsers:
+            self.parsers[significant_whitespace] = self.parser_class(
+                significant_whitespace=significant_whitespace)
+        return self.parsers[significant_whitespace]
+
+    def compile(self, path, significant_whitespace=False,
+                process_templates=True):
+        """Return the CompiledFile for the current contents of a file.
+           Raises IOError if it can't be read, and one of
+           mwx.parser.document_errors if it doesn't parse.
+        """
+        key = (path, significant_whitespace, process_templates)
+
+        with open(path, 'r') as f:
+            contents = f.read()
+
+        compiled = self.files.get(key)
+        if compiled is not None and compiled.unchanged(contents):
+            return compiled
+
+        base_path = os.path.dirname(path)
+        extension = os.path.splitext(path)[-1]
+        if extension == ".mw":
+            parser = self.parser(significant_whitespace)
+            old_result = compiled and compiled.result
+            included_files = []
+            result = parser.reparse_document(old_result, contents,
+                                             process_templates, base_path,
+                                             included_files)
+            included_files = [(os.path.join(base_path, p), c)
+                              for p, c in included_files]
+        elif extension == ".xml":
+            result = self.xml_parser.parse_string(contents, process_templates,
+                                                  base_path)
+            included_files = []
+        else:
+            raise Exception("Unknown file extension: %s" % extension)
+
+        compiled = CompiledFile(contents, included_files, result)
+        self.files[key] = compiled
+        return compiled
+
+    def handle(self, request, out):
+        """Answer a request, writing the response frames to out"""
+        from mwx.parser import document_errors, format_document_error
+
+        formats = [f for f in ('mwx', 'ast', 'xml') if request.get(f)]
+
+        try:
+            compiled = self.compile(request['file'],
+                                    bool(request.get('significant_whitespace')),
+                                    not request.get('no_templates'))
+            for output_format in formats:
+                write_frames(out, "o", compiled.output(output_format))
+        except document_errors, e:
+            write_frames(out, "e", format_document_error(e))
+            status = 1
+        except Exception, e:
+            write_frames(out, "e", "%s: %s\n" % (e.__class__.__name__, e))
+            status = 1
+        else:
+            status = 0
+
+        out.write("x%d\n" % status)
+
+
+def serve(socket_path=None):
+    """Run a compile server on a Unix socket until interrupted"""
+    import signal
+    import logging
+    import SocketServer
+
+    socket_path = socket_path or default_socket_path()
+
+    if os.path.dirname(socket_path) == private_socket_directory():
+        make_private_directory(os.path.dirname(socket_path))
+
+    if os.path.exists(socket_path):
+        if not owned_socket(socket_path):
+            raise Exception("%s belongs to someone else" % socket_path)
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+        except socket.error:
+            # left behind by a server that didn't shut down cleanly
+            os.unlink(socket_path)
+        else:
+            raise Exception("An mwx server is already listening on %s" %
+                            socket_path)
+        finally:
+            probe.close()
+
+    compiler = Compiler()
+
+    class RequestHandler(SocketServer.StreamRequestHandler):
+
+        def handle(self):
+            line = self.rfile.readline()
+            if not line:
+                return
+            try:
+                request = json.loads(line)
+                request['file'] = str(request['file'])
+            except (ValueError, KeyError, TypeError):
+                logging.warning("Bad request: %r" % line)
+                return
+            compiler.handle(request, self.wfile)
+
+    # requests are answered one at a time: the parsers keep per-parse state
+    server = SocketServer.UnixStreamServer(socket_path, RequestHandler)
+
+    # how often to check for a signal to stop
+    server.timeout = 0.5
+
+    # SocketServer catches every exception raised while a request is being
+    # answered, so the signal handlers just leave a note
+    stop = []
+
+    def terminate(signum, frame):
+        stop.append(signum)
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+
+    try:
+        while not stop:
+            server.handle_request()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
@@ -0,0 +1,138 @@
+"""Check that a batch compile (mwx -o) writes the same outputs as the mwx
+   command gives for each file on its own, and that a failure in one file
+   doesn't stop the others.
+
+   usage: python -m unittest discover -s mwx/test -t .
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from mwx import batch
+
+
+package_dir = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+mwx_script = os.path.join(package_dir, 'scripts', 'mwx')
+examples_dir = os.path.join(package_dir, 'examples')
+
+options = {'significant_whitespace': False,
+           'process_templates': True,
+           'cache_dir': None}
+
+included = '''
+macro make_trial(name) {
+    trial[@name]{
+        report(@name)
+    }
+}
+'''
+
+including = '''
+include "../common/templates.mwx"
+
+protocol P {
+    @make_trial("T1")
+    @make_trial("T2")
+}
+'''
+
+
+def run_mwx(*args):
+    """Run the mwx command, and return its stdout"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = package_dir
+    env.pop('MWX_CACHE_DIR', None)
+    process = subprocess.Popen([sys.executable, mwx_script] + list(args),
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, env=env)
+    out, err = process.communicate()
+    if process.returncode != 0:
+        raise Exception("mwx %s failed:\n%s" % (" ".join(args), err))
+    return out
+
+
+def read(path):
+    with open(path, 'r') as f:
+        return f.read()
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.directory, 'in')
+        self.output_dir = os.path.join(self.directory, 'out')
+
+        for name in ('if_test.mw', 'mw_test_syntax_advanced.mw'):
+            self.write(os.path.join('examples', name),
+                       read(os.path.join(examples_dir, name)))
+        self.write('common/templates.mwx', included)
+        self.write('protocols/including.mw', including)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, relative_path, contents):
+        path = os.path.join(self.input_dir, relative_path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(contents)
+        return path
+
+    def compile(self, formats, processes=1):
+        jobs = batch.make_jobs(batch.find_input_files([self.input_dir]),
+                               self.output_dir, formats)
+        return batch.run_jobs(jobs, options, processes)
+
+    def check_outputs(self, results, formats):
+        flags = {'xml': '-x', 'mwx': '-m'}
+        for result in results:
+            self.assertTrue(result.ok, result.error)
+            for output_format, output_path in result.job.outputs:
+                self.assertEqual(read(output_path),
+                                 run_mwx(flags[output_format],
+                                         result.job.input_path))
+
+    def test_outputs(self):
+        results = self.compile(['xml'])
+        self.assertEqual(
+            sorted([os.path.relpath(r.job.outputs[0][1], self.output_dir)
+                    for r in results]),
+            ['examples/if_test.xml',
+             'examples/mw_test_syntax_advanced.xml',
+             'protocols/including.xml'])
+        self.check_outputs(results, ['xml'])
+
+    def test_processes(self):
+        results = self.compile(['xml'], processes=2)
+        self.assertEqual(len(results), 3)
+        self.check_outputs(results, ['xml'])
+
+    def test_mwx_output(self):
+        results = self.compile(['mwx'], processes=1)
+        results = [r for r in results if 'including' in r.job.input_path]
+        self.check_outputs(results, ['mwx'])
+
+    def test_failure(self):
+        bad = self.write('protocols/broken.mw', 'protocol P {\n    trial {\n')
+        results = self.compile(['xml'])
+        failed = [r for r in results if not r.ok]
+        self.assertEqual([r.job.input_path for r in failed], [bad])
+        self.assertFalse(os.path.exists(failed[0].job.outputs[0][1]))
+        self.check_outputs([r for r in results if r.ok], ['xml'])
+        self.assertTrue('1 failed' in batch.format_summary(results, 0))
+
+    def test_own_output(self):
+        self.assertRaises(Exception, batch.make_jobs,
+                          batch.find_input_files([self.input_dir]),
+                          self.input_dir, ['mwx'])
+
+
+if __name__ == '__main__':
+    unittest.main()
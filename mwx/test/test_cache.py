@@ -0,0 +1,115 @@
+"""Check the on-disk cache of parsed trees (mwx.cache): that a cached tree
+   comes back as it went in, and that anything that changes the result
+   misses the cache.
+
+   usage: python -m unittest discover -s mwx/test -t .
+"""
+
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+
+from mwx import cache
+from mwx.cache import ParseCache
+from mwx.parser import MWXParser
+
+
+document = '''include "trials.mwx"
+protocol P {
+    @t("T")
+}
+'''
+
+trials = '''macro t(name) {
+    trial[@name] {
+        report("%s")
+    }
+}
+'''
+
+
+class CachedParser(MWXParser):
+    """An MWXParser that counts the documents it actually parses"""
+
+    def __init__(self, **kwargs):
+        MWXParser.__init__(self, **kwargs)
+        self.parsed = 0
+
+    def parse_preprocessed(self, preprocessed):
+        self.parsed += 1
+        return MWXParser.parse_preprocessed(self, preprocessed)
+
+
+class ParseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.directory, 'cache')
+        self.write_include('one')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_include(self, message):
+        with open(os.path.join(self.directory, 'trials.mwx'), 'w') as f:
+            f.write(trials % message)
+
+    def parse(self, s=document, **kwargs):
+        parser = CachedParser(cache_dir=self.cache_dir, **kwargs)
+        tree = parser.parse_document(s, base_path=self.directory)
+        return tree.to_xml(), parser.parsed
+
+    def test_round_trip(self):
+        (xml, parsed) = self.parse()
+        self.assertEqual(parsed, 1)
+        self.assertEqual(len(ParseCache(self.cache_dir).entries()), 1)
+        self.assertEqual(self.parse(), (xml, 0))
+        self.assertEqual(self.parse(engine='fast'), (xml, 0))
+        self.assertEqual(MWXParser().parse_document(
+            document, base_path=self.directory).to_xml(), xml)
+
+    def test_invalidation(self):
+        (xml, parsed) = self.parse()
+
+        # the document, an included file, or the options changed
+        self.assertEqual(self.parse(document + '\n')[1], 1)
+        self.write_include('two')
+        (changed, parsed) = self.parse()
+        self.assertEqual(parsed, 1)
+        self.assertNotEqual(changed, xml)
+        self.assertEqual(self.parse(significant_whitespace=True)[1], 1)
+
+        # or the package did
+        fingerprint = cache.package_fingerprint()
+        cache.fingerprint = 'changed'
+        try:
+            self.assertEqual(self.parse()[1], 1)
+        finally:
+            cache.fingerprint = fingerprint
+        self.assertEqual(self.parse()[1], 0)
+
+    def test_unreadable_entry(self):
+        (xml, parsed) = self.parse()
+        for (mtime, size, path) in ParseCache(self.cache_dir).entries():
+            with open(path, 'wb') as f:
+                f.write('not a tree')
+        logging.disable(logging.WARNING)
+        try:
+            self.assertEqual(self.parse(), (xml, 1))
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertEqual(self.parse(), (xml, 0))
+
+    def test_eviction(self):
+        parse_cache = ParseCache(self.cache_dir, max_size=1)
+        parse_cache.put(parse_cache.key('a'), [])
+        parse_cache.put(parse_cache.key('b'), [])
+        # (an entry bigger than the cache doesn't stay)
+        self.assertEqual(parse_cache.entries(), [])
+        self.assertEqual(parse_cache.get(parse_cache.key('a')), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+"""Check that the "fast" parser engine builds the trees the "pyparsing" engine
+   does, and rejects the documents it rejects.
+
+   usage: python -m unittest discover -s mwx/test -t .
+"""
+
+import os
+import glob
+import unittest
+
+from mwx.parser import MWXParser
+from mwx.expression import MWXSyntaxError
+
+
+examples = os.path.join(os.path.dirname(__file__), '..', '..', 'examples')
+
+engines = ('pyparsing', 'fast')
+
+sigwhite_document = '''macro state(name, x):
+    block[@name, nsamples=@x]:
+        trial["templated trial"]:
+            wait(101ms)
+    block["other"]:
+        wait(10ms)
+
+protocol P:
+    @state("B", 3)
+    trial T:
+        report("hi")
+'''
+
+# documents that neither engine accepts
+bad_documents = ['protocol P {',
+                 'protocol P { wait( }',
+                 'var x = \n',
+                 'trial T { x = 1 +  }',
+                 'macro m(a { }',
+                 'protocol P { @if (1 > ) { } }',
+                 '}']
+
+# examples that can't be written back out as MWX: a template @if has no tag
+# for MWXWriter to write, and to_mwx raises KeyError for it
+no_mwx = ['if_test.mw', 'mw_test_syntax_advanced.mw']
+
+
+def parse(s, engine, significant_whitespace=False, base_path='.'):
+    """The tree parsed from s, or the MWXSyntaxError raised parsing it (any
+       other error is raised)
+    """
+    parser = MWXParser(engine=engine,
+                       significant_whitespace=significant_whitespace)
+    try:
+        return parser.parse_document(s, base_path=base_path)
+    except MWXSyntaxError, e:
+        return e
+
+
+class EngineEquivalenceTest(unittest.TestCase):
+
+    def assert_same(self, s, significant_whitespace=False, base_path='.',
+                    writes_mwx=True):
+        (slow, fast) = [parse(s, engine, significant_whitespace, base_path)
+                        for engine in engines]
+        if isinstance(slow, MWXSyntaxError):
+            self.assertTrue(isinstance(fast, MWXSyntaxError),
+                            "only pyparsing rejected the document")
+            return slow
+
+        self.assertFalse(isinstance(fast, MWXSyntaxError),
+                         "only fast rejected the document: %s" % fast)
+        self.assertEqual(slow.to_xml(), fast.to_xml())
+        if writes_mwx:
+            self.assertEqual(slow.to_mwx(), fast.to_mwx())
+        else:
+            self.assertRaises(KeyError, slow.to_mwx)
+            self.assertRaises(KeyError, fast.to_mwx)
+        return slow
+
+    def test_examples(self):
+        filenames = sorted(glob.glob(os.path.join(examples, '*.mw')))
+        self.assertTrue(filenames)
+        for filename in filenames:
+            # (mw_test_syntax_sigwhite.mw is written with "def" templates,
+            # which neither engine accepts, so it checks only that both
+            # reject it)
+            name = os.path.basename(filename)
+            self.assert_same(open(filename).read(), 'sigwhite' in name,
+                             os.path.dirname(filename), name not in no_mwx)
+
+    def test_significant_whitespace(self):
+        result = self.assert_same(sigwhite_document, True)
+        self.assertFalse(isinstance(result, MWXSyntaxError))
+
+    def test_errors(self):
+        for s in bad_documents:
+            result = self.assert_same(s)
+            self.assertTrue(isinstance(result, MWXSyntaxError),
+                            "%r was accepted" % s)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+"""Check the parse-time evaluation of expressions (mwx.ast.evaluation), and
+   the template conditionals that use it.
+
+   usage: python -m unittest discover -s mwx/test -t .
+"""
+
+import os
+import unittest
+
+from mwx.ast import *
+from mwx.ast.evaluation import evaluate, fold, ExpressionError
+from mwx.ast.templates import TemplateConditionException
+from mwx.parser import MWXParser, document_errors
+
+
+examples = os.path.join(os.path.dirname(__file__), '..', '..', 'examples')
+data = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def binary(op, a, b):
+    return MWBinaryExpression(op, a, b)
+
+
+def unary(op, a):
+    return MWUnaryExpression(op, a)
+
+
+def variable(name):
+    return MWVariableReference(name)
+
+
+conditional = '''macro m(x) {
+    @if (%s) {
+        report("yes")
+    } else {
+        report("no")
+    }
+}
+protocol P {
+    @m(%s)
+}
+'''
+
+
+def branch(condition, argument, definitions=''):
+    """The message reported by the branch of a template conditional that
+       is taken, for each engine
+    """
+    messages = []
+    for engine in ('pyparsing', 'fast'):
+        tree = MWXParser(engine=engine).parse_document(
+            definitions + conditional % (condition, argument))
+        messages.extend([node.props['message'] for node in
+                         find_nodes(tree, lambda n: n.obj_type == 'action',
+                                    TemplateDefinition)])
+    return messages
+
+
+class EvaluateTest(unittest.TestCase):
+
+    def test_arithmetic(self):
+        self.assertEqual(evaluate(binary('+', binary('*', 2, 3), 1)), 7)
+        self.assertEqual(evaluate(binary('^', 2, 10)), 1024)
+        self.assertEqual(evaluate(binary('**', 2, 3)), 8)
+        self.assertEqual(evaluate(unary('-', 4)), -4)
+        self.assertEqual(evaluate(binary('+', "a", 1)), "a1")
+
+    def test_comparison(self):
+        self.assertTrue(evaluate(binary('<', 1, 2)))
+        self.assertFalse(evaluate(binary('>=', 1, 2)))
+        self.assertTrue(evaluate(binary('==', "B", "B")))
+        self.assertTrue(evaluate(binary('!=', "B", 2)))
+        # a number and a string are never in order
+        self.assertFalse(evaluate(binary('>', "B", 2)))
+        self.assertFalse(evaluate(binary('<', "B", 2)))
+
+    def test_durations(self):
+        self.assertTrue(evaluate(binary('<', '100ms', '1s')))
+        self.assertTrue(evaluate(binary('==', '1min', '60s')))
+        self.assertEqual(evaluate(binary('+', '100ms', '50ms')), 150000)
+
+    def test_logic(self):
+        self.assertTrue(evaluate(binary('and', binary('>', 3, 2),
+                                        unary('not', 0))))
+        self.assertFalse(evaluate(binary('or', 0, binary('==', 1, 2))))
+        # and and or don't evaluate what they don't need
+        self.assertFalse(evaluate(binary('and', 0, variable('x'))))
+        self.assertTrue(evaluate(binary('or', 1, variable('x'))))
+
+    def test_boolean_literals(self):
+        self.assertTrue(evaluate(binary('and', variable('true'),
+                                        unary('not', variable('false')))))
+        self.assertTrue(evaluate(binary('==', variable('true'), 1)))
+
+    def test_errors(self):
+        for expression in (binary('>', variable('x'), 1),
+                           binary('/', 1, 0),
+                           binary('-', "a", 1),
+                           unary('-', "a")):
+            self.assertRaises(ExpressionError, evaluate, expression)
+
+    def test_compiled_once(self):
+        expression = binary('>', 3, 2)
+        evaluate(expression)
+        compiled = expression.compiled
+        evaluate(expression)
+        self.assertTrue(expression.compiled is compiled)
+
+        # (compiled again once the operands change)
+        expression.children[1] = 4
+        self.assertFalse(evaluate(expression))
+        self.assertFalse(expression.compiled is compiled)
+
+    def test_fold(self):
+        self.assertEqual(fold(binary('*', 2, 3)), 6)
+        # comparisons and durations are left for MWorks
+        for expression in (binary('>', 3, 2), binary('+', '100ms', '50ms'),
+                           binary('^', 2, 3)):
+            self.assertTrue(fold(expression) is expression)
+
+
+class TemplateConditionTest(unittest.TestCase):
+
+    def test_true(self):
+        self.assertEqual(branch('@x > 2', '7ms'), ['yes', 'yes'])
+        self.assertEqual(branch('@x == "B"', '"B"'), ['yes', 'yes'])
+        self.assertEqual(branch('@x', '1'), ['yes', 'yes'])
+        self.assertEqual(branch('@x and true', 'true'), ['yes', 'yes'])
+
+    def test_false(self):
+        self.assertEqual(branch('@x > 2', '1'), ['no', 'no'])
+        self.assertEqual(branch('@x', '0'), ['no', 'no'])
+        self.assertEqual(branch('not @x', 'true'), ['no', 'no'])
+
+    def test_value_template(self):
+        self.assertEqual(branch('@x > @limit', '3', 'macro limit = 2\n'),
+                         ['yes', 'yes'])
+
+    def test_no_value(self):
+        # a name with no value before the experiment runs is false, as it
+        # always has been
+        self.assertEqual(branch('@x', 'v'), ['no', 'no'])
+        self.assertEqual(branch('v', '1'), ['no', 'no'])
+
+    def test_error(self):
+        # an expression on a variable can't be evaluated, and a template
+        # that isn't defined can't be filled in
+        for (condition, argument) in (('@x > 2', 'v'), ('@y', '1')):
+            self.assertRaises(UnresolvedTemplateReferencesException,
+                              branch, condition, argument)
+        self.assertRaises(TemplateConditionException, branch, '@x > 2', 'v')
+        self.assertTrue(issubclass(TemplateConditionException,
+                                   document_errors))
+
+    def test_advanced_example(self):
+        # (its @if (long_wait) has no value, and takes the else branch)
+        path = os.path.join(examples, 'mw_test_syntax_advanced.mw')
+        expected = open(os.path.join(data, 'mw_test_syntax_advanced.xml'))
+        expected = expected.read()
+        for engine in ('pyparsing', 'fast'):
+            tree = MWXParser(engine=engine).parse_document(
+                open(path).read(), base_path=examples)
+            self.assertEqual(tree.to_xml(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""Check the cache of template expansions (mwx.ast.templates.ExpansionCache):
+   that it gives the trees expanding each call would, that each resolution
+   has its own, and that a cached expansion is counted once against the
+   node limit.
+
+   usage: python -m unittest discover -s mwx/test -t .
+"""
+
+import unittest
+
+from mwx.ast import *
+from mwx.ast.templates import ExpansionCache, TemplateResolver
+from mwx.parser import MWXParser
+
+
+document = '''macro reward() {
+    report("reward")
+}
+macro trial_template(name, dur) {
+    trial[@name] {
+        wait(@dur)
+        @reward
+        @if (@dur > 150) {
+            report("long")
+        }
+    }
+}
+protocol P {
+%s}
+'''
+
+
+def calls(durations):
+    return document % ''.join(['    @trial_template("T", %d)\n' % d
+                               for d in durations])
+
+
+def parse(s):
+    return MWXParser(engine='fast').parse_preprocessed(s)
+
+
+def expand(s, expansion_cache):
+    return RootNode(resolve_templates(parse(s),
+                                      expansion_cache=expansion_cache))
+
+
+class ExpansionCacheTest(unittest.TestCase):
+
+    def test_same_trees(self):
+        s = calls([100, 200, 100, 200, 100])
+        cache = ExpansionCache()
+        self.assertEqual(expand(s, cache).to_xml(),
+                         expand(s, ExpansionCache(0)).to_xml())
+        self.assertEqual(cache.stats()['misses'], 2)
+        self.assertEqual(cache.stats()['hits'], 3)
+
+    def test_copies(self):
+        # each call gets a copy of its own
+        root = expand(calls([100, 100]), ExpansionCache())
+        (first, second) = find_nodes(root, lambda n: n.obj_type == 'trial',
+                                     TemplateDefinition)
+        self.assertFalse(first is second)
+        first.children[0].set_prop('duration', '1s')
+        self.assertEqual(second.children[0].props['duration'], 100)
+
+    def test_eviction(self):
+        cache = ExpansionCache(1)
+        expand(calls([100, 200, 100]), cache)
+        self.assertEqual(cache.stats(), {'hits': 0, 'misses': 3,
+                                         'evictions': 2, 'entries': 1,
+                                         'max_entries': 1})
+
+    def test_per_resolution(self):
+        # (so that the templates kept go with the resolver)
+        resolver = TemplateResolver()
+        self.assertFalse(resolver.expansion_cache is
+                         TemplateResolver().expansion_cache)
+        self.assertTrue(resolver.nested({}).expansion_cache is
+                        resolver.expansion_cache)
+
+    def test_charged_once(self):
+        # a miss counts the nodes of the expansion it makes, and no more
+        counts = []
+        for cache in (ExpansionCache(0), ExpansionCache()):
+            nodes = parse(calls([100]))
+            resolver = TemplateResolver(expansion_cache=cache)
+            resolve_templates(nodes, resolver=resolver)
+            counts.append(resolver.nodes)
+        self.assertEqual(counts[0], counts[1])
+        self.assertTrue(counts[0] > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+"""Check that expanding a template from its ExpansionPlan gives the tree that
+   walking a copy of its body with a SimpleReplacementTreeWalker did, and
+   that each expansion is a tree of its own.
+
+   usage: python -m unittest discover -s mwx/test -t .
+"""
+
+import cPickle
+import unittest
+
+from mwx.ast import *
+from mwx.ast.templates import (TemplateDefinition, TemplateTreeRewriter,
+                               SimpleReplacementTreeWalker, ExpansionCache,
+                               CompiledStringTemplate, MWStringTemplate,
+                               resolve_templates)
+from mwx.parser import MWXParser
+
+
+trials = '''
+macro trial_template(name, dur, gain) {
+    trial[@name] {
+        wait(@dur)
+        report("@name: gain @@x @{gain}")
+        stimulus["@name stim", type="image", elevation=@gain * 2]
+    }
+}
+protocol P {
+    @trial_template("T1", 10ms, 1)
+    @trial_template("T2", 20ms, 2)
+    @trial_template("T1", 10ms, 1)
+}
+'''
+
+nested = '''
+macro inner(x) {
+    report(@x)
+}
+macro outer(name, x) {
+    block[@name] {
+        @inner(@x)
+        @inner("fixed")
+        trial["@name-@x"] {
+            @inner(x + 1)
+        }
+    }
+}
+protocol P {
+    @outer("B1", 1)
+    @outer("B2", 2)
+}
+'''
+
+conditional = '''
+macro choose(x) {
+    @if (@x > 1) {
+        report("big @x")
+    } else {
+        report("small @x")
+    }
+}
+protocol P {
+    @choose(1)
+    @choose(2)
+    @choose(1)
+}
+'''
+
+local_definitions = '''
+macro with_local(x) {
+    macro local() {
+        report("local")
+    }
+    @local()
+    report(@x)
+}
+protocol P {
+    @with_local("a")
+    @with_local("b")
+}
+'''
+
+
+def walk_call(self, args=[], templates=None, resolver=None):
+    """TemplateDefinition.__call__ as it was before the ExpansionPlan, on a
+       fresh copy of the body (it rewrote the body in place)
+    """
+    if templates is None:
+        templates = {}
+
+    body = cPickle.loads(cPickle.dumps(self.body, 1))
+
+    if args is None or len(args) is not len(self.args):
+        raise Exception("Incorrect number of arguments to template")
+
+    walker = SimpleReplacementTreeWalker(RootNode(children=body),
+                                         dict(zip(self.args, args)))
+    walker.walk()
+
+    template_rewriter = TemplateTreeRewriter(walker.tree, templates=templates,
+                                             resolver=resolver)
+    template_rewriter.rewrite_tree()
+    new_tree = template_rewriter.tree.children
+
+    if len(new_tree) == 1:
+        new_tree = new_tree[0]
+    return new_tree
+
+
+def expand(text, call=None):
+    """The XML of a document with its templates resolved, by call (or by
+       TemplateDefinition.__call__)
+    """
+    plan_call = TemplateDefinition.__call__
+    if call is not None:
+        TemplateDefinition.__call__ = call
+    try:
+        nodes = MWXParser(engine='fast').parse_preprocessed(text)
+        nodes = resolve_templates(nodes, expansion_cache=ExpansionCache(0))
+        return RootNode(children=nodes).to_xml()
+    finally:
+        TemplateDefinition.__call__ = plan_call
+
+
+def definition(text, name):
+    nodes = MWXParser(engine='fast').parse_preprocessed(text)
+    for node in nodes:
+        if isinstance(node, TemplateDefinition) and node.name == name:
+            return node
+
+
+class ExpansionPlanTest(unittest.TestCase):
+
+    def test_same_trees(self):
+        for text in (trials, nested, conditional, local_definitions):
+            self.assertEqual(expand(text), expand(text, walk_call))
+
+    def test_calls(self):
+        xml = expand(trials)
+        self.assertEqual(xml.count('tag="T1"'), 2)
+        self.assertEqual(xml.count('tag="T2"'), 1)
+        self.assertTrue('message="T2: gain @x 2.0"' in xml)
+
+        xml = expand(conditional)
+        self.assertEqual(xml.count('message="small 1.0"'), 2)
+        self.assertEqual(xml.count('message="big 2.0"'), 1)
+
+    def test_fresh_trees(self):
+        template = definition(trials, 'trial_template')
+        body = RootNode(children=template.body).to_xml()
+
+        first = template(['"T1"', '10ms', 1])
+        second = template(['"T1"', '10ms', 1])
+        self.assertTrue(first is not second)
+        self.assertEqual(first.to_xml(), second.to_xml())
+
+        # nothing is shared with the body, or between expansions
+        first.set_prop('tag', 'changed')
+        first.children[0].set_prop('duration', '1s')
+        first.add_children([MWASTNode('list')])
+        self.assertNotEqual(first.to_xml(), second.to_xml())
+        self.assertEqual(second.to_xml(),
+                         template(['"T1"', '10ms', 1]).to_xml())
+        self.assertEqual(RootNode(children=template.body).to_xml(), body)
+
+    def test_plan(self):
+        template = definition(trials, 'trial_template')
+        template(['"T1"', '10ms', 1])
+        plan = template.expansion_plan()
+        self.assertTrue(plan is template.expansion_plan())
+        self.assertEqual(plan.args, frozenset(['name', 'dur', 'gain']))
+        self.assertFalse(plan.has_unresolved)
+
+        # the plan isn't pickled, but built again
+        loaded = cPickle.loads(cPickle.dumps(template, 1))
+        self.assertTrue(loaded.plan is None)
+        self.assertEqual(loaded(['"T1"', '10ms', 1]).to_xml(),
+                         template(['"T1"', '10ms', 1]).to_xml())
+
+    def test_string_templates(self):
+        values = {'a': 'A', 'b': 2}
+        for s in ('@a', 'x@a', '@a-@b', '${a}b', '$$a @b', 'none', '', '@@a'):
+            self.assertEqual(CompiledStringTemplate(s).substitute(values),
+                             MWStringTemplate(s).substitute(values), s)
+
+        self.assertRaises(KeyError,
+                          CompiledStringTemplate('@c').substitute, values)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""Check the precedence-climbing expression parser (mwx.expression): the
+   trees it builds group operators as the operatorPrecedence grammar it
+   replaced did, and both engines parse expressions the same way.
+
+   usage: python -m unittest discover -s mwx/test -t .
+"""
+
+import unittest
+
+from mwx.expression import parse_expression, MWXSyntaxError
+from mwx.parser import MWXParser
+
+
+# expression -> its grouping, as the operatorPrecedence grammar gave it
+groupings = [('2 ^ 3 ^ 2', '(2.0 ^ (3.0 ^ 2.0))'),
+             ('-2 ^ 2', '- (2.0 ^ 2.0)'),
+             ('2 * -x', '(2.0 * - x)'),
+             ('a - b - c', '((a - b) - c)'),
+             ('a / b * c', '((a / b) * c)'),
+             ('a + b * c', '(a + (b * c))'),
+             ('(a + b) * c', '((a + b) * c)'),
+             ('not not a', 'not not a'),
+             ('not a > 1', '(not a > 1.0)'),
+             ('a or b and c', '((a or b) and c)'),
+             ('a and b or c', '(a and (b or c))'),
+             ('a == b != c', '((a == b) != c)'),
+             # (comparisons bind loosest of all)
+             ('x > 1 && y < 2 || z', '((x > (1.0 and y)) < (2.0 or z))'),
+             ('f(1, x + 1)', 'f(1.0, (x + 1.0))'),
+             ('x[2] + 1', '(x[2.0] + 1.0)'),
+             ('100ms + 1s', '(100ms + 1s)')]
+
+
+class ExpressionTest(unittest.TestCase):
+
+    def test_groupings(self):
+        for (expression, grouping) in groupings:
+            self.assertEqual(parse_expression(expression).to_infix(),
+                             grouping)
+
+    def test_values(self):
+        self.assertEqual(parse_expression('3'), 3.0)
+        self.assertEqual(parse_expression(' "a b" '), 'a b')
+
+    def test_engines(self):
+        document = 'var v = %s\n'
+        for (expression, grouping) in groupings:
+            (pyparsing, fast) = [
+                MWXParser(engine=engine).parse_document(
+                    document % expression).to_xml()
+                for engine in ('pyparsing', 'fast')]
+            self.assertEqual(pyparsing, fast)
+
+    def test_errors(self):
+        for (expression, column) in (('1 +', 4), ('(a + b', 7),
+                                     ('a b', 3)):
+            try:
+                parse_expression(expression)
+            except MWXSyntaxError, e:
+                self.assertEqual(e.col, column)
+            else:
+                self.fail("%r parsed" % expression)
+
+
+if __name__ == '__main__':
+    unittest.main()
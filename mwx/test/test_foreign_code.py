@@ -0,0 +1,104 @@
+"""Check the scanners for the code of python and ruby actions
+   (mwx.foreign_code): nested braces, braces in strings, padding, and
+   blocks that aren't well formed.
+
+   usage: python -m unittest discover -s mwx/test -t .
+"""
+
+import unittest
+
+from mwx.ast.ast import escape
+from mwx.parser import MWXParser
+from mwx.foreign_code import scan_brace_block, scan_string_block
+
+
+brace_document = '''protocol P {
+    trial T {
+        python {
+            s = {"a": "}", 'b': '{'}
+            if s:
+                print("""}
+            {""")
+
+        }
+        report("after")
+    }
+}
+'''
+
+brace_code = '''s = {"a": "}", 'b': '{'}
+if s:
+    print("""}
+{""")
+'''
+
+indented_document = '''protocol P:
+    trial T:
+        python("""
+            s = {"a": 1}
+            if s:
+                print(s)
+        """)
+        report("after")
+'''
+
+
+class ForeignCodeTest(unittest.TestCase):
+
+    def test_brace_block(self):
+        text = 'python {\n    d = {"}": {1: 2}}\n    e = 1\n}\nrest'
+        code, end = scan_brace_block(text, 7)
+        self.assertEqual(code, 'd = {"}": {1: 2}}\ne = 1\n')
+        self.assertEqual(text[end:], '\nrest')
+
+    def test_padding(self):
+        text = '{\n\n        a\n          b\n        c\n\n    }'
+        code, end = scan_brace_block(text, 0)
+        self.assertEqual(code, 'a\n  b\nc\n')
+        self.assertEqual(end, len(text))
+
+    def test_unclosed_strings(self):
+        # a quote that isn't closed ends at the end of its line
+        text = "{\n    it's {\n    }\n}"
+        code, end = scan_brace_block(text, 0)
+        self.assertEqual(code, "it's {\n")
+        self.assertEqual(text[end:], "\n}")
+
+    def test_malformed_blocks(self):
+        for text in ['{ x }',           # the code must start a new line
+                     '{\n    x }',      # the brace must start a line
+                     '{\n    x\n',      # no closing brace
+                     '{\n    "}\n',     # nor here
+                     '{\n    {\n}',     # nor here
+                     'x {\n}']:         # no opening brace
+            self.assertEqual(scan_brace_block(text, 0), None, text)
+
+    def test_string_block(self):
+        text = '"""\n    a = "{"\n      b\n    """)'
+        code, end = scan_string_block(text, 0)
+        self.assertEqual(code, 'a = "{"\n  b')
+        self.assertEqual(text[end:], ')')
+
+        for text in ['""" a """', '"""\n    a\n', '"\n a\n"']:
+            self.assertEqual(scan_string_block(text, 0), None, text)
+
+    def code(self, parser, s):
+        root = parser.parse_document(s)
+        trial = root.by_tag('T')
+        self.assertEqual(len(trial.children), 2)
+        self.assertEqual(trial.children[1].props['message'], 'after')
+        return trial.children[0].children[0]
+
+    def test_documents(self):
+        for engine in ('pyparsing', 'fast'):
+            parser = MWXParser(engine=engine)
+            self.assertEqual(self.code(parser, brace_document),
+                             escape(brace_code))
+
+            parser = MWXParser(significant_whitespace=True, engine=engine)
+            self.assertEqual(self.code(parser, indented_document),
+                             's = {"a": 1}\nif s:\n    print(s)')
+
+
+if __name__ == '__main__':
+    unittest.main()
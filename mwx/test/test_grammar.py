@@ -0,0 +1,61 @@
+"""Check that the pyparsing grammar is built once per flavor of the syntax,
+   and that the parsers sharing it don't share anything else.
+
+   usage: python -m unittest discover -s mwx/test -t .
+"""
+
+import unittest
+
+from mwx.grammar import get_grammar
+from mwx.expression import MWXSyntaxError
+from mwx.parser import MWXParser
+
+
+braces = '''protocol P {
+    trial T {
+        report("braces")
+    }
+}
+'''
+
+indented = '''protocol P:
+    trial T:
+        report("indented")
+'''
+
+
+class GrammarTest(unittest.TestCase):
+
+    def test_shared(self):
+        self.assertTrue(MWXParser().grammar is MWXParser().grammar)
+        self.assertTrue(MWXParser().grammar is get_grammar(False))
+        self.assertTrue(MWXParser(significant_whitespace=True).grammar is
+                        get_grammar(True))
+        self.assertFalse(get_grammar(True) is get_grammar(False))
+
+    def test_profiled(self):
+        # (a profiled parser instruments a grammar of its own)
+        self.assertFalse(MWXParser(profile=True).grammar is get_grammar())
+
+    def test_interleaved(self):
+        a = MWXParser()
+        b = MWXParser(significant_whitespace=True)
+        expected = [MWXParser().parse_document(braces).to_xml(),
+                    MWXParser(significant_whitespace=True).parse_document(
+                        indented).to_xml()]
+        for i in range(2):
+            self.assertEqual([a.parse_document(braces).to_xml(),
+                              b.parse_document(indented).to_xml()], expected)
+
+    def test_after_error(self):
+        parser = MWXParser()
+        expected = parser.parse_document(braces).to_xml()
+        self.assertRaises(MWXSyntaxError, parser.parse_document,
+                          braces.replace('}\n}', '}'))
+        self.assertEqual(parser.parse_document(braces).to_xml(), expected)
+        self.assertEqual(MWXParser().parse_document(braces).to_xml(),
+                         expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
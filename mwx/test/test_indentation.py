@@ -0,0 +1,120 @@
+"""Check that significant-whitespace documents (mwx.indentation) parse to
+   the same trees as the brace documents they stand for, and that errors are
+   reported at their place in the original document.
+
+   usage: python -m unittest discover -s mwx/test -t .
+"""
+
+import unittest
+
+from mwx.parser import MWXParser
+from mwx.expression import MWXSyntaxError
+from mwx.indentation import IndentedText
+
+
+# (significant-whitespace document, brace document)
+documents = [
+    ('''protocol P:
+    block B:
+        trial T1:
+            report("one")
+
+        trial T2:
+            wait(
+                10ms)
+    block C:
+        report("c")
+var x = 2
+''', '''protocol P {
+    block B {
+        trial T1 {
+            report("one")
+        }
+        trial T2 {
+            wait(10ms)
+        }
+    }
+    block C {
+        report("c")
+    }
+}
+var x = 2
+'''),
+
+    # brace blocks, colons in comments and strings, and tabs
+    ('''protocol P:  // a comment:
+    trial T1 {
+        report("brace")
+    }
+    trial T2:
+\treport("tab: inside")
+''', '''protocol P {
+    trial T1 {
+        report("brace")
+    }
+    trial T2 {
+        report("tab: inside")
+    }
+}
+'''),
+
+    # a block that ends the document, without a newline
+    ('protocol P:\n    trial T:\n        report("x")',
+     'protocol P {\n    trial T {\n        report("x")\n    }\n}\n'),
+]
+
+# (document, message, line, column)
+errors = [
+    ('protocol P:\nreport("x")\n',
+     'Expected an indented block', 2, 1),
+    ('protocol P:\n    report("x")\n      report("y")\n',
+     'Unexpected indent', 3, 7),
+    ('protocol P:\n    block B:\n        report("x")\n      report("y")\n',
+     'Unindent does not match any outer indentation level', 4, 7),
+    ('protocol P:',
+     'Expected an indented block', 1, 12),
+
+    # errors found by the grammar, in the rewrite
+    ('protocol P:\n    block B:\n        report("x" +)\n',
+     'Expected ")"', 3, 20),
+]
+
+
+class IndentationTest(unittest.TestCase):
+
+    def test_documents(self):
+        for engine in ('pyparsing', 'fast'):
+            indented = MWXParser(significant_whitespace=True, engine=engine)
+            braces = MWXParser(engine=engine)
+            for s, expected in documents:
+                self.assertEqual(indented.parse_document(s).to_xml(),
+                                 braces.parse_document(expected).to_xml())
+
+    def test_errors(self):
+        for engine in ('pyparsing', 'fast'):
+            parser = MWXParser(significant_whitespace=True, engine=engine)
+            for s, msg, line, column in errors:
+                try:
+                    parser.parse_document(s)
+                except MWXSyntaxError, e:
+                    self.assertEqual((e.msg, e.lineno, e.col),
+                                     (msg, line, column))
+                else:
+                    self.fail("no error in %r" % s)
+
+    def test_original_offset(self):
+        s = 'protocol P:\n    trial T:\n        report("x")\n'
+        indented = IndentedText(s)
+        self.assertEqual(indented.text.count('{'), 2)
+        self.assertEqual(indented.text.count('}'), 2)
+
+        for offset, c in enumerate(indented.text):
+            original = indented.original_offset(offset)
+            if c in '{}':
+                self.assertTrue(s[original] in ':\n', (offset, original))
+            else:
+                self.assertEqual(s[original], c)
+
+
+if __name__ == '__main__':
+    unittest.main()
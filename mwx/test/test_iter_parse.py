@@ -0,0 +1,147 @@
+"""Check that MWXParser.iter_parse gives the nodes parse_string does, as
+   the declarations they come from are read, and that it resolves templates
+   as parse_string does, whichever order they are defined in.
+
+   usage: python -m unittest discover -s mwx/test -t .
+"""
+
+import os
+import unittest
+from StringIO import StringIO
+
+from mwx.ast import RootNode
+from mwx.ast.templates import RecursiveTemplateException
+from mwx.parser import MWXParser
+
+
+# f uses g, which is defined after f is called
+defined_later = '''macro f(x) {
+    @g(1)
+}
+protocol P {
+    trial T {
+        @f(1)
+    }
+}
+macro g(y) {
+    report("g")
+}
+'''
+
+mutually_recursive = '''macro f(x) {
+    @g(1)
+}
+macro g(y) {
+    @f(1)
+}
+protocol P {
+    trial T {
+        @f(1)
+    }
+}
+'''
+
+# f might use h, in a conditional, and h is defined after f is called
+conditional = '''macro f(x) {
+    @if (@x > 1) {
+        @h(1)
+    } else {
+        report("f")
+    }
+}
+protocol P {
+    @f(1)
+}
+macro h(y) {
+    report("h")
+}
+'''
+
+
+declarations = '''var x = 0
+var y = 1  // y
+stimulus S [type="blank_screen"]
+
+protocol P {
+    trial T {
+        report("one")
+    }
+}
+
+protocol Q {
+    trial U {
+        report("two")
+    }
+}
+'''
+
+examples = os.path.join(os.path.dirname(__file__), '..', '..', 'examples')
+
+
+class Lines(object):
+    """The lines of a string, noting how many have been read"""
+
+    def __init__(self, s):
+        self.lines = s.splitlines(True)
+        self.read = 0
+
+    def __iter__(self):
+        for line in self.lines:
+            self.read += 1
+            yield line
+
+
+def iter_parse(s, engine='pyparsing'):
+    parser = MWXParser(engine=engine)
+    return RootNode(list(parser.iter_parse(StringIO(s))))
+
+
+def parse(s, engine='pyparsing'):
+    return MWXParser(engine=engine).parse_document(s)
+
+
+class IterParseTest(unittest.TestCase):
+
+    def test_same_nodes(self):
+        for engine in ('pyparsing', 'fast'):
+            self.assertEqual(iter_parse(declarations, engine).to_xml(),
+                             parse(declarations, engine).to_xml())
+
+    def test_example(self):
+        with open(os.path.join(examples, 'if_test.mw')) as f:
+            s = f.read()
+        self.assertEqual(iter_parse(s).to_xml(), parse(s).to_xml())
+
+    def test_streaming(self):
+        # each node comes out once the declaration after it has started
+        lines = Lines(declarations)
+        nodes = MWXParser().iter_parse(lines)
+        self.assertEqual(nodes.next().tag, 'x')
+        self.assertEqual(lines.read, 2)
+        self.assertEqual([n.tag for n in nodes], ['y', 'S', 'P', 'Q'])
+        self.assertEqual(lines.read, len(lines.lines))
+
+
+class IterParseTemplatesTest(unittest.TestCase):
+
+    def test_template_used_by_template_defined_later(self):
+        for engine in ('pyparsing', 'fast'):
+            self.assertEqual(iter_parse(defined_later, engine).to_xml(),
+                             parse(defined_later, engine).to_xml())
+
+    def test_conditional_reference(self):
+        self.assertEqual(iter_parse(conditional).to_xml(),
+                         parse(conditional).to_xml())
+
+    def test_mutual_recursion(self):
+        for parse_document in (parse, iter_parse):
+            try:
+                parse_document(mutually_recursive)
+            except RecursiveTemplateException, e:
+                self.assertEqual(e.path, ['f', 'g', 'f'])
+            else:
+                self.fail("mutual recursion wasn't detected")
+
+
+if __name__ == '__main__':
+    unittest.main()
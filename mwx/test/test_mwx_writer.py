@@ -0,0 +1,109 @@
+"""Check that the streamed MWX (MWXWriter, to_mwx and write_mwx) is the MWX
+   that to_mwx gave before it was streamed, in each style.
+
+   usage: python -m unittest discover -s mwx/test -t .
+"""
+
+import os
+import unittest
+from StringIO import StringIO
+
+from mwx.ast import *
+from mwx.ast.ast import MWXStyle, MWXWriter
+from mwx.parser import MWXParser
+
+
+data = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def read(path):
+    with open(path, 'r') as f:
+        return f.read()
+
+
+def parse(engine='pyparsing'):
+    return MWXParser(engine=engine).parse_document(
+        read(os.path.join(data, 'writers.mw')))
+
+
+class Writes(object):
+    """A file object that keeps each write"""
+
+    def __init__(self):
+        self.writes = []
+
+    def write(self, s):
+        self.writes.append(s)
+
+
+class MWXWriterTest(unittest.TestCase):
+
+    def test_document(self):
+        # (writers.mwx was written by to_mwx before it was streamed)
+        expected = read(os.path.join(data, 'writers.mwx'))
+        for engine in ('pyparsing', 'fast'):
+            tree = parse(engine)
+            self.assertEqual(tree.to_mwx(), expected)
+            f = StringIO()
+            tree.write_mwx(f)
+            self.assertEqual(f.getvalue(), expected)
+
+    def test_buffered_writes(self):
+        tree = parse()
+        f = Writes()
+        writer = MWXWriter(f, buffer_size=100)
+        writer.value(tree)
+        writer.flush()
+        self.assertTrue(len(f.writes) > 1)
+        self.assertEqual(''.join(f.writes), tree.to_mwx())
+
+    def test_subtrees(self):
+        tree = parse()
+        for tag in ('B', 'T1', 'TS', 'S1'):
+            node = tree.by_tag(tag)
+            f = StringIO()
+            node.write_mwx(f)
+            self.assertEqual(f.getvalue(), node.to_mwx())
+
+        block = tree.by_tag('B')
+        self.assertTrue(block.to_mwx(1) in tree.to_mwx())
+
+    def test_styles(self):
+        tree = parse()
+        expected = read(os.path.join(data, 'writers.mwx'))
+
+        # (as with use_declaration_style_syntax_for_states = False, before)
+        style = MWXStyle(declaration_style_syntax_for_states=False)
+        self.assertEqual(tree.to_mwx(style=style),
+                         expected.replace('task_system_state S1{',
+                                          'task_system_state["S1"]{')
+                                 .replace('task_system_state S2{',
+                                          'task_system_state["S2"]{'))
+
+        style = MWXStyle(declaration_style_syntax=False)
+        mwx = tree.to_mwx(style=style)
+        self.assertTrue('    block["B"]{\n' in mwx)
+        self.assertTrue('task_system_state S1{' in mwx)
+        f = StringIO()
+        tree.write_mwx(f, style)
+        self.assertEqual(f.getvalue(), mwx)
+
+        # the writer's own cache of declarations is kept per style
+        self.assertEqual(tree.to_mwx(), expected)
+
+    def test_declarations(self):
+        writer = MWXWriter()
+        props = {'tag': 'B', 'nsamples': '2'}
+        first = writer.declaration('block', props, True)
+        self.assertTrue(writer.declaration('block', dict(props), True)
+                        is first)
+        self.assertNotEqual(writer.declaration('block', props, False), first)
+
+        writer.declarations_size = 2
+        for i in range(5):
+            writer.declaration('block', {'tag': str(i)}, True)
+        self.assertTrue(len(writer.declarations) <= 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
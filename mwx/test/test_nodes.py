@@ -0,0 +1,138 @@
+"""Check the slotted AST nodes: the empty props and children that nodes
+   share are never modified through them, pickles and copies come back the
+   same, and a derived tag reads the same as one set up front.
+
+   usage: python -m unittest discover -s mwx/test -t .
+"""
+
+import cPickle
+import unittest
+from copy import copy, deepcopy
+
+from mwx.ast import *
+from mwx.ast.ast import empty_props, empty_children
+from mwx.parser import MWXParser
+
+
+document = '''
+macro make_trial(name) {
+    trial[@name]{
+        report(@name)
+        wait(10ms)
+    }
+}
+
+protocol P {
+    block B {
+        @make_trial("T1")
+        @make_trial("T2")
+    }
+}
+'''
+
+
+def all_nodes(node):
+    nodes = [node]
+    for child in node.children or ():
+        if isinstance(child, MWASTNode):
+            nodes.extend(all_nodes(child))
+    for value in node.props.values():
+        if isinstance(value, MWASTNode):
+            nodes.extend(all_nodes(value))
+    return nodes
+
+
+class NodeTest(unittest.TestCase):
+
+    def tearDown(self):
+        self.assertEqual(len(empty_props), 0)
+        self.assertEqual(empty_children, ())
+
+    def test_slots(self):
+        for node in [MWASTNode('list'), Action('wait', '10ms'),
+                     Transition('always', 'S')]:
+            self.assertFalse(hasattr(node, '__dict__'), node)
+
+    def test_shared(self):
+        a = MWASTNode('list')
+        b = MWASTNode('list')
+        self.assertTrue(a.props is empty_props and b.props is empty_props)
+        self.assertTrue(a.children is empty_children)
+
+        a.set_prop('tag', 'A')
+        self.assertEqual(a.props, {'tag': 'A'})
+        self.assertTrue(b.props is empty_props)
+
+        a.add_children([b])
+        self.assertEqual(a.children, [b])
+        self.assertTrue(b.children is empty_children)
+
+        b.add_children([])
+        self.assertTrue(b.children is empty_children)
+
+        self.assertTrue(b.pop_prop('tag', None) is None)
+
+    def test_writes_refused(self):
+        node = MWASTNode('list')
+        self.assertRaises(TypeError, node.props.__setitem__, 'tag', 'x')
+        self.assertRaises(TypeError, node.props.update, {'tag': 'x'})
+        self.assertRaises(TypeError, node.props.setdefault, 'tag', 'x')
+        self.assertFalse(hasattr(node.children, 'append'))
+
+        # a copy of the props is a dict of its own
+        props = copy(node.props)
+        props['tag'] = 'x'
+        self.assertEqual(type(props), dict)
+
+    def test_derived_tag(self):
+        action = Action('wait', '10ms')
+        self.assertFalse('tag' in action.props)
+        self.assertEqual(action.tag, 'wait 10ms')
+
+        # the tag is put in before a new property
+        action = Action('wait', '10ms')
+        action.set_prop('extra', 1)
+        self.assertEqual(action.props['tag'], 'wait 10ms')
+
+        self.assertEqual(Action('report', 'x').to_xml(),
+                         Action('report', 'x', alt_tag='report x').to_xml())
+
+    def test_parsed_tree(self):
+        root = MWXParser().parse_document(document)
+        shared = [n for n in all_nodes(root)
+                  if n.props is empty_props or n.children is empty_children]
+        self.assertTrue(shared)
+
+    def test_pickle(self):
+        root = MWXParser().parse_document(document)
+        xml = root.to_xml()
+        # (the protocols the parse cache can use)
+        for protocol in (0, 1):
+            loaded = cPickle.loads(cPickle.dumps(root, protocol))
+            self.assertEqual(loaded.to_xml(), xml)
+            for node in all_nodes(loaded):
+                if not node.props:
+                    self.assertTrue(node.props is empty_props)
+                if not node.children:
+                    self.assertTrue(node.children is empty_children)
+
+            # the loaded tree can be edited like any other
+            for node in all_nodes(loaded):
+                node.set_prop('extra', 1)
+                node.add_children([])
+        self.assertEqual(root.to_xml(), xml)
+
+    def test_copies(self):
+        # (template definitions hold pyparsing results, which can't be
+        # copied)
+        root = MWXParser().parse_document(document).by_tag('P')
+        xml = root.to_xml()
+        copied = deepcopy(root)
+        for node in all_nodes(copied):
+            node.set_prop('extra', 1)
+            node.add_children([MWASTNode('list')])
+        self.assertEqual(root.to_xml(), xml)
+
+
+if __name__ == '__main__':
+    unittest.main()
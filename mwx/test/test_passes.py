@@ -0,0 +1,243 @@
+"""Check that a PassManager (mwx.ast.passes) leaves a tree as it would be
+   if each of its passes walked the tree in turn.
+
+   usage: python -m unittest discover -s mwx/test -t .
+"""
+
+import unittest
+from xml.etree import ElementTree
+
+from mwx.ast import *
+from mwx.ast import xml_export, xml_import
+from mwx.ast.passes import PassManager, FusedPasses, is_fusible
+from mwx.parser import MWXParser, MWXMLParser
+
+
+document = '''
+macro make_trial(name) {
+    trial[@name]{
+        report(@name)
+    }
+}
+
+protocol P {
+    block B {
+        @make_trial("T1")
+        channel C
+        block L {
+            @make_trial("T2")
+        }
+    }
+}
+'''
+
+mw_xml = '''<monkeyml version="1.0">
+<folder tag="Variables">
+    <variable tag="x" scope="global" type="integer" default_value="0"
+              logging="when_changed" full_name="x"/>
+    <variable tag="y" scope="global" type="float" default_value="1"/>
+</folder>
+<io_devices tag="IO">
+    <iochannel tag="C" description="a channel"/>
+</io_devices>
+<protocol tag="P" interruptible="YES">
+    <trial tag="T" nsamples="2">
+        <action type="report" message="hello" tag="r"/>
+        <action type="assignment" variable="x" value="x + 1"/>
+        <action_marker _unmoveable="1" tag="Actions"/>
+        <task_system tag="TS">
+            <task_system_state tag="S1" interruptible="YES">
+                <action type="wait" duration="10" duration_units="ms"/>
+                <transition_marker _unmoveable="1" tag="Transitions"/>
+                <transition type="conditional" condition="x &gt; 2"
+                            target="S2"/>
+                <transition type="yield"/>
+            </task_system_state>
+            <task_system_state tag="S2">
+                <action type="start_timer" timer="t" duration="5" tag="start"/>
+                <transition type="timer_expired" timer="t" target="S1"/>
+                <transition type="direct" target="S1"/>
+            </task_system_state>
+        </task_system>
+    </trial>
+</protocol>
+</monkeyml>
+'''
+
+
+def one_by_one(pass_classes, tree):
+    """Run each pass over the whole tree in turn"""
+    for c in pass_classes:
+        walker = c(tree)
+        walker.walk()
+        tree = walker.tree
+    return tree
+
+
+def mwx_tree():
+    """A tree as the MWX parser has it before its rewrite passes"""
+    parser = MWXParser()
+    nodes = resolve_templates(parser.parse_preprocessed(document))
+    tree = RootNode(children=nodes)
+    tree.by_tag('B').set_prop('draws', '3 samples')
+    tree.by_tag('L').set_prop('draws', '2 cycles')
+    return tree
+
+
+def xml_tree():
+    """A tree as the MW XML parser has it before its import passes"""
+    parser = MWXMLParser()
+    root = ElementTree.fromstring(mw_xml)
+    return RootNode(children=[parser.xml_element_to_ast(e) for e in root])
+
+
+# passes over a small tree of 'a', 'b' and 'c' nodes, some of which depend
+# on what the ones before them did
+
+class RenameA(TreeWalker):
+    obj_types = ['a']
+
+    def trigger(self, node):
+        return isinstance(node, MWASTNode) and node.obj_type == 'a'
+
+    def action(self, node, parent=None, parent_ctx=None, index=None):
+        node.set_obj_type('b')
+
+
+class MarkB(TreeWalker):
+    obj_types = ['b']
+
+    def trigger(self, node):
+        return isinstance(node, MWASTNode) and node.obj_type == 'b'
+
+    def action(self, node, parent=None, parent_ctx=None, index=None):
+        node.set_prop('marked', 'yes')
+
+
+class RemoveC(TreeWalker):
+    obj_types = ['c']
+
+    def trigger(self, node):
+        return isinstance(node, MWASTNode) and node.obj_type == 'c'
+
+    def action(self, node, parent=None, parent_ctx=None, index=None):
+        parent.remove_node(parent_ctx, index)
+
+
+class ReplaceMarked(TreeWalker):
+
+    def trigger(self, node):
+        return (isinstance(node, MWASTNode) and
+                node.props.get('marked') == 'yes')
+
+    def action(self, node, parent=None, parent_ctx=None, index=None):
+        replacement = MWASTNode('d', tag=node.props.get('tag'),
+                                children=node.children)
+        parent.rewrite(parent_ctx, index, replacement)
+        return replacement
+
+
+class CountChildren(TreeWalker):
+    obj_types = ['d']
+    requires = (ReplaceMarked,)
+
+    def trigger(self, node):
+        return isinstance(node, MWASTNode) and node.obj_type == 'd'
+
+    def action(self, node, parent=None, parent_ctx=None, index=None):
+        node.set_prop('count', str(len(node.children)))
+
+
+class SkipUnder(TreeWalker):
+    """Walks in a way of its own: not below 'e' nodes"""
+
+    def trigger(self, node):
+        return isinstance(node, MWASTNode)
+
+    def action(self, node, parent=None, parent_ctx=None, index=None):
+        node.set_prop('seen', 'yes')
+
+    def should_descend(self, node):
+        return getattr(node, 'obj_type', None) != 'e'
+
+
+def letters():
+    def node(obj_type, tag, children=[]):
+        return MWASTNode(obj_type, tag=tag, children=children)
+    return RootNode(children=[
+        node('a', 'a1', [node('c', 'c1'), node('a', 'a2', [node('b', 'b1')]),
+                         node('c', 'c2', [node('a', 'a3')])]),
+        node('e', 'e1', [node('a', 'a4'), node('c', 'c3')]),
+        node('b', 'b2', [node('c', 'c4'), node('c', 'c5'), node('b', 'b3')])])
+
+
+class PassManagerTest(unittest.TestCase):
+
+    def check(self, pass_classes, make_tree):
+        manager = PassManager(pass_classes)
+        fused = manager.run(make_tree())
+        expected = one_by_one(pass_classes, make_tree())
+        self.assertEqual(fused.to_mwx(), expected.to_mwx())
+        return manager, fused
+
+    def test_export_passes(self):
+        manager, tree = self.check(xml_export.registry, mwx_tree)
+        self.assertEqual(len(manager.stages), 1)
+        self.assertEqual(tree.by_tag('C').obj_type, 'iochannel')
+        self.assertEqual(tree.by_tag('L').props['sampling_method'], 'CYCLES')
+
+    def test_import_passes(self):
+        manager, tree = self.check(xml_import.registry, xml_tree)
+        self.assertTrue(len(manager.stages) > 1)
+        self.assertEqual(tree.nodes_of_type(['action_marker',
+                                             'transition_marker']), [])
+        self.assertTrue(isinstance(tree.by_tag('S1'), State))
+        self.assertEqual(tree.by_tag('C').obj_type, 'channel')
+
+        # the same as the MW XML parser gives
+        self.assertEqual(tree.to_mwx(),
+                         MWXMLParser().parse_string(mw_xml).to_mwx())
+        self.assertEqual(sum(manager.stages, []), xml_import.registry)
+
+    def test_dependent_passes(self):
+        passes = [RenameA, MarkB, RemoveC, ReplaceMarked, CountChildren]
+        manager, tree = self.check(passes, letters)
+        self.assertEqual(manager.stages, [passes[:4], passes[4:]])
+        self.assertEqual([n.obj_type for n in tree.children], ['d', 'e', 'd'])
+        self.assertEqual(tree.by_tag('b2').props['count'], '1')
+        self.assertEqual(tree.nodes_of_type(['a', 'b', 'c']), [])
+        self.assertEqual(len(tree.nodes_of_type('d')), 6)
+
+        # in other orders too
+        for order in ([RemoveC, MarkB, RenameA, ReplaceMarked],
+                      [ReplaceMarked, MarkB, RenameA, RemoveC],
+                      [MarkB, ReplaceMarked, RemoveC, RenameA]):
+            self.check(order, letters)
+
+    def test_walkers_of_their_own(self):
+        self.assertFalse(is_fusible(SkipUnder))
+        passes = [RenameA, SkipUnder, MarkB, RemoveC]
+        manager, tree = self.check(passes, letters)
+        self.assertEqual(manager.stages, [[RenameA], [SkipUnder],
+                                          [MarkB, RemoveC]])
+        self.assertFalse('seen' in tree.by_tag('a4').props)
+
+    def test_requires(self):
+        self.assertRaises(Exception, PassManager,
+                          [CountChildren, ReplaceMarked])
+        self.assertRaises(Exception, PassManager, [CountChildren])
+
+    def test_fused_walk(self):
+        tree = letters()
+        walkers = [c(tree) for c in (RenameA, MarkB, RemoveC)]
+        fused = FusedPasses(tree, walkers)
+        self.assertEqual(fused.dispatch(MWASTNode('a')), walkers[:1])
+        self.assertEqual(fused.dispatch(MWASTNode('z')), [])
+        fused.walk()
+        self.assertEqual(tree.nodes_of_type(['a', 'c']), [])
+        # (a3 went with c2)
+        self.assertEqual(len(tree.nodes_of_type('b')), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
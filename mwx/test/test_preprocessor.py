@@ -0,0 +1,100 @@
+"""Check the preprocessor (mwx.preprocessor): comments, nested includes,
+   each file included once, include cycles, and the map from the
+   preprocessed text back to the files and lines it came from.
+
+   usage: python -m unittest discover -s mwx/test -t .
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mwx.preprocessor import Preprocessor, PreprocessorError
+
+
+class PreprocessorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, path, contents):
+        path = os.path.join(self.directory, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(contents)
+
+    def preprocess(self, s, preprocessor=None):
+        preprocessor = preprocessor or Preprocessor()
+        return preprocessor.preprocess(s, self.directory)
+
+    def test_comments(self):
+        result = self.preprocess('a = 1 // one\n'
+                                 '# two\n'
+                                 'b = "// not # a comment"\n')
+        self.assertEqual(result.text, 'a = 1 \n\nb = "// not # a comment"\n')
+
+    def test_nested_includes(self):
+        self.write('lib/a.mwx', 'a // in a\ninclude "b.mwx"\n')
+        self.write('lib/b.mwx', 'b\n')
+        result = self.preprocess('include "lib/a.mwx"\nmain\n')
+        self.assertEqual(result.text, 'a \nb\nmain\n')
+        self.assertEqual([p for p, c in result.included_files],
+                         ['lib/a.mwx', 'lib/b.mwx'])
+
+    def test_include_once(self):
+        self.write('a.mwx', 'a\ninclude b.mwx\n')
+        self.write('b.mwx', 'b\n')
+        result = self.preprocess('include b.mwx\ninclude a.mwx\n'
+                                 'include "b.mwx"\n')
+        self.assertEqual(result.text, 'b\na\n')
+        self.assertEqual([p for p, c in result.included_files],
+                         ['b.mwx', 'a.mwx'])
+
+    def test_cycle(self):
+        self.write('a.mwx', 'include b.mwx\n')
+        self.write('b.mwx', 'b\ninclude a.mwx\n')
+        try:
+            self.preprocess('main\ninclude a.mwx\n')
+        except PreprocessorError, e:
+            self.assertEqual((e.filename, e.lineno), ('b.mwx', 2))
+            self.assertTrue('a.mwx -> b.mwx -> a.mwx' in e.msg)
+        else:
+            self.fail("the include cycle wasn't found")
+
+    def test_missing(self):
+        try:
+            self.preprocess('main\n\ninclude missing.mwx\n')
+        except PreprocessorError, e:
+            self.assertEqual((e.filename, e.lineno), (None, 3))
+        else:
+            self.fail("the missing include wasn't reported")
+
+    def test_source_map(self):
+        self.write('a.mwx', '// a\na1\na2\n')
+        result = self.preprocess('one\ninclude a.mwx\ntwo\nthree\n')
+        source_map = result.source_map
+        text = result.text
+        self.assertEqual(text, 'one\n\na1\na2\ntwo\nthree\n')
+        self.assertEqual(source_map.origin(text.index('one')), (None, 1))
+        self.assertEqual(source_map.origin(text.index('a1')), ('a.mwx', 2))
+        self.assertEqual(source_map.origin(text.index('a2')), ('a.mwx', 3))
+        self.assertEqual(source_map.origin(text.index('two')), (None, 3))
+        self.assertEqual(source_map.origin(text.index('three')), (None, 4))
+
+    def test_rescanned_on_change(self):
+        preprocessor = Preprocessor()
+        self.write('a.mwx', 'first\n')
+        self.assertEqual(self.preprocess('include a.mwx\n', preprocessor).text,
+                         'first\n')
+        self.write('a.mwx', 'second\n')
+        self.assertEqual(self.preprocess('include a.mwx\n', preprocessor).text,
+                         'second\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""Check the per-rule parser profiler (mwx.profiler), for both engines: it
+   counts the rules it should, doesn't change what is parsed, and isn't
+   left on the grammar that parsers share.
+
+   usage: python -m unittest discover -s mwx/test -t .
+"""
+
+import json
+import unittest
+
+from mwx.parser import MWXParser
+
+
+document = '''var x = 0
+protocol P {
+    task_system TS {
+        state S {
+            x = x + 1
+        } transition {
+            x > 2 -> yield
+            always -> "S"
+        }
+    }
+}
+'''
+
+
+def profiled(engine):
+    parser = MWXParser(engine=engine, profile=True)
+    return parser, parser.parse_document(document).to_xml()
+
+
+class ParserProfilerTest(unittest.TestCase):
+
+    def test_counts(self):
+        for engine in ('pyparsing', 'fast'):
+            (parser, xml) = profiled(engine)
+            report = parser.profiler.report('name')
+            names = [s.name for s in report]
+            for name in ('state', 'variable_declaration'):
+                self.assertTrue(name in names)
+            for s in report:
+                self.assertEqual(s.attempts, s.successes + s.failures)
+                self.assertTrue(s.time >= 0)
+
+            # what's parsed is the same
+            self.assertEqual(xml, MWXParser(engine=engine).parse_document(
+                document).to_xml())
+
+    def test_shared_grammar(self):
+        (parser, xml) = profiled('pyparsing')
+        before = [(s.name, s.attempts) for s in parser.profiler.report()]
+        MWXParser().parse_document(document)
+        self.assertEqual([(s.name, s.attempts)
+                          for s in parser.profiler.report()], before)
+
+    def test_reports(self):
+        (parser, xml) = profiled('fast')
+        profiler = parser.profiler
+        attempts = [s.attempts for s in profiler.report('attempts')]
+        self.assertEqual(attempts, sorted(attempts, reverse=True))
+        self.assertRaises(Exception, profiler.report, 'nonsense')
+
+        rows = json.loads(profiler.to_json('name'))
+        self.assertEqual([row['name'] for row in rows],
+                         [s.name for s in profiler.report('name')])
+        self.assertEqual(len(profiler.format_table().splitlines()),
+                         len(rows) + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""Check that reparsing a document after an edit (MWXParser.reparse_document)
+   gives the same tree as parsing it from scratch, and that the chunks an
+   edit doesn't touch are reused.
+
+   usage: python -m unittest discover -s mwx/test -t .
+"""
+
+import unittest
+
+from mwx.parser import MWXParser
+
+
+template = '''
+macro make_trial(name, duration) {
+    trial[@name]{
+        wait(@duration)
+    }
+}
+'''
+
+call = '''
+@make_trial("T%d", %s)
+'''
+
+plain = '''
+integer var_%d = %s
+'''
+
+
+def document(calls, edits={}, definition=template):
+    parts = [definition]
+    for i in range(calls):
+        parts.append(call % (i, edits.get(i, '100ms')))
+        parts.append(plain % (i, edits.get(i, '0')))
+    return ''.join(parts)
+
+
+class ReparseTest(unittest.TestCase):
+
+    def reparse(self, versions):
+        """Reparse each version in turn, checking it against a parse from
+           scratch; returns the results
+        """
+        results = []
+        for engine in ('pyparsing', 'fast'):
+            parser = MWXParser(engine=engine)
+            result = None
+            results = []
+            for s in versions:
+                result = parser.reparse_document(result, s)
+                self.assertEqual(result.to_xml(),
+                                 parser.parse_document(s).to_xml())
+                results.append(result)
+        return results
+
+    def test_edits(self):
+        self.reparse([document(4),
+                      document(4, {1: '200ms'}),
+                      document(4, {1: '200ms', 3: '5'}),
+                      document(3),
+                      document(5, {4: '1s'}),
+                      document(5)])
+
+    def test_edited_definition(self):
+        edited = template.replace('wait(@duration)',
+                                  'wait(@duration)\n        report("edited")')
+        self.reparse([document(3),
+                      document(3, definition=edited),
+                      document(3, {0: '1s'}, definition=edited),
+                      document(3)])
+
+    def test_reused_chunks(self):
+        first, second = self.reparse([document(4), document(4, {1: '200ms'})])
+        old = first.declaration_chunks.chunks
+        new = second.declaration_chunks.chunks
+        self.assertEqual(len(old), len(new))
+
+        # only the edited call (and the edited variable) are resolved again
+        changed = [i for i in range(len(new)) if new[i].final is not
+                   old[i].final]
+        self.assertEqual([new[i].text.strip() for i in changed],
+                         [(call % (1, '200ms')).strip(),
+                          (plain % (1, '200ms')).strip()])
+
+    def test_duplicate_chunks(self):
+        s = document(2) + call % (0, '100ms')
+        self.reparse([s, s.replace('wait(@duration)', 'wait(10ms)')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+"""Check that the compile server (mwx serve) answers with what the mwx
+   command prints, after edits to a file and to the files it includes, and
+   that the client only talks to a socket of its own.
+
+   usage: python -m unittest discover -s mwx/test -t .
+"""
+
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import unittest
+import subprocess
+from StringIO import StringIO
+
+from mwx import server
+from mwx.test.test_batch import run_mwx, read, mwx_script, package_dir
+
+
+included = '''
+macro make_trial(name) {
+    trial[@name]{
+        report(@name)
+    }
+}
+'''
+
+including = '''
+include "templates.mwx"
+
+protocol P {
+    @make_trial("T1")
+    @make_trial("T2")
+}
+'''
+
+
+def frames(response):
+    """The (channel, data) frames of a response"""
+    f = StringIO(response)
+    result = []
+    while True:
+        channel, data = server.read_frame(f)
+        result.append((channel, data))
+        if channel == "x":
+            return result
+
+
+class ServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.compiler = server.Compiler()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, contents):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(contents)
+        return path
+
+    def handle(self, request):
+        """The output and status of a request"""
+        out = StringIO()
+        self.compiler.handle(request, out)
+        response = frames(out.getvalue())
+        output = "".join([data for (c, data) in response if c == "o"])
+        return output, response[-1][1]
+
+    def check(self, path, *flags):
+        request = server.client_request(list(flags) + [path])
+        output, status = self.handle(request)
+        self.assertEqual(status, 0)
+        self.assertEqual(output, run_mwx(*(list(flags) + [path])))
+
+    def test_outputs(self):
+        self.write('templates.mwx', included)
+        path = self.write('including.mw', including)
+        self.check(path, '-x')
+        self.check(path, '-m')
+        self.check(path, '-x', '-T')
+
+    def test_edits(self):
+        self.write('templates.mwx', included)
+        path = self.write('including.mw', including)
+        self.check(path, '-x')
+        first = self.compiler.files.values()[0]
+
+        # unchanged: answered from memory
+        self.check(path, '-x')
+        self.assertTrue(self.compiler.files.values()[0] is first)
+
+        self.write('including.mw', including.replace('"T2"', '"T3"'))
+        self.check(path, '-x')
+
+        self.write('templates.mwx', included.replace('report(@name)',
+                                                     'report("edited")'))
+        self.check(path, '-x')
+
+    def test_errors(self):
+        path = self.write('broken.mw', 'protocol P {\n    trial {\n')
+        output, status = self.handle({'file': path, 'xml': True})
+        self.assertEqual((output, status), ("", 1))
+
+        output, status = self.handle(
+            {'file': os.path.join(self.directory, 'missing.mw'), 'xml': True})
+        self.assertEqual((output, status), ("", 1))
+
+    def test_large_output(self):
+        trials = "\n".join(['    trial T%d { report("%s") }' % (i, 'x' * 100)
+                            for i in range(1000)])
+        path = self.write('large.mw', 'protocol P {\n%s\n}\n' % trials)
+        out = StringIO()
+        self.compiler.handle({'file': path, 'xml': True}, out)
+        response = frames(out.getvalue())
+        self.assertTrue(len(response) > 2)
+        self.assertEqual("".join([data for (c, data) in response[:-1]]),
+                         run_mwx('-x', path))
+
+    def test_client_request(self):
+        self.assertEqual(server.client_request(['-x', '-T', 'a.mw']),
+                         {'xml': True, 'no_templates': True,
+                          'file': os.path.abspath('a.mw')})
+        self.assertEqual(server.client_request(['-x']), None)
+        self.assertEqual(server.client_request(['-o', 'out', 'a.mw']), None)
+        self.assertEqual(server.client_request(['a.mw', 'b.mw']), None)
+
+    def test_private_directory(self):
+        path = os.path.join(self.directory, 'private')
+        server.make_private_directory(path)
+        self.assertEqual(os.stat(path).st_mode & 0777, 0700)
+        server.make_private_directory(path)
+
+        os.chmod(path, 0755)
+        self.assertRaises(Exception, server.make_private_directory, path)
+
+        os.chmod(path, 0700)
+        link = os.path.join(self.directory, 'link')
+        os.symlink(path, link)
+        self.assertRaises(Exception, server.make_private_directory, link)
+
+    def test_no_server(self):
+        path = self.write('a.mw', 'protocol P {}\n')
+        socket_path = os.path.join(self.directory, 'mwx.sock')
+        self.assertFalse(server.owned_socket(socket_path))
+        self.assertEqual(server.run_client(['-x', path],
+                                           socket_path=socket_path), None)
+
+        # a file that isn't a socket
+        self.write('mwx.sock', '')
+        self.assertFalse(server.owned_socket(socket_path))
+
+        # a socket that nobody listens on
+        os.unlink(socket_path)
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.bind(socket_path)
+        s.close()
+        self.assertTrue(server.owned_socket(socket_path))
+        self.assertEqual(server.run_client(['-x', path],
+                                           socket_path=socket_path), None)
+
+    def test_serve(self):
+        self.write('templates.mwx', included)
+        path = self.write('including.mw', including)
+        socket_path = os.path.join(self.directory, 'mwx.sock')
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = package_dir
+        process = subprocess.Popen([sys.executable, mwx_script, 'serve',
+                                    '--socket', socket_path], env=env)
+        try:
+            for i in range(200):
+                if os.path.exists(socket_path):
+                    break
+                time.sleep(0.05)
+
+            for flags in (['-x'], ['-m']):
+                out, err = StringIO(), StringIO()
+                status = server.run_client(flags + [path], out, err,
+                                           socket_path)
+                self.assertEqual(status, 0)
+                self.assertEqual(out.getvalue(), run_mwx(*(flags + [path])))
+        finally:
+            process.terminate()
+            process.wait()
+        self.assertFalse(os.path.exists(socket_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+"""Check the TemplateGraph of a document's templates: templates that refer
+   to themselves at every call are refused up front, with the path, and the
+   others are prepared after those they refer to.
+
+   usage: python -m unittest discover -s mwx/test -t .
+"""
+
+import unittest
+
+from mwx.ast import *
+from mwx.ast.templates import (TemplateDefinition, TemplateGraph,
+                               RecursiveTemplateException,
+                               MaximumTreeRewritesExceededException)
+from mwx.parser import MWXParser
+
+
+mutual = '''
+macro f() {
+    @g()
+}
+macro g() {
+    @f()
+}
+protocol P {
+    @f()
+}
+'''
+
+itself = '''
+macro f(x) {
+    report(@x)
+    @f(@x)
+}
+protocol P {
+    @f(1)
+}
+'''
+
+conditional = '''
+macro count(x) {
+    report(@x)
+    @if (@x > 0) {
+        @count(0)
+    }
+}
+protocol P {
+    @count(2)
+}
+'''
+
+chain = '''
+macro c(x) {
+    report(@x)
+}
+macro b(x) {
+    @c(@x)
+}
+macro a(x) {
+    @b(@x)
+    @c("a")
+}
+macro local() {
+    macro b() {
+        report("inner")
+    }
+    @b()
+}
+protocol P {
+    @a(1)
+    @local()
+}
+'''
+
+
+def definitions(text):
+    nodes = MWXParser(engine='fast').parse_preprocessed(text)
+    return dict([(node.name, node) for node in nodes
+                 if isinstance(node, TemplateDefinition)])
+
+
+class TemplateGraphTest(unittest.TestCase):
+
+    def recursion(self, text):
+        try:
+            TemplateGraph(definitions(text))
+        except RecursiveTemplateException, e:
+            return e
+        self.fail("no RecursiveTemplateException")
+
+    def test_mutual_recursion(self):
+        e = self.recursion(mutual)
+        self.assertEqual(e.path, ['f', 'g', 'f'])
+        self.assertEqual(e.n, 2)
+        self.assertEqual(str(e), "Template f refers to itself: f -> g -> f")
+        self.assertTrue(isinstance(e, MaximumTreeRewritesExceededException))
+
+    def test_self_recursion(self):
+        self.assertEqual(self.recursion(itself).path, ['f', 'f'])
+
+    def test_parse(self):
+        for engine in ('pyparsing', 'fast'):
+            parser = MWXParser(engine=engine)
+            for (text, path) in ((mutual, ['f', 'g', 'f']),
+                                 (itself, ['f', 'f'])):
+                try:
+                    parser.parse_document(text)
+                except RecursiveTemplateException, e:
+                    self.assertEqual(e.path, path)
+                else:
+                    self.fail("no RecursiveTemplateException")
+
+    def test_conditional(self):
+        graph = TemplateGraph(definitions(conditional))
+        self.assertEqual(graph.refers['count'], set())
+        self.assertEqual(graph.may_refer['count'], set(['count']))
+        self.assertEqual(graph.order, ['count'])
+
+        xml = MWXParser().parse_document(conditional).to_xml()
+        for x in ('2.0', '0.0'):
+            self.assertTrue('message="%s"' % x in xml, x)
+
+    def test_order(self):
+        graph = TemplateGraph(definitions(chain))
+        self.assertEqual(graph.refers['a'], set(['b', 'c']))
+        self.assertEqual(graph.refers['b'], set(['c']))
+        # (the b that local refers to is its own)
+        self.assertEqual(graph.refers['local'], set())
+
+        order = graph.order
+        self.assertEqual(sorted(order), ['a', 'b', 'c', 'local'])
+        for name in order:
+            for other in graph.may_refer[name]:
+                self.assertTrue(order.index(other) < order.index(name))
+
+    def test_depth_first(self):
+        edges = {'a': set(['b']), 'b': set(['c']), 'c': set()}
+        self.assertEqual(TemplateGraph.depth_first(edges),
+                         (['c', 'b', 'a'], None))
+        edges['c'] = set(['b'])
+        self.assertEqual(TemplateGraph.depth_first(edges)[1], ['b', 'c', 'b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
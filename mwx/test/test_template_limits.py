@@ -0,0 +1,67 @@
+"""Check the limits on template expansion (TemplateResolver's maximum_depth
+   and maximum_nodes), and the arguments TemplateTreeRewriter takes for
+   them.
+
+   usage: python -m unittest discover -s mwx/test -t .
+"""
+
+import warnings
+import unittest
+
+from mwx.ast import *
+from mwx.parser import MWXParser
+
+
+def chain(n):
+    """A document calling a chain of n + 1 templates, each calling the next"""
+    s = ''.join(['macro m%d(x) {\n    report("%d")\n    @m%d(@x)\n}\n' %
+                 (i, i, i + 1) for i in range(n)])
+    s += 'macro m%d(x) {\n    report("end")\n}\n' % n
+    return s + 'protocol P {\n    @m0(1)\n}\n'
+
+
+def rewrite(s, *args, **kwargs):
+    nodes = MWXParser(engine='fast').parse_preprocessed(s)
+    return TemplateTreeRewriter(nodes, *args, **kwargs).rewrite_tree()
+
+
+def messages(nodes):
+    return sorted([node.props['message'] for node in
+                   find_nodes(nodes, lambda n: n.obj_type == 'action',
+                              TemplateDefinition)])
+
+
+class TemplateLimitsTest(unittest.TestCase):
+
+    def test_depth(self):
+        self.assertRaises(MaximumTreeRewritesExceededException,
+                          rewrite, chain(6), maximum_depth=3)
+        self.assertEqual(messages(rewrite(chain(6), maximum_depth=6)),
+                         ['0', '1', '2', '3', '4', '5', 'end'])
+
+    def test_nodes(self):
+        self.assertRaises(MaximumTemplateNodesExceededException,
+                          rewrite, chain(6), maximum_nodes=5)
+        self.assertEqual(len(messages(rewrite(chain(6), maximum_nodes=100))),
+                         7)
+
+    def test_maximum_rewrites(self):
+        # the old name of maximum_depth still works, with a warning
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertRaises(MaximumTreeRewritesExceededException,
+                              rewrite, chain(6), maximum_rewrites=3)
+        self.assertEqual([w.category for w in caught], [DeprecationWarning])
+
+        # (and as the second argument, as before)
+        self.assertRaises(MaximumTreeRewritesExceededException,
+                          rewrite, chain(6), 3)
+
+    def test_templates_not_shared(self):
+        rewrite(chain(1))
+        rewriter = TemplateTreeRewriter([])
+        self.assertFalse('m0' in rewriter.templates)
+
+
+if __name__ == '__main__':
+    unittest.main()
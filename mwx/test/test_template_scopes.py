@@ -0,0 +1,73 @@
+"""Check how templates are looked up (TemplateScope), in the scopes of the
+   trees being resolved and of the expansions in them.
+
+   usage: python -m unittest discover -s mwx/test -t .
+"""
+
+import unittest
+
+from mwx.ast import *
+from mwx.ast.templates import TemplateScope, TemplateResolver
+from mwx.parser import MWXParser
+
+
+def messages(s):
+    tree = MWXParser(engine='fast').parse_document(s)
+    return [node.props['message'] for node in
+            find_nodes(tree, lambda n: n.obj_type == 'action',
+                       TemplateDefinition)]
+
+
+class TemplateScopeTest(unittest.TestCase):
+
+    def test_lookup(self):
+        outer = TemplateScope({'a': 1, 'b': 2})
+        inner = TemplateScope(outer)
+        inner.update({'b': 3})
+        self.assertEqual(inner.get('a'), 1)
+        self.assertEqual(inner.get('b'), 3)
+        self.assertEqual(outer.get('b'), 2)
+        self.assertEqual(inner.get('c', 4), 4)
+        self.assertTrue('a' in inner)
+        self.assertFalse('c' in inner)
+        self.assertRaises(KeyError, lambda: inner['c'])
+
+    def test_defined_later(self):
+        # the order templates are defined in doesn't matter, even in a
+        # scope that defined nothing when another was nested in it
+        outer = TemplateScope({'a': 1})
+        middle = TemplateScope(outer)
+        inner = TemplateScope(middle)
+        middle.update({'b': 2})
+        outer.update({'c': 3})
+        self.assertEqual([inner.get(n) for n in 'abc'], [1, 2, 3])
+
+    def test_shared(self):
+        # a resolver nested in another uses its scope until it defines
+        # templates of its own
+        resolver = TemplateResolver({'a': 1})
+        nested = resolver.nested(resolver.templates)
+        self.assertTrue(nested.templates is resolver.templates)
+        nested.define({'b': 2})
+        self.assertFalse(nested.templates is resolver.templates)
+        self.assertEqual(nested.templates.get('a'), 1)
+        self.assertEqual(resolver.templates.get('b'), None)
+
+    def test_nested_definitions(self):
+        # a template defined in an expansion is found there first
+        definitions = '''macro note() {
+    report("outer")
+}
+macro inner() {
+    macro note() {
+        report("inner")
+    }
+    @note
+}
+'''
+        protocol = 'protocol P {\n    @%s\n}\n'
+        self.assertEqual(messages(definitions + protocol % 'inner'),
+                         ['inner'])
+
+if __name__ == '__main__':
+    unittest.main()
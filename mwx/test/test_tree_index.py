@@ -0,0 +1,133 @@
+"""Check that the indexes a RootNode keeps of its tree (by obj_type, tag and
+   parent) follow the edits made to it, and only to it.
+
+   usage: python -m unittest discover -s mwx/test -t .
+"""
+
+import unittest
+
+from mwx.ast import *
+from mwx.ast import ast
+from mwx.ast.xml_export import DrawsSyntaxRewriter, TypeAliasRewriter
+from mwx.parser import MWXParser
+
+
+document = '''protocol P {
+    block B {
+        trial T1 {
+            report("one")
+        }
+        trial T2 {
+            report("two")
+        }
+    }
+}
+'''
+
+
+def parse(s=document, process_templates=True, rewrites=True):
+    parser = MWXParser(engine='fast')
+    if rewrites:
+        return parser.parse_document(s, process_templates)
+    return RootNode(parser.parse_preprocessed(s))
+
+
+def tags(nodes):
+    return [node.tag for node in nodes]
+
+
+class TreeIndexTest(unittest.TestCase):
+
+    def test_set_obj_type(self):
+        root = parse()
+        self.assertEqual(tags(root.nodes_of_type('trial')), ['T1', 'T2'])
+        root.by_tag('T2').set_obj_type('block')
+        self.assertEqual(tags(root.nodes_of_type('trial')), ['T1'])
+        self.assertEqual(tags(root.nodes_of_type('block')), ['B', 'T2'])
+
+    def test_set_prop(self):
+        root = parse()
+        trial = root.by_tag('T1')
+        trial.set_prop('tag', 'renamed')
+        self.assertTrue(root.by_tag('T1') is None)
+        self.assertTrue(root.by_tag('renamed') is trial)
+
+        # a node put in as a property is indexed, with its parent
+        action = Action('wait', '10ms')
+        trial.set_prop('extra', action)
+        self.assertTrue(root.parent_of(action) is trial)
+        self.assertTrue(trial.pop_prop('extra') is action)
+        self.assertTrue(root.parent_of(action) is None)
+
+    def test_children(self):
+        root = parse()
+        block = root.by_tag('B')
+        trial = MWASTNode('trial', tag='T3')
+        self.assertTrue(root.parent_of(trial) is None)
+        block.add_children([trial])
+        self.assertTrue(root.parent_of(trial) is block)
+        self.assertEqual(tags(root.nodes_of_type('trial')),
+                         ['T1', 'T2', 'T3'])
+
+        block.remove_node(MWASTNode.CHILD_CTX, 0)
+        self.assertEqual(tags(root.nodes_of_type('trial')), ['T2', 'T3'])
+
+        other = MWASTNode('trial', tag='T4')
+        block.rewrite(MWASTNode.CHILD_CTX, 0, other)
+        self.assertTrue(root.by_tag('T4') is other)
+        self.assertTrue(root.parent_of(other) is block)
+
+    def test_tree_changed(self):
+        root = parse()
+        block = root.by_tag('B')
+        self.assertEqual(len(root.nodes_of_type('trial')), 2)
+
+        # an edit to the children list itself, noted afterwards
+        block.children.append(MWASTNode('trial', tag='T3'))
+        ast.tree_changed(block)
+        self.assertEqual(tags(root.nodes_of_type('trial')),
+                         ['T1', 'T2', 'T3'])
+
+        block.children.pop()
+        ast.tree_changed()
+        self.assertEqual(tags(root.nodes_of_type('trial')), ['T1', 'T2'])
+
+    def test_rewriters(self):
+        # (these used to set props and obj_types directly)
+        root = parse(document.replace('trial T2', 'channel T2'),
+                     process_templates=False, rewrites=False)
+        self.assertEqual(tags(root.nodes_of_type('channel')), ['T2'])
+        block = root.by_tag('B')
+
+        TypeAliasRewriter(root).walk()
+        self.assertEqual(tags(root.nodes_of_type('channel')), [])
+        self.assertEqual(tags(root.nodes_of_type('iochannel')), ['T2'])
+
+        block.set_prop('draws', '3 samples')
+        DrawsSyntaxRewriter(root).walk()
+        self.assertEqual(block.props['nsamples'], 3)
+        self.assertFalse('draws' in block.props)
+
+    def test_other_trees(self):
+        root = parse()
+        other = parse()
+        index = root.tree_index()
+        other.by_tag('B').set_obj_type('list')
+        other.by_tag('T1').set_prop('tag', 'renamed')
+        root.by_tag('T1')
+        self.assertTrue(root.tree_index() is index)
+        self.assertTrue(root.by_tag('T1') is not None)
+
+    def test_forgotten_edits(self):
+        root = parse()
+        index = root.tree_index()
+        trial = root.by_tag('T1')
+        for i in range(ast.structure_edits.max_edits + 1):
+            MWASTNode('trial').add_children([])
+        # (the edits since the index was built are no longer known)
+        self.assertTrue(root.tree_index() is not index)
+        self.assertTrue(root.by_tag('T1') is trial)
+
+
+if __name__ == '__main__':
+    unittest.main()
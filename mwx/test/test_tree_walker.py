@@ -0,0 +1,118 @@
+"""Check the order a TreeWalker walks a tree in, and where it carries on
+   when its actions change the children of the node being walked.
+
+   usage: python -m unittest discover -s mwx/test -t .
+"""
+
+import unittest
+
+from mwx.ast import *
+from mwx.ast.ast import TreeWalker
+
+
+def trial(tag, children=[]):
+    return MWASTNode('trial', tag, children=list(children))
+
+
+def block(*tags):
+    return MWASTNode('block', 'B', children=[trial(t) for t in tags])
+
+
+class Visits(TreeWalker):
+    """Notes the tag and index of each trial it reaches, and calls edit
+       with it
+    """
+
+    def __init__(self, tree, edit=None):
+        TreeWalker.__init__(self, tree)
+        self.edit = edit
+        self.visits = []
+
+    def trigger(self, node):
+        return getattr(node, 'obj_type', None) == 'trial'
+
+    def action(self, node, parent, parent_ctx, index):
+        self.visits.append((node.props['tag'], index))
+        if self.edit is not None:
+            return self.edit(node, parent, index)
+
+
+class TreeWalkerTest(unittest.TestCase):
+
+    def walk(self, tree, edit=None):
+        walker = Visits(tree, edit)
+        walker.walk()
+        return walker.visits
+
+    def test_order(self):
+        tree = block('A', 'B')
+        tree.children[0].add_children([trial('A1'), trial('A2')])
+        self.assertEqual(self.walk(tree), [('A', 0), ('A1', 0), ('A2', 1),
+                                           ('B', 1)])
+
+    def test_insert_after(self):
+        # siblings put in after the node are walked, in order
+        def edit(node, parent, index):
+            if node.props['tag'] == 'A':
+                parent.children.insert(index + 1, trial('X'))
+                parent.children.insert(index + 2, trial('Y'))
+
+        tree = block('A', 'B')
+        self.assertEqual(self.walk(tree, edit), [('A', 0), ('X', 1),
+                                                 ('Y', 2), ('B', 3)])
+
+    def test_insert_before(self):
+        # siblings put in before the node aren't walked, and neither the
+        # node nor the ones after it are walked twice (or skipped)
+        def edit(node, parent, index):
+            if node.props['tag'] == 'B':
+                parent.children.insert(0, trial('X'))
+                parent.children.insert(index + 1, trial('Y'))
+
+        tree = block('A', 'B', 'C', 'D')
+        self.assertEqual(self.walk(tree, edit), [('A', 0), ('B', 1),
+                                                 ('C', 4), ('D', 5)])
+        self.assertEqual([c.props['tag'] for c in tree.children],
+                         ['X', 'A', 'Y', 'B', 'C', 'D'])
+
+    def test_insert_from_below(self):
+        # (while walking a child of a child)
+        def edit(node, parent, index):
+            if node.props['tag'] == 'A1':
+                tree.children.insert(0, trial('X'))
+                tree.children.insert(2, trial('Y'))
+
+        tree = block('A', 'B')
+        tree.children[0].add_children([trial('A1')])
+        self.assertEqual(self.walk(tree, edit), [('A', 0), ('A1', 0),
+                                                 ('Y', 2), ('B', 3)])
+
+    def test_replace(self):
+        # the nodes put in place of the node aren't walked
+        def edit(node, parent, index):
+            if node.props['tag'] == 'B':
+                parent.rewrite(MWASTNode.CHILD_CTX, index,
+                               [trial('X'), trial('Y')])
+
+        tree = block('A', 'B', 'C')
+        self.assertEqual(self.walk(tree, edit), [('A', 0), ('B', 1),
+                                                 ('C', 3)])
+
+    def test_remove(self):
+        def edit(node, parent, index):
+            if node.props['tag'] in ('A', 'B'):
+                parent.remove_node(MWASTNode.CHILD_CTX, index)
+
+        tree = block('A', 'B', 'C')
+        self.assertEqual(self.walk(tree, edit), [('A', 0), ('B', 0),
+                                                 ('C', 0)])
+
+    def test_deep(self):
+        node = trial('leaf')
+        for i in range(10000):
+            node = trial('T', [node])
+        self.assertEqual(len(self.walk(node)), 10001)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""Check that the streamed XML (MWASTNode.iter_xml, write_xml and
+   write_xml_document) is the XML that to_xml gave before it was streamed.
+
+   usage: python -m unittest discover -s mwx/test -t .
+"""
+
+import os
+import unittest
+from StringIO import StringIO
+
+from mwx.ast import *
+from mwx.ast import ast
+from mwx.ast.ast import write_chunks, write_xml_document
+from mwx.parser import MWXParser
+
+
+examples = os.path.join(os.path.dirname(__file__), '..', '..', 'examples')
+data = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def read(path):
+    with open(path, 'r') as f:
+        return f.read()
+
+
+class Writes(object):
+    """A file object that keeps each write"""
+
+    def __init__(self):
+        self.writes = []
+
+    def write(self, s):
+        self.writes.append(s)
+
+
+class StringNode(MWASTNode):
+    """A node that only overrides to_xml"""
+
+    __slots__ = ()
+
+    def to_xml(self):
+        return "<string_node/>"
+
+
+class XMLWriterTest(unittest.TestCase):
+
+    def test_document(self):
+        # (writers.xml was written by to_xml before it was streamed)
+        expected = read(os.path.join(data, 'writers.xml'))
+        for engine in ('pyparsing', 'fast'):
+            tree = MWXParser(engine=engine).parse_document(
+                read(os.path.join(data, 'writers.mw')))
+            self.assertEqual(tree.to_xml(), expected)
+            f = StringIO()
+            tree.write_xml(f)
+            self.assertEqual(f.getvalue(), expected)
+
+    def test_examples(self):
+        for name in ('if_test.mw', 'mw_test_syntax_advanced.mw'):
+            tree = MWXParser().parse_document(
+                read(os.path.join(examples, name)), base_path=examples)
+            xml = tree.to_xml()
+            self.assertEqual(''.join(tree.iter_xml()), xml)
+
+            f = StringIO()
+            write_xml_document(iter(tree.children), f)
+            self.assertEqual(f.getvalue(), xml)
+
+    def test_iter_parse(self):
+        s = read(os.path.join(data, 'writers.mw'))
+        parser = MWXParser()
+        f = StringIO()
+        write_xml_document(parser.iter_parse(StringIO(s)), f)
+        self.assertEqual(f.getvalue(), parser.parse_string(s).to_xml())
+
+    def test_buffered_writes(self):
+        f = Writes()
+        write_chunks(['a' * 10] * 25, f, buffer_size=100)
+        self.assertEqual([len(s) for s in f.writes], [100, 100, 50])
+
+        tree = MWXParser().parse_document(
+            read(os.path.join(data, 'writers.mw')))
+        f = Writes()
+        tree.write_xml(f)
+        self.assertEqual(''.join(f.writes), tree.to_xml())
+
+    def test_indent(self):
+        tree = MWXParser().parse_document(
+            read(os.path.join(data, 'writers.mw')))
+        f = StringIO()
+        tree.write_xml(f, indent='  ')
+        indented = f.getvalue()
+        self.assertTrue('\n    <block  tag="B">' in indented)
+
+        # only whitespace is added
+        self.assertEqual(''.join(indented.split()),
+                         ''.join(tree.to_xml().split()))
+        for line in indented.split('\n'):
+            self.assertEqual(line.rstrip(), line)
+
+    def test_subclasses(self):
+        node = MWASTNode('block', tag='B', children=[
+            StringNode('string_node'),
+            MWBinaryExpression('+', MWVariableReference('x'), 1),
+            'text'])
+        self.assertEqual(node.to_xml(),
+                         '<block  tag="B">\n<string_node/>\n(x + 1)\ntext\n'
+                         '</block>')
+
+    def test_deep_tree(self):
+        node = top = MWASTNode('block', tag='0')
+        for i in range(1, 5000):
+            child = MWASTNode('block', tag=str(i))
+            node.add_children([child])
+            node = child
+        xml = top.to_xml()
+        self.assertEqual(xml.count('<block '), 5000)
+        self.assertTrue(xml.endswith('</block>\n</block>'))
+
+    def test_attribute_table(self):
+        size = ast.xml_attribute_table_size
+        nodes = [MWASTNode('block', tag='t<%d>' % i) for i in range(size + 10)]
+        xml = MWASTNode('block', children=nodes).to_xml()
+        for i in (0, size - 1, size, size + 9):
+            self.assertTrue('tag="t&lt;%d&gt;"' % i in xml)
+        self.assertTrue(len(ast.xml_attribute_table) <= size)
+
+
+if __name__ == '__main__':
+    unittest.main()